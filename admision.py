@@ -0,0 +1,218 @@
+"""
+Control de admisión por clase de endpoint
+
+Las descargas de PDF y los endpoints por lotes cuestan mucho más que una
+inferencia: sin límite pueden ocupar todos los hilos del servidor y hacer
+esperar a /diagnosticar. Cada ruta pertenece a una clase (pdf, lote,
+inferencia) con dos límites:
+
+- concurrencia: peticiones de la clase en curso a la vez; al superarlo se
+  responde 503 de inmediato en lugar de encolar sin límite.
+- cubeta de fichas por cliente (inquilino + IP): `tasa` peticiones por
+  segundo con ráfagas de hasta `rafaga`; al agotarla se responde 429.
+
+Ambos rechazos incluyen Retry-After y se cuentan por clase. Los límites por
+defecto se pueden reemplazar con un JSON indicado en ADMISION_LIMITES.
+
+El middleware corre en el bucle de eventos (un solo hilo), así que los
+contadores no necesitan lock.
+"""
+
+import json
+import math
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+LIMITES_ADMISION = {
+    "pdf": {"concurrencia": 2, "tasa": 1.0, "rafaga": 3},
+    "lote": {"concurrencia": 4, "tasa": 5.0, "rafaga": 10},
+    "inferencia": {"concurrencia": 64, "tasa": 50.0, "rafaga": 100},
+}
+
+# (clase, método o None para cualquiera, ruta); una ruta que termina en "/"
+# es un prefijo. Las rutas sin clase no tienen límites.
+RUTAS_ADMISION = [
+    ("pdf", "GET", "/descargar-pdf/"),
+    ("pdf", "GET", "/descargar-historial-pdf"),
+    ("pdf", "GET", "/exportar-pdf"),
+    ("lote", "POST", "/diagnosticar-certeza-lote"),
+    ("lote", "POST", "/telemetria"),
+    ("lote", "POST", "/sensibilidad"),
+    ("lote", "POST", "/diagnosticos/sincronizar"),
+    ("inferencia", "POST", "/diagnosticar"),
+    ("inferencia", "POST", "/diagnosticar-multiple"),
+    ("inferencia", "POST", "/diagnosticar-parcial"),
+    ("inferencia", "POST", "/diagnosticar-certeza"),
+]
+
+# Cubetas guardadas por clase; se descartan las de los clientes menos recientes
+MAX_CLIENTES = 10000
+
+
+def cargar_limites() -> Dict[str, Dict[str, float]]:
+    """Límites del archivo ADMISION_LIMITES (sobre los de por defecto)"""
+    ruta = os.environ.get("ADMISION_LIMITES")
+    if not ruta:
+        return LIMITES_ADMISION
+    with open(ruta, encoding="utf-8") as f:
+        cambios = json.load(f)
+    limites = {clase: dict(valores) for clase, valores in LIMITES_ADMISION.items()}
+    for clase, valores in cambios.items():
+        if clase not in limites:
+            raise ValueError(f"Clase de admisión desconocida en {ruta}: {clase}")
+        limites[clase].update(valores)
+    return limites
+
+
+class ClaseAdmision:
+    """Límites, cubetas de fichas y contadores de una clase de endpoints"""
+
+    __slots__ = ("nombre", "concurrencia", "tasa", "rafaga", "en_curso", "max_en_curso",
+                 "admitidas", "rechazadas_tasa", "rechazadas_concurrencia", "_cubetas", "_reloj")
+
+    def __init__(self, nombre: str, concurrencia: int, tasa: float, rafaga: float,
+                 reloj: Callable[[], float] = time.monotonic):
+        if concurrencia < 1 or tasa <= 0 or rafaga < 1:
+            raise ValueError(f"Límites inválidos para la clase {nombre}")
+        self.nombre = nombre
+        self.concurrencia = concurrencia
+        self.tasa = tasa
+        self.rafaga = rafaga
+        self.en_curso = 0
+        self.max_en_curso = 0
+        self.admitidas = 0
+        self.rechazadas_tasa = 0
+        self.rechazadas_concurrencia = 0
+        # cliente -> [fichas, momento de la última actualización]
+        self._cubetas: "OrderedDict[str, List[float]]" = OrderedDict()
+        self._reloj = reloj
+
+    def admitir(self, cliente: str) -> Optional[Tuple[int, int]]:
+        """
+        Intenta admitir una petición del cliente; si se admite, hay que
+        llamar a liberar() al terminar
+
+        Returns:
+            None si se admite, o (código HTTP, segundos para Retry-After)
+        """
+        if self.en_curso >= self.concurrencia:
+            self.rechazadas_concurrencia += 1
+            return 503, 1
+
+        ahora = self._reloj()
+        cubeta = self._cubetas.get(cliente)
+        if cubeta is None:
+            cubeta = self._cubetas[cliente] = [float(self.rafaga), ahora]
+            if len(self._cubetas) > MAX_CLIENTES:
+                self._cubetas.popitem(last=False)
+        else:
+            self._cubetas.move_to_end(cliente)
+            cubeta[0] = min(self.rafaga, cubeta[0] + (ahora - cubeta[1]) * self.tasa)
+            cubeta[1] = ahora
+
+        if cubeta[0] < 1.0:
+            self.rechazadas_tasa += 1
+            return 429, max(1, math.ceil((1.0 - cubeta[0]) / self.tasa))
+
+        cubeta[0] -= 1.0
+        self.en_curso += 1
+        self.max_en_curso = max(self.max_en_curso, self.en_curso)
+        self.admitidas += 1
+        return None
+
+    def liberar(self) -> None:
+        self.en_curso -= 1
+
+    def estadisticas(self) -> Dict[str, Any]:
+        return {
+            "concurrencia": self.concurrencia,
+            "tasa": self.tasa,
+            "rafaga": self.rafaga,
+            "en_curso": self.en_curso,
+            "max_en_curso": self.max_en_curso,
+            "admitidas": self.admitidas,
+            "rechazadas_tasa": self.rechazadas_tasa,
+            "rechazadas_concurrencia": self.rechazadas_concurrencia,
+            "clientes": len(self._cubetas),
+        }
+
+
+class ControlAdmision:
+    """Clasifica las rutas y guarda una ClaseAdmision por clase"""
+
+    def __init__(self, limites: Optional[Dict[str, Dict[str, float]]] = None,
+                 rutas: Optional[List[Tuple[str, Optional[str], str]]] = None):
+        limites = cargar_limites() if limites is None else limites
+        self.clases = {nombre: ClaseAdmision(nombre, **valores) for nombre, valores in limites.items()}
+        self._exactas: Dict[Tuple[Optional[str], str], str] = {}
+        self._prefijos: List[Tuple[Optional[str], str, str]] = []
+        for clase, metodo, ruta in RUTAS_ADMISION if rutas is None else rutas:
+            if ruta.endswith("/"):
+                self._prefijos.append((metodo, ruta, clase))
+            else:
+                self._exactas[(metodo, ruta)] = clase
+
+    def clasificar(self, metodo: str, ruta: str) -> Optional[ClaseAdmision]:
+        """Clase de la ruta, o None si no tiene límites"""
+        clase = self._exactas.get((metodo, ruta)) or self._exactas.get((None, ruta))
+        if clase is None:
+            for metodo_prefijo, prefijo, nombre in self._prefijos:
+                if metodo_prefijo in (None, metodo) and ruta.startswith(prefijo):
+                    clase = nombre
+                    break
+        return None if clase is None else self.clases.get(clase)
+
+    def estadisticas(self) -> Dict[str, Dict[str, Any]]:
+        return {nombre: clase.estadisticas() for nombre, clase in self.clases.items()}
+
+
+class MiddlewareAdmision:
+    """
+    Middleware ASGI que aplica el ControlAdmision antes de llegar a la ruta;
+    las peticiones rechazadas no ocupan ningún hilo
+    """
+
+    def __init__(self, app, control: ControlAdmision):
+        self.app = app
+        self.control = control
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        clase = self.control.clasificar(scope["method"], scope["path"])
+        if clase is None:
+            await self.app(scope, receive, send)
+            return
+
+        inquilino = next((v for k, v in scope["headers"] if k == b"x-inquilino"), b"").decode("utf-8", "replace")
+        ip = scope["client"][0] if scope.get("client") else ""
+        rechazo = clase.admitir(f"{inquilino}|{ip}")
+        if rechazo is not None:
+            await rechazar(send, *rechazo)
+            return
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            clase.liberar()
+
+
+async def rechazar(send, estado: int, reintento: int) -> None:
+    """Respuesta inmediata de rechazo con Retry-After"""
+    if estado == 429:
+        mensaje = "Demasiadas peticiones, intente más tarde"
+    else:
+        mensaje = "Servidor ocupado, intente más tarde"
+    cuerpo = json.dumps({"error": mensaje}, ensure_ascii=False).encode("utf-8")
+    await send({
+        "type": "http.response.start",
+        "status": estado,
+        "headers": [
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(cuerpo)).encode()),
+            (b"retry-after", str(reintento).encode()),
+        ],
+    })
+    await send({"type": "http.response.body", "body": cuerpo})
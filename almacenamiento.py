@@ -0,0 +1,498 @@
+"""
+Motores de almacenamiento de diagnósticos intercambiables
+
+La API guarda y consulta diagnósticos a través de un Almacen: guardar (uno,
+por lote o por lote con claves de idempotencia), obtener por ID, buscar por clave de idempotencia, historial
+paginado, estadísticas y coocurrencias de hechos. Hay tres motores:
+
+- sqlite: las funciones de database.py (el motor de siempre, por defecto)
+- memoria: todo en diccionarios del proceso; para tests y benchmarks
+- log: archivo de solo agregado con un índice en memoria y lecturas por
+  mmap, para ingestas con muchas escrituras
+
+El motor se elige con la variable de entorno ALMACEN (sqlite, memoria o
+log); el archivo del motor log se indica con ALMACEN_RUTA. La telemetría
+(bloques de lecturas y cambios de estado) queda siempre en SQLite.
+
+Formato del log: un encabezado MAGIA y registros [largo u32][crc32 u32]
+[JSON]. Cada JSON es la lista de columnas de COLUMNAS_LOG. Al abrir se
+recorre el archivo para rearmar el índice y se descarta una cola
+incompleta (una escritura cortada por una caída). Un solo proceso puede
+escribir el archivo a la vez: se toma un lock exclusivo donde hay fcntl.
+"""
+
+import json
+import mmap
+import os
+import struct
+import threading
+import zlib
+from bisect import bisect_left
+from collections import Counter
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterable, List, Mapping, Optional, Sequence, Tuple
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+import database
+from coocurrencia import MatrizCoocurrencia
+from database import SIN_DIAGNOSTICO
+from registros import Diagnostico
+from serializacion import dumps
+
+MOTORES = ("sqlite", "memoria", "log")
+MAGIA = b"DIAGLOG1"
+COLUMNAS_LOG = ("id", "fecha", "hechos", "regla_id", "titulo", "categoria", "riesgo", "descripcion",
+                "justificacion", "acciones", "version_reglas", "inquilino", "clave_idempotencia")
+
+_CABECERA = struct.Struct("<II")
+
+
+def _fecha_actual() -> str:
+    # Mismo formato que CURRENT_TIMESTAMP de SQLite (UTC)
+    return datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+
+
+class Almacen:
+    """Interfaz común de los motores de almacenamiento de diagnósticos"""
+
+    nombre = ""
+
+    def guardar(self, hechos: Dict[str, bool], resultado: Optional[Mapping[str, Any]],
+                clave_idempotencia: Optional[str] = None, version_reglas: Optional[str] = None,
+                inquilino: str = '') -> int:
+        """
+        Guarda un diagnóstico y avisa a los observadores de database.py
+
+        Returns:
+            ID del diagnóstico guardado (o del ya existente con la misma clave y los mismos hechos)
+
+        Raises:
+            database.ClaveIdempotenciaUsada: Si la clave ya se guardó con otros hechos
+        """
+        raise NotImplementedError
+
+    def guardar_lote(self, diagnosticos: Iterable[Tuple[str, Optional[Mapping[str, Any]]]],
+                     version_reglas: Optional[str] = None, inquilino: str = '') -> int:
+        """Guarda pares (hechos en JSON, resultado) sin avisar a los observadores"""
+        raise NotImplementedError
+
+    def guardar_con_claves(self, diagnosticos: Sequence[Tuple[str, Dict[str, bool], Optional[Mapping[str, Any]]]],
+                           version_reglas: Optional[str] = None,
+                           inquilino: str = '') -> List[Tuple[int, Optional[Dict[str, Any]]]]:
+        """
+        Guarda (clave, hechos, resultado) sin repetir claves ya usadas; por cada
+        uno devuelve el ID y None si es nuevo, o el ID y los hechos del que ya tenía la clave
+        """
+        raise NotImplementedError
+
+    def obtener(self, diagnostico_id: int, inquilino: str = '') -> Optional[Diagnostico]:
+        raise NotImplementedError
+
+    def buscar_por_clave(self, clave: str, inquilino: str = '') -> Optional[Diagnostico]:
+        raise NotImplementedError
+
+    def historial(self, limite: int = 50, offset: int = 0, inquilino: str = '',
+                  desde: Optional[str] = None, hasta: Optional[str] = None,
+                  antes: Optional[Tuple[str, int]] = None) -> List[Diagnostico]:
+        """
+        Diagnósticos del inquilino, del más reciente al más antiguo (desde inclusivo,
+        hasta exclusivo). Con antes = (fecha, id) del último de la página anterior
+        solo devuelve los que le siguen: paginar así no depende de lo que se borre o
+        archive mientras tanto, como sí pasa con offset.
+        """
+        raise NotImplementedError
+
+    def estadisticas(self, inquilino: str = '', desde: Optional[str] = None,
+                     hasta: Optional[str] = None) -> Dict[str, Any]:
+        """Total, cantidad por riesgo y las 5 categorías más frecuentes"""
+        raise NotImplementedError
+
+    def coocurrencias(self, inquilino: str = '') -> Dict[str, Any]:
+        """Conteos, probabilidades condicionales y lift de hechos y reglas (ver coocurrencia.py)"""
+        raise NotImplementedError
+
+    def cerrar(self) -> None:
+        pass
+
+
+class AlmacenSQLite(Almacen):
+    """Las funciones de database.py (usa database.DATABASE_NAME al momento de cada llamada)"""
+
+    nombre = "sqlite"
+
+    def guardar(self, hechos, resultado, clave_idempotencia=None, version_reglas=None, inquilino=''):
+        return database.guardar_diagnostico(hechos, resultado, clave_idempotencia, version_reglas, inquilino)
+
+    def guardar_lote(self, diagnosticos, version_reglas=None, inquilino=''):
+        return database.guardar_diagnosticos_lote(diagnosticos, version_reglas, inquilino)
+
+    def guardar_con_claves(self, diagnosticos, version_reglas=None, inquilino=''):
+        return database.guardar_diagnosticos_con_claves(diagnosticos, version_reglas, inquilino)
+
+    def obtener(self, diagnostico_id, inquilino=''):
+        return database.obtener_diagnostico_por_id(diagnostico_id, inquilino)
+
+    def buscar_por_clave(self, clave, inquilino=''):
+        return database.buscar_por_clave_idempotencia(clave, inquilino)
+
+    def historial(self, limite=50, offset=0, inquilino='', desde=None, hasta=None, antes=None):
+        return database.obtener_historial(limite, offset, inquilino, desde, hasta, antes)
+
+    def estadisticas(self, inquilino='', desde=None, hasta=None):
+        return database.obtener_estadisticas(inquilino, desde, hasta)
+
+    def coocurrencias(self, inquilino=''):
+        return database.obtener_coocurrencias(inquilino)
+
+
+class _AlmacenIndexado(Almacen):
+    """
+    Base de los motores con índices en memoria: IDs por inquilino (en orden
+    de inserción, que es el de las fechas), claves de idempotencia y conteos
+    por riesgo y categoría, y matrices de coocurrencia. Las subclases solo guardan y leen las filas.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._ultimo_id = 0
+        self._inquilino_de: Dict[int, str] = {}
+        self._ids: Dict[str, List[int]] = {}
+        # Fechas de cada ID de _ids (crecientes: se busca un rango con bisect)
+        self._fechas: Dict[str, List[str]] = {}
+        self._claves: Dict[Tuple[str, str], int] = {}
+        self._riesgos: Dict[str, Counter] = {}
+        self._categorias: Dict[str, Counter] = {}
+        self._coocurrencias: Dict[str, MatrizCoocurrencia] = {}
+
+    def _indexar(self, diagnostico_id: int, fecha: str, inquilino: str, clave: Optional[str],
+                 riesgo: Optional[str], categoria: Optional[str]) -> None:
+        self._ultimo_id = max(self._ultimo_id, diagnostico_id)
+        self._inquilino_de[diagnostico_id] = inquilino
+        self._ids.setdefault(inquilino, []).append(diagnostico_id)
+        self._fechas.setdefault(inquilino, []).append(fecha)
+        if clave is not None:
+            self._claves[(inquilino, clave)] = diagnostico_id
+        self._riesgos.setdefault(inquilino, Counter())[riesgo] += 1
+        self._categorias.setdefault(inquilino, Counter())[categoria] += 1
+
+    def _contar_hechos(self, inquilino: str, hechos: Mapping[str, Any], regla_id: Optional[str],
+                       veces: int = 1) -> None:
+        self._coocurrencias.setdefault(inquilino, MatrizCoocurrencia()).sumar(hechos, regla_id, veces)
+
+    def _agregar(self, filas: List[tuple]) -> None:
+        """
+        Guarda filas (id, fecha, hechos, hechos_json, datos, version_reglas,
+        inquilino, clave); de hechos y hechos_json viene al menos uno
+        """
+        raise NotImplementedError
+
+    def _leer(self, diagnostico_id: int) -> Diagnostico:
+        raise NotImplementedError
+
+    def guardar(self, hechos, resultado, clave_idempotencia=None, version_reglas=None, inquilino=''):
+        datos = SIN_DIAGNOSTICO if resultado is None else resultado
+        fecha = _fecha_actual()
+        with self._lock:
+            existente = None
+            if clave_idempotencia is not None:
+                existente = self._claves.get((inquilino, clave_idempotencia))
+            if existente is None:
+                diagnostico_id = self._ultimo_id + 1
+                self._agregar([(diagnostico_id, fecha, hechos, None, datos, version_reglas, inquilino,
+                                clave_idempotencia)])
+                self._indexar(diagnostico_id, fecha, inquilino, clave_idempotencia, datos.get('riesgo'),
+                              datos.get('categoria'))
+                self._contar_hechos(inquilino, hechos, datos.get('id'))
+        if existente is not None:
+            # Fuera del lock: el motor log puede tener que volver a mapear el archivo
+            previo = self._leer(existente)
+            if previo['hechos'] != hechos:
+                raise database.ClaveIdempotenciaUsada(previo)
+            return existente
+
+        database._notificar_guardado({
+            'id': diagnostico_id,
+            'fecha': fecha,
+            'regla_id': datos.get('id'),
+            'titulo': datos.get('titulo'),
+            'categoria': datos.get('categoria'),
+            'riesgo': datos.get('riesgo'),
+            'inquilino': inquilino,
+        })
+        return diagnostico_id
+
+    def guardar_lote(self, diagnosticos, version_reglas=None, inquilino=''):
+        fecha = _fecha_actual()
+        with self._lock:
+            filas = []
+            siguiente = self._ultimo_id
+            for hechos_json, resultado in diagnosticos:
+                siguiente += 1
+                filas.append((siguiente, fecha, None, hechos_json, SIN_DIAGNOSTICO if resultado is None else resultado,
+                              version_reglas, inquilino, None))
+            self._agregar(filas)
+            combinaciones: Counter = Counter()
+            for fila in filas:
+                self._indexar(fila[0], fecha, inquilino, None, fila[4].get('riesgo'), fila[4].get('categoria'))
+                combinaciones[(fila[3], fila[4].get('id'))] += 1
+            for (hechos_json, regla_id), veces in combinaciones.items():
+                self._contar_hechos(inquilino, json.loads(hechos_json), regla_id, veces)
+        return len(filas)
+
+    def guardar_con_claves(self, diagnosticos, version_reglas=None, inquilino=''):
+        fecha = _fecha_actual()
+        with self._lock:
+            filas, resultados = [], []
+            # Posiciones de las claves que ya estaban guardadas (sus hechos se leen después)
+            anteriores: List[int] = []
+            nuevas: Dict[str, Tuple[int, Dict[str, Any]]] = {}
+            siguiente = self._ultimo_id
+            for clave, hechos, resultado in diagnosticos:
+                previo = nuevas.get(clave)
+                if previo is None:
+                    existente = self._claves.get((inquilino, clave))
+                    if existente is not None:
+                        anteriores.append(len(resultados))
+                        previo = existente, None
+                if previo is not None:
+                    resultados.append(previo)
+                    continue
+                siguiente += 1
+                filas.append((siguiente, fecha, hechos, None, SIN_DIAGNOSTICO if resultado is None else resultado,
+                              version_reglas, inquilino, clave))
+                nuevas[clave] = (siguiente, dict(hechos))
+                resultados.append((siguiente, None))
+            if filas:
+                self._agregar(filas)
+            for fila in filas:
+                self._indexar(fila[0], fecha, inquilino, fila[7], fila[4].get('riesgo'), fila[4].get('categoria'))
+                self._contar_hechos(inquilino, fila[2], fila[4].get('id'))
+        # Fuera del lock, como en guardar: el motor log puede tener que volver a mapear el archivo
+        for posicion in anteriores:
+            existente = resultados[posicion][0]
+            resultados[posicion] = existente, self._leer(existente)['hechos']
+        return resultados
+
+    def obtener(self, diagnostico_id, inquilino=''):
+        if self._inquilino_de.get(diagnostico_id) != inquilino:
+            return None
+        return self._leer(diagnostico_id)
+
+    def buscar_por_clave(self, clave, inquilino=''):
+        diagnostico_id = self._claves.get((inquilino, clave))
+        return None if diagnostico_id is None else self._leer(diagnostico_id)
+
+    def _rango(self, inquilino: str, desde: Optional[str], hasta: Optional[str]) -> Tuple[List[int], int, int]:
+        """IDs del inquilino y posiciones [inicio, fin) de las fechas pedidas"""
+        ids, fechas = self._ids.get(inquilino, []), self._fechas.get(inquilino, [])
+        inicio = bisect_left(fechas, desde) if desde is not None else 0
+        fin = bisect_left(fechas, hasta) if hasta is not None else len(ids)
+        return ids, inicio, fin
+
+    def historial(self, limite=50, offset=0, inquilino='', desde=None, hasta=None, antes=None):
+        ids, inicio, fin = self._rango(inquilino, desde, hasta)
+        if antes is not None:
+            # Los IDs del índice van en el orden del historial
+            fin = min(fin, bisect_left(ids, antes[1]))
+        fin -= offset
+        return [self._leer(ids[i]) for i in range(fin - 1, max(fin - limite, inicio) - 1, -1)]
+
+    def estadisticas(self, inquilino='', desde=None, hasta=None):
+        if desde is None and hasta is None:
+            with self._lock:
+                total = len(self._ids.get(inquilino, []))
+                riesgos = Counter(self._riesgos.get(inquilino, Counter()))
+                categorias = Counter(self._categorias.get(inquilino, Counter()))
+        else:
+            ids, inicio, fin = self._rango(inquilino, desde, hasta)
+            total, riesgos, categorias = max(fin - inicio, 0), Counter(), Counter()
+            for i in range(inicio, fin):
+                diagnostico = self._leer(ids[i])
+                riesgos[diagnostico.riesgo] += 1
+                categorias[diagnostico.categoria] += 1
+        return {
+            'total': total,
+            'por_riesgo': dict(riesgos),
+            'por_categoria': dict(categorias.most_common(5)),
+        }
+
+    def coocurrencias(self, inquilino=''):
+        with self._lock:
+            matriz = self._coocurrencias.get(inquilino) or MatrizCoocurrencia()
+            return matriz.analizar()
+
+
+def _diagnostico(diagnostico_id: int, fecha: str, hechos: Dict[str, Any], datos: Mapping[str, Any],
+                 version_reglas: Optional[str]) -> Diagnostico:
+    return Diagnostico(
+        id=diagnostico_id,
+        fecha=fecha,
+        hechos=hechos,
+        regla_id=datos.get('id'),
+        titulo=datos.get('titulo'),
+        categoria=datos.get('categoria'),
+        riesgo=datos.get('riesgo'),
+        descripcion=datos.get('descripcion'),
+        justificacion=datos.get('justificacion'),
+        acciones=datos.get('acciones', []),
+        version_reglas=version_reglas,
+    )
+
+
+class AlmacenMemoria(_AlmacenIndexado):
+    """Diagnósticos en memoria del proceso (se pierden al terminar)"""
+
+    nombre = "memoria"
+
+    def __init__(self):
+        super().__init__()
+        self._registros: Dict[int, Diagnostico] = {}
+
+    def _agregar(self, filas):
+        for diagnostico_id, fecha, hechos, hechos_json, datos, version_reglas, _, _ in filas:
+            if hechos is None:
+                hechos = json.loads(hechos_json)
+            self._registros[diagnostico_id] = _diagnostico(diagnostico_id, fecha, hechos, datos, version_reglas)
+
+    def _leer(self, diagnostico_id):
+        return self._registros[diagnostico_id]
+
+
+class AlmacenLog(_AlmacenIndexado):
+    """
+    Archivo de solo agregado. Las escrituras se acumulan en un solo write por
+    llamada y las lecturas toman el registro del mapa en memoria (mmap) del
+    archivo, que se vuelve a mapear cuando el archivo creció.
+
+    Args:
+        ruta: Archivo del log (se crea si no existe)
+        sincronizar: fsync después de cada escritura (más lento, sobrevive a
+                     un corte de energía y no solo a la caída del proceso)
+    """
+
+    nombre = "log"
+
+    def __init__(self, ruta: str, sincronizar: bool = False):
+        super().__init__()
+        self.ruta = ruta
+        self.sincronizar = sincronizar
+        self._archivo = open(ruta, "a+b")
+        if fcntl is not None:
+            try:
+                fcntl.flock(self._archivo.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                self._archivo.close()
+                raise RuntimeError(f"Otro proceso está escribiendo {ruta}") from None
+        self._mapa: Optional[mmap.mmap] = None
+        self._ubicacion: Dict[int, Tuple[int, int]] = {}
+        self._recuperar()
+
+    def _recuperar(self) -> None:
+        """Rearma los índices recorriendo el archivo y corta una cola incompleta"""
+        tamano = os.fstat(self._archivo.fileno()).st_size
+        if tamano == 0:
+            self._archivo.write(MAGIA)
+            self._archivo.flush()
+            return
+        self._remapear()
+        if self._mapa[:len(MAGIA)] != MAGIA:
+            raise ValueError(f"{self.ruta} no es un log de diagnósticos")
+        posicion = len(MAGIA)
+        while posicion + _CABECERA.size <= tamano:
+            largo, crc = _CABECERA.unpack_from(self._mapa, posicion)
+            inicio = posicion + _CABECERA.size
+            carga = self._mapa[inicio:inicio + largo]
+            if len(carga) < largo or zlib.crc32(carga) != crc:
+                break
+            columnas = json.loads(carga)
+            self._ubicacion[columnas[0]] = (inicio, largo)
+            self._indexar(columnas[0], columnas[1], columnas[11], columnas[12], columnas[6], columnas[5])
+            self._contar_hechos(columnas[11], columnas[2], columnas[3])
+            posicion = inicio + largo
+        if posicion < tamano:
+            print(f"Log {self.ruta}: se descartan {tamano - posicion} bytes incompletos al final")
+            self._mapa.close()
+            self._mapa = None
+            self._archivo.truncate(posicion)
+
+    def _remapear(self) -> None:
+        # El mapa anterior no se cierra: puede haber lecturas en curso y se
+        # libera solo cuando nadie lo referencia
+        self._mapa = mmap.mmap(self._archivo.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def _carga(self, columnas_regla: Dict[int, bytes], diagnostico_id, fecha, hechos, hechos_json, datos,
+               version_reglas, inquilino, clave) -> bytes:
+        columnas = columnas_regla.get(id(datos))
+        if columnas is None:
+            columnas = columnas_regla[id(datos)] = dumps([
+                datos.get('id'), datos.get('titulo'), datos.get('categoria'), datos.get('riesgo'),
+                datos.get('descripcion'), datos.get('justificacion'), list(datos.get('acciones', [])),
+            ])[1:-1]
+        hechos_json = dumps(hechos) if hechos_json is None else hechos_json.encode("utf-8")
+        return b"".join((
+            dumps([diagnostico_id, fecha])[:-1], b",", hechos_json, b",", columnas, b",",
+            dumps([version_reglas, inquilino, clave])[1:],
+        ))
+
+    def _agregar(self, filas):
+        partes = []
+        posicion = self._archivo.seek(0, os.SEEK_END)
+        ubicaciones = []
+        # Columnas de cada regla serializadas una vez por llamada: las reglas son objetos
+        # compartidos, pero solo mientras las filas las referencian su id() no se reutiliza
+        columnas_regla: Dict[int, bytes] = {}
+        for fila in filas:
+            carga = self._carga(columnas_regla, *fila)
+            partes.append(_CABECERA.pack(len(carga), zlib.crc32(carga)))
+            partes.append(carga)
+            posicion += _CABECERA.size
+            ubicaciones.append((fila[0], (posicion, len(carga))))
+            posicion += len(carga)
+        self._archivo.write(b"".join(partes))
+        self._archivo.flush()
+        if self.sincronizar:
+            os.fsync(self._archivo.fileno())
+        self._ubicacion.update(ubicaciones)
+
+    def _leer(self, diagnostico_id):
+        inicio, largo = self._ubicacion[diagnostico_id]
+        mapa = self._mapa
+        if mapa is None or inicio + largo > len(mapa):
+            with self._lock:
+                if self._mapa is None or inicio + largo > len(self._mapa):
+                    self._remapear()
+                mapa = self._mapa
+        columnas = json.loads(mapa[inicio:inicio + largo])
+        return Diagnostico(**dict(zip(COLUMNAS_LOG[:11], columnas)))
+
+    def cerrar(self):
+        with self._lock:
+            if self._mapa is not None:
+                self._mapa.close()
+                self._mapa = None
+            self._archivo.close()
+
+
+def crear_almacen(motor: Optional[str] = None, ruta: Optional[str] = None) -> Almacen:
+    """
+    Crea el motor de almacenamiento configurado
+
+    Args:
+        motor: sqlite, memoria o log (por defecto la variable ALMACEN, o sqlite)
+        ruta: Archivo del motor log (por defecto ALMACEN_RUTA o diagnosticos_ambientales.log)
+
+    Raises:
+        ValueError: Si el motor no existe
+    """
+    motor = motor or os.environ.get("ALMACEN", "sqlite")
+    if motor == "sqlite":
+        return AlmacenSQLite()
+    if motor == "memoria":
+        return AlmacenMemoria()
+    if motor == "log":
+        return AlmacenLog(ruta or os.environ.get("ALMACEN_RUTA", "diagnosticos_ambientales.log"))
+    raise ValueError(f"Motor de almacenamiento desconocido: {motor} (opciones: {', '.join(MOTORES)})")
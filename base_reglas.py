@@ -0,0 +1,295 @@
+"""
+Base de reglas recargable en caliente
+
+Las reglas se leen de un archivo JSON externo (variable de entorno
+REGLAS_ARCHIVO, por defecto reglas.json); si no existe se usan las de
+reglas.py. Cada recarga valida y compila la base nueva (catálogo
+serializado, diagrama y motor de certeza) fuera del camino de las peticiones y la
+publica con una sola asignación. La tabla de decisión y la del navegador
+ocupan 2^F entradas y se arman la primera vez que se piden, solo si hay
+hasta MAX_HECHOS_TABLA hechos observables: cada petición toma la base vigente al
+empezar y termina con esa misma versión aunque haya una recarga en medio.
+
+Para generar el archivo a partir de las reglas incluidas:
+
+    python base_reglas.py exportar reglas.json
+
+Para revisar un archivo antes de publicarlo (reglas inalcanzables,
+sombreadas y solapamientos; termina con código 1 si hay reglas que nunca
+se aplican):
+
+    python base_reglas.py analizar reglas.json
+"""
+
+import argparse
+import json
+import os
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+from bdd import ReglasCompiladas
+from certeza import MAX_TERMINOS_FND, MotorCerteza
+from sensibilidad import TablaDecision
+from condiciones import Expresion, desde_dict
+from reglas import (
+    REGLAS_AMBIENTALES, HECHOS_OBSERVABLES,
+    motor_inferencia_multiple, motor_inferencia_parcial,
+)
+from registros import Regla, compilar_reglas
+from serializacion import CatalogoSerializado, TablaCliente
+
+ARCHIVO_REGLAS = os.environ.get("REGLAS_ARCHIVO", "reglas.json")
+
+CAMPOS_TEXTO = ("id", "titulo", "categoria", "riesgo", "descripcion", "justificacion")
+RIESGOS = ("ALTO", "MEDIO", "BAJO")
+HECHOS_VALIDOS = frozenset(hecho["id"] for hecho in HECHOS_OBSERVABLES)
+
+
+def validar_reglas(reglas: List[Dict[str, Any]]) -> None:
+    """
+    Verifica que una base de reglas se pueda usar
+
+    Raises:
+        ValueError: Con el detalle de la primera regla inválida
+    """
+    if not reglas:
+        raise ValueError("La base de reglas está vacía")
+    vistos = set()
+    for posicion, regla in enumerate(reglas):
+        nombre = regla.get("id", f"#{posicion}") if isinstance(regla, dict) else f"#{posicion}"
+        if not isinstance(regla, dict):
+            raise ValueError(f"Regla {nombre}: debe ser un objeto")
+        for campo in CAMPOS_TEXTO:
+            if not isinstance(regla.get(campo), str) or not regla[campo]:
+                raise ValueError(f"Regla {nombre}: falta el campo '{campo}'")
+        if regla["id"] in vistos:
+            raise ValueError(f"Regla {nombre}: ID repetido")
+        vistos.add(regla["id"])
+        if regla["riesgo"] not in RIESGOS:
+            raise ValueError(f"Regla {nombre}: riesgo inválido '{regla['riesgo']}'")
+        acciones = regla.get("acciones")
+        if not isinstance(acciones, list) or not all(isinstance(a, str) for a in acciones):
+            raise ValueError(f"Regla {nombre}: 'acciones' debe ser una lista de textos")
+        certeza = regla.get("certeza", 1.0)
+        if not isinstance(certeza, (int, float)) or not 0.0 <= certeza <= 1.0:
+            raise ValueError(f"Regla {nombre}: 'certeza' debe estar entre 0 y 1")
+        if not isinstance(regla.get("condicion"), Expresion):
+            raise ValueError(f"Regla {nombre}: falta la condición")
+        desconocidos = regla["condicion"].hechos() - HECHOS_VALIDOS
+        if desconocidos:
+            raise ValueError(f"Regla {nombre}: hechos desconocidos {sorted(desconocidos)}")
+        # El motor de certeza la expande a forma normal disyuntiva: se cuenta antes de expandirla
+        if regla["condicion"].terminos_fnd() > MAX_TERMINOS_FND:
+            raise ValueError(f"Regla {nombre}: la condición tiene más de {MAX_TERMINOS_FND} términos en "
+                             f"forma normal disyuntiva; hay que simplificarla o dividirla en varias reglas")
+
+
+class BaseReglas:
+    """Base de reglas validada y compilada; no se modifica una vez creada"""
+
+    __slots__ = ("reglas", "version", "origen", "serializado", "certeza", "diagrama", "_tablas", "_bloqueo_tablas")
+
+    def __init__(self, reglas: List[Dict[str, Any]], origen: str = "reglas.py"):
+        validar_reglas(reglas)
+        self.reglas = compilar_reglas(reglas)
+        self.origen = origen
+        self.serializado = CatalogoSerializado(self.reglas)
+        self.version = self.serializado.version
+        self.certeza = MotorCerteza(self.reglas, [hecho["id"] for hecho in HECHOS_OBSERVABLES])
+        self.diagrama = ReglasCompiladas(self.reglas)
+        self._tablas: Optional[Tuple[TablaDecision, TablaCliente]] = None
+        self._bloqueo_tablas = threading.Lock()
+
+    @property
+    def tablas_armadas(self) -> bool:
+        """Si sensibilidad y cliente ya están calculadas (pedirlas no bloquea)"""
+        return self._tablas is not None
+
+    def _armar_tablas(self) -> Tuple[TablaDecision, TablaCliente]:
+        """
+        Raises:
+            DemasiadosHechos: Si hay más de MAX_HECHOS_TABLA hechos observables
+        """
+        with self._bloqueo_tablas:
+            if self._tablas is None:
+                tabla = TablaDecision(self.diagrama, [hecho["id"] for hecho in HECHOS_OBSERVABLES])
+                # La misma tabla para diagnosticar sin conexión en el navegador (ver sincronizacion.py)
+                self._tablas = (tabla, TablaCliente(tabla, self.serializado, HECHOS_OBSERVABLES))
+            return self._tablas
+
+    @property
+    def sensibilidad(self) -> TablaDecision:
+        """Tabla de decisión (ver sensibilidad.py); puede lanzar DemasiadosHechos"""
+        return self._armar_tablas()[0]
+
+    @property
+    def cliente(self) -> TablaCliente:
+        """Tabla para el navegador (ver serializacion.py); puede lanzar DemasiadosHechos"""
+        return self._armar_tablas()[1]
+
+    def diagnosticar(self, hechos: Dict[str, bool]) -> Optional[Regla]:
+        return self.diagrama.diagnosticar(hechos)
+
+    def analizar(self) -> Dict[str, Any]:
+        """Análisis estático de la base (ver ReglasCompiladas.analizar)"""
+        return dict(self.diagrama.analizar(), version=self.version)
+
+    def diagnosticar_multiple(self, hechos: Dict[str, bool]) -> List[Regla]:
+        return motor_inferencia_multiple(hechos, self.reglas)
+
+    def diagnosticar_parcial(self, hechos: Dict[str, Optional[bool]],
+                             terminacion_temprana: bool = True) -> Dict[str, Any]:
+        return motor_inferencia_parcial(hechos, terminacion_temprana, self.reglas)
+
+
+def leer_archivo(ruta: str) -> List[Dict[str, Any]]:
+    """
+    Lee un archivo de reglas JSON (lista de reglas con la condición en
+    formato a_dict)
+
+    Raises:
+        ValueError: Si el JSON o alguna condición no son válidos
+    """
+    with open(ruta, encoding="utf-8") as f:
+        datos = json.load(f)
+    if not isinstance(datos, list):
+        raise ValueError("El archivo de reglas debe contener una lista")
+    reglas = []
+    for posicion, regla in enumerate(datos):
+        if not isinstance(regla, dict) or "condicion" not in regla:
+            raise ValueError(f"Regla #{posicion}: falta la condición")
+        try:
+            condicion = desde_dict(regla["condicion"])
+        except ValueError as e:
+            raise ValueError(f"Regla {regla.get('id', posicion)}: {e}") from None
+        reglas.append(dict(regla, condicion=condicion))
+    return reglas
+
+
+def exportar(reglas: List[Dict[str, Any]], ruta: str) -> None:
+    """Escribe las reglas en el formato que lee leer_archivo"""
+    datos = [dict(regla, condicion=regla.condicion.a_dict()) for regla in compilar_reglas(reglas)]
+    with open(ruta, "w", encoding="utf-8") as f:
+        json.dump(datos, f, ensure_ascii=False, indent=2)
+
+
+def _base_inicial() -> BaseReglas:
+    if os.path.exists(ARCHIVO_REGLAS):
+        return BaseReglas(leer_archivo(ARCHIVO_REGLAS), ARCHIVO_REGLAS)
+    return BaseReglas(REGLAS_AMBIENTALES)
+
+
+_vigente = _base_inicial()
+# Evita que dos recargas simultáneas se pisen; las lecturas no lo usan
+_lock_recarga = threading.Lock()
+
+
+def base_vigente() -> BaseReglas:
+    """Base de reglas vigente (tomarla una vez por petición)"""
+    return _vigente
+
+
+def recargar(ruta: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Lee, valida y compila las reglas y las publica como base vigente.
+    Si algo falla, la base anterior sigue vigente.
+
+    Args:
+        ruta: Archivo de reglas (por defecto ARCHIVO_REGLAS)
+
+    Returns:
+        Versión nueva, versión anterior y cantidad de reglas
+
+    Raises:
+        ValueError / OSError: Si el archivo no se puede usar
+    """
+    global _vigente
+    ruta = ruta or ARCHIVO_REGLAS
+    with _lock_recarga:
+        nueva = BaseReglas(leer_archivo(ruta), ruta)
+        anterior = _vigente
+        _vigente = nueva
+    return {"version": nueva.version, "anterior": anterior.version, "reglas": len(nueva.reglas), "origen": ruta}
+
+
+class VigilanteArchivo:
+    """Hilo que recarga las reglas cuando cambia el archivo"""
+
+    def __init__(self, ruta: str = ARCHIVO_REGLAS, intervalo: float = 2.0):
+        self.ruta = ruta
+        self.intervalo = intervalo
+        self._detener = threading.Event()
+        self._hilo: Optional[threading.Thread] = None
+        self._firma = self._firma_actual()
+
+    def _firma_actual(self):
+        try:
+            estado = os.stat(self.ruta)
+        except OSError:
+            return None
+        return (estado.st_mtime_ns, estado.st_size)
+
+    def revisar(self) -> Optional[Dict[str, Any]]:
+        """Recarga si el archivo cambió desde la última revisión"""
+        firma = self._firma_actual()
+        if firma is None or firma == self._firma:
+            return None
+        self._firma = firma
+        try:
+            return recargar(self.ruta)
+        except (ValueError, OSError) as e:
+            print(f"Error recargando reglas desde {self.ruta}: {e}")
+            return None
+
+    def _ciclo(self) -> None:
+        while not self._detener.wait(self.intervalo):
+            self.revisar()
+
+    def iniciar(self) -> None:
+        self._hilo = threading.Thread(target=self._ciclo, name="vigilante-reglas", daemon=True)
+        self._hilo.start()
+
+    def detener(self) -> None:
+        self._detener.set()
+        if self._hilo is not None:
+            self._hilo.join()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Herramientas de la base de reglas")
+    sub = parser.add_subparsers(dest="comando", required=True)
+    exp = sub.add_parser("exportar", help="Exporta las reglas de reglas.py a JSON")
+    exp.add_argument("ruta", nargs="?", default=ARCHIVO_REGLAS)
+    val = sub.add_parser("validar", help="Valida un archivo de reglas")
+    val.add_argument("ruta", nargs="?", default=ARCHIVO_REGLAS)
+    ana = sub.add_parser("analizar", help="Busca reglas inalcanzables, sombreadas y solapadas")
+    ana.add_argument("ruta", nargs="?", help="Archivo de reglas (por defecto las de reglas.py)")
+    ana.add_argument("--solapamientos", action="store_true", help="Listar también los solapamientos")
+    args = parser.parse_args()
+
+    if args.comando == "exportar":
+        exportar(REGLAS_AMBIENTALES, args.ruta)
+        print(f"{len(REGLAS_AMBIENTALES)} reglas exportadas a {args.ruta}")
+    elif args.comando == "analizar":
+        base = BaseReglas(leer_archivo(args.ruta), args.ruta) if args.ruta else BaseReglas(REGLAS_AMBIENTALES)
+        analisis = base.analizar()
+        cobertura = "sin calcular" if analisis["cobertura"] is None else f"{analisis['cobertura']:.1%}"
+        print(f"{analisis['reglas']} reglas, {analisis['hechos']} hechos, diagrama de {analisis['nodos']} nodos "
+              f"(profundidad {analisis['profundidad']}), cobertura {cobertura}")
+        if not analisis["completo"]:
+            print(f"  INCOMPLETO    análisis cortado en {analisis['max_nodos']} nodos (BDD_MAX_NODOS_ANALISIS): "
+                  f"sombreadas y alcance solo de las primeras {analisis['reglas_analizadas']} reglas"
+                  + (f", {len(analisis['pares_omitidos'])} pares sin comparar" if analisis["pares_omitidos"] else ""))
+        for regla in analisis["inalcanzables"]:
+            print(f"  INALCANZABLE  {regla['id']}: la condición nunca se cumple")
+        for regla in analisis["sombreadas"]:
+            print(f"  SOMBREADA     {regla['id']}: siempre gana antes {', '.join(regla['por'])}")
+        if args.solapamientos:
+            for par in analisis["solapamientos"]:
+                print(f"  solapa        {par['id']} con {par['con']} ({par['fraccion']:.1%}), "
+                      f"ej. {json.dumps(par['ejemplo'], ensure_ascii=False)}")
+        if analisis["inalcanzables"] or analisis["sombreadas"]:
+            raise SystemExit(1)
+    else:
+        base = BaseReglas(leer_archivo(args.ruta), args.ruta)
+        print(f"{len(base.reglas)} reglas válidas, versión {base.version}")
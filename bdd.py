@@ -0,0 +1,480 @@
+"""
+Diagramas de decisión binarios (BDD) para las condiciones de las reglas
+
+Cada condición se compila a un BDD reducido y ordenado: un grafo donde cada
+nodo pregunta por un hecho y los nodos iguales se comparten. Con eso:
+
+- La base de reglas completa (primera regla que se cumple gana) se compila
+  a un único diagrama cuyas hojas son reglas; diagnosticar es recorrer un
+  camino desde la raíz, como mucho un paso por hecho, sin evaluar regla
+  por regla.
+- El análisis estático trabaja sobre los diagramas y no sobre las 2^F
+  combinaciones de hechos: detecta reglas con condiciones imposibles, reglas
+  que nunca ganan porque otras anteriores cubren todos sus casos
+  (sombreadas) y solapamientos parciales con reglas anteriores, contando
+  las combinaciones afectadas y dando un ejemplo de cada caso.
+
+El tamaño de un BDD depende del orden de los hechos; se usa el orden en que
+aparecen en las reglas (las de mayor prioridad primero). Las condiciones
+por separado son chicas, pero el diagrama de la base completa puede crecer
+mucho con cientos de reglas independientes: si supera el máximo de nodos
+no se construye y las reglas se evalúan en orden, cada una por su BDD.
+"""
+
+import os
+import threading
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from condiciones import Expresion, Hecho, No, O, Y
+
+
+# Nodos del diagrama descartable en que se hace el análisis estático
+MAX_NODOS_ANALISIS = int(os.environ.get("BDD_MAX_NODOS_ANALISIS", "200000"))
+
+
+class DiagramaDemasiadoGrande(Exception):
+    """El diagrama superó el máximo de nodos permitido"""
+
+
+class DiagramaDecision:
+    """
+    Administrador de BDD compartidos sobre un orden fijo de hechos. Las hojas
+    pueden tener cualquier valor (CERO y UNO son False y True), así el mismo
+    administrador sirve para condiciones y para el diagrama de reglas.
+    """
+
+    CERO = 0
+    UNO = 1
+
+    def __init__(self, hechos: Sequence[str], max_nodos: int = 1_000_000):
+        self.hechos = list(hechos)
+        self._posicion = {hecho: i for i, hecho in enumerate(self.hechos)}
+        self.max_nodos = max_nodos
+        # Las hojas tienen como variable len(hechos): quedan debajo de todos los nodos
+        self._hoja_var = len(self.hechos)
+        self._var: List[int] = []
+        self._bajo: List[int] = []
+        self._alto: List[int] = []
+        self._valores: Dict[int, Any] = {}
+        self._hojas: Dict[Any, int] = {}
+        self._unicos: Dict[Tuple[int, int, int], int] = {}
+        self._cache_ite: Dict[Tuple[int, int, int], int] = {}
+        self.hoja(False)
+        self.hoja(True)
+
+    def __len__(self) -> int:
+        return len(self._var)
+
+    def hoja(self, valor: Any) -> int:
+        """Nodo terminal con el valor dado"""
+        nodo = self._hojas.get(valor)
+        if nodo is None:
+            nodo = self._hojas[valor] = len(self._var)
+            self._var.append(self._hoja_var)
+            self._bajo.append(nodo)
+            self._alto.append(nodo)
+            self._valores[nodo] = valor
+        return nodo
+
+    def es_hoja(self, nodo: int) -> bool:
+        return self._var[nodo] == self._hoja_var
+
+    def valor(self, nodo: int) -> Any:
+        return self._valores[nodo]
+
+    def _nodo(self, var: int, bajo: int, alto: int) -> int:
+        if bajo == alto:
+            return bajo
+        clave = (var, bajo, alto)
+        nodo = self._unicos.get(clave)
+        if nodo is None:
+            if len(self._var) >= self.max_nodos:
+                raise DiagramaDemasiadoGrande(f"Más de {self.max_nodos} nodos")
+            nodo = self._unicos[clave] = len(self._var)
+            self._var.append(var)
+            self._bajo.append(bajo)
+            self._alto.append(alto)
+        return nodo
+
+    def variable(self, hecho: str) -> int:
+        return self._nodo(self._posicion[hecho], self.CERO, self.UNO)
+
+    def _cofactores(self, nodo: int, var: int) -> Tuple[int, int]:
+        if self._var[nodo] == var:
+            return self._bajo[nodo], self._alto[nodo]
+        return nodo, nodo
+
+    def ite(self, f: int, g: int, h: int) -> int:
+        """Si f entonces g si no h (f debe ser una condición: hojas CERO/UNO)"""
+        if f == self.UNO:
+            return g
+        if f == self.CERO:
+            return h
+        if g == h:
+            return g
+        if g == self.UNO and h == self.CERO:
+            return f
+        clave = (f, g, h)
+        resultado = self._cache_ite.get(clave)
+        if resultado is not None:
+            return resultado
+        var = min(self._var[f], self._var[g], self._var[h])
+        f0, f1 = self._cofactores(f, var)
+        g0, g1 = self._cofactores(g, var)
+        h0, h1 = self._cofactores(h, var)
+        resultado = self._nodo(var, self.ite(f0, g0, h0), self.ite(f1, g1, h1))
+        self._cache_ite[clave] = resultado
+        return resultado
+
+    def y(self, a: int, b: int) -> int:
+        return self.ite(a, b, self.CERO)
+
+    def o(self, a: int, b: int) -> int:
+        return self.ite(a, self.UNO, b)
+
+    def no(self, a: int) -> int:
+        return self.ite(a, self.CERO, self.UNO)
+
+    def desde_expresion(self, expresion: Expresion) -> int:
+        """BDD de una condición"""
+        if isinstance(expresion, Hecho):
+            return self.variable(expresion.nombre)
+        if isinstance(expresion, No):
+            return self.no(self.desde_expresion(expresion.termino))
+        if isinstance(expresion, Y):
+            resultado = self.UNO
+            for termino in expresion.terminos:
+                resultado = self.y(resultado, self.desde_expresion(termino))
+            return resultado
+        if isinstance(expresion, O):
+            resultado = self.CERO
+            for termino in expresion.terminos:
+                resultado = self.o(resultado, self.desde_expresion(termino))
+            return resultado
+        raise TypeError(f"Expresión no soportada: {expresion!r}")
+
+    def evaluar(self, nodo: int, hechos: Dict[str, bool]) -> Any:
+        """Valor de la hoja a la que lleva el camino de los hechos (ausente = falso)"""
+        var, bajo, alto, nombres, hoja_var = self._var, self._bajo, self._alto, self.hechos, self._hoja_var
+        while var[nodo] != hoja_var:
+            nodo = alto[nodo] if hechos.get(nombres[var[nodo]]) else bajo[nodo]
+        return self._valores[nodo]
+
+    def evaluar_mascaras(self, nodo: int, mascaras: np.ndarray, bits: Sequence[int]) -> np.ndarray:
+        """
+        Como evaluar para muchas combinaciones a la vez, con numpy
+
+        Args:
+            nodo: Raíz del diagrama
+            mascaras: Vector de enteros con una combinación de hechos por elemento
+            bits: Bit de cada hecho del diagrama (en el orden de self.hechos)
+                  dentro de las máscaras; -1 si el hecho no está (cuenta como falso)
+
+        Returns:
+            Valor de la hoja a la que llega cada máscara, como entero
+        """
+        var = np.array(self._var, dtype=np.int64)
+        bajo = np.array(self._bajo, dtype=np.int64)
+        alto = np.array(self._alto, dtype=np.int64)
+        valores = np.zeros(len(var), dtype=np.int64)
+        for hoja, valor in self._valores.items():
+            valores[hoja] = int(valor)
+        # Posición de las hojas (hoja_var) al final: nunca se consulta su bit
+        bit_var = np.array(list(bits) + [-1], dtype=np.int64)
+        presente = bit_var >= 0
+        bit_var = np.maximum(bit_var, 0)
+
+        actual = np.full(len(mascaras), nodo, dtype=np.int64)
+        # Las hojas apuntan a sí mismas: basta con avanzar tantas veces como la profundidad
+        for _ in range(self.profundidad(nodo)):
+            v = var[actual]
+            verdadero = presente[v] & ((mascaras >> bit_var[v]) & 1).astype(bool)
+            actual = np.where(verdadero, alto[actual], bajo[actual])
+        return valores[actual]
+
+    def contar(self, nodo: int, hoja: int = UNO) -> int:
+        """Cantidad de combinaciones de todos los hechos que llegan a la hoja"""
+        memo: Dict[int, int] = {}
+
+        def caminos(n: int) -> int:
+            # Combinaciones de las variables desde la de n hacia abajo
+            if self._var[n] == self._hoja_var:
+                return 1 if n == hoja else 0
+            if n not in memo:
+                var = self._var[n]
+                bajo, alto = self._bajo[n], self._alto[n]
+                memo[n] = (caminos(bajo) << (self._var[bajo] - var - 1)) + \
+                          (caminos(alto) << (self._var[alto] - var - 1))
+            return memo[n]
+
+        return caminos(nodo) << self._var[nodo] if not self.es_hoja(nodo) else \
+            (1 << self._hoja_var if nodo == hoja else 0)
+
+    def ejemplo(self, nodo: int, hoja: int = UNO) -> Optional[Dict[str, bool]]:
+        """Una combinación (solo los hechos que deciden) que llega a la hoja, o None"""
+        memo: Dict[int, bool] = {}
+
+        def llega(n: int) -> bool:
+            if self._var[n] == self._hoja_var:
+                return n == hoja
+            if n not in memo:
+                memo[n] = llega(self._alto[n]) or llega(self._bajo[n])
+            return memo[n]
+
+        if not llega(nodo):
+            return None
+        camino: Dict[str, bool] = {}
+        while not self.es_hoja(nodo):
+            alto = llega(self._alto[nodo])
+            camino[self.hechos[self._var[nodo]]] = alto
+            nodo = self._alto[nodo] if alto else self._bajo[nodo]
+        return camino
+
+    def tamano(self, nodo: int) -> int:
+        """Nodos alcanzables desde nodo"""
+        vistos = set()
+        pendientes = [nodo]
+        while pendientes:
+            n = pendientes.pop()
+            if n in vistos:
+                continue
+            vistos.add(n)
+            if not self.es_hoja(n):
+                pendientes.extend((self._bajo[n], self._alto[n]))
+        return len(vistos)
+
+    def profundidad(self, nodo: int) -> int:
+        """Largo del camino más largo hasta una hoja (pasos de evaluación)"""
+        memo: Dict[int, int] = {}
+
+        def largo(n: int) -> int:
+            if self.es_hoja(n):
+                return 0
+            if n not in memo:
+                memo[n] = 1 + max(largo(self._bajo[n]), largo(self._alto[n]))
+            return memo[n]
+
+        return largo(nodo)
+
+
+def orden_hechos(reglas: Sequence[Any]) -> List[str]:
+    """Hechos en el orden en que aparecen en las condiciones, por prioridad"""
+    orden: Dict[str, None] = {}
+
+    def recorrer(expresion: Expresion) -> None:
+        if isinstance(expresion, Hecho):
+            orden.setdefault(expresion.nombre)
+        elif isinstance(expresion, No):
+            recorrer(expresion.termino)
+        else:
+            for termino in expresion.terminos:
+                recorrer(termino)
+
+    for regla in reglas:
+        recorrer(_condicion(regla))
+    return list(orden)
+
+
+def _condicion(regla: Any) -> Expresion:
+    # Reglas como diccionarios (archivo) o como registros compilados
+    return regla["condicion"] if isinstance(regla, dict) else regla.condicion
+
+
+class ReglasCompiladas:
+    """
+    Base de reglas compilada a BDD: un diagrama por condición y, si no supera
+    max_nodos_base, uno para la base completa cuyas hojas son los índices de
+    la regla ganadora (-1 si ninguna se cumple). Sin ese diagrama (bases con
+    muchas reglas independientes) diagnosticar recorre las reglas en orden.
+    """
+
+    def __init__(self, reglas: Sequence[Any], max_nodos_base: int = 200_000,
+                 max_nodos_analisis: int = MAX_NODOS_ANALISIS):
+        self.reglas = list(reglas)
+        self.diagrama = DiagramaDecision(orden_hechos(self.reglas), max_nodos=10 ** 7)
+        d = self.diagrama
+        self.condiciones = [d.desde_expresion(_condicion(regla)) for regla in self.reglas]
+        # El análisis usa su propio diagrama (acotado y descartable) y se hace
+        # una sola vez: la base no cambia. El lock evita calcularlo dos veces.
+        self.max_nodos_analisis = max_nodos_analisis
+        self._analisis: Optional[Dict[str, Any]] = None
+        self._lock = threading.Lock()
+
+        # De la última regla a la primera: cada regla tapa a las posteriores
+        self.raiz: Optional[int] = None
+        maximo, d.max_nodos = d.max_nodos, len(d) + max_nodos_base
+        try:
+            raiz = d.hoja(-1)
+            for indice in range(len(self.reglas) - 1, -1, -1):
+                raiz = d.ite(self.condiciones[indice], d.hoja(indice), raiz)
+            self.raiz = raiz
+        except DiagramaDemasiadoGrande:
+            # Los nodos del intento no se pueden liberar uno por uno: se
+            # vuelve a empezar solo con las condiciones
+            self.diagrama = DiagramaDecision(d.hechos, max_nodos=maximo)
+            self.condiciones = [self.diagrama.desde_expresion(_condicion(regla)) for regla in self.reglas]
+        finally:
+            d.max_nodos = maximo
+
+    def indice(self, hechos: Dict[str, bool]) -> int:
+        """Posición de la regla ganadora, o -1 si ninguna se cumple"""
+        if self.raiz is None:
+            for indice, condicion in enumerate(self.condiciones):
+                if self.diagrama.evaluar(condicion, hechos):
+                    return indice
+            return -1
+        return self.diagrama.evaluar(self.raiz, hechos)
+
+    def indices(self, hechos: Sequence[str], mascaras: np.ndarray) -> np.ndarray:
+        """
+        Como indice para un vector de combinaciones (bit i de cada máscara =
+        hechos[i]); sin el diagrama de la base, cada regla se evalúa solo
+        sobre las combinaciones que no resolvió una anterior
+        """
+        posicion = {hecho: bit for bit, hecho in enumerate(hechos)}
+        bits = [posicion.get(hecho, -1) for hecho in self.diagrama.hechos]
+        if self.raiz is not None:
+            return self.diagrama.evaluar_mascaras(self.raiz, mascaras, bits)
+        resultado = np.full(len(mascaras), -1, dtype=np.int64)
+        pendientes = np.arange(len(mascaras))
+        for indice, condicion in enumerate(self.condiciones):
+            if not len(pendientes):
+                break
+            cumple = self.diagrama.evaluar_mascaras(condicion, mascaras[pendientes], bits).astype(bool)
+            resultado[pendientes[cumple]] = indice
+            pendientes = pendientes[~cumple]
+        return resultado
+
+    def diagnosticar(self, hechos: Dict[str, bool]) -> Optional[Any]:
+        """Regla ganadora (la misma que motor_inferencia) o None"""
+        indice = self.indice(hechos)
+        return None if indice < 0 else self.reglas[indice]
+
+    def analizar(self) -> Dict[str, Any]:
+        """
+        Análisis estático de la base con orden de prioridad (primera regla gana)
+
+        Se calcula en diagramas descartables de hasta max_nodos_analisis
+        nodos, así no queda memoria tomada en el diagrama de la base. Contar
+        en qué casos gana cada regla necesita la unión de todas las
+        anteriores, que con muchas reglas en forma normal disyuntiva puede
+        crecer sin límite práctico: al llegar al máximo el análisis se corta
+        y el resultado es parcial (completo = False).
+
+        Returns:
+            Diccionario con:
+            - inalcanzables: reglas cuya condición no se puede cumplir
+            - sombreadas: reglas que se cumplen pero nunca ganan, y las reglas
+              anteriores que las tapan
+            - solapamientos: pares (regla, anterior) con combinaciones en común
+              en que gana la anterior, con cantidad y un ejemplo
+            - alcance: por regla, fracción de sus combinaciones en que gana
+            - cobertura: fracción de todas las combinaciones con alguna regla
+              (None si el análisis quedó incompleto)
+            - completo y reglas_analizadas: si se llegó al final y cuántas
+              reglas (en orden de prioridad) tienen sombreadas y alcance
+            - pares_omitidos: pares demasiado grandes para compararlos
+        """
+        with self._lock:
+            if self._analisis is None:
+                self._analisis = self._analizar()
+            return self._analisis
+
+    def _analizar(self) -> Dict[str, Any]:
+        base = self.diagrama
+        hechos = base.hechos
+        total = 1 << len(hechos)
+        ids = [regla["id"] for regla in self.reglas]
+        expresiones = [_condicion(regla) for regla in self.reglas]
+        # contar no agrega nodos: se puede hacer sobre el diagrama de la base
+        casos = [base.contar(condicion) for condicion in self.condiciones]
+        inalcanzables = [{"id": ids[i]} for i in range(len(ids)) if casos[i] == 0]
+
+        # Pares: con hechos en común se construye la conjunción; cada una es
+        # chica, pero se acumulan y cuando se llena el administrador se
+        # empieza otro. Sin hechos en común las condiciones son independientes.
+        solapamientos, pares_omitidos = [], []
+        anteriores: List[List[str]] = [[] for _ in ids]
+        variables = [expresion.hechos() for expresion in expresiones]
+        ejemplos = [base.ejemplo(condicion) for condicion in self.condiciones]
+        d, condiciones = None, []
+        for i in range(len(ids)):
+            if casos[i] == 0:
+                continue
+            for j in range(i):
+                if casos[j] == 0:
+                    continue
+                if variables[i].isdisjoint(variables[j]):
+                    anteriores[i].append(ids[j])
+                    solapamientos.append({
+                        "id": ids[i],
+                        "con": ids[j],
+                        "fraccion": casos[j] / total,
+                        "ejemplo": {**ejemplos[j], **ejemplos[i]},
+                    })
+                    continue
+                if d is None or len(d) > self.max_nodos_analisis // 2:
+                    d = DiagramaDecision(hechos, max_nodos=self.max_nodos_analisis)
+                    condiciones = [None] * len(ids)
+                try:
+                    for k in (i, j):
+                        if condiciones[k] is None:
+                            condiciones[k] = d.desde_expresion(expresiones[k])
+                    comunes = d.y(condiciones[i], condiciones[j])
+                except DiagramaDemasiadoGrande:
+                    pares_omitidos.append({"id": ids[i], "con": ids[j]})
+                    d = None
+                    continue
+                if comunes != d.CERO:
+                    anteriores[i].append(ids[j])
+                    solapamientos.append({
+                        "id": ids[i],
+                        "con": ids[j],
+                        "fraccion": d.contar(comunes) / casos[i],
+                        "ejemplo": d.ejemplo(comunes),
+                    })
+        d = condiciones = None
+
+        # Alcance: en qué casos gana cada regla, con la unión de las anteriores
+        sombreadas = []
+        alcance: Dict[str, float] = {}
+        d = DiagramaDecision(hechos, max_nodos=self.max_nodos_analisis)
+        cubierto = d.CERO
+        analizadas = 0
+        try:
+            for i, expresion in enumerate(expresiones):
+                if casos[i] == 0:
+                    alcance[ids[i]] = 0.0
+                else:
+                    condicion = d.desde_expresion(expresion)
+                    # condición y no cubierto, sin construir la negación aparte
+                    gana = d.ite(cubierto, d.CERO, condicion)
+                    alcance[ids[i]] = d.contar(gana) / casos[i]
+                    if gana == d.CERO:
+                        sombreadas.append({"id": ids[i], "por": anteriores[i]})
+                analizadas = i + 1
+                if casos[i]:
+                    cubierto = d.o(cubierto, condicion)
+            cobertura: Optional[float] = d.contar(cubierto) / total if total else 0.0
+        except DiagramaDemasiadoGrande:
+            cobertura = None
+        d = None
+
+        return {
+            "reglas": len(self.reglas),
+            "hechos": len(hechos),
+            "diagrama_base": self.raiz is not None,
+            "nodos": base.tamano(self.raiz) if self.raiz is not None else len(base),
+            "profundidad": base.profundidad(self.raiz) if self.raiz is not None else len(hechos),
+            "completo": analizadas == len(ids) and not pares_omitidos,
+            "reglas_analizadas": analizadas,
+            "max_nodos": self.max_nodos_analisis,
+            "inalcanzables": inalcanzables,
+            "sombreadas": sombreadas,
+            "solapamientos": solapamientos,
+            "pares_omitidos": pares_omitidos,
+            "alcance": alcance,
+            "cobertura": cobertura,
+        }
@@ -0,0 +1,90 @@
+"""
+Benchmark de latencia de /diagnosticar con sobrecarga de PDF
+
+Mientras CLIENTES_PDF clientes piden PDF sin pausa, un cliente mide la
+latencia de /diagnosticar. Se compara sin límites (todas las peticiones se
+encolan en el pool de hilos) con los límites de admisión por defecto para
+los PDF (los que sobran se rechazan de inmediato con 429/503). La inferencia
+queda sin límite de tasa en ambos casos: aquí un solo cliente hace todas
+las peticiones.
+
+Ejecutar con: python benchmarks/bench_admision.py
+"""
+
+import asyncio
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.chdir(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import httpx
+
+import database
+import main
+from admision import LIMITES_ADMISION, ClaseAdmision
+
+CLIENTES_PDF = 40
+DIAGNOSTICOS = 100
+SIN_LIMITES = {"concurrencia": 10 ** 6, "tasa": 10.0 ** 6, "rafaga": 10 ** 6}
+
+
+async def inundar_pdf(cliente, diagnostico_id, detener, codigos):
+    while not detener.is_set():
+        res = await cliente.get(f"/descargar-pdf/{diagnostico_id}")
+        codigos[res.status_code] = codigos.get(res.status_code, 0) + 1
+        if res.status_code != 200:
+            # Un cliente que respeta Retry-After reintentaría más tarde; aquí solo se cede el turno
+            await asyncio.sleep(0.01)
+
+
+async def escenario(limites):
+    for nombre, valores in limites.items():
+        main.control_admision.clases[nombre] = ClaseAdmision(nombre, **valores)
+
+    transporte = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transporte, base_url="http://bench") as cliente:
+        res = await cliente.post("/diagnosticar", json={"hechos": {"ruido_elevado": True}})
+        diagnostico_id = res.json()["diagnostico"]["diagnostico_id"]
+
+        detener = asyncio.Event()
+        codigos = {}
+        tareas = [asyncio.create_task(inundar_pdf(cliente, diagnostico_id, detener, codigos))
+                  for _ in range(CLIENTES_PDF)]
+        await asyncio.sleep(0.5)
+
+        latencias = []
+        for i in range(DIAGNOSTICOS):
+            inicio = time.perf_counter()
+            await cliente.post("/diagnosticar", json={"hechos": {"ruido_elevado": i % 2 == 0}})
+            latencias.append((time.perf_counter() - inicio) * 1000)
+
+        detener.set()
+        await asyncio.gather(*tareas)
+    return latencias, codigos
+
+
+def percentil(valores, p):
+    return sorted(valores)[min(len(valores) - 1, int(len(valores) * p))]
+
+
+async def principal():
+    print(f"/diagnosticar con {CLIENTES_PDF} clientes pidiendo PDF en paralelo")
+    print(f"{'escenario':<14}{'p50 ms':>10}{'p99 ms':>10}{'media ms':>10}  PDF por código")
+    for nombre, limites in (
+        ("sin límites", {clase: SIN_LIMITES for clase in LIMITES_ADMISION}),
+        ("con admisión", dict(LIMITES_ADMISION, inferencia=SIN_LIMITES)),
+    ):
+        latencias, codigos = await escenario(limites)
+        print(f"{nombre:<14}{percentil(latencias, 0.5):>10.1f}{percentil(latencias, 0.99):>10.1f}"
+              f"{statistics.mean(latencias):>10.1f}  {dict(sorted(codigos.items()))}")
+
+
+if __name__ == "__main__":
+    with tempfile.TemporaryDirectory() as directorio:
+        database.DATABASE_NAME = os.path.join(directorio, "bench.db")
+        database.init_database()
+        asyncio.run(principal())
@@ -0,0 +1,72 @@
+"""
+Benchmark de los motores de almacenamiento (sqlite, memoria, log)
+
+Mide, para cada motor: guardados de a uno, guardado por lotes, lecturas por
+ID al azar, páginas del historial y estadísticas.
+
+Ejecutar con: python benchmarks/bench_almacenamiento.py
+"""
+
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database
+from almacenamiento import MOTORES, crear_almacen
+from reglas import HECHOS_OBSERVABLES, motor_inferencia
+from serializacion import dumps
+
+GUARDADOS = 2000
+LOTE = 100_000
+BLOQUE = 20_000
+LECTURAS = 5000
+PAGINAS = 500
+
+
+def observaciones(cantidad, aleatorio):
+    hechos = [hecho["id"] for hecho in HECHOS_OBSERVABLES]
+    return [{hecho: aleatorio.random() < 0.4 for hecho in hechos} for _ in range(cantidad)]
+
+
+def medir(funcion):
+    inicio = time.perf_counter()
+    funcion()
+    return time.perf_counter() - inicio
+
+
+def escenario(motor, directorio):
+    database._observadores_guardado.clear()
+    database.DATABASE_NAME = os.path.join(directorio, f"{motor}.db")
+    database.init_database()
+    almacen = crear_almacen(motor, os.path.join(directorio, f"{motor}.log"))
+    aleatorio = random.Random(1)
+
+    individuales = [(hechos, motor_inferencia(hechos)) for hechos in observaciones(GUARDADOS, aleatorio)]
+    lote = [(dumps(hechos).decode(), motor_inferencia(hechos)) for hechos in observaciones(LOTE, aleatorio)]
+
+    resultados = {}
+    resultados["guardar/s"] = GUARDADOS / medir(lambda: [almacen.guardar(h, r) for h, r in individuales])
+    resultados["lote/s"] = LOTE / medir(
+        lambda: [almacen.guardar_lote(lote[i:i + BLOQUE]) for i in range(0, LOTE, BLOQUE)]
+    )
+    total = GUARDADOS + LOTE
+    ids = [aleatorio.randint(1, total) for _ in range(LECTURAS)]
+    resultados["obtener/s"] = LECTURAS / medir(lambda: [almacen.obtener(i) for i in ids])
+    paginas = [aleatorio.randint(0, total - 50) for _ in range(PAGINAS)]
+    resultados["historial/s"] = PAGINAS / medir(lambda: [almacen.historial(50, offset) for offset in paginas])
+    resultados["estadisticas ms"] = medir(almacen.estadisticas) * 1000
+    almacen.cerrar()
+    return resultados
+
+
+if __name__ == "__main__":
+    columnas = ("guardar/s", "lote/s", "obtener/s", "historial/s", "estadisticas ms")
+    print(f"{'motor':<10}" + "".join(f"{c:>17}" for c in columnas))
+    with tempfile.TemporaryDirectory() as directorio:
+        for motor in MOTORES:
+            resultados = escenario(motor, directorio)
+            print(f"{motor:<10}" + "".join(f"{resultados[c]:>17,.1f}" for c in columnas))
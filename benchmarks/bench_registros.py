@@ -0,0 +1,130 @@
+"""
+Benchmark de asignaciones y recolección de basura con registros compartidos
+
+Simula carga sostenida sobre el camino de /diagnosticar (con la caché de
+idempotencia reteniendo las últimas RETENIDAS respuestas) y sobre el
+historial, y compara:
+
+- anterior: el motor copia la regla coincidente a un dict nuevo, se le
+  agrega diagnostico_id y se serializa el dict completo; cada fila del
+  historial es un dict.
+- registros: el motor devuelve la Regla compartida, el JSON se arma con los
+  fragmentos precalculados y cada fila es un Diagnostico con __slots__.
+
+Ejecutar con: python benchmarks/bench_registros.py
+"""
+
+import gc
+import os
+import sys
+import time
+import tracemalloc
+from collections import deque
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from reglas import REGLAS_AMBIENTALES, REGLAS_COMPILADAS, motor_inferencia
+from registros import Diagnostico
+from serializacion import CatalogoSerializado, dumps
+
+PETICIONES = 200_000
+RETENIDAS = 10_000
+FILAS_HISTORIAL = 50_000
+
+CASOS_HECHOS = [
+    {"olor_fuerte": True, "residuos_acumulados": True},
+    {"agua_turbia": True, "olor_fuerte": True},
+    {"ruido_elevado": True},
+    {"aire_contaminado": True, "vegetacion_deteriorada": True},
+    {"humedad_excesiva": True},
+]
+
+
+def motor_anterior(hechos):
+    """Motor previo: copia de la regla sin la condición en cada coincidencia"""
+    for regla in REGLAS_AMBIENTALES:
+        if regla["condicion"](hechos):
+            return {k: v for k, v in regla.items() if k != "condicion"}
+    return None
+
+
+def peticion_anterior(hechos, diagnostico_id):
+    """Devuelve el cuerpo y la entrada que quedaba en la caché de idempotencia"""
+    resultado = motor_anterior(hechos)
+    if resultado:
+        resultado["diagnostico_id"] = diagnostico_id
+        respuesta = {"diagnostico": resultado}
+    else:
+        respuesta = {"diagnostico": {"diagnostico_id": diagnostico_id}}
+    return dumps(respuesta), {"hechos": hechos, "respuesta": respuesta}
+
+
+def peticion_registros(serializado, hechos, diagnostico_id):
+    resultado = motor_inferencia(hechos, REGLAS_COMPILADAS)
+    cuerpo = serializado.json_diagnostico(resultado, diagnostico_id)
+    return cuerpo, {"hechos": hechos, "resultado": resultado, "diagnostico_id": diagnostico_id}
+
+
+def carga_sostenida(peticion):
+    """Tiempo, colecciones de GC y memoria retenida durante PETICIONES llamadas"""
+    cache = deque(maxlen=RETENIDAS)
+    gc.collect()
+    colecciones = [etapa["collections"] for etapa in gc.get_stats()]
+    inicio = time.perf_counter()
+    for i in range(PETICIONES):
+        cache.append(peticion(CASOS_HECHOS[i % len(CASOS_HECHOS)], i)[1])
+    segundos = time.perf_counter() - inicio
+    colecciones = [etapa["collections"] - antes for etapa, antes in zip(gc.get_stats(), colecciones)]
+
+    # Memoria de la caché llena, medida aparte (tracemalloc es muy lento para toda la carga)
+    cache.clear()
+    gc.collect()
+    tracemalloc.start()
+    for i in range(RETENIDAS):
+        cache.append(peticion(CASOS_HECHOS[i % len(CASOS_HECHOS)], i)[1])
+    retenido, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return segundos, colecciones, retenido
+
+
+def memoria_historial(fabrica):
+    """Bytes retenidos por FILAS_HISTORIAL filas del historial"""
+    regla = REGLAS_AMBIENTALES[0]
+    hechos = CASOS_HECHOS[0]
+    gc.collect()
+    tracemalloc.start()
+    filas = [
+        fabrica(id=i, fecha="2026-01-01 10:00:00", hechos=hechos, regla_id=regla["id"],
+                titulo=regla["titulo"], categoria=regla["categoria"], riesgo=regla["riesgo"],
+                descripcion=regla["descripcion"], justificacion=regla["justificacion"],
+                acciones=regla["acciones"], version_reglas="0123456789ab")
+        for i in range(FILAS_HISTORIAL)
+    ]
+    retenido, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del filas
+    return retenido
+
+
+def main():
+    serializado = CatalogoSerializado(REGLAS_COMPILADAS)
+
+    print(f"Carga sostenida: {PETICIONES} peticiones a /diagnosticar, {RETENIDAS} retenidas en caché")
+    print(f"{'camino':<12}{'req/s':>10}{'GC gen0/1/2':>16}{'caché KiB':>12}")
+    for nombre, peticion in (
+        ("anterior", peticion_anterior),
+        ("registros", lambda hechos, i: peticion_registros(serializado, hechos, i)),
+    ):
+        segundos, colecciones, retenido = carga_sostenida(peticion)
+        gcs = "/".join(str(c) for c in colecciones)
+        print(f"{nombre:<12}{PETICIONES / segundos:>10.0f}{gcs:>16}{retenido / 1024:>12.1f}")
+
+    print(f"\nMemoria de {FILAS_HISTORIAL} filas de historial")
+    anterior = memoria_historial(dict)
+    registros = memoria_historial(Diagnostico)
+    print(f"{'dict':<12}{anterior / FILAS_HISTORIAL:>8.0f} B/fila")
+    print(f"{'Diagnostico':<12}{registros / FILAS_HISTORIAL:>8.0f} B/fila ({1 - registros / anterior:.0%} menos)")
+
+
+if __name__ == "__main__":
+    main()
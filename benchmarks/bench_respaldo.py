@@ -0,0 +1,82 @@
+"""
+Benchmark de latencia de /diagnosticar durante un respaldo en caliente
+
+Sobre una base con FILAS diagnósticos, un cliente mide la latencia de
+/diagnosticar sin respaldo y mientras un respaldo copia la base en otro
+hilo: de a PAGINAS_POR_PASO páginas con pausa (lo que hace respaldo.py) y
+de una sola vez (pages=-1, como una copia del archivo).
+
+Ejecutar con: python benchmarks/bench_respaldo.py
+"""
+
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.chdir(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fastapi.testclient import TestClient
+
+import database
+import main
+import respaldo
+from admision import ClaseAdmision
+from reglas import motor_inferencia
+from serializacion import dumps
+
+FILAS = 300_000
+DIAGNOSTICOS = 300
+HECHOS = {"agua_turbia": True, "olor_fuerte": True, "humedad_excesiva": True}
+
+
+def medir(cliente, respaldar):
+    detener = threading.Event()
+    manifiestos = []
+
+    def copiar():
+        while not detener.is_set():
+            manifiestos.append(respaldar())
+
+    hilo = threading.Thread(target=copiar) if respaldar else None
+    if hilo:
+        hilo.start()
+        time.sleep(0.05)
+    latencias = []
+    for _ in range(DIAGNOSTICOS):
+        inicio = time.perf_counter()
+        cliente.post("/diagnosticar", json={"hechos": HECHOS})
+        latencias.append((time.perf_counter() - inicio) * 1000)
+    detener.set()
+    if hilo:
+        hilo.join()
+    latencias.sort()
+    return latencias, manifiestos
+
+
+if __name__ == "__main__":
+    with tempfile.TemporaryDirectory() as directorio:
+        database.DATABASE_NAME = os.path.join(directorio, "bench.db")
+        database.init_database()
+        fila = (dumps(HECHOS).decode(), motor_inferencia(HECHOS))
+        for _ in range(FILAS // 50_000):
+            database.guardar_diagnosticos_lote([fila] * 50_000)
+        main.control_admision.clases["inferencia"] = ClaseAdmision("inferencia", 10 ** 6, 10.0 ** 6, 10 ** 6)
+        destino = os.path.join(directorio, "respaldos")
+        print(f"Base de {os.path.getsize(database.DATABASE_NAME) / 2 ** 20:,.0f} MB")
+
+        escenarios = {
+            "sin respaldo": None,
+            "incremental": lambda: respaldo.crear_respaldo(destino, conservar=1),
+            "de una vez": lambda: respaldo.crear_respaldo(destino, paginas=-1, pausa=0, conservar=1),
+        }
+        with TestClient(main.app) as cliente:
+            print(f"{'escenario':<14}{'p50 ms':>9}{'p99 ms':>9}{'max ms':>9}{'respaldo s':>12}")
+            for nombre, respaldar in escenarios.items():
+                latencias, manifiestos = medir(cliente, respaldar)
+                duracion = statistics.mean(m["segundos"] for m in manifiestos) if manifiestos else 0
+                print(f"{nombre:<14}{latencias[len(latencias) // 2]:>9.2f}"
+                      f"{latencias[int(len(latencias) * 0.99)]:>9.2f}{latencias[-1]:>9.2f}{duracion:>12.2f}")
@@ -0,0 +1,96 @@
+"""
+Benchmark del costo de serialización por endpoint
+
+Compara el camino anterior (validación del response_model + codificación
+JSON de FastAPI) con la serialización precalculada de serializacion.py.
+
+Ejecutar con: python benchmarks/bench_serializacion.py
+"""
+
+import json
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fastapi.encoders import jsonable_encoder
+
+from modelos import DiagnosticoResponse, DiagnosticoMultipleResponse
+from reglas import REGLAS_AMBIENTALES, motor_inferencia, motor_inferencia_multiple
+from serializacion import CatalogoSerializado, dumps
+
+REPETICIONES = 2000
+
+TODOS_LOS_HECHOS = {
+    "olor_fuerte": True,
+    "vegetacion_deteriorada": True,
+    "residuos_acumulados": True,
+    "humedad_excesiva": True,
+    "ruido_elevado": True,
+    "aire_contaminado": True,
+    "agua_turbia": True
+}
+
+
+def camino_fastapi(modelo, datos) -> bytes:
+    """Lo que hacía FastAPI con response_model: validar, convertir y codificar"""
+    validado = modelo.model_validate(datos)
+    return json.dumps(jsonable_encoder(validado), ensure_ascii=False).encode("utf-8")
+
+
+def camino_historial_anterior(datos) -> bytes:
+    """Respuesta de /historial devuelta como dict por FastAPI"""
+    return json.dumps(jsonable_encoder(datos), ensure_ascii=False).encode("utf-8")
+
+
+def medir(funcion) -> float:
+    """Microsegundos por llamada"""
+    return timeit.timeit(funcion, number=REPETICIONES) / REPETICIONES * 1e6
+
+
+def main():
+    serializado = CatalogoSerializado(REGLAS_AMBIENTALES)
+
+    resultado = motor_inferencia(TODOS_LOS_HECHOS)
+    diagnostico = dict(resultado, diagnostico_id=12345)
+    resultados = motor_inferencia_multiple(TODOS_LOS_HECHOS)
+    historial = {
+        "historial": [
+            {
+                "id": i,
+                "fecha": "2026-01-01 10:00:00",
+                "hechos": TODOS_LOS_HECHOS,
+                "regla_id": regla["id"],
+                "titulo": regla["titulo"],
+                "categoria": regla["categoria"],
+                "riesgo": regla["riesgo"],
+                "descripcion": regla["descripcion"],
+                "justificacion": regla["justificacion"],
+                "acciones": regla["acciones"],
+            }
+            for i, regla in zip(range(50), REGLAS_AMBIENTALES * 6)
+        ],
+        "total": 50,
+    }
+
+    casos = [
+        ("/diagnosticar",
+         lambda: camino_fastapi(DiagnosticoResponse, {"diagnostico": diagnostico}),
+         lambda: serializado.json_diagnostico(resultado, 12345)),
+        ("/diagnosticar-multiple",
+         lambda: camino_fastapi(DiagnosticoMultipleResponse, {"diagnosticos": resultados, "total": len(resultados)}),
+         lambda: serializado.json_diagnosticos(resultados)),
+        ("/historial (50)",
+         lambda: camino_historial_anterior(historial),
+         lambda: dumps(historial)),
+    ]
+
+    print(f"{'Endpoint':<26}{'Antes (µs)':>12}{'Después (µs)':>14}{'Mejora':>9}")
+    for nombre, antes, despues in casos:
+        t_antes, t_despues = medir(antes), medir(despues)
+        print(f"{nombre:<26}{t_antes:>12.1f}{t_despues:>14.1f}{t_antes / t_despues:>8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+"""
+Caché LRU de diagnósticos ya decodificados
+
+/diagnostico/{id} y /descargar-pdf/{id} suelen pedir el mismo diagnóstico
+varias veces justo después de crearlo. Sin caché, cada pedido abre una
+conexión, consulta la tabla y decodifica hechos_json y acciones_json.
+
+guardar_diagnostico llena la caché al escribir y obtener_diagnostico_por_id
+al leer algo que no estaba; un acierto no lee la tabla. Como los Diagnostico
+son inmutables, la caché devuelve el mismo objeto a todos. Un diagnóstico
+no cambia después de guardado (archivarlo no altera sus datos); solo
+restaurar un respaldo vuelve atrás la tabla y reutiliza sus IDs.
+
+Por eso cada caché lleva la generación de su base de datos: un valor que
+respaldo.restaurar cambia dentro de la base, lo corra la API u otro proceso
+(python respaldo.py restaurar). database.cache_diagnosticos la revisa a lo
+sumo cada CACHE_GENERACION_SEGUNDOS (entre revisiones un acierto solo lee
+memoria) con PRAGMA data_version sobre una conexión que queda abierta (solo
+relee la generación cuando otra conexión escribió) y vacía la caché si
+cambió; el proceso que restaura la revisa enseguida. Lo que se leyó con la
+generación anterior ya no se guarda. Los lotes, que no llenan
+la caché, descartan las entradas de los IDs que acaban de usar.
+
+La caché está acotada por cantidad de entradas (CACHE_DIAGNOSTICOS_MAX) y
+por memoria estimada (CACHE_DIAGNOSTICOS_MB); al pasarse de cualquiera de
+los dos se descartan los diagnósticos usados hace más tiempo.
+"""
+
+import os
+import sys
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional
+
+from registros import Diagnostico
+
+MAX_ENTRADAS = int(os.environ.get("CACHE_DIAGNOSTICOS_MAX", "10000"))
+MAX_BYTES = int(float(os.environ.get("CACHE_DIAGNOSTICOS_MB", "32")) * 2 ** 20)
+
+
+def tamano_estimado(diagnostico: Diagnostico) -> int:
+    """Bytes aproximados que ocupa un diagnóstico en memoria (objeto, textos, hechos y acciones)"""
+    tamano = sys.getsizeof(diagnostico)
+    for campo in Diagnostico.CAMPOS:
+        valor = getattr(diagnostico, campo)
+        tamano += sys.getsizeof(valor)
+        if isinstance(valor, dict):
+            tamano += sum(sys.getsizeof(clave) for clave in valor)
+        elif isinstance(valor, list):
+            tamano += sum(sys.getsizeof(elemento) for elemento in valor)
+    return tamano
+
+
+class CacheDiagnosticos:
+    """Caché LRU acotada por cantidad de entradas y por bytes estimados"""
+
+    def __init__(self, max_entradas: int = MAX_ENTRADAS, max_bytes: int = MAX_BYTES):
+        self.max_entradas = max_entradas
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.aciertos = 0
+        self.fallos = 0
+        self.descartados = 0
+        self.generacion: Optional[Hashable] = None
+        self._entradas: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def obtener(self, clave: Hashable) -> Optional[Diagnostico]:
+        """Devuelve el diagnóstico y lo marca como usado, o None (y cuenta un fallo)"""
+        with self._lock:
+            entrada = self._entradas.get(clave)
+            if entrada is None:
+                self.fallos += 1
+                return None
+            self._entradas.move_to_end(clave)
+            self.aciertos += 1
+            return entrada[0]
+
+    def guardar(self, clave: Hashable, diagnostico: Diagnostico, generacion: Optional[Hashable] = None) -> None:
+        """
+        Guarda un diagnóstico descartando los menos usados si se pasa de algún límite
+
+        Args:
+            generacion: La de la base cuando se leyó; si ya no es la vigente no se guarda
+        """
+        tamano = tamano_estimado(diagnostico)
+        if tamano > self.max_bytes:
+            return
+        with self._lock:
+            if generacion is not None and generacion != self.generacion:
+                return
+            anterior = self._entradas.pop(clave, None)
+            if anterior is not None:
+                self.bytes -= anterior[1]
+            self._entradas[clave] = (diagnostico, tamano)
+            self.bytes += tamano
+            while len(self._entradas) > self.max_entradas or self.bytes > self.max_bytes:
+                _, (_, liberado) = self._entradas.popitem(last=False)
+                self.bytes -= liberado
+                self.descartados += 1
+
+    def vaciar(self) -> None:
+        """Descarta todas las entradas (por ejemplo, tras restaurar un respaldo)"""
+        with self._lock:
+            self._entradas.clear()
+            self.bytes = 0
+
+    def validar(self, generacion: Optional[Hashable]) -> None:
+        """Vacía la caché si la base de datos cambió de generación"""
+        with self._lock:
+            if generacion != self.generacion:
+                self._entradas.clear()
+                self.bytes = 0
+                self.generacion = generacion
+
+    def descartar(self, condicion: Callable[[Hashable], bool]) -> int:
+        """Descarta las entradas cuya clave cumple la condición; devuelve cuántas"""
+        with self._lock:
+            claves = [clave for clave in self._entradas if condicion(clave)]
+            for clave in claves:
+                self.bytes -= self._entradas.pop(clave)[1]
+            return len(claves)
+
+    def estadisticas(self) -> Dict[str, Any]:
+        with self._lock:
+            consultas = self.aciertos + self.fallos
+            return {
+                "entradas": len(self._entradas),
+                "max_entradas": self.max_entradas,
+                "bytes": self.bytes,
+                "max_bytes": self.max_bytes,
+                "aciertos": self.aciertos,
+                "fallos": self.fallos,
+                "tasa_aciertos": round(self.aciertos / consultas, 4) if consultas else 0.0,
+                "descartados": self.descartados,
+            }
+
+    def __len__(self) -> int:
+        return len(self._entradas)
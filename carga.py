@@ -0,0 +1,370 @@
+"""
+Generador de carga que repite los recorridos del navegador
+
+Cada flujo reproduce lo que hace interfaz/static/script.js para un usuario:
+
+* cuestionario: GET /reglas/tabla (con If-None-Match, como la tabla
+  guardada en el navegador), el diagnóstico se hace localmente y se envía
+  con POST /diagnosticos/sincronizar (un lote de uno, como cuando hay
+  conexión) y, a veces, POST /diagnosticar-multiple?compacto=true y
+  GET /descargar-pdf/{id}.
+* historial: GET /historial?limite=50&compacto=true, GET /estadisticas y, a
+  veces, GET /descargar-historial-pdf?limite=50.
+
+Los flujos llegan como un proceso de Poisson a `tasa` flujos por segundo y
+se eligen según la mezcla pedida. Es un modelo abierto: un flujo empieza a
+su hora aunque los anteriores no hayan terminado, así una respuesta lenta
+no frena la llegada de usuarios ni esconde su propia latencia. Si hay más
+de `max_en_curso` flujos en vuelo, los nuevos se cuentan como descartados.
+
+Por defecto corre contra la app en el mismo proceso (sin red, sobre una
+base de datos temporal y sin límites de admisión). Con --url apunta a un
+servidor ya levantado y con --workers levanta uvicorn localmente con esa
+cantidad de procesos (sobre la base de datos configurada).
+
+Uso:
+
+    python carga.py --tasa 50 --duracion 30
+    python carga.py --mezcla cuestionario=9,historial=1 --workers 4
+    python carga.py --url http://localhost:8000 --json informe.json
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from collections import Counter
+from contextlib import contextmanager
+from typing import Any, Awaitable, Callable, Dict, Iterator, List, Optional
+
+import httpx
+
+# Probabilidades de los pasos opcionales de cada flujo
+PROB_MULTIPLE = 0.3
+PROB_PDF = 0.2
+PROB_PDF_HISTORIAL = 0.1
+# Fracción de respuestas afirmativas del cuestionario
+PROB_SI = 0.4
+
+SIN_LIMITES = {"concurrencia": 10 ** 6, "tasa": 10.0 ** 6, "rafaga": 10 ** 6}
+
+
+class Medicion:
+    """Latencias y códigos de respuesta de un endpoint"""
+
+    __slots__ = ("latencias", "codigos", "errores")
+
+    def __init__(self):
+        self.latencias: List[float] = []
+        self.codigos: Counter = Counter()
+        self.errores = 0
+
+
+class Sesion:
+    """Un usuario simulado: hace las peticiones de su flujo y las mide"""
+
+    def __init__(self, cliente: httpx.AsyncClient, mediciones: Dict[str, Medicion],
+                 estado: Dict[str, Any], aleatorio: random.Random):
+        self.cliente = cliente
+        self.mediciones = mediciones
+        self.estado = estado
+        self.aleatorio = aleatorio
+
+    async def pedir(self, etiqueta: str, metodo: str, ruta: str, **kwargs) -> Optional[httpx.Response]:
+        """
+        Hace una petición y la registra bajo `etiqueta` (método y ruta sin IDs)
+
+        Returns:
+            La respuesta, o None si falló la conexión o devolvió un error
+        """
+        medicion = self.mediciones.setdefault(etiqueta, Medicion())
+        inicio = time.perf_counter()
+        try:
+            respuesta = await self.cliente.request(metodo, ruta, **kwargs)
+            # El cuerpo completo es parte de la latencia (los PDF se transmiten)
+            await respuesta.aread()
+        except httpx.HTTPError:
+            medicion.latencias.append(time.perf_counter() - inicio)
+            medicion.codigos["conexion"] += 1
+            medicion.errores += 1
+            return None
+        medicion.latencias.append(time.perf_counter() - inicio)
+        medicion.codigos[str(respuesta.status_code)] += 1
+        if respuesta.status_code >= 400:
+            medicion.errores += 1
+            return None
+        return respuesta
+
+
+async def flujo_cuestionario(sesion: Sesion) -> None:
+    """Diagnosticar con la tabla de reglas, sincronizar el diagnóstico y a veces ver todos los problemas y el PDF"""
+    etag = sesion.estado.get("etag_tabla")
+    respuesta = await sesion.pedir("GET /reglas/tabla", "GET", "/reglas/tabla",
+                                   headers={"If-None-Match": etag} if etag else {})
+    if respuesta is None:
+        return
+    if respuesta.status_code == 200:
+        sesion.estado["etag_tabla"] = respuesta.headers.get("etag")
+        sesion.estado["hechos"] = [hecho["id"] for hecho in respuesta.json()["hechos"]]
+    hechos = {hecho: sesion.aleatorio.random() < PROB_SI for hecho in sesion.estado["hechos"]}
+
+    respuesta = await sesion.pedir("POST /diagnosticos/sincronizar", "POST", "/diagnosticos/sincronizar",
+                                   json={"diagnosticos": [{"clave": str(uuid.uuid4()), "hechos": hechos}]})
+    if respuesta is None:
+        return
+    diagnostico_id = respuesta.json()["resultados"][0]["diagnostico_id"]
+
+    if sesion.aleatorio.random() < PROB_MULTIPLE:
+        await sesion.pedir("POST /diagnosticar-multiple", "POST", "/diagnosticar-multiple?compacto=true",
+                           json={"hechos": hechos})
+    if sesion.aleatorio.random() < PROB_PDF:
+        await sesion.pedir("GET /descargar-pdf/{id}", "GET", f"/descargar-pdf/{diagnostico_id}")
+
+
+async def flujo_historial(sesion: Sesion) -> None:
+    """Abrir el historial con sus estadísticas y a veces descargarlo en PDF"""
+    await sesion.pedir("GET /historial", "GET", "/historial?limite=50&compacto=true")
+    await sesion.pedir("GET /estadisticas", "GET", "/estadisticas")
+    if sesion.aleatorio.random() < PROB_PDF_HISTORIAL:
+        await sesion.pedir("GET /descargar-historial-pdf", "GET", "/descargar-historial-pdf?limite=50")
+
+
+FLUJOS: Dict[str, Callable[[Sesion], Awaitable[None]]] = {
+    "cuestionario": flujo_cuestionario,
+    "historial": flujo_historial,
+}
+
+MEZCLA_POR_DEFECTO = {"cuestionario": 4.0, "historial": 1.0}
+
+
+def leer_mezcla(texto: str) -> Dict[str, float]:
+    """
+    Convierte 'cuestionario=4,historial=1' en pesos por flujo
+
+    Raises:
+        ValueError: Si un flujo no existe o un peso no es positivo
+    """
+    mezcla = {}
+    for parte in texto.split(","):
+        nombre, _, peso = parte.partition("=")
+        nombre = nombre.strip()
+        if nombre not in FLUJOS:
+            raise ValueError(f"Flujo desconocido: {nombre!r} (disponibles: {', '.join(FLUJOS)})")
+        mezcla[nombre] = float(peso) if peso else 1.0
+        if mezcla[nombre] < 0:
+            raise ValueError(f"Peso negativo para {nombre}")
+    if not any(mezcla.values()):
+        raise ValueError("La mezcla no tiene ningún flujo con peso positivo")
+    return mezcla
+
+
+def percentil(ordenados: List[float], p: float) -> float:
+    return ordenados[min(len(ordenados) - 1, int(len(ordenados) * p))]
+
+
+def armar_informe(mediciones: Dict[str, Medicion], flujos: Counter, descartados: int,
+                  segundos: float) -> Dict[str, Any]:
+    """Rendimiento, percentiles de latencia (ms) y tasa de error por endpoint"""
+    endpoints = {}
+    for etiqueta, medicion in sorted(mediciones.items()):
+        ordenados = sorted(medicion.latencias)
+        total = len(ordenados)
+        endpoints[etiqueta] = {
+            "peticiones": total,
+            "por_segundo": round(total / segundos, 2),
+            "errores": medicion.errores,
+            "tasa_error": round(medicion.errores / total, 4),
+            "p50_ms": round(percentil(ordenados, 0.50) * 1000, 2),
+            "p90_ms": round(percentil(ordenados, 0.90) * 1000, 2),
+            "p99_ms": round(percentil(ordenados, 0.99) * 1000, 2),
+            "max_ms": round(ordenados[-1] * 1000, 2),
+            "codigos": dict(sorted(medicion.codigos.items())),
+        }
+    peticiones = sum(e["peticiones"] for e in endpoints.values())
+    errores = sum(e["errores"] for e in endpoints.values())
+    return {
+        "segundos": round(segundos, 2),
+        "flujos": dict(flujos),
+        "descartados": descartados,
+        "peticiones": peticiones,
+        "por_segundo": round(peticiones / segundos, 2) if segundos else 0.0,
+        "tasa_error": round(errores / peticiones, 4) if peticiones else 0.0,
+        "endpoints": endpoints,
+    }
+
+
+async def generar_carga(cliente: httpx.AsyncClient, mezcla: Optional[Dict[str, float]] = None,
+                        tasa: float = 20.0, duracion: float = 10.0, semilla: Optional[int] = None,
+                        max_en_curso: int = 1000) -> Dict[str, Any]:
+    """
+    Lanza flujos con llegadas de Poisson durante `duracion` segundos y espera a que terminen
+
+    Args:
+        cliente: Cliente httpx con base_url apuntando a la app
+        mezcla: Peso de cada flujo de FLUJOS (por defecto MEZCLA_POR_DEFECTO)
+        tasa: Flujos que empiezan por segundo, en promedio
+        duracion: Segundos durante los que llegan flujos nuevos
+        semilla: Semilla de las llegadas, la elección de flujos y las respuestas
+        max_en_curso: Flujos en vuelo a partir de los cuales los nuevos se descartan
+
+    Returns:
+        El informe de armar_informe
+    """
+    mezcla = mezcla or MEZCLA_POR_DEFECTO
+    nombres = [nombre for nombre, peso in mezcla.items() if peso > 0]
+    pesos = [mezcla[nombre] for nombre in nombres]
+    aleatorio = random.Random(semilla)
+    mediciones: Dict[str, Medicion] = {}
+    estado: Dict[str, Any] = {}
+    flujos: Counter = Counter()
+    en_curso = set()
+    descartados = 0
+
+    inicio = time.perf_counter()
+    proxima = inicio
+    while proxima - inicio < duracion:
+        espera = proxima - time.perf_counter()
+        if espera > 0:
+            await asyncio.sleep(espera)
+        if len(en_curso) >= max_en_curso:
+            descartados += 1
+        else:
+            nombre = aleatorio.choices(nombres, pesos)[0]
+            flujos[nombre] += 1
+            sesion = Sesion(cliente, mediciones, estado, random.Random(aleatorio.random()))
+            tarea = asyncio.create_task(FLUJOS[nombre](sesion))
+            en_curso.add(tarea)
+            tarea.add_done_callback(en_curso.discard)
+        proxima += aleatorio.expovariate(tasa)
+    if en_curso:
+        await asyncio.gather(*en_curso)
+    return armar_informe(mediciones, flujos, descartados, time.perf_counter() - inicio)
+
+
+def imprimir_informe(informe: Dict[str, Any]) -> None:
+    print(f"{informe['peticiones']:,} peticiones en {informe['segundos']} s "
+          f"({informe['por_segundo']:,.1f}/s), flujos {informe['flujos']}, "
+          f"descartados {informe['descartados']}, errores {informe['tasa_error']:.2%}")
+    print(f"{'endpoint':<32}{'pet.':>7}{'/s':>8}{'err %':>7}{'p50 ms':>9}{'p90 ms':>9}{'p99 ms':>9}{'max ms':>9}")
+    for etiqueta, datos in informe["endpoints"].items():
+        print(f"{etiqueta:<32}{datos['peticiones']:>7}{datos['por_segundo']:>8.1f}{datos['tasa_error'] * 100:>7.1f}"
+              f"{datos['p50_ms']:>9.1f}{datos['p90_ms']:>9.1f}{datos['p99_ms']:>9.1f}{datos['max_ms']:>9.1f}")
+
+
+@contextmanager
+def app_en_proceso(db: Optional[str] = None, admision: bool = False) -> Iterator[httpx.AsyncClient]:
+    """
+    Cliente contra main.app sin red, sobre una base temporal (o `db`) y sin
+    límites de admisión salvo que se pidan
+    """
+    import database
+    import main
+    from admision import ClaseAdmision
+
+    with tempfile.TemporaryDirectory() as directorio:
+        anterior = database.DATABASE_NAME
+        database.DATABASE_NAME = db or os.path.join(directorio, "carga.db")
+        database.init_database()
+        clases = dict(main.control_admision.clases)
+        if not admision:
+            for nombre in clases:
+                main.control_admision.clases[nombre] = ClaseAdmision(nombre, **SIN_LIMITES)
+        try:
+            yield httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app), base_url="http://carga")
+        finally:
+            main.control_admision.clases.update(clases)
+            database.DATABASE_NAME = anterior
+
+
+def _puerto_libre() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+@contextmanager
+def uvicorn_local(workers: int, admision: bool = False, espera: float = 30.0) -> Iterator[str]:
+    """
+    Levanta `uvicorn main:app` con `workers` procesos en un puerto libre y
+    devuelve su URL; lo detiene al salir
+
+    Raises:
+        RuntimeError: Si el servidor no responde a tiempo
+    """
+    puerto = _puerto_libre()
+    url = f"http://127.0.0.1:{puerto}"
+    with tempfile.TemporaryDirectory() as directorio:
+        entorno = dict(os.environ)
+        if not admision:
+            limites = os.path.join(directorio, "admision.json")
+            with open(limites, "w", encoding="utf-8") as archivo:
+                json.dump({clase: SIN_LIMITES for clase in ("pdf", "lote", "inferencia")}, archivo)
+            entorno["ADMISION_LIMITES"] = limites
+        proceso = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(puerto),
+             "--workers", str(workers), "--log-level", "warning"],
+            cwd=os.path.dirname(os.path.abspath(__file__)), env=entorno,
+        )
+        try:
+            limite = time.monotonic() + espera
+            while True:
+                try:
+                    if httpx.get(f"{url}/hechos", timeout=1).status_code == 200:
+                        break
+                except httpx.HTTPError:
+                    pass
+                if proceso.poll() is not None or time.monotonic() > limite:
+                    raise RuntimeError("uvicorn no respondió a tiempo")
+                time.sleep(0.2)
+            yield url
+        finally:
+            proceso.terminate()
+            proceso.wait(timeout=30)
+
+
+async def _correr(url: Optional[str], args: argparse.Namespace, mezcla: Dict[str, float]) -> Dict[str, Any]:
+    limites = httpx.Limits(max_connections=args.conexiones, max_keepalive_connections=args.conexiones)
+    if url is None:
+        with app_en_proceso(args.db, args.admision) as cliente:
+            async with cliente:
+                return await generar_carga(cliente, mezcla, args.tasa, args.duracion, args.semilla)
+    async with httpx.AsyncClient(base_url=url, limits=limites, timeout=60) as cliente:
+        return await generar_carga(cliente, mezcla, args.tasa, args.duracion, args.semilla)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Prueba de carga con los recorridos del navegador")
+    parser.add_argument("--mezcla", default="cuestionario=4,historial=1",
+                        help=f"Peso de cada flujo ({', '.join(FLUJOS)})")
+    parser.add_argument("--tasa", type=float, default=20.0, help="Flujos nuevos por segundo")
+    parser.add_argument("--duracion", type=float, default=10.0, help="Segundos de llegadas")
+    parser.add_argument("--semilla", type=int, help="Para repetir exactamente la misma carga")
+    destino = parser.add_mutually_exclusive_group()
+    destino.add_argument("--url", help="Servidor ya levantado (por defecto la app en este proceso)")
+    destino.add_argument("--workers", type=int, help="Levantar uvicorn local con estos procesos")
+    parser.add_argument("--conexiones", type=int, default=200, help="Conexiones HTTP máximas (con --url/--workers)")
+    parser.add_argument("--admision", action="store_true", help="Mantener los límites de admisión")
+    parser.add_argument("--db", help="Base de datos en proceso (por defecto una temporal)")
+    parser.add_argument("--json", help="Guardar el informe en este archivo")
+    args = parser.parse_args()
+
+    try:
+        mezcla = leer_mezcla(args.mezcla)
+    except ValueError as e:
+        raise SystemExit(str(e))
+    if args.workers:
+        with uvicorn_local(args.workers, args.admision) as url:
+            informe = asyncio.run(_correr(url, args, mezcla))
+    else:
+        informe = asyncio.run(_correr(args.url, args, mezcla))
+    imprimir_informe(informe)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as archivo:
+            json.dump(informe, archivo, ensure_ascii=False, indent=2)
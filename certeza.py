@@ -0,0 +1,159 @@
+"""
+Motor de inferencia con factores de certeza (estilo MYCIN)
+
+Cada hecho llega con una confianza entre 0 y 1. La certeza de una premisa
+se combina como en MYCIN: Y toma el mínimo, O el máximo y NO el
+complemento (1 - c). La certeza de la conclusión es la de la premisa por
+la certeza propia de la regla (campo opcional "certeza", 1.0 por defecto),
+y una regla solo se dispara si su premisa supera el umbral (0.2 en MYCIN).
+El umbral es exclusivo, como en MYCIN: una premisa igual al umbral no
+dispara la regla, por eso debe ser menor que 1.
+
+Las condiciones se compilan una vez a forma normal disyuntiva; así la
+puntuación de todas las reglas para un lote de observaciones es una sola
+operación de matrices: mínimo por término sobre los literales que usa y
+máximo por regla sobre sus términos. La forma normal disyuntiva puede
+crecer exponencialmente (un Y de n O de dos hechos tiene 2^n términos), así
+que cada regla admite hasta MAX_TERMINOS_FND términos; validar_reglas
+rechaza las que se pasan antes de compilar la base.
+"""
+
+import os
+from typing import Any, Dict, List, Sequence
+
+import numpy as np
+
+from reglas import REGLAS_COMPILADAS, HECHOS_OBSERVABLES, ORDEN_RIESGO
+from registros import compilar_reglas
+
+UMBRAL_MYCIN = 0.2
+
+# Elementos máximos de la matriz intermedia (observaciones x términos x literales por término)
+MAX_ELEMENTOS_BLOQUE = 8_000_000
+
+# Términos de la forma normal disyuntiva por regla (contados sin quitar repetidos)
+MAX_TERMINOS_FND = int(os.environ.get("CERTEZA_MAX_TERMINOS", "1024"))
+
+
+class MotorCerteza:
+    """Base de reglas compilada para puntuar factores de certeza en lote"""
+
+    def __init__(self, reglas: Sequence[Dict[str, Any]], hechos: Sequence[str]):
+        """
+        Raises:
+            ValueError: Si la condición de alguna regla supera MAX_TERMINOS_FND términos
+        """
+        reglas = self.reglas = compilar_reglas(reglas)
+        for regla in reglas:
+            if regla.condicion.terminos_fnd() > MAX_TERMINOS_FND:
+                raise ValueError(f"Regla {regla['id']}: la condición supera {MAX_TERMINOS_FND} términos "
+                                 f"en forma normal disyuntiva")
+        self.hechos = list(hechos)
+        self._conocidos = frozenset(self.hechos)
+        indice_hecho = {hecho: i for i, hecho in enumerate(self.hechos)}
+        n_hechos = len(self.hechos)
+
+        # Columnas de literales: [h_0 .. h_F-1, ~h_0 .. ~h_F-1, 1]. La última
+        # columna vale siempre 1 y rellena los términos con menos literales.
+        terminos, inicios = [], []
+        for regla in reglas:
+            inicios.append(len(terminos))
+            for termino in regla.condicion.forma_normal_disyuntiva():
+                terminos.append([indice_hecho[hecho] + (0 if afirmado else n_hechos) for hecho, afirmado in termino])
+
+        # (términos, literales por término): índices de los literales de cada término
+        ancho = max((len(t) for t in terminos), default=1)
+        self._indices = np.full((len(terminos), ancho), 2 * n_hechos, dtype=np.intp)
+        for fila, literales in enumerate(terminos):
+            self._indices[fila, :len(literales)] = literales
+        self._inicios = np.array(inicios, dtype=np.intp)
+        self._certeza_regla = np.array([regla.get("certeza", 1.0) for regla in reglas], dtype=np.float64)
+        self._prioridad = np.array([ORDEN_RIESGO.get(regla["riesgo"], 3) for regla in reglas])
+
+    def matriz_confianzas(self, observaciones: Sequence[Dict[str, float]]) -> np.ndarray:
+        """
+        Convierte observaciones {hecho: confianza} en una matriz (observaciones, hechos).
+        Un hecho ausente tiene confianza 0, igual que en motor_inferencia.
+
+        Raises:
+            ValueError: Si alguna observación trae un hecho que no es de la base
+        """
+        conocidos = self._conocidos
+        for numero, observacion in enumerate(observaciones):
+            desconocidos = observacion.keys() - conocidos
+            if desconocidos:
+                raise ValueError(f"Observación {numero}: hechos desconocidos {sorted(desconocidos)}")
+        return np.array(
+            [[observacion.get(hecho, 0.0) for hecho in self.hechos] for observacion in observaciones],
+            dtype=np.float64,
+        ).reshape(len(observaciones), len(self.hechos))
+
+    def puntuar(self, confianzas: np.ndarray) -> np.ndarray:
+        """
+        Certeza de la premisa de cada regla
+
+        Args:
+            confianzas: Matriz (observaciones, hechos) con valores en [0, 1]
+
+        Returns:
+            Matriz (observaciones, reglas) con la certeza de cada premisa
+        """
+        unos = np.ones((len(confianzas), 1), dtype=np.float64)
+        literales = np.concatenate([confianzas, 1.0 - confianzas, unos], axis=1)
+        bloque = max(1, MAX_ELEMENTOS_BLOQUE // max(1, self._indices.size))
+
+        resultado = np.empty((len(confianzas), len(self._inicios)), dtype=np.float64)
+        for inicio in range(0, len(confianzas), bloque):
+            parte = literales[inicio:inicio + bloque]
+            # Y = mínimo sobre los literales de cada término
+            terminos = parte[:, self._indices].min(axis=2)
+            # O = máximo sobre los términos de cada regla
+            resultado[inicio:inicio + bloque] = np.maximum.reduceat(terminos, self._inicios, axis=1)
+        return resultado
+
+    def diagnosticar_lote(self, observaciones: Sequence[Dict[str, float]],
+                          umbral: float = UMBRAL_MYCIN) -> List[List[Dict[str, Any]]]:
+        """
+        Reglas disparadas para cada observación, ordenadas por certeza
+
+        Args:
+            observaciones: Lista de diccionarios {hecho: confianza}
+            umbral: La premisa debe superarlo (estrictamente) para disparar una regla
+
+        Returns:
+            Por cada observación, lista de reglas con el campo "certeza",
+            de mayor a menor certeza (a igual certeza, por nivel de riesgo)
+
+        Raises:
+            ValueError: Si alguna observación trae un hecho que no es de la base
+        """
+        premisas = self.puntuar(self.matriz_confianzas(observaciones))
+        conclusiones = premisas * self._certeza_regla
+        resultados = []
+        for fila_premisas, fila_conclusiones in zip(premisas, conclusiones):
+            disparadas = np.flatnonzero(fila_premisas > umbral)
+            orden = sorted(disparadas, key=lambda r: (-fila_conclusiones[r], self._prioridad[r], r))
+            resultados.append([
+                dict(self.reglas[r], certeza=round(float(fila_conclusiones[r]), 4)) for r in orden
+            ])
+        return resultados
+
+
+motor_certeza = MotorCerteza(REGLAS_COMPILADAS, [hecho["id"] for hecho in HECHOS_OBSERVABLES])
+
+
+def motor_inferencia_certeza(hechos: Dict[str, float], umbral: float = UMBRAL_MYCIN) -> List[Dict[str, Any]]:
+    """
+    Motor de inferencia con factores de certeza
+
+    Args:
+        hechos: Diccionario {hecho: confianza entre 0 y 1}
+        umbral: La premisa debe superarlo (estrictamente) para disparar una regla
+
+    Returns:
+        Reglas disparadas con su certeza, ordenadas de mayor a menor
+
+    Raises:
+        ValueError: Si hay hechos que no son de la base
+    """
+    return motor_certeza.diagnosticar_lote([hechos], umbral)[0]
@@ -0,0 +1,265 @@
+"""
+Expresiones lógicas para las condiciones de las reglas ambientales
+
+Las condiciones se construyen combinando hechos con los operadores
+& (Y), | (O) y ~ (NO), por ejemplo:
+
+    Hecho("agua_turbia") & Hecho("olor_fuerte") & ~Hecho("aire_contaminado")
+
+Una expresión se puede llamar como función con un diccionario de hechos
+(un hecho ausente cuenta como falso) o evaluar con lógica de tres valores
+mediante evaluar_parcial (un hecho ausente o None es desconocido).
+
+Para guardarlas en archivos de reglas se convierten a una estructura JSON
+con a_dict / desde_dict: un hecho es su nombre y los operadores son
+{"y": [...]}, {"o": [...]} y {"no": ...}.
+"""
+
+from itertools import product
+from typing import Any, Dict, FrozenSet, List, Optional, Set, Tuple
+
+# Literal: (hecho, True si aparece afirmado / False si aparece negado)
+Literal = Tuple[str, bool]
+Termino = FrozenSet[Literal]
+
+
+class Expresion:
+    """Clase base de las expresiones lógicas sobre hechos observables"""
+
+    __slots__ = ()
+
+    def __call__(self, hechos: Dict[str, bool]) -> bool:
+        return self.evaluar(hechos)
+
+    def evaluar(self, hechos: Dict[str, bool]) -> bool:
+        raise NotImplementedError
+
+    def evaluar_parcial(self, hechos: Dict[str, Optional[bool]]) -> Optional[bool]:
+        raise NotImplementedError
+
+    def hechos(self) -> Set[str]:
+        raise NotImplementedError
+
+    def forma_normal_disyuntiva(self) -> List[Termino]:
+        """
+        Convierte la expresión en una disyunción de conjunciones de literales
+
+        Returns:
+            Lista de términos; la expresión es verdadera si algún término lo es
+        """
+        # Sin repetidos y en el orden en que aparecen
+        return list(dict.fromkeys(self._fnd(False)))
+
+    def terminos_fnd(self, negada: bool = False) -> int:
+        """
+        Cantidad de términos de la forma normal disyuntiva antes de quitar los
+        repetidos, calculada sin expandirla (crece exponencialmente con los Y de O)
+        """
+        raise NotImplementedError
+
+    def _fnd(self, negada: bool) -> List[Termino]:
+        raise NotImplementedError
+
+    def a_dict(self) -> Any:
+        """Estructura JSON equivalente (ver desde_dict)"""
+        raise NotImplementedError
+
+    def __and__(self, otra: "Expresion") -> "Expresion":
+        return Y(self, otra)
+
+    def __or__(self, otra: "Expresion") -> "Expresion":
+        return O(self, otra)
+
+    def __invert__(self) -> "Expresion":
+        return No(self)
+
+
+class Hecho(Expresion):
+    """Hecho observable individual"""
+
+    __slots__ = ("nombre",)
+
+    def __init__(self, nombre: str):
+        self.nombre = nombre
+
+    def evaluar(self, hechos: Dict[str, bool]) -> bool:
+        return bool(hechos.get(self.nombre))
+
+    def evaluar_parcial(self, hechos: Dict[str, Optional[bool]]) -> Optional[bool]:
+        valor = hechos.get(self.nombre)
+        return None if valor is None else bool(valor)
+
+    def hechos(self) -> Set[str]:
+        return {self.nombre}
+
+    def _fnd(self, negada: bool) -> List[Termino]:
+        return [frozenset({(self.nombre, not negada)})]
+
+    def a_dict(self) -> Any:
+        return self.nombre
+
+    def terminos_fnd(self, negada: bool = False) -> int:
+        return 1
+
+    def __repr__(self) -> str:
+        return f"Hecho({self.nombre!r})"
+
+
+class No(Expresion):
+    """Negación de una expresión"""
+
+    __slots__ = ("termino",)
+
+    def __init__(self, termino: Expresion):
+        self.termino = termino
+
+    def evaluar(self, hechos: Dict[str, bool]) -> bool:
+        return not self.termino.evaluar(hechos)
+
+    def evaluar_parcial(self, hechos: Dict[str, Optional[bool]]) -> Optional[bool]:
+        valor = self.termino.evaluar_parcial(hechos)
+        return None if valor is None else not valor
+
+    def hechos(self) -> Set[str]:
+        return self.termino.hechos()
+
+    def terminos_fnd(self, negada: bool = False) -> int:
+        return self.termino.terminos_fnd(not negada)
+
+    def _fnd(self, negada: bool) -> List[Termino]:
+        return self.termino._fnd(not negada)
+
+    def a_dict(self) -> Any:
+        return {"no": self.termino.a_dict()}
+
+    def __repr__(self) -> str:
+        return f"~{self.termino!r}"
+
+
+class _Compuesta(Expresion):
+    """Expresión con varios términos (base de Y y O)"""
+
+    __slots__ = ("terminos",)
+
+    def __init__(self, *terminos: Expresion):
+        planos = []
+        for termino in terminos:
+            # Aplanar Y(Y(a, b), c) en Y(a, b, c)
+            if type(termino) is type(self):
+                planos.extend(termino.terminos)
+            else:
+                planos.append(termino)
+        self.terminos: Tuple[Expresion, ...] = tuple(planos)
+
+    def hechos(self) -> Set[str]:
+        resultado: Set[str] = set()
+        for termino in self.terminos:
+            resultado |= termino.hechos()
+        return resultado
+
+    def _fnd_conjuncion(self, negada: bool) -> List[Termino]:
+        # Producto de las FND de cada término: (a | b) & c = (a & c) | (b & c)
+        return [frozenset().union(*combinacion)
+                for combinacion in product(*(t._fnd(negada) for t in self.terminos))]
+
+    def _fnd_disyuncion(self, negada: bool) -> List[Termino]:
+        return [termino for t in self.terminos for termino in t._fnd(negada)]
+
+    def _terminos_conjuncion(self, negada: bool) -> int:
+        total = 1
+        for termino in self.terminos:
+            total *= termino.terminos_fnd(negada)
+        return total
+
+    def _terminos_disyuncion(self, negada: bool) -> int:
+        return sum(termino.terminos_fnd(negada) for termino in self.terminos)
+
+
+class Y(_Compuesta):
+    """Conjunción: verdadera si todos los términos son verdaderos"""
+
+    __slots__ = ()
+
+    def evaluar(self, hechos: Dict[str, bool]) -> bool:
+        return all(termino.evaluar(hechos) for termino in self.terminos)
+
+    def evaluar_parcial(self, hechos: Dict[str, Optional[bool]]) -> Optional[bool]:
+        desconocido = False
+        for termino in self.terminos:
+            valor = termino.evaluar_parcial(hechos)
+            if valor is False:
+                return False
+            if valor is None:
+                desconocido = True
+        return None if desconocido else True
+
+    def _fnd(self, negada: bool) -> List[Termino]:
+        # De Morgan: ~(a & b) = ~a | ~b
+        return self._fnd_disyuncion(True) if negada else self._fnd_conjuncion(False)
+
+    def terminos_fnd(self, negada: bool = False) -> int:
+        return self._terminos_disyuncion(True) if negada else self._terminos_conjuncion(False)
+
+    def a_dict(self) -> Any:
+        return {"y": [t.a_dict() for t in self.terminos]}
+
+    def __repr__(self) -> str:
+        return "(" + " & ".join(repr(t) for t in self.terminos) + ")"
+
+
+class O(_Compuesta):
+    """Disyunción: verdadera si algún término es verdadero"""
+
+    __slots__ = ()
+
+    def evaluar(self, hechos: Dict[str, bool]) -> bool:
+        return any(termino.evaluar(hechos) for termino in self.terminos)
+
+    def evaluar_parcial(self, hechos: Dict[str, Optional[bool]]) -> Optional[bool]:
+        desconocido = False
+        for termino in self.terminos:
+            valor = termino.evaluar_parcial(hechos)
+            if valor is True:
+                return True
+            if valor is None:
+                desconocido = True
+        return None if desconocido else False
+
+    def _fnd(self, negada: bool) -> List[Termino]:
+        # De Morgan: ~(a | b) = ~a & ~b
+        return self._fnd_conjuncion(True) if negada else self._fnd_disyuncion(False)
+
+    def terminos_fnd(self, negada: bool = False) -> int:
+        return self._terminos_conjuncion(True) if negada else self._terminos_disyuncion(False)
+
+    def a_dict(self) -> Any:
+        return {"o": [t.a_dict() for t in self.terminos]}
+
+    def __repr__(self) -> str:
+        return "(" + " | ".join(repr(t) for t in self.terminos) + ")"
+
+
+def desde_dict(datos: Any) -> Expresion:
+    """
+    Construye una expresión desde su estructura JSON
+
+    Args:
+        datos: Nombre de un hecho, o {"y": [...]}, {"o": [...]} o {"no": ...}
+
+    Returns:
+        Expresión equivalente
+
+    Raises:
+        ValueError: Si la estructura no es válida
+    """
+    if isinstance(datos, str):
+        return Hecho(datos)
+    if isinstance(datos, dict) and len(datos) == 1:
+        (operador, valor), = datos.items()
+        if operador == "no":
+            return No(desde_dict(valor))
+        if operador in ("y", "o") and isinstance(valor, list) and valor:
+            clase = Y if operador == "y" else O
+            return clase(*(desde_dict(termino) for termino in valor))
+    raise ValueError(f"Condición inválida: {datos!r}")
+
@@ -0,0 +1,249 @@
+"""
+Matrices de coocurrencia de hechos, mantenidas al guardar cada diagnóstico
+
+Para ajustar las reglas interesa saber qué hechos observables aparecen
+juntos y con qué reglas. En vez de releer cada hechos_json del historial,
+por inquilino se mantienen tres arreglos int64:
+
+* pares (F×F): diagnósticos con los dos hechos presentes; la diagonal es
+  la cantidad con cada hecho.
+* por_regla (F×R): diagnósticos con el hecho presente y esa regla aplicada.
+* conteo_reglas (R): diagnósticos por regla (None = sin regla aplicable).
+
+Se guardan como BLOB en la tabla coocurrencias y guardar_diagnostico (o
+guardar_diagnosticos_lote) los actualiza dentro de la misma transacción
+del INSERT: varios procesos pueden escribir a la vez porque SQLite
+serializa las transacciones de escritura, y un INSERT que falla no deja
+conteos de más. Leerlas cuesta una fila, sin importar el tamaño del
+historial. El archivo frío no las modifica: cuentan todo lo guardado.
+
+Uso:
+
+    python coocurrencia.py reconstruir   # recalcula desde la tabla y el archivo frío
+"""
+
+import argparse
+import json
+import sqlite3
+from collections import Counter
+from typing import Any, Dict, Iterable, List, Mapping, Optional, Sequence, Tuple
+
+import numpy as np
+
+from reglas import HECHOS_OBSERVABLES
+
+HECHOS = [hecho["id"] for hecho in HECHOS_OBSERVABLES]
+
+
+class MatrizCoocurrencia:
+    """Conteos de hechos, pares de hechos y hechos por regla de un inquilino"""
+
+    def __init__(self, hechos: Sequence[str] = HECHOS):
+        self.hechos = list(hechos)
+        self._posiciones = {hecho: posicion for posicion, hecho in enumerate(self.hechos)}
+        self.reglas: List[Optional[str]] = []
+        self._columnas: Dict[Optional[str], int] = {}
+        self.total = 0
+        self.pares = np.zeros((len(self.hechos), len(self.hechos)), dtype=np.int64)
+        self.por_regla = np.zeros((len(self.hechos), 0), dtype=np.int64)
+        self.conteo_reglas = np.zeros(0, dtype=np.int64)
+
+    def _columna(self, regla_id: Optional[str]) -> int:
+        columna = self._columnas.get(regla_id)
+        if columna is None:
+            columna = self._columnas[regla_id] = len(self.reglas)
+            self.reglas.append(regla_id)
+            self.por_regla = np.hstack([self.por_regla, np.zeros((len(self.hechos), 1), dtype=np.int64)])
+            self.conteo_reglas = np.append(self.conteo_reglas, 0)
+        return columna
+
+    def sumar(self, hechos: Mapping[str, Any], regla_id: Optional[str], veces: int = 1) -> None:
+        """Cuenta `veces` diagnósticos con esos hechos y esa regla (solo los hechos presentes)"""
+        presentes = [self._posiciones[hecho] for hecho, valor in hechos.items()
+                     if valor is True and hecho in self._posiciones]
+        columna = self._columna(regla_id)
+        self.pares[np.ix_(presentes, presentes)] += veces
+        self.por_regla[presentes, columna] += veces
+        self.conteo_reglas[columna] += veces
+        self.total += veces
+
+    def a_fila(self) -> Tuple[str, str, int, bytes, bytes, bytes]:
+        """Valores de las columnas hechos, reglas, total, pares, por_regla y conteo_reglas"""
+        return (json.dumps(self.hechos), json.dumps(self.reglas, ensure_ascii=False), self.total,
+                self.pares.tobytes(), self.por_regla.tobytes(), self.conteo_reglas.tobytes())
+
+    @classmethod
+    def desde_fila(cls, fila: Sequence[Any], hechos: Sequence[str] = HECHOS) -> "MatrizCoocurrencia":
+        """Reconstruye la matriz guardada, reordenada a `hechos` (los que ya no existen se descartan)"""
+        guardados = json.loads(fila[0])
+        reglas = json.loads(fila[1])
+        pares = np.frombuffer(fila[3], dtype=np.int64).reshape(len(guardados), len(guardados))
+        por_regla = np.frombuffer(fila[4], dtype=np.int64).reshape(len(guardados), len(reglas))
+        matriz = cls(hechos)
+        matriz.total = fila[2]
+        for regla_id in reglas:
+            matriz._columna(regla_id)
+        matriz.conteo_reglas[:] = np.frombuffer(fila[5], dtype=np.int64)
+        comunes = [(matriz._posiciones[hecho], origen) for origen, hecho in enumerate(guardados)
+                   if hecho in matriz._posiciones]
+        destino = [d for d, _ in comunes]
+        origen = [o for _, o in comunes]
+        matriz.pares[np.ix_(destino, destino)] = pares[np.ix_(origen, origen)]
+        matriz.por_regla[destino, :] = por_regla[origen, :]
+        return matriz
+
+    def analizar(self) -> Dict[str, Any]:
+        """
+        Conteos, probabilidades condicionales y lift de pares de hechos y de hechos por regla
+
+        lift(A, B) = P(A y B) / (P(A) P(B)): mayor que 1 si aparecen juntos más
+        de lo que aparecerían por azar. None cuando algún conteo es cero.
+
+        Returns:
+            total, conteo y probabilidad de cada hecho, pares (A antes que B en
+            el orden de los hechos) y, por regla, su total y sus hechos
+        """
+        total = self.total
+        conteos = np.diag(self.pares).tolist()
+
+        def proporcion(numerador: int, denominador: int) -> Optional[float]:
+            return round(numerador / denominador, 4) if denominador else None
+
+        def lift(juntos: int, a: int, b: int) -> Optional[float]:
+            return round(juntos * total / (a * b), 4) if a and b else None
+
+        pares = []
+        for i, hecho_a in enumerate(self.hechos):
+            for j in range(i + 1, len(self.hechos)):
+                juntos = int(self.pares[i, j])
+                pares.append({
+                    "a": hecho_a,
+                    "b": self.hechos[j],
+                    "juntos": juntos,
+                    "p_b_dado_a": proporcion(juntos, conteos[i]),
+                    "p_a_dado_b": proporcion(juntos, conteos[j]),
+                    "lift": lift(juntos, conteos[i], conteos[j]),
+                })
+        reglas = {}
+        for columna, regla_id in enumerate(self.reglas):
+            con_regla = int(self.conteo_reglas[columna])
+            reglas[regla_id or "sin_regla"] = {
+                "total": con_regla,
+                "proporcion": proporcion(con_regla, total),
+                "hechos": {
+                    hecho: {
+                        "conteo": int(self.por_regla[i, columna]),
+                        "p_hecho_dado_regla": proporcion(int(self.por_regla[i, columna]), con_regla),
+                        "p_regla_dado_hecho": proporcion(int(self.por_regla[i, columna]), conteos[i]),
+                        "lift": lift(int(self.por_regla[i, columna]), conteos[i], con_regla),
+                    }
+                    for i, hecho in enumerate(self.hechos)
+                },
+            }
+        return {
+            "total": total,
+            "hechos": {
+                hecho: {"conteo": conteos[i], "proporcion": proporcion(conteos[i], total)}
+                for i, hecho in enumerate(self.hechos)
+            },
+            "pares": pares,
+            "reglas": reglas,
+        }
+
+
+def crear_tabla(cursor: sqlite3.Cursor) -> None:
+    """Crea la tabla coocurrencias (una fila por inquilino)"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS coocurrencias (
+            inquilino TEXT PRIMARY KEY,
+            hechos TEXT NOT NULL,
+            reglas TEXT NOT NULL,
+            total INTEGER NOT NULL,
+            pares BLOB NOT NULL,
+            por_regla BLOB NOT NULL,
+            conteo_reglas BLOB NOT NULL
+        )
+    ''')
+
+
+def cargar(conn: sqlite3.Connection, inquilino: str = '') -> MatrizCoocurrencia:
+    """Matriz guardada del inquilino (vacía si todavía no tiene diagnósticos)"""
+    fila = conn.execute('''
+        SELECT hechos, reglas, total, pares, por_regla, conteo_reglas
+        FROM coocurrencias WHERE inquilino = ?
+    ''', (inquilino,)).fetchone()
+    return MatrizCoocurrencia() if fila is None else MatrizCoocurrencia.desde_fila(tuple(fila))
+
+
+def _guardar(conn: sqlite3.Connection, inquilino: str, matriz: MatrizCoocurrencia) -> None:
+    conn.execute('''
+        INSERT OR REPLACE INTO coocurrencias (inquilino, hechos, reglas, total, pares, por_regla, conteo_reglas)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    ''', (inquilino,) + matriz.a_fila())
+
+
+def acumular(conn: sqlite3.Connection, inquilino: str,
+             diagnosticos: Iterable[Tuple[Mapping[str, Any], Optional[str], int]]) -> None:
+    """
+    Suma diagnósticos a la matriz del inquilino, en la transacción abierta de `conn`
+
+    Debe llamarse después del INSERT de los diagnósticos: la transacción ya
+    tiene el bloqueo de escritura, así que nadie más cambia la matriz entre
+    la lectura y la escritura.
+
+    Args:
+        conn: Conexión con la transacción del INSERT
+        inquilino: Inquilino de los diagnósticos
+        diagnosticos: Tripletas (hechos, regla_id, cantidad de diagnósticos iguales)
+    """
+    matriz = cargar(conn, inquilino)
+    for hechos, regla_id, veces in diagnosticos:
+        matriz.sumar(hechos, regla_id, veces)
+    _guardar(conn, inquilino, matriz)
+
+
+def reconstruir(conn: sqlite3.Connection, archivados: Optional[Counter] = None) -> Dict[str, int]:
+    """
+    Recalcula todas las matrices desde la tabla diagnosticos (y lo archivado)
+
+    Cada combinación distinta de inquilino, hechos y regla se decodifica una
+    sola vez.
+
+    Args:
+        conn: Conexión a la base de datos
+        archivados: Conteos por (inquilino, hechos_json, regla_id) del archivo frío
+
+    Returns:
+        Diagnósticos contados por inquilino
+    """
+    combinaciones = Counter(archivados or {})
+    for inquilino, hechos_json, regla_id, cantidad in conn.execute('''
+        SELECT inquilino, hechos_json, regla_id, COUNT(*)
+        FROM diagnosticos
+        GROUP BY inquilino, hechos_json, regla_id
+    '''):
+        combinaciones[(inquilino, hechos_json, regla_id)] += cantidad
+    matrices: Dict[str, MatrizCoocurrencia] = {}
+    for (inquilino, hechos_json, regla_id), cantidad in combinaciones.items():
+        matrices.setdefault(inquilino, MatrizCoocurrencia()).sumar(json.loads(hechos_json), regla_id, cantidad)
+    conn.execute('DELETE FROM coocurrencias')
+    for inquilino, matriz in matrices.items():
+        _guardar(conn, inquilino, matriz)
+    return {inquilino: matriz.total for inquilino, matriz in matrices.items()}
+
+
+if __name__ == "__main__":
+    import database
+
+    parser = argparse.ArgumentParser(description="Matrices de coocurrencia de hechos")
+    parser.add_argument("--db", help="Base de datos (por defecto la de la API)")
+    sub = parser.add_subparsers(dest="comando", required=True)
+    sub.add_parser("reconstruir", help="Recalcula las matrices desde los diagnósticos guardados")
+    args = parser.parse_args()
+
+    if args.db:
+        database.DATABASE_NAME = args.db
+    database.init_database()
+    totales = database.reconstruir_coocurrencias()
+    for inquilino, total in sorted(totales.items()):
+        print(f"{inquilino or '(sin inquilino)'}: {total:,} diagnósticos")
@@ -1,29 +1,131 @@
+import os
 import sqlite3
 import json
-from datetime import datetime
-from typing import List, Dict, Any, Optional
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+from typing import List, Dict, Any, Optional, Callable, Iterable, Mapping, Sequence, Tuple
 from contextlib import contextmanager
+from collections import Counter
+from registros import Diagnostico
+from trazas import tramo
+from cache_diagnosticos import CacheDiagnosticos
+import retencion
+import coocurrencia
 
 DATABASE_NAME = "diagnosticos_ambientales.db"
 
+# Archivo frío de diagnósticos antiguos (ver retencion.py); por defecto junto a la base
+ARCHIVO_DIR = os.environ.get("ARCHIVO_DIR")
+_archivos_frios: Dict[str, "retencion.ArchivoFrio"] = {}
+
+# Diagnósticos decodificados por base de datos (ver cache_diagnosticos.py)
+_caches_diagnosticos: Dict[str, CacheDiagnosticos] = {}
+_vigilantes_generacion: Dict[str, "_VigilanteGeneracion"] = {}
+# Segundos entre revisiones de la generación: lo que tarda, a lo sumo, en notarse
+# una restauración hecha desde otro proceso
+GENERACION_INTERVALO = float(os.environ.get("CACHE_GENERACION_SEGUNDOS", "1"))
+
+# Funciones que se llaman cada vez que se guarda un diagnóstico
+_observadores_guardado: List[Callable[[Dict[str, Any]], None]] = []
+
+class ClaveIdempotenciaUsada(Exception):
+    """La clave de idempotencia ya se usó con otros hechos"""
+
+    def __init__(self, existente: Diagnostico):
+        super().__init__(f"La clave ya se usó en el diagnóstico {existente['id']}")
+        self.existente = existente
+
 @contextmanager
 def get_db_connection():
     """Context manager para manejar conexiones a la base de datos"""
-    conn = sqlite3.connect(DATABASE_NAME)
+    with tramo("db.conectar"):
+        conn = sqlite3.connect(DATABASE_NAME)
     conn.row_factory = sqlite3.Row
     try:
         yield conn
-        conn.commit()
+        with tramo("db.commit"):
+            conn.commit()
     except Exception as e:
         conn.rollback()
         raise e
     finally:
         conn.close()
 
+def nueva_generacion(conn: sqlite3.Connection) -> str:
+    """
+    Marca la base con una generación nueva (ver cache_diagnosticos.py); la
+    llama respaldo.restaurar después de copiar el respaldo
+
+    Returns:
+        La generación escrita (sin confirmar: el commit queda a cargo de quien llama)
+    """
+    conn.execute('CREATE TABLE IF NOT EXISTS generacion (id INTEGER PRIMARY KEY CHECK (id = 1), valor TEXT NOT NULL)')
+    valor = uuid.uuid4().hex
+    conn.execute('INSERT OR REPLACE INTO generacion (id, valor) VALUES (1, ?)', (valor,))
+    return valor
+
+class _VigilanteGeneracion:
+    """
+    Generación vigente de una base de datos. Se revisa cada
+    GENERACION_INTERVALO segundos (entre revisiones se devuelve la última
+    leída, sin tocar SQLite ni esperar un lock). La conexión queda abierta
+    para consultar PRAGMA data_version, que cambia cuando otra conexión (de
+    este u otro proceso) confirma algo; solo entonces se relee la generación.
+    """
+
+    def __init__(self, base: str):
+        self.base = base
+        self._conn: Optional[sqlite3.Connection] = None
+        self._version_datos: Optional[int] = None
+        self._generacion: Optional[str] = None
+        self._revisada = float("-inf")
+        self._lock = threading.Lock()
+
+    def generacion(self, forzar: bool = False) -> Optional[str]:
+        """
+        Args:
+            forzar: Revisar ya, sin esperar el intervalo (tras restaurar en este proceso)
+        """
+        if not forzar and time.monotonic() - self._revisada < GENERACION_INTERVALO:
+            return self._generacion
+        # Si otro hilo ya la está revisando, alcanza con la última leída
+        if not self._lock.acquire(blocking=forzar):
+            return self._generacion
+        try:
+            try:
+                if self._conn is None:
+                    # mode=rw: no crear la base si todavía no existe
+                    self._conn = sqlite3.connect(f"file:{os.path.abspath(self.base)}?mode=rw", uri=True,
+                                                 check_same_thread=False)
+                version = self._conn.execute('PRAGMA data_version').fetchone()[0]
+                if version != self._version_datos:
+                    fila = self._conn.execute('SELECT valor FROM generacion WHERE id = 1').fetchone()
+                    self._generacion = fila[0] if fila else None
+                    self._version_datos = version
+            except sqlite3.Error:
+                # Base sin crear o sin la tabla: se vuelve a intentar la próxima vez
+                self._version_datos = self._generacion = None
+            self._revisada = time.monotonic()
+            return self._generacion
+        finally:
+            self._lock.release()
+
+def _agregar_columna_si_falta(cursor: sqlite3.Cursor, columna: str, definicion: str):
+    """Migra bases de datos creadas con versiones anteriores del esquema"""
+    cursor.execute('PRAGMA table_info(diagnosticos)')
+    if columna not in {row['name'] for row in cursor.fetchall()}:
+        cursor.execute(f'ALTER TABLE diagnosticos ADD COLUMN {columna} {definicion}')
+
 def init_database():
     """Inicializa la base de datos con las tablas necesarias"""
     with get_db_connection() as conn:
         cursor = conn.cursor()
+        # WAL: las lecturas (y los respaldos en caliente, ver respaldo.py) no bloquean a los escritores
+        cursor.execute('PRAGMA journal_mode=WAL')
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'coocurrencias'")
+        habia_coocurrencias = cursor.fetchone() is not None
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS diagnosticos (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -35,194 +137,625 @@ def init_database():
                 riesgo TEXT,
                 descripcion TEXT,
                 justificacion TEXT,
-                acciones_json TEXT
+                acciones_json TEXT,
+                clave_idempotencia TEXT,
+                version_reglas TEXT,
+                inquilino TEXT NOT NULL DEFAULT ''
+            )
+        ''')
+        _agregar_columna_si_falta(cursor, 'clave_idempotencia', 'TEXT')
+        _agregar_columna_si_falta(cursor, 'version_reglas', 'TEXT')
+        _agregar_columna_si_falta(cursor, 'inquilino', "TEXT NOT NULL DEFAULT ''")
+        # Índice único: un reintento con la misma clave no puede insertar otra fila
+        # (las claves de distintos inquilinos no chocan)
+        cursor.execute('DROP INDEX IF EXISTS idx_diagnosticos_clave_idempotencia')
+        cursor.execute('''
+            CREATE UNIQUE INDEX IF NOT EXISTS idx_diagnosticos_inquilino_clave
+            ON diagnosticos (inquilino, clave_idempotencia)
+        ''')
+        # Índices por inquilino para /historial y /estadisticas
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_diagnosticos_inquilino_fecha
+            ON diagnosticos (inquilino, fecha)
+        ''')
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_diagnosticos_inquilino_riesgo
+            ON diagnosticos (inquilino, riesgo)
+        ''')
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_diagnosticos_inquilino_categoria
+            ON diagnosticos (inquilino, categoria)
+        ''')
+        # Lecturas de telemetría en bloques columnares (arreglos float64 en BLOB)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS lecturas_bloques (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                estacion TEXT NOT NULL,
+                variable TEXT NOT NULL,
+                t_inicio REAL NOT NULL,
+                t_fin REAL NOT NULL,
+                cantidad INTEGER NOT NULL,
+                tiempos BLOB NOT NULL,
+                valores BLOB NOT NULL
+            )
+        ''')
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_lecturas_estacion
+            ON lecturas_bloques (estacion, variable, t_inicio)
+        ''')
+        # Solo los cambios de estado derivados de la telemetría
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS estados_estacion (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                estacion TEXT NOT NULL,
+                fecha TIMESTAMP NOT NULL,
+                hechos_json TEXT NOT NULL,
+                regla_id TEXT,
+                riesgo TEXT,
+                decidido INTEGER NOT NULL
             )
         ''')
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_estados_estacion
+            ON estados_estacion (estacion, id)
+        ''')
+        # Generación de la base: cambia al restaurar un respaldo (ver cache_diagnosticos.py)
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'generacion'")
+        if cursor.fetchone() is None:
+            nueva_generacion(conn)
+        # Matrices de coocurrencia de hechos (ver coocurrencia.py)
+        coocurrencia.crear_tabla(cursor)
+        if not habia_coocurrencias:
+            # Base creada antes de las matrices: se calculan una vez desde lo ya guardado
+            _reconstruir_coocurrencias(conn)
         conn.commit()
 
-def guardar_diagnostico(hechos: Dict[str, bool], resultado: Optional[Dict[str, Any]]) -> int:
+def archivo_frio() -> "retencion.ArchivoFrio":
+    """Archivo frío de la base de datos actual (directorio <base>_archivo salvo ARCHIVO_DIR)"""
+    directorio = ARCHIVO_DIR or os.path.splitext(DATABASE_NAME)[0] + "_archivo"
+    archivo = _archivos_frios.get(directorio)
+    if archivo is None:
+        archivo = _archivos_frios[directorio] = retencion.ArchivoFrio(directorio)
+    return archivo
+
+def cache_diagnosticos(base: Optional[str] = None) -> CacheDiagnosticos:
+    """
+    Caché LRU de diagnósticos de una base de datos (por defecto la actual),
+    vaciada si desde la última vez se restauró un respaldo
+    """
+    base = base or DATABASE_NAME
+    cache = _caches_diagnosticos.get(base)
+    if cache is None:
+        cache = _caches_diagnosticos[base] = CacheDiagnosticos()
+        _vigilantes_generacion[base] = _VigilanteGeneracion(base)
+    cache.validar(_vigilantes_generacion[base].generacion())
+    return cache
+
+def revisar_generacion(base: Optional[str] = None) -> None:
+    """Vacía ya la caché de la base si cambió de generación (respaldo.restaurar, en este proceso)"""
+    base = base or DATABASE_NAME
+    vigilante = _vigilantes_generacion.get(base)
+    if vigilante is not None:
+        _caches_diagnosticos[base].validar(vigilante.generacion(forzar=True))
+
+def _reconstruir_coocurrencias(conn: sqlite3.Connection) -> Dict[str, int]:
+    archivados = archivo_frio().agrupar(("inquilino", "hechos_json", "regla_id"))
+    return coocurrencia.reconstruir(conn, archivados)
+
+def reconstruir_coocurrencias() -> Dict[str, int]:
+    """
+    Recalcula las matrices de coocurrencia desde la tabla y el archivo frío
+
+    Returns:
+        Diagnósticos contados por inquilino
+    """
+    with get_db_connection() as conn:
+        return _reconstruir_coocurrencias(conn)
+
+def obtener_coocurrencias(inquilino: str = '') -> Dict[str, Any]:
+    """
+    Conteos, probabilidades condicionales y lift de hechos y reglas
+
+    Lee una sola fila: el costo no depende del tamaño del historial.
+
+    Args:
+        inquilino: Inquilino de los diagnósticos
+
+    Returns:
+        Análisis de la matriz (ver coocurrencia.MatrizCoocurrencia.analizar)
+    """
+    with get_db_connection() as conn:
+        return coocurrencia.cargar(conn, inquilino).analizar()
+
+def _filtro_fechas(desde: Optional[str], hasta: Optional[str]) -> Tuple[str, tuple]:
+    """Condición SQL extra para un rango de fechas (desde inclusivo, hasta exclusivo)"""
+    condicion, parametros = '', ()
+    if desde is not None:
+        condicion += ' AND fecha >= ?'
+        parametros += (desde,)
+    if hasta is not None:
+        condicion += ' AND fecha < ?'
+        parametros += (hasta,)
+    return condicion, parametros
+
+# Valores guardados cuando ninguna regla se cumple (condiciones normales)
+SIN_DIAGNOSTICO = {
+    'id': None,
+    'titulo': "Sin diagnóstico aplicable",
+    'categoria': "Monitoreo Preventivo",
+    'riesgo': "BAJO",
+    'descripcion': "No se encontraron condiciones críticas",
+    'justificacion': "La ausencia de indicadores críticos sugiere buena gestión ambiental",
+    'acciones': ["Mantener monitoreo periódico", "Continuar con buenas prácticas ambientales"],
+}
+
+def guardar_diagnostico(hechos: Dict[str, bool], resultado: Optional[Dict[str, Any]],
+                        clave_idempotencia: Optional[str] = None, version_reglas: Optional[str] = None,
+                        inquilino: str = '') -> int:
     """
     Guarda un diagnóstico en la base de datos
     
     Args:
         hechos: Diccionario con los hechos observados
         resultado: Resultado del motor de inferencia (puede ser None)
+        clave_idempotencia: Clave enviada por el cliente para evitar duplicados al reintentar
+        version_reglas: Versión de la base de reglas con que se hizo el diagnóstico
+        inquilino: Inquilino al que pertenece el diagnóstico ('' = sin inquilino)
+    
+    Returns:
+        ID del diagnóstico guardado (o del ya existente con la misma clave y los mismos hechos)
+    
+    Raises:
+        ClaveIdempotenciaUsada: Si la clave ya se guardó con otros hechos
+    """
+    datos = SIN_DIAGNOSTICO if resultado is None else resultado
+    # Mismo formato que CURRENT_TIMESTAMP (UTC)
+    fecha = datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+    cache = cache_diagnosticos()
+    generacion = cache.generacion
+    
+    try:
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            with tramo("db.insertar"):
+                cursor.execute('''
+                    INSERT INTO diagnosticos 
+                    (fecha, hechos_json, regla_id, titulo, categoria, riesgo, descripcion, justificacion, acciones_json,
+                     clave_idempotencia, version_reglas, inquilino)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ''', (
+                    fecha,
+                    json.dumps(hechos, ensure_ascii=False),
+                    datos.get('id'),
+                    datos.get('titulo'),
+                    datos.get('categoria'),
+                    datos.get('riesgo'),
+                    datos.get('descripcion'),
+                    datos.get('justificacion'),
+                    json.dumps(datos.get('acciones', []), ensure_ascii=False),
+                    clave_idempotencia,
+                    version_reglas,
+                    inquilino
+                ))
+            diagnostico_id = cursor.lastrowid
+            # En la misma transacción: el INSERT ya tomó el bloqueo de escritura
+            with tramo("db.coocurrencia"):
+                coocurrencia.acumular(conn, inquilino, [(hechos, datos.get('id'), 1)])
+    except sqlite3.IntegrityError:
+        # Otro reintento con la misma clave se guardó primero
+        existente = buscar_por_clave_idempotencia(clave_idempotencia, inquilino) if clave_idempotencia else None
+        if existente is None:
+            raise
+        if existente['hechos'] != hechos:
+            raise ClaveIdempotenciaUsada(existente)
+        return existente['id']
+    
+    # Quien crea un diagnóstico suele pedirlo enseguida (detalle, PDF)
+    cache.guardar((inquilino, diagnostico_id), Diagnostico(
+        id=diagnostico_id,
+        fecha=fecha,
+        hechos=hechos,
+        regla_id=datos.get('id'),
+        titulo=datos.get('titulo'),
+        categoria=datos.get('categoria'),
+        riesgo=datos.get('riesgo'),
+        descripcion=datos.get('descripcion'),
+        justificacion=datos.get('justificacion'),
+        acciones=datos.get('acciones', []),
+        version_reglas=version_reglas
+    ), generacion)
     
+    # Notificar después del commit
+    _notificar_guardado({
+        'id': diagnostico_id,
+        'fecha': fecha,
+        'regla_id': datos.get('id'),
+        'titulo': datos.get('titulo'),
+        'categoria': datos.get('categoria'),
+        'riesgo': datos.get('riesgo'),
+        'inquilino': inquilino,
+    })
+    
+    return diagnostico_id
+
+def guardar_diagnosticos_lote(diagnosticos: Iterable[Tuple[str, Optional[Mapping[str, Any]]]],
+                              version_reglas: Optional[str] = None, inquilino: str = '') -> int:
+    """
+    Guarda muchos diagnósticos en una sola transacción (carga masiva desde lote.py)
+
+    No avisa a los observadores: un lote de millones de filas no debe
+    inundar el flujo de eventos.
+
+    Args:
+        diagnosticos: Pares (hechos en JSON, resultado del motor o None)
+        version_reglas: Versión de la base de reglas con que se hicieron
+        inquilino: Inquilino al que pertenecen ('' = sin inquilino)
+
+    Returns:
+        Cantidad de diagnósticos guardados
+    """
+    fecha = datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+    # Las reglas del motor son objetos compartidos: sus columnas se arman una vez por regla
+    columnas: Dict[int, tuple] = {}
+    # Para las matrices de coocurrencia cada combinación distinta se decodifica una vez
+    combinaciones: Counter = Counter()
+
+    def fila(hechos_json: str, resultado: Optional[Mapping[str, Any]]) -> tuple:
+        datos = SIN_DIAGNOSTICO if resultado is None else resultado
+        columnas_regla = columnas.get(id(datos))
+        if columnas_regla is None:
+            columnas_regla = columnas[id(datos)] = (
+                datos.get('id'),
+                datos.get('titulo'),
+                datos.get('categoria'),
+                datos.get('riesgo'),
+                datos.get('descripcion'),
+                datos.get('justificacion'),
+                json.dumps(datos.get('acciones', []), ensure_ascii=False),
+            )
+        combinaciones[(hechos_json, columnas_regla[0])] += 1
+        return (fecha, hechos_json) + columnas_regla + (version_reglas, inquilino)
+
+    with get_db_connection() as conn:
+        cursor = conn.executemany('''
+            INSERT INTO diagnosticos
+            (fecha, hechos_json, regla_id, titulo, categoria, riesgo, descripcion, justificacion, acciones_json,
+             version_reglas, inquilino)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', (fila(hechos_json, resultado) for hechos_json, resultado in diagnosticos))
+        # Con el bloqueo de escritura tomado los IDs del lote son consecutivos
+        ultimo = conn.execute('SELECT last_insert_rowid()').fetchone()[0]
+        guardados = cursor.rowcount
+        coocurrencia.acumular(conn, inquilino, ((json.loads(hechos_json), regla_id, veces)
+                                                for (hechos_json, regla_id), veces in combinaciones.items()))
+    if guardados:
+        # Tras restaurar un respaldo los IDs se reutilizan: la caché podría tener otros datos con ellos
+        primero = ultimo - guardados + 1
+        cache_diagnosticos().descartar(lambda clave: primero <= clave[1] <= ultimo)
+    return guardados
+
+def guardar_diagnosticos_con_claves(diagnosticos: Sequence[Tuple[str, Dict[str, bool], Optional[Mapping[str, Any]]]],
+                                    version_reglas: Optional[str] = None,
+                                    inquilino: str = '') -> List[Tuple[int, Optional[Dict[str, Any]]]]:
+    """
+    Guarda un lote con clave de idempotencia por diagnóstico (sincronización
+    de diagnósticos hechos sin conexión) en una sola transacción
+
+    Las claves ya usadas, en la base o antes en el mismo lote, no se vuelven
+    a guardar. Como guardar_diagnosticos_lote, no avisa a los observadores.
+
+    Args:
+        diagnosticos: Tripletas (clave, hechos, resultado del motor o None)
+        version_reglas: Versión de la base de reglas con que se hicieron
+        inquilino: Inquilino al que pertenecen ('' = sin inquilino)
+
     Returns:
-        ID del diagnóstico guardado
+        Por diagnóstico, el ID guardado y None si es nuevo, o el ID y los
+        hechos del que ya tenía esa clave
     """
+    fecha = datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+    claves = list(dict.fromkeys(clave for clave, _, _ in diagnosticos))
     with get_db_connection() as conn:
-        cursor = conn.cursor()
-        
-        hechos_json = json.dumps(hechos, ensure_ascii=False)
-        
-        if resultado:
-            cursor.execute('''
-                INSERT INTO diagnosticos 
-                (hechos_json, regla_id, titulo, categoria, riesgo, descripcion, justificacion, acciones_json)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-            ''', (
-                hechos_json,
-                resultado.get('id'),
-                resultado.get('titulo'),
-                resultado.get('categoria'),
-                resultado.get('riesgo'),
-                resultado.get('descripcion'),
-                resultado.get('justificacion'),
-                json.dumps(resultado.get('acciones', []), ensure_ascii=False)
-            ))
-        else:
-            # Diagnóstico sin resultado (condiciones normales)
-            cursor.execute('''
-                INSERT INTO diagnosticos 
-                (hechos_json, regla_id, titulo, categoria, riesgo, descripcion, justificacion, acciones_json)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        # Bloqueo de escritura desde la consulta: nadie usa una clave entre la búsqueda y el INSERT
+        conn.execute('BEGIN IMMEDIATE')
+        existentes: Dict[str, Tuple[int, Dict[str, Any]]] = {}
+        for inicio in range(0, len(claves), 500):
+            parte = claves[inicio:inicio + 500]
+            for row in conn.execute(f'''
+                SELECT id, clave_idempotencia, hechos_json FROM diagnosticos
+                WHERE inquilino = ? AND clave_idempotencia IN ({", ".join("?" * len(parte))})
+            ''', (inquilino, *parte)):
+                existentes[row['clave_idempotencia']] = (row['id'], json.loads(row['hechos_json']))
+
+        resultados: List[Tuple[int, Optional[Dict[str, Any]]]] = []
+        combinaciones: Counter = Counter()
+        for clave, hechos, resultado in diagnosticos:
+            previo = existentes.get(clave)
+            if previo is not None:
+                resultados.append(previo)
+                continue
+            datos = SIN_DIAGNOSTICO if resultado is None else resultado
+            hechos_json = json.dumps(hechos, ensure_ascii=False)
+            cursor = conn.execute('''
+                INSERT INTO diagnosticos
+                (fecha, hechos_json, regla_id, titulo, categoria, riesgo, descripcion, justificacion, acciones_json,
+                 clave_idempotencia, version_reglas, inquilino)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
             ''', (
+                fecha,
                 hechos_json,
-                None,
-                "Sin diagnóstico aplicable",
-                "Monitoreo Preventivo",
-                "BAJO",
-                "No se encontraron condiciones críticas",
-                "La ausencia de indicadores críticos sugiere buena gestión ambiental",
-                json.dumps(["Mantener monitoreo periódico", "Continuar con buenas prácticas ambientales"], ensure_ascii=False)
+                datos.get('id'),
+                datos.get('titulo'),
+                datos.get('categoria'),
+                datos.get('riesgo'),
+                datos.get('descripcion'),
+                datos.get('justificacion'),
+                json.dumps(datos.get('acciones', []), ensure_ascii=False),
+                clave,
+                version_reglas,
+                inquilino
             ))
-        
-        return cursor.lastrowid
+            existentes[clave] = (cursor.lastrowid, dict(hechos))
+            resultados.append((cursor.lastrowid, None))
+            combinaciones[(hechos_json, datos.get('id'))] += 1
+        coocurrencia.acumular(conn, inquilino, ((json.loads(hechos_json), regla_id, veces)
+                                                for (hechos_json, regla_id), veces in combinaciones.items()))
+    # Como en guardar_diagnosticos_lote: los IDs nuevos pueden estar en la caché de antes de restaurar
+    nuevos = {diagnostico_id for diagnostico_id, previos in resultados if previos is None}
+    if nuevos:
+        cache_diagnosticos().descartar(lambda clave: clave[1] in nuevos)
+    return resultados
+
+def registrar_observador(funcion: Callable[[Dict[str, Any]], None]) -> None:
+    """
+    Registra una función que recibe un resumen de cada diagnóstico guardado
+    
+    Args:
+        funcion: Recibe un diccionario con id, fecha, regla_id, titulo, categoria, riesgo e inquilino.
+                 Se llama tras el commit y no debe bloquear.
+    """
+    _observadores_guardado.append(funcion)
+
+def _notificar_guardado(resumen: Dict[str, Any]) -> None:
+    """Avisa a los observadores; un error en uno no afecta el guardado"""
+    for funcion in _observadores_guardado:
+        try:
+            funcion(resumen)
+        except Exception as e:
+            print(f"Error notificando diagnóstico guardado: {e}")
+
+# Columnas que se leen para armar un diagnóstico completo
+COLUMNAS_DIAGNOSTICO = ('id, fecha, hechos_json, regla_id, titulo, categoria, riesgo, descripcion, justificacion, '
+                        'acciones_json, version_reglas')
 
-def obtener_historial(limite: int = 50, offset: int = 0) -> List[Dict[str, Any]]:
+def _fila_a_diagnostico(row: sqlite3.Row) -> Diagnostico:
+    """Convierte una fila de la tabla diagnosticos en un registro de solo lectura"""
+    return Diagnostico(
+        id=row['id'],
+        fecha=row['fecha'],
+        hechos=json.loads(row['hechos_json']),
+        regla_id=row['regla_id'],
+        titulo=row['titulo'],
+        categoria=row['categoria'],
+        riesgo=row['riesgo'],
+        descripcion=row['descripcion'],
+        justificacion=row['justificacion'],
+        acciones=json.loads(row['acciones_json']) if row['acciones_json'] else [],
+        version_reglas=row['version_reglas']
+    )
+
+def obtener_historial(limite: int = 50, offset: int = 0, inquilino: str = '',
+                      desde: Optional[str] = None, hasta: Optional[str] = None,
+                      antes: Optional[Tuple[str, int]] = None) -> List[Diagnostico]:
     """
-    Obtiene el historial de diagnósticos
+    Obtiene el historial de diagnósticos (tabla y archivo frío)
     
     Args:
         limite: Número máximo de registros a devolver
         offset: Número de registros a saltar
+        inquilino: Inquilino cuyos diagnósticos se devuelven
+        desde: Fecha mínima (inclusive, 'YYYY-MM-DD[ HH:MM:SS]')
+        hasta: Fecha máxima (exclusive)
+        antes: (fecha, id) del último diagnóstico de la página anterior; se
+               devuelven los que le siguen en el orden del historial
     
     Returns:
         Lista de diagnósticos con toda la información
     """
+    filtro, parametros = _filtro_fechas(desde, hasta)
+    filtro_antes, parametros_antes = '', ()
+    if antes is not None:
+        filtro_antes = ' AND (fecha < ? OR (fecha = ? AND id < ?))'
+        parametros_antes = (antes[0], antes[0], antes[1])
     with get_db_connection() as conn:
         cursor = conn.cursor()
-        cursor.execute('''
-            SELECT 
-                id,
-                fecha,
-                hechos_json,
-                regla_id,
-                titulo,
-                categoria,
-                riesgo,
-                descripcion,
-                justificacion,
-                acciones_json
+        cursor.execute(f'''
+            SELECT {COLUMNAS_DIAGNOSTICO}
             FROM diagnosticos
-            ORDER BY fecha DESC
+            WHERE inquilino = ?{filtro}{filtro_antes}
+            ORDER BY fecha DESC, id DESC
             LIMIT ? OFFSET ?
-        ''', (limite, offset))
+        ''', (inquilino,) + parametros + parametros_antes + (limite, offset))
         
         rows = cursor.fetchall()
-        
-        diagnosticos = []
-        for row in rows:
-            diagnostico = {
-                'id': row['id'],
-                'fecha': row['fecha'],
-                'hechos': json.loads(row['hechos_json']),
-                'regla_id': row['regla_id'],
-                'titulo': row['titulo'],
-                'categoria': row['categoria'],
-                'riesgo': row['riesgo'],
-                'descripcion': row['descripcion'],
-                'justificacion': row['justificacion'],
-                'acciones': json.loads(row['acciones_json']) if row['acciones_json'] else []
-            }
-            diagnosticos.append(diagnostico)
-        
-        return diagnosticos
+        historial = [_fila_a_diagnostico(row) for row in rows]
+
+        # Lo archivado es más viejo que todo lo de la tabla: va a continuación
+        archivo = archivo_frio()
+        if len(historial) < limite and archivo.actualizar():
+            if historial or offset == 0:
+                en_tabla = offset + len(historial)
+            else:
+                cursor.execute(f'SELECT COUNT(*) FROM diagnosticos WHERE inquilino = ?{filtro}{filtro_antes}',
+                               (inquilino,) + parametros + parametros_antes)
+                en_tabla = cursor.fetchone()[0]
+            historial += archivo.historial(limite - len(historial), max(0, offset - en_tabla),
+                                           inquilino, desde, hasta, antes)
+        return historial
 
-def obtener_diagnostico_por_id(diagnostico_id: int) -> Optional[Dict[str, Any]]:
+def obtener_diagnostico_por_id(diagnostico_id: int, inquilino: str = '') -> Optional[Diagnostico]:
     """
-    Obtiene un diagnóstico específico por su ID
+    Obtiene un diagnóstico específico por su ID (de la caché, la tabla o el archivo frío)
     
     Args:
         diagnostico_id: ID del diagnóstico
+        inquilino: Inquilino dueño del diagnóstico
     
     Returns:
         Diagnóstico completo o None si no existe
     """
+    cache = cache_diagnosticos()
+    generacion = cache.generacion
+    diagnostico = cache.obtener((inquilino, diagnostico_id))
+    if diagnostico is not None:
+        return diagnostico
     with get_db_connection() as conn:
         cursor = conn.cursor()
-        cursor.execute('''
-            SELECT 
-                id,
-                fecha,
-                hechos_json,
-                regla_id,
-                titulo,
-                categoria,
-                riesgo,
-                descripcion,
-                justificacion,
-                acciones_json
+        cursor.execute(f'''
+            SELECT {COLUMNAS_DIAGNOSTICO}
             FROM diagnosticos
-            WHERE id = ?
-        ''', (diagnostico_id,))
+            WHERE id = ? AND inquilino = ?
+        ''', (diagnostico_id, inquilino))
         
         row = cursor.fetchone()
         
-        if row:
-            return {
-                'id': row['id'],
-                'fecha': row['fecha'],
-                'hechos': json.loads(row['hechos_json']),
-                'regla_id': row['regla_id'],
-                'titulo': row['titulo'],
-                'categoria': row['categoria'],
-                'riesgo': row['riesgo'],
-                'descripcion': row['descripcion'],
-                'justificacion': row['justificacion'],
-                'acciones': json.loads(row['acciones_json']) if row['acciones_json'] else []
-            }
+    diagnostico = _fila_a_diagnostico(row) if row else archivo_frio().obtener(diagnostico_id, inquilino)
+    if diagnostico is not None:
+        cache.guardar((inquilino, diagnostico_id), diagnostico, generacion)
+    return diagnostico
+
+def buscar_por_clave_idempotencia(clave: str, inquilino: str = '') -> Optional[Diagnostico]:
+    """
+    Busca un diagnóstico por su clave de idempotencia (usa el índice único)
+    
+    Args:
+        clave: Clave enviada en el encabezado Idempotency-Key
+        inquilino: Inquilino que envió la clave
+    
+    Returns:
+        Diagnóstico completo o None si la clave no se usó
+    """
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(f'''
+            SELECT {COLUMNAS_DIAGNOSTICO}
+            FROM diagnosticos
+            WHERE inquilino = ? AND clave_idempotencia = ?
+        ''', (inquilino, clave))
+        row = cursor.fetchone()
+        
+        return _fila_a_diagnostico(row) if row else None
+
+def guardar_bloques_lecturas(bloques: List[tuple]) -> None:
+    """
+    Guarda bloques de lecturas de telemetría en una sola transacción
+    
+    Args:
+        bloques: Tuplas (estacion, variable, t_inicio, t_fin, cantidad, tiempos, valores),
+                 con tiempos y valores como bytes de array('d')
+    """
+    with get_db_connection() as conn:
+        conn.executemany('''
+            INSERT INTO lecturas_bloques (estacion, variable, t_inicio, t_fin, cantidad, tiempos, valores)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', bloques)
+
+def guardar_cambios_estado(cambios: List[Dict[str, Any]]) -> None:
+    """
+    Guarda los cambios de estado de las estaciones de telemetría
+    
+    Args:
+        cambios: Estados con estacion, hechos, regla_id, riesgo y decidido
+    """
+    fecha = datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+    with get_db_connection() as conn:
+        conn.executemany('''
+            INSERT INTO estados_estacion (estacion, fecha, hechos_json, regla_id, riesgo, decidido)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', [
+            (c['estacion'], fecha, json.dumps(c['hechos'], ensure_ascii=False), c['regla_id'], c['riesgo'],
+             int(c['decidido']))
+            for c in cambios
+        ])
+
+def obtener_cambios_estado(estacion: str, limite: int = 50) -> List[Dict[str, Any]]:
+    """
+    Obtiene los últimos cambios de estado de una estación
+    
+    Args:
+        estacion: Identificador de la estación
+        limite: Número máximo de registros a devolver
+    
+    Returns:
+        Cambios de estado, del más reciente al más antiguo
+    """
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT id, fecha, hechos_json, regla_id, riesgo, decidido
+            FROM estados_estacion
+            WHERE estacion = ?
+            ORDER BY id DESC
+            LIMIT ?
+        ''', (estacion, limite))
         
-        return None
+        return [{
+            'id': row['id'],
+            'fecha': row['fecha'],
+            'hechos': json.loads(row['hechos_json']),
+            'regla_id': row['regla_id'],
+            'riesgo': row['riesgo'],
+            'decidido': bool(row['decidido'])
+        } for row in cursor.fetchall()]
 
-def obtener_estadisticas() -> Dict[str, Any]:
+def obtener_estadisticas(inquilino: str = '', desde: Optional[str] = None,
+                         hasta: Optional[str] = None) -> Dict[str, Any]:
     """
-    Obtiene estadísticas generales de los diagnósticos
+    Obtiene estadísticas generales de los diagnósticos (tabla y archivo frío)
+    
+    Args:
+        inquilino: Inquilino cuyos diagnósticos se cuentan
+        desde: Fecha mínima (inclusive)
+        hasta: Fecha máxima (exclusive)
     
     Returns:
         Diccionario con estadísticas
     """
+    filtro, parametros = _filtro_fechas(desde, hasta)
     with get_db_connection() as conn:
         cursor = conn.cursor()
         
-        # Total de diagnósticos
-        cursor.execute('SELECT COUNT(*) as total FROM diagnosticos')
-        total = cursor.fetchone()['total']
-        
-        # Diagnósticos por nivel de riesgo
-        cursor.execute('''
+        # Diagnósticos por nivel de riesgo (el total es la suma)
+        cursor.execute(f'''
             SELECT riesgo, COUNT(*) as cantidad
             FROM diagnosticos
+            WHERE inquilino = ?{filtro}
             GROUP BY riesgo
-        ''')
-        por_riesgo = {row['riesgo']: row['cantidad'] for row in cursor.fetchall()}
+        ''', (inquilino,) + parametros)
+        por_riesgo = Counter({row['riesgo']: row['cantidad'] for row in cursor.fetchall()})
         
-        # Diagnósticos por categoría
-        cursor.execute('''
+        # Diagnósticos por categoría (todas: el top 5 se arma después de sumar el archivo)
+        cursor.execute(f'''
             SELECT categoria, COUNT(*) as cantidad
             FROM diagnosticos
+            WHERE inquilino = ?{filtro}
             GROUP BY categoria
-            ORDER BY cantidad DESC
-            LIMIT 5
-        ''')
-        por_categoria = {row['categoria']: row['cantidad'] for row in cursor.fetchall()}
-        
-        return {
-            'total': total,
-            'por_riesgo': por_riesgo,
-            'por_categoria': por_categoria
-        }
+        ''', (inquilino,) + parametros)
+        por_categoria = Counter({row['categoria']: row['cantidad'] for row in cursor.fetchall()})
+    
+    total = sum(por_riesgo.values())
+    archivo = archivo_frio()
+    if archivo.actualizar():
+        archivados, riesgos, categorias = archivo.estadisticas(inquilino, desde, hasta)
+        total += archivados
+        por_riesgo.update(riesgos)
+        por_categoria.update(categorias)
+    
+    return {
+        'total': total,
+        'por_riesgo': dict(por_riesgo),
+        'por_categoria': dict(por_categoria.most_common(5))
+    }
 
 # Inicializar base de datos al importar el módulo
 init_database()
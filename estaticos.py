@@ -0,0 +1,136 @@
+"""
+Construcción de los archivos estáticos de la interfaz al iniciar la aplicación
+
+Los .js y .css se minifican, se renombran con una huella de su contenido
+(script.<huella>.js) y se precomprimen en gzip y, si está instalado el
+paquete `brotli`, también en brotli. Como el nombre cambia cuando cambia el
+contenido, se pueden servir con caché de un año (Cache-Control: immutable).
+"""
+
+import gzip
+import hashlib
+import os
+import re
+from typing import Dict, Optional
+
+try:
+    import brotli
+except ImportError:  # brotli es opcional: sin él solo se sirve gzip
+    brotli = None
+
+CACHE_INMUTABLE = "public, max-age=31536000, immutable"
+
+TIPOS_MIME = {
+    ".js": "application/javascript; charset=utf-8",
+    ".css": "text/css; charset=utf-8",
+    ".html": "text/html; charset=utf-8",
+}
+
+
+class Activo:
+    """Archivo servido desde memoria con sus versiones comprimidas"""
+
+    __slots__ = ("nombre", "contenido", "gzip", "brotli", "media_type", "huella")
+
+    def __init__(self, nombre: str, contenido: bytes, media_type: str):
+        self.nombre = nombre
+        self.contenido = contenido
+        self.media_type = media_type
+        self.huella = hashlib.sha256(contenido).hexdigest()[:16]
+        self.gzip = gzip.compress(contenido, compresslevel=9, mtime=0)
+        self.brotli = brotli.compress(contenido, quality=11) if brotli else None
+
+    def etag(self, codificacion: Optional[str] = None) -> str:
+        """ETag de la representación: cada codificación tiene bytes distintos y su propio ETag"""
+        return f'"{self.huella}-{codificacion}"' if codificacion else f'"{self.huella}"'
+
+    def cuerpo_para(self, accept_encoding: Optional[str]):
+        """
+        Elige la mejor codificación aceptada por el cliente según sus valores q
+        (a igual preferencia, brotli antes que gzip)
+
+        Returns:
+            Tupla (bytes, content-encoding o None)
+        """
+        calidades = calidades_aceptadas(accept_encoding)
+        comodin = calidades.get("*", 0.0)
+        opciones = [(self.brotli, "br"), (self.gzip, "gzip")] if self.brotli is not None else [(self.gzip, "gzip")]
+        mejor, calidad_mejor = (self.contenido, None), 0.0
+        for cuerpo, codificacion in opciones:
+            calidad = calidades.get(codificacion, comodin)
+            if calidad > calidad_mejor:
+                mejor, calidad_mejor = (cuerpo, codificacion), calidad
+        return mejor
+
+
+def calidades_aceptadas(accept_encoding: Optional[str]) -> Dict[str, float]:
+    """
+    Valor q de cada codificación de un Accept-Encoding ("gzip;q=0.5, br" ->
+    {"gzip": 0.5, "br": 1.0}). Un q mal formado cuenta como 0 (no aceptada).
+    """
+    calidades = {}
+    for parte in (accept_encoding or "").split(","):
+        codificacion, *parametros = parte.split(";")
+        codificacion = codificacion.strip().lower()
+        if not codificacion:
+            continue
+        calidad = 1.0
+        for parametro in parametros:
+            clave, _, valor = parametro.partition("=")
+            if clave.strip().lower() == "q":
+                try:
+                    calidad = float(valor.strip())
+                except ValueError:
+                    calidad = 0.0
+                if not 0.0 <= calidad <= 1.0:
+                    calidad = 0.0
+        calidades[codificacion] = calidad
+    return calidades
+
+
+def minificar_js(texto: str) -> str:
+    """
+    Minificación conservadora: quita sangrías, líneas vacías y líneas que son
+    solo comentarios. No une líneas para no depender de la inserción
+    automática de punto y coma.
+    """
+    lineas = []
+    for linea in texto.splitlines():
+        linea = linea.strip()
+        if not linea or linea.startswith("//"):
+            continue
+        lineas.append(linea)
+    return "\n".join(lineas)
+
+
+def minificar_css(texto: str) -> str:
+    """Quita comentarios y espacios innecesarios del CSS"""
+    texto = re.sub(r"/\*.*?\*/", "", texto, flags=re.DOTALL)
+    texto = re.sub(r"\s+", " ", texto)
+    texto = re.sub(r"\s*([{};,>])\s*", r"\1", texto)
+    return texto.replace(";}", "}").strip()
+
+
+MINIFICADORES = {".js": minificar_js, ".css": minificar_css}
+
+
+def construir_activos(directorio: str) -> Dict[str, Activo]:
+    """
+    Minifica, firma y comprime los .js y .css de un directorio
+
+    Args:
+        directorio: Carpeta de archivos estáticos
+
+    Returns:
+        Diccionario nombre original -> Activo (con el nombre con huella)
+    """
+    activos = {}
+    for nombre in sorted(os.listdir(directorio)):
+        base, extension = os.path.splitext(nombre)
+        if extension not in MINIFICADORES:
+            continue
+        with open(os.path.join(directorio, nombre), encoding="utf-8") as f:
+            contenido = MINIFICADORES[extension](f.read()).encode("utf-8")
+        huella = hashlib.sha256(contenido).hexdigest()[:10]
+        activos[nombre] = Activo(f"{base}.{huella}{extension}", contenido, TIPOS_MIME[extension])
+    return activos
@@ -0,0 +1,182 @@
+"""
+Difusión en proceso de los diagnósticos guardados (Server-Sent Events)
+
+Cada suscriptor tiene una cola acotada: si un cliente lento no la vacía a
+tiempo se descartan los eventos más antiguos y se contabilizan, de modo que
+publicar nunca bloquea a quien guarda el diagnóstico. Un suscriptor inactivo
+solo ocupa su cola vacía y un asyncio.Event en espera.
+"""
+
+import asyncio
+import threading
+from collections import deque
+from typing import Any, Deque, Dict, Iterable, List, Optional, Set, Tuple
+
+Evento = Tuple[int, Dict[str, Any]]
+
+
+class Suscripcion:
+    """Suscriptor con filtros y cola acotada de eventos pendientes"""
+
+    __slots__ = ("riesgos", "categorias", "inquilino", "_cola", "_lock", "_loop", "_aviso",
+                 "_aviso_pendiente", "descartados", "descartados_sin_informar")
+
+    def __init__(self, riesgos: Optional[Set[str]], categorias: Optional[Set[str]], capacidad: int,
+                 loop: asyncio.AbstractEventLoop, inquilino: str = ""):
+        self.riesgos = riesgos
+        self.categorias = categorias
+        self.inquilino = inquilino
+        self._cola: Deque[Evento] = deque(maxlen=capacidad)
+        self._lock = threading.Lock()
+        self._loop = loop
+        self._aviso = asyncio.Event()
+        self._aviso_pendiente = False
+        self.descartados = 0
+        self.descartados_sin_informar = 0
+
+    def acepta(self, datos: Dict[str, Any]) -> bool:
+        """Indica si el evento es del inquilino y pasa los filtros de riesgo y categoría"""
+        if datos.get("inquilino", "") != self.inquilino:
+            return False
+        if self.riesgos is not None and datos.get("riesgo") not in self.riesgos:
+            return False
+        if self.categorias is not None and datos.get("categoria") not in self.categorias:
+            return False
+        return True
+
+    def entregar(self, evento: Evento) -> bool:
+        """
+        Encola un evento sin bloquear (se puede llamar desde cualquier hilo)
+
+        Returns:
+            False si hubo que descartar el evento más antiguo de la cola
+        """
+        with self._lock:
+            lleno = len(self._cola) == self._cola.maxlen
+            if lleno:
+                self.descartados += 1
+                self.descartados_sin_informar += 1
+            self._cola.append(evento)
+            avisar = not self._aviso_pendiente
+            self._aviso_pendiente = True
+        # Un solo aviso al event loop por tanda, aunque lleguen muchos eventos
+        if avisar:
+            try:
+                self._loop.call_soon_threadsafe(self._aviso.set)
+            except RuntimeError:
+                # El event loop ya se cerró: el suscriptor está terminando
+                pass
+        return not lleno
+
+    async def esperar(self, timeout: float) -> List[Evento]:
+        """
+        Espera eventos hasta `timeout` segundos y devuelve los pendientes
+
+        Returns:
+            Lista de eventos (vacía si se agotó el tiempo)
+        """
+        if not self._cola:
+            self._aviso.clear()
+            try:
+                await asyncio.wait_for(self._aviso.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        with self._lock:
+            eventos = list(self._cola)
+            self._cola.clear()
+            self._aviso_pendiente = False
+        return eventos
+
+    def tomar_descartados(self) -> int:
+        """Devuelve los eventos descartados desde la última consulta"""
+        with self._lock:
+            cantidad = self.descartados_sin_informar
+            self.descartados_sin_informar = 0
+        return cantidad
+
+
+class Difusor:
+    """Difusor de eventos en proceso con historial corto para reanudar"""
+
+    def __init__(self, capacidad_cola: int = 100, tamano_historial: int = 1000):
+        self.capacidad_cola = capacidad_cola
+        self._historial: Deque[Evento] = deque(maxlen=tamano_historial)
+        self._suscripciones: Set[Suscripcion] = set()
+        self._lock = threading.Lock()
+        self._ultimo_id = 0
+        self.publicados = 0
+        self.descartados = 0
+
+    def publicar(self, datos: Dict[str, Any]) -> int:
+        """
+        Publica un evento a todos los suscriptores cuyos filtros lo aceptan.
+        No bloquea: los suscriptores lentos pierden sus eventos más antiguos.
+
+        Returns:
+            ID del evento publicado
+        """
+        with self._lock:
+            self._ultimo_id += 1
+            evento = (self._ultimo_id, datos)
+            self._historial.append(evento)
+            self.publicados += 1
+            suscripciones = list(self._suscripciones)
+
+        descartados = 0
+        for suscripcion in suscripciones:
+            if suscripcion.acepta(datos) and not suscripcion.entregar(evento):
+                descartados += 1
+        if descartados:
+            with self._lock:
+                self.descartados += descartados
+        return evento[0]
+
+    def suscribir(self, riesgos: Optional[Iterable[str]] = None, categorias: Optional[Iterable[str]] = None,
+                  ultimo_id: Optional[int] = None, inquilino: str = "") -> Suscripcion:
+        """
+        Registra un suscriptor en el event loop actual
+
+        Args:
+            riesgos: Niveles de riesgo aceptados (None = todos)
+            categorias: Categorías aceptadas (None = todas)
+            ultimo_id: Último evento recibido (Last-Event-ID) para reanudar
+            inquilino: Solo se reciben los diagnósticos de este inquilino
+
+        Returns:
+            La suscripción creada, con los eventos posteriores a ultimo_id ya encolados
+        """
+        suscripcion = Suscripcion(
+            set(riesgos) if riesgos else None,
+            set(categorias) if categorias else None,
+            self.capacidad_cola,
+            asyncio.get_running_loop(),
+            inquilino,
+        )
+        with self._lock:
+            if ultimo_id is not None:
+                # Los eventos que ya salieron del historial se informan como perdidos
+                primero = self._historial[0][0] if self._historial else self._ultimo_id + 1
+                if ultimo_id + 1 < primero:
+                    perdidos = primero - ultimo_id - 1
+                    suscripcion.descartados += perdidos
+                    suscripcion.descartados_sin_informar += perdidos
+                for evento in self._historial:
+                    if evento[0] > ultimo_id and suscripcion.acepta(evento[1]):
+                        suscripcion.entregar(evento)
+            self._suscripciones.add(suscripcion)
+        return suscripcion
+
+    def cancelar(self, suscripcion: Suscripcion) -> None:
+        """Elimina un suscriptor"""
+        with self._lock:
+            self._suscripciones.discard(suscripcion)
+
+    def estadisticas(self) -> Dict[str, Any]:
+        """Contadores del difusor"""
+        with self._lock:
+            return {
+                "suscriptores": len(self._suscripciones),
+                "publicados": self.publicados,
+                "descartados": self.descartados,
+                "ultimo_id": self._ultimo_id,
+            }
@@ -0,0 +1,275 @@
+"""
+Exportación masiva de diagnósticos en PDF, empaquetados en un ZIP
+
+Los auditores piden el informe individual de cada diagnóstico de un período.
+En vez de cientos de /descargar-pdf/{id} seguidos (cada uno generado en un
+solo hilo), /exportar-pdf genera los PDF en un pool de procesos y va
+enviando el ZIP mientras se siguen generando.
+
+La memoria queda acotada igual que en lote.py: los diagnósticos se leen de
+a páginas y nunca hay más de 2 PDF por proceso en vuelo; cada PDF se
+escribe en el ZIP (sin comprimir: los PDF ya vienen comprimidos) y sus
+bytes salen hacia el cliente antes de pedir el siguiente. El ZIP termina
+con indice.csv (id, fecha, riesgo, regla y archivo de cada diagnóstico).
+
+El avance de cada exportación se consulta en /exportaciones/{id}; el id
+viene en el encabezado X-Exportacion-Id de la respuesta.
+"""
+
+import csv
+import io
+import multiprocessing
+import os
+import threading
+import time
+import uuid
+import zipfile
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from almacenamiento import Almacen
+from pdf_generator import generar_pdf_diagnostico
+from registros import Diagnostico
+
+PDF_PROCESOS = int(os.environ.get("PDF_PROCESOS", "0")) or os.cpu_count() or 1
+MAX_EXPORTACION = int(os.environ.get("PDF_EXPORTACION_MAX", "10000"))
+# Diagnósticos leídos por consulta al recorrer un rango de fechas
+PAGINA = 200
+# Con menos diagnósticos que esto no vale la pena levantar procesos
+MIN_PARA_POOL = 8
+# Exportaciones recordadas para /exportaciones/{id}
+MAX_EXPORTACIONES = 100
+
+
+def _renderizar(diagnostico: Diagnostico) -> bytes:
+    """Genera el PDF de un diagnóstico (corre en los procesos del pool)"""
+    return generar_pdf_diagnostico(diagnostico, diagnostico['hechos'])
+
+
+def nombre_pdf(diagnostico: Diagnostico) -> str:
+    return f"diagnostico_{diagnostico['id']}.pdf"
+
+
+class ProgresoExportacion:
+    """Avance de una exportación, para consultarlo mientras se genera"""
+
+    def __init__(self, total: int):
+        self.id = uuid.uuid4().hex
+        self.total = total
+        self.generados = 0
+        self.faltantes = 0
+        self.bytes = 0
+        self.estado = "en_curso"
+        self.inicio = time.time()
+        self.fin: Optional[float] = None
+
+    def terminar(self, estado: str) -> None:
+        self.estado = estado
+        self.fin = time.time()
+
+    def a_dict(self) -> Dict[str, Any]:
+        segundos = (self.fin or time.time()) - self.inicio
+        return {
+            "id": self.id,
+            "estado": self.estado,
+            "total": self.total,
+            "generados": self.generados,
+            "faltantes": self.faltantes,
+            "bytes": self.bytes,
+            "segundos": round(segundos, 3),
+            "por_segundo": round(self.generados / segundos, 1) if segundos else 0.0,
+        }
+
+
+class RegistroExportaciones:
+    """Las últimas exportaciones (en curso o terminadas), por id"""
+
+    def __init__(self, max_exportaciones: int = MAX_EXPORTACIONES):
+        self.max_exportaciones = max_exportaciones
+        self._exportaciones: "OrderedDict[str, ProgresoExportacion]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def nueva(self, total: int) -> ProgresoExportacion:
+        progreso = ProgresoExportacion(total)
+        with self._lock:
+            self._exportaciones[progreso.id] = progreso
+            while len(self._exportaciones) > self.max_exportaciones:
+                self._exportaciones.popitem(last=False)
+        return progreso
+
+    def obtener(self, exportacion_id: str) -> Optional[ProgresoExportacion]:
+        with self._lock:
+            return self._exportaciones.get(exportacion_id)
+
+
+def diagnosticos_a_exportar(almacen: Almacen, inquilino: str = '', ids: Optional[List[int]] = None,
+                            desde: Optional[str] = None, hasta: Optional[str] = None,
+                            progreso: Optional[ProgresoExportacion] = None) -> Iterator[Diagnostico]:
+    """
+    Recorre los diagnósticos pedidos sin cargarlos todos a la vez
+
+    Args:
+        almacen: De dónde leerlos
+        inquilino: Inquilino dueño de los diagnósticos
+        ids: IDs puntuales (los que no existen se cuentan en progreso.faltantes)
+        desde: Sin ids, fecha mínima (inclusive)
+        hasta: Sin ids, fecha máxima (exclusive); debe estar fija para que las
+               páginas no se corran con los diagnósticos nuevos
+        progreso: Avance; sin ids, lo que falte para progreso.total (contado al
+                  empezar) porque se borró o archivó durante la exportación se
+                  suma a progreso.faltantes
+
+    Returns:
+        Iterador de diagnósticos (con ids, en el orden pedido; si no, del más reciente al más antiguo)
+    """
+    if ids is not None:
+        for diagnostico_id in ids:
+            diagnostico = almacen.obtener(diagnostico_id, inquilino)
+            if diagnostico is None:
+                if progreso is not None:
+                    progreso.faltantes += 1
+                continue
+            yield diagnostico
+        return
+    # Cada página sigue a la última fila vista: con offset, lo que se borra
+    # durante la exportación correría las páginas y se saltarían filas
+    antes, exportados = None, 0
+    while True:
+        pagina = almacen.historial(PAGINA, 0, inquilino, desde, hasta, antes)
+        yield from pagina
+        exportados += len(pagina)
+        if len(pagina) < PAGINA:
+            break
+        antes = (pagina[-1]["fecha"], pagina[-1]["id"])
+    if progreso is not None:
+        progreso.faltantes += max(0, progreso.total - exportados)
+
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_procesos = 0
+_pool_lock = threading.Lock()
+
+
+def pool_pdf(procesos: int) -> ProcessPoolExecutor:
+    """
+    Pool de procesos compartido por las exportaciones; se crea la primera vez
+    (levantar procesos e importar reportlab cuesta más que generar decenas de PDF)
+    """
+    global _pool, _pool_procesos
+    with _pool_lock:
+        if _pool is None or _pool_procesos != procesos:
+            if _pool is not None:
+                _pool.shutdown(wait=False)
+            # forkserver: el servidor tiene hilos y hacer fork de un proceso con hilos puede trabarse.
+            # Donde no existe (Windows) spawn, que tampoco hereda los hilos
+            if "forkserver" in multiprocessing.get_all_start_methods():
+                contexto = multiprocessing.get_context("forkserver")
+                contexto.set_forkserver_preload(["pdf_generator"])
+            else:
+                contexto = multiprocessing.get_context("spawn")
+            _pool = ProcessPoolExecutor(procesos, mp_context=contexto)
+            _pool_procesos = procesos
+        return _pool
+
+
+def cerrar_pool() -> None:
+    """Detiene el pool de procesos (al apagar el servidor)"""
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=True, cancel_futures=True)
+            _pool = None
+
+
+def _en_paralelo(diagnosticos: Iterable[Diagnostico], procesos: int) -> Iterator[Tuple[Diagnostico, bytes]]:
+    """PDF de cada diagnóstico, en orden, con a lo sumo 2 por proceso en vuelo"""
+    if procesos <= 1:
+        for diagnostico in diagnosticos:
+            yield diagnostico, _renderizar(diagnostico)
+        return
+    pool = pool_pdf(procesos)
+    pendientes = deque()
+    try:
+        for diagnostico in diagnosticos:
+            pendientes.append((diagnostico, pool.submit(_renderizar, diagnostico)))
+            while len(pendientes) >= 2 * procesos:
+                diagnostico_listo, futuro = pendientes.popleft()
+                yield diagnostico_listo, futuro.result()
+        while pendientes:
+            diagnostico_listo, futuro = pendientes.popleft()
+            yield diagnostico_listo, futuro.result()
+    finally:
+        # Si el cliente cortó la descarga, lo que no empezó no se genera
+        for _, futuro in pendientes:
+            futuro.cancel()
+
+
+class _Tubo(io.RawIOBase):
+    """Archivo de solo escritura y sin posición: zipfile escribe y el generador se lleva los bytes"""
+
+    def __init__(self):
+        self._partes: List[bytes] = []
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, datos) -> int:
+        self._partes.append(bytes(datos))
+        return len(datos)
+
+    def vaciar(self) -> bytes:
+        datos = b"".join(self._partes)
+        self._partes.clear()
+        return datos
+
+
+def _fecha_zip(fecha: Optional[str]) -> Tuple[int, int, int, int, int, int]:
+    try:
+        return datetime.strptime(fecha or '', '%Y-%m-%d %H:%M:%S').timetuple()[:6]
+    except ValueError:
+        return datetime.now(timezone.utc).timetuple()[:6]
+
+
+def generar_zip(diagnosticos: Iterable[Diagnostico], progreso: ProgresoExportacion,
+                procesos: Optional[int] = None) -> Iterator[bytes]:
+    """
+    Genera el ZIP de a pedazos: cada PDF sale hacia el cliente apenas está listo
+
+    Args:
+        diagnosticos: Diagnósticos a exportar (por ejemplo, de diagnosticos_a_exportar)
+        progreso: Se actualiza con cada PDF y al terminar
+        procesos: Procesos del pool (por defecto PDF_PROCESOS; con pocos diagnósticos, ninguno)
+
+    Returns:
+        Iterador de bytes del ZIP
+    """
+    if procesos is None:
+        procesos = PDF_PROCESOS if progreso.total >= MIN_PARA_POOL else 1
+    tubo = _Tubo()
+    indice = io.StringIO()
+    escritor = csv.writer(indice)
+    escritor.writerow(["id", "fecha", "riesgo", "regla_id", "archivo"])
+    try:
+        with zipfile.ZipFile(tubo, "w", zipfile.ZIP_STORED) as archivo_zip:
+            for diagnostico, pdf in _en_paralelo(diagnosticos, procesos):
+                nombre = nombre_pdf(diagnostico)
+                archivo_zip.writestr(zipfile.ZipInfo(nombre, _fecha_zip(diagnostico['fecha'])), pdf)
+                escritor.writerow([diagnostico['id'], diagnostico['fecha'], diagnostico['riesgo'],
+                                   diagnostico['regla_id'] or '', nombre])
+                progreso.generados += 1
+                datos = tubo.vaciar()
+                progreso.bytes += len(datos)
+                yield datos
+            archivo_zip.writestr("indice.csv", indice.getvalue())
+        datos = tubo.vaciar()
+        progreso.bytes += len(datos)
+        yield datos
+    except GeneratorExit:
+        progreso.terminar("cancelada")
+        raise
+    except Exception:
+        progreso.terminar("error")
+        raise
+    progreso.terminar("terminada")
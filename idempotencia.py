@@ -0,0 +1,46 @@
+"""
+Caché en memoria de respuestas por clave de idempotencia
+
+Guarda por poco tiempo la respuesta de cada diagnóstico enviado con el
+encabezado Idempotency-Key, para que un reintento del cliente se responda
+sin volver a ejecutar el motor ni consultar la base de datos. Pasado el
+plazo, la clave sigue protegida por el índice único de la tabla.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional
+
+
+class CacheIdempotencia:
+    """Caché acotada por cantidad de entradas y tiempo de vida"""
+
+    def __init__(self, max_entradas: int = 10000, ttl_segundos: float = 600):
+        self.max_entradas = max_entradas
+        self.ttl_segundos = ttl_segundos
+        self._entradas: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def obtener(self, clave: Hashable) -> Optional[Dict[str, Any]]:
+        """Devuelve la respuesta guardada o None si no existe o venció"""
+        with self._lock:
+            entrada = self._entradas.get(clave)
+            if entrada is None:
+                return None
+            vence, respuesta = entrada
+            if vence < time.monotonic():
+                del self._entradas[clave]
+                return None
+            return respuesta
+
+    def guardar(self, clave: Hashable, respuesta: Dict[str, Any]) -> None:
+        """Guarda una respuesta descartando las entradas más antiguas si hace falta"""
+        with self._lock:
+            self._entradas[clave] = (time.monotonic() + self.ttl_segundos, respuesta)
+            self._entradas.move_to_end(clave)
+            while len(self._entradas) > self.max_entradas:
+                self._entradas.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._entradas)
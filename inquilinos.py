@@ -0,0 +1,141 @@
+"""
+Bases de reglas por inquilino (municipio)
+
+Cada inquilino tiene su archivo de reglas en DIRECTORIO_INQUILINOS
+(<inquilino>.json, mismo formato que base_reglas.exportar). El inquilino se
+elige con el encabezado X-Inquilino o con el prefijo de ruta
+/inquilinos/<inquilino>/...; sin inquilino se usa la base global.
+
+Las bases compiladas se guardan en una caché LRU acotada: con cientos de
+inquilinos solo los más usados quedan en memoria, y para uno ya cargado
+obtener su base es una búsqueda en un diccionario. Compilar una base nueva
+lleva tiempo (motor de certeza, tabla de decisión...), así que los
+endpoints async la piden a un hilo del pool (ver main.base_del_inquilino_async).
+"""
+
+import os
+import re
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+from base_reglas import BaseReglas, base_vigente, leer_archivo
+
+DIRECTORIO_INQUILINOS = os.environ.get("REGLAS_INQUILINOS_DIR", "inquilinos")
+MAX_INQUILINOS_CARGADOS = int(os.environ.get("MAX_INQUILINOS_CARGADOS", "64"))
+
+# También evita rutas como "../" al armar el nombre del archivo
+PATRON_INQUILINO = r"^[a-z0-9][a-z0-9_-]{0,63}$"
+_patron = re.compile(PATRON_INQUILINO)
+
+PREFIJO_RUTA = "/inquilinos/"
+
+
+class InquilinoDesconocido(KeyError):
+    """No hay archivo de reglas para el inquilino pedido"""
+
+
+class CacheBasesInquilinos:
+    """LRU de bases de reglas compiladas, por inquilino"""
+
+    def __init__(self, directorio: str = DIRECTORIO_INQUILINOS, max_cargados: int = MAX_INQUILINOS_CARGADOS):
+        self.directorio = directorio
+        self.max_cargados = max_cargados
+        self._bases: "OrderedDict[str, BaseReglas]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.aciertos = 0
+        self.fallos = 0
+
+    def ruta(self, inquilino: str) -> str:
+        return os.path.join(self.directorio, f"{inquilino}.json")
+
+    def base_para(self, inquilino: Optional[str]) -> BaseReglas:
+        """
+        Base de reglas del inquilino (la global si no se indica ninguno)
+
+        Raises:
+            InquilinoDesconocido: Si el nombre no es válido o no tiene archivo de reglas
+        """
+        if not inquilino:
+            return base_vigente()
+        with self._lock:
+            base = self._bases.get(inquilino)
+            if base is not None:
+                self._bases.move_to_end(inquilino)
+                self.aciertos += 1
+                return base
+            self.fallos += 1
+
+        # Compilar fuera del lock: no frena a los inquilinos ya cargados
+        base = self._compilar(inquilino)
+        with self._lock:
+            existente = self._bases.get(inquilino)
+            if existente is not None:
+                return existente
+            self._bases[inquilino] = base
+            while len(self._bases) > self.max_cargados:
+                self._bases.popitem(last=False)
+        return base
+
+    def cargada(self, inquilino: Optional[str]) -> Optional[BaseReglas]:
+        """
+        Base del inquilino solo si ya está compilada (la global si no se indica
+        ninguno); None si hay que compilarla con base_para
+        """
+        if not inquilino:
+            return base_vigente()
+        with self._lock:
+            base = self._bases.get(inquilino)
+            if base is not None:
+                self._bases.move_to_end(inquilino)
+                self.aciertos += 1
+            return base
+
+    def _compilar(self, inquilino: str) -> BaseReglas:
+        if not _patron.match(inquilino):
+            raise InquilinoDesconocido(inquilino)
+        ruta = self.ruta(inquilino)
+        if not os.path.exists(ruta):
+            raise InquilinoDesconocido(inquilino)
+        return BaseReglas(leer_archivo(ruta), ruta)
+
+    def recargar(self, inquilino: str) -> BaseReglas:
+        """
+        Vuelve a compilar el archivo del inquilino y reemplaza su base.
+        Si el archivo no es válido, la base cargada sigue vigente.
+        """
+        base = self._compilar(inquilino)
+        with self._lock:
+            self._bases[inquilino] = base
+            self._bases.move_to_end(inquilino)
+            while len(self._bases) > self.max_cargados:
+                self._bases.popitem(last=False)
+        return base
+
+    def estadisticas(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "cargados": len(self._bases),
+                "max_cargados": self.max_cargados,
+                "aciertos": self.aciertos,
+                "fallos": self.fallos,
+            }
+
+
+class InquilinoEnRuta:
+    """
+    Middleware ASGI: /inquilinos/<inquilino>/resto se atiende como /resto
+    con el encabezado X-Inquilino, así las rutas no se duplican
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] in ("http", "websocket") and scope["path"].startswith(PREFIJO_RUTA):
+            inquilino, _, resto = scope["path"][len(PREFIJO_RUTA):].partition("/")
+            ruta = "/" + resto
+            headers = [(k, v) for k, v in scope["headers"] if k != b"x-inquilino"]
+            headers.append((b"x-inquilino", inquilino.encode("utf-8")))
+            scope = dict(scope, path=ruta, raw_path=ruta.encode("utf-8"), headers=headers)
+        await self.app(scope, receive, send)
@@ -2,24 +2,195 @@ let hechos = {};
 let preguntas = [];
 let indice = 0;
 let diagnosticoActualId = null;
+// Clave de idempotencia del cuestionario actual: los reintentos no duplican el diagnóstico
+let claveDiagnostico = null;
+
+// Sesión WebSocket del cuestionario (null si no está disponible: se usa REST)
+let sesion = null;
+let esperandoSesion = {};
+
+// Catálogo de reglas cacheado en el navegador: { version, reglas: { id: regla } }
+const CLAVE_CATALOGO = 'catalogoReglas';
+let catalogo = null;
+
+// Tabla de reglas compilada para diagnosticar sin conexión (ver sincronizacion.py):
+// { etag, datos: { version, hechos, reglas, bytes_por_entrada, tabla, textos } }
+const CLAVE_TABLA = 'tablaReglas';
+let tablaReglas = null;
+let codigosTabla = null;
+
+// Diagnósticos hechos en el navegador que todavía no llegaron al servidor
+const CLAVE_PENDIENTES = 'diagnosticosPendientes';
+const MAX_POR_SINCRONIZACION = 200;
+let sincronizando = null;
+
+// Texto de un diagnóstico guardado sin regla aplicable (igual que database.py)
+const SIN_DIAGNOSTICO = {
+  titulo: 'Sin diagnóstico aplicable',
+  categoria: 'Monitoreo Preventivo',
+  riesgo: 'BAJO',
+  descripcion: 'No se encontraron condiciones críticas',
+  justificacion: 'La ausencia de indicadores críticos sugiere buena gestión ambiental',
+  acciones: ['Mantener monitoreo periódico', 'Continuar con buenas prácticas ambientales']
+};
 
 // Funciones
+async function cargarCatalogo() {
+  if (!catalogo) {
+    try {
+      catalogo = JSON.parse(localStorage.getItem(CLAVE_CATALOGO));
+    } catch (error) {
+      catalogo = null;
+    }
+  }
+  try {
+    // Si la versión guardada sigue vigente el servidor responde 304 sin cuerpo
+    const headers = catalogo ? { 'If-None-Match': `"${catalogo.version}"` } : {};
+    const res = await fetch('/reglas', { headers });
+    if (res.status === 304) return catalogo;
+    if (!res.ok) throw new Error('Error al cargar catálogo: ' + res.status);
+    catalogo = await res.json();
+    localStorage.setItem(CLAVE_CATALOGO, JSON.stringify(catalogo));
+  } catch (error) {
+    console.error('Error al cargar catálogo de reglas:', error);
+  }
+  return catalogo;
+}
+
+async function cargarTabla() {
+  if (!tablaReglas) {
+    try {
+      tablaReglas = JSON.parse(localStorage.getItem(CLAVE_TABLA));
+    } catch (error) {
+      tablaReglas = null;
+    }
+  }
+  try {
+    // Sin conexión se sigue usando la tabla guardada
+    const headers = tablaReglas ? { 'If-None-Match': tablaReglas.etag } : {};
+    const res = await fetch('/reglas/tabla', { headers });
+    if (res.status === 304) return tablaReglas;
+    if (!res.ok) throw new Error('Error al cargar la tabla de reglas: ' + res.status);
+    tablaReglas = { etag: res.headers.get('ETag'), datos: await res.json() };
+    codigosTabla = null;
+    localStorage.setItem(CLAVE_TABLA, JSON.stringify(tablaReglas));
+  } catch (error) {
+    console.warn('Tabla de reglas no actualizada:', error);
+  }
+  return tablaReglas;
+}
+
+// Regla ganadora para los hechos, leída de la tabla (null si ninguna se cumple)
+function diagnosticarLocal(hechosObservados) {
+  const datos = tablaReglas.datos;
+  if (!codigosTabla) {
+    const binario = atob(datos.tabla);
+    const bytes = new Uint8Array(binario.length);
+    for (let i = 0; i < binario.length; i++) bytes[i] = binario.charCodeAt(i);
+    codigosTabla = new DataView(bytes.buffer);
+  }
+  let mascara = 0;
+  datos.hechos.forEach((hecho, bit) => {
+    if (hechosObservados[hecho.id] === true) mascara += 2 ** bit;
+  });
+  const codigo = datos.bytes_por_entrada === 2
+    ? codigosTabla.getUint16(mascara * 2, true)
+    : codigosTabla.getUint8(mascara);
+  if (codigo === 0) return null;
+  const reglaId = datos.reglas[codigo - 1];
+  return { ...datos.textos[reglaId], id: reglaId };
+}
+
+function leerPendientes() {
+  try {
+    return JSON.parse(localStorage.getItem(CLAVE_PENDIENTES)) ?? [];
+  } catch (error) {
+    return [];
+  }
+}
+
+function encolarDiagnostico(pendiente) {
+  const pendientes = leerPendientes();
+  pendientes.push(pendiente);
+  localStorage.setItem(CLAVE_PENDIENTES, JSON.stringify(pendientes));
+}
+
+// Envía los diagnósticos pendientes por lotes; reenviar uno ya guardado no lo duplica
+function sincronizarPendientes() {
+  if (!sincronizando) {
+    sincronizando = (async () => {
+      try {
+        let pendientes = leerPendientes();
+        while (pendientes.length > 0) {
+          const lote = pendientes.slice(0, MAX_POR_SINCRONIZACION);
+          const res = await fetch('/diagnosticos/sincronizar', {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({ diagnosticos: lote })
+          });
+          if (!res.ok) throw new Error('Error al sincronizar: ' + res.status);
+          const { resultados } = await res.json();
+          for (const resultado of resultados) {
+            if (resultado.clave === claveDiagnostico) diagnosticoActualId = resultado.diagnostico_id;
+          }
+          // Se relee la cola: pudieron encolarse diagnósticos mientras tanto
+          const enviadas = new Set(lote.map(p => p.clave));
+          pendientes = leerPendientes().filter(p => !enviadas.has(p.clave));
+          localStorage.setItem(CLAVE_PENDIENTES, JSON.stringify(pendientes));
+        }
+      } catch (error) {
+        console.warn('Diagnósticos pendientes de sincronizar:', error);
+      } finally {
+        sincronizando = null;
+      }
+    })();
+  }
+  return sincronizando;
+}
+
+// Devuelve el texto de las reglas pedidas, recargando el catálogo si cambió de versión
+async function reglasDelCatalogo(reglaIds, version) {
+  if (!catalogo || catalogo.version !== version) await cargarCatalogo();
+  return reglaIds.map(id => catalogo?.reglas?.[id] ?? null);
+}
+
+function nuevaClave() {
+  if (window.crypto?.randomUUID) return crypto.randomUUID();
+  return Date.now().toString(36) + Math.random().toString(36).slice(2);
+}
+
+// Reintenta ante errores de red (no ante respuestas HTTP con error)
+async function fetchConReintentos(url, opciones, intentos = 3) {
+  for (let intento = 1; ; intento++) {
+    try {
+      return await fetch(url, opciones);
+    } catch (error) {
+      if (intento >= intentos) throw error;
+      await new Promise(r => setTimeout(r, 500 * intento));
+    }
+  }
+}
+
+function normalizarPreguntas(datos) {
+  // Normalizar distintos formatos que pueda devolver el backend
+  return datos.map(hecho => {
+    if (typeof hecho === 'string') {
+      return { id: hecho, pregunta: hecho };
+    }
+    // si es objeto, intentar obtener campos comunes
+    const id = hecho.id ?? hecho.key ?? hecho.codigo ?? hecho.name ?? JSON.stringify(hecho);
+    const pregunta = hecho.pregunta ?? hecho.texto ?? hecho.label ?? hecho.nombre ?? hecho.descripcion ?? JSON.stringify(hecho);
+    return { id, pregunta };
+  });
+}
+
 async function cargarPreguntas() {
   try {
     const res = await fetch('/hechos'); // usa ruta relativa al mismo server
     if (!res.ok) throw new Error('Error al cargar preguntas: ' + res.status);
     const datos = await res.json();
 
-    // Normalizar distintos formatos que pueda devolver el backend
-    preguntas = datos.map(hecho => {
-      if (typeof hecho === 'string') {
-        return { id: hecho, pregunta: hecho };
-      }
-      // si es objeto, intentar obtener campos comunes
-      const id = hecho.id ?? hecho.key ?? hecho.codigo ?? hecho.name ?? JSON.stringify(hecho);
-      const pregunta = hecho.pregunta ?? hecho.texto ?? hecho.label ?? hecho.nombre ?? hecho.descripcion ?? JSON.stringify(hecho);
-      return { id, pregunta };
-    });
+    preguntas = normalizarPreguntas(datos);
 
     if (preguntas.length === 0) {
       console.warn('No hay preguntas devueltas por /hechos');
@@ -30,10 +201,100 @@ async function cargarPreguntas() {
   }
 }
 
+// Abre una sesión por cuestionario. Resuelve con las preguntas que envía el
+// servidor al conectar, o con null si no hay WebSocket (se usará REST).
+function abrirSesion() {
+  cerrarSesion();
+  return new Promise(resolve => {
+    if (!('WebSocket' in window)) return resolve(null);
+
+    const protocolo = location.protocol === 'https:' ? 'wss:' : 'ws:';
+    let ws;
+    try {
+      ws = new WebSocket(`${protocolo}//${location.host}/ws/diagnostico`);
+    } catch (error) {
+      return resolve(null);
+    }
+
+    ws.onmessage = (evento) => {
+      const mensaje = JSON.parse(evento.data);
+      if (mensaje.tipo === 'preguntas') {
+        sesion = ws;
+        resolve(mensaje.preguntas);
+        return;
+      }
+      const pendiente = esperandoSesion[mensaje.tipo] ?? (mensaje.tipo === 'error' ? Object.values(esperandoSesion)[0] : null);
+      if (pendiente) {
+        esperandoSesion = {};
+        pendiente(mensaje);
+      }
+    };
+    ws.onerror = () => {
+      soltarSesion(ws);
+      resolve(null);
+    };
+    ws.onclose = () => {
+      soltarSesion(ws);
+      resolve(null);
+    };
+  });
+}
+
+// La conexión se cortó: quien esperaba respuesta sigue por REST
+function soltarSesion(ws) {
+  if (sesion !== ws) return;
+  sesion = null;
+  const pendientes = Object.values(esperandoSesion);
+  esperandoSesion = {};
+  pendientes.forEach(pendiente => pendiente({ tipo: 'error', detalle: 'Sesión cerrada', desconectado: true }));
+}
+
+function cerrarSesion() {
+  if (sesion) {
+    sesion.close();
+    sesion = null;
+  }
+  esperandoSesion = {};
+}
+
+// Envía un mensaje por la sesión y espera la respuesta del tipo indicado
+function pedirASesion(mensaje, tipoRespuesta) {
+  return new Promise((resolve, reject) => {
+    esperandoSesion[tipoRespuesta] = (respuesta) => {
+      if (respuesta.tipo === 'error') reject(Object.assign(new Error(respuesta.detalle), { desconectado: respuesta.desconectado === true }));
+      else resolve(respuesta);
+    };
+    sesion.send(JSON.stringify(mensaje));
+  });
+}
+
+// Pide por la sesión; si se corta antes de responder, usa la alternativa REST
+async function pedirASesionOREST(mensaje, tipoRespuesta, porREST) {
+  try {
+    return await pedirASesion(mensaje, tipoRespuesta);
+  } catch (error) {
+    if (!error.desconectado) throw error;
+    return porREST();
+  }
+}
+
 async function empezarDiagnostico() {
-  await cargarPreguntas();
+  // Con la tabla de reglas el cuestionario no necesita al servidor
+  if (await cargarTabla()) {
+    cerrarSesion();
+    preguntas = normalizarPreguntas(tablaReglas.datos.hechos);
+  } else {
+    const preguntasSesion = await abrirSesion();
+    if (preguntasSesion) {
+      preguntas = normalizarPreguntas(preguntasSesion);
+    } else {
+      await cargarPreguntas();
+    }
+  }
   hechos = {};
   indice = 0;
+  diagnosticoActualId = null;
+  claveDiagnostico = nuevaClave();
   mostrarPregunta();
   document.getElementById('inicio').classList.add('hidden');
   document.getElementById('cuestionario').classList.remove('hidden');
@@ -69,18 +330,26 @@ async function responder(respuesta) {
   const id = preguntas[indice].id;
   hechos[id] = respuesta;
   indice++;
+  // Con sesión abierta solo se envía el cambio; el servidor acumula los hechos
+  if (sesion) {
+    sesion.send(JSON.stringify({ tipo: 'respuesta', hecho: id, valor: respuesta }));
+  }
 if (indice < preguntas.length) {
     mostrarPregunta();
   } else {
     try {
-      const res = await fetch('/diagnosticar', {
-        method: 'POST',
-        headers: { 'Content-Type': 'application/json' },
-        body: JSON.stringify({ hechos })
-      });
-
-      if (!res.ok) throw new Error('Error en diagnóstico: ' + res.status);
-      const data = await res.json();
+      let data;
+      if (tablaReglas) {
+        // Respuesta inmediata; el diagnóstico se guarda en el servidor al sincronizar
+        const regla = diagnosticarLocal(hechos);
+        encolarDiagnostico({ clave: claveDiagnostico, hechos: { ...hechos }, regla_id: regla?.id ?? null });
+        sincronizarPendientes();
+        data = { diagnostico: regla };
+      } else if (sesion) {
+        data = await pedirASesionOREST({ tipo: 'finalizar' }, 'diagnostico', diagnosticarREST);
+      } else {
+        data = await diagnosticarREST();
+      }
       // esperar que el response_model devuelva { diagnostico: ... }
       const diagnostico = data.diagnostico ?? null;
       // Guardar el ID del diagnóstico para poder descargarlo
@@ -95,6 +364,19 @@ if (indice < preguntas.length) {
   }
 }
 
+async function diagnosticarREST() {
+  const res = await fetchConReintentos('/diagnosticar?compacto=true', {
+    method: 'POST',
+    headers: { 'Content-Type': 'application/json', 'Idempotency-Key': claveDiagnostico },
+    body: JSON.stringify({ hechos })
+  });
+
+  if (!res.ok) throw new Error('Error en diagnóstico: ' + res.status);
+  const compacto = await res.json();
+  const { regla_id, diagnostico_id } = compacto.diagnostico;
+  const [regla] = regla_id ? await reglasDelCatalogo([regla_id], compacto.version_catalogo) : [null];
+  return { diagnostico: { ...(regla ?? {}), diagnostico_id } };
+}
 
 function mostrarResultados(regla) {
   const cont = document.getElementById('resultado-contenido');
@@ -196,6 +478,7 @@ function nuevoDiagnostico() {
 }
 
 function volverInicio() {
+  cerrarSesion();
   ocultarTodasPantallas();
   document.getElementById('inicio').classList.remove('hidden');
 }
@@ -210,10 +493,15 @@ function anteriorPregunta() {
 
 async function cargarHistorial() {
   try {
-    const res = await fetch('/historial?limite=50');
+    const res = await fetch('/historial?limite=50&compacto=true');
     if (!res.ok) throw new Error('Error al cargar historial');
     const data = await res.json();
-    mostrarHistorial(data.historial);
+    const reglas = await reglasDelCatalogo(data.historial.map(d => d.regla_id), data.version_catalogo);
+    const historial = data.historial.map((fila, i) => ({
+      ...(fila.regla_id ? reglas[i] : SIN_DIAGNOSTICO),
+      ...fila
+    }));
+    mostrarHistorial(historial);
   } catch (error) {
     console.error('Error al cargar historial:', error);
     document.getElementById('historial-contenido').innerHTML = '<p class="error">Error al cargar el historial.</p>';
@@ -331,9 +619,10 @@ function ocultarTodasPantallas() {
   document.getElementById('diagnosticos-multiples')?.classList.add('hidden');
 }
 
-function descargarPDF() {
+async function descargarPDF() {
+  if (!diagnosticoActualId && claveDiagnostico) await sincronizarPendientes();
   if (!diagnosticoActualId) {
-    alert('No hay diagnóstico disponible para descargar.');
+    alert('El diagnóstico todavía no se guardó en el servidor. Se podrá descargar cuando vuelva la conexión.');
     return;
   }
   
@@ -352,14 +641,12 @@ async function verTodosDiagnosticos() {
   }
   
   try {
-    const res = await fetch('/diagnosticar-multiple', {
-      method: 'POST',
-      headers: { 'Content-Type': 'application/json' },
-      body: JSON.stringify({ hechos })
-    });
-    
-    if (!res.ok) throw new Error('Error al obtener diagnósticos múltiples');
-    const data = await res.json();
+    let data;
+    if (sesion) {
+      data = await pedirASesionOREST({ tipo: 'multiple' }, 'multiple', diagnosticarMultipleREST);
+    } else {
+      data = await diagnosticarMultipleREST();
+    }
     
     mostrarDiagnosticosMultiples(data.diagnosticos, data.total);
   } catch (error) {
@@ -368,6 +655,19 @@ async function verTodosDiagnosticos() {
   }
 }
 
+async function diagnosticarMultipleREST() {
+  const res = await fetch('/diagnosticar-multiple?compacto=true', {
+    method: 'POST',
+    headers: { 'Content-Type': 'application/json' },
+    body: JSON.stringify({ hechos })
+  });
+
+  if (!res.ok) throw new Error('Error al obtener diagnósticos múltiples');
+  const compacto = await res.json();
+  const diagnosticos = await reglasDelCatalogo(compacto.regla_ids, compacto.version_catalogo);
+  return { diagnosticos, total: compacto.total };
+}
+
 function mostrarDiagnosticosMultiples(diagnosticos, total) {
   const cont = document.getElementById('diagnosticos-multiples-contenido');
   
@@ -420,8 +720,12 @@ function volverAlResultado() {
   document.getElementById('resultados').classList.remove('hidden');
 }
 
+// Al volver la conexión se envían los diagnósticos hechos sin ella
+window.addEventListener('online', sincronizarPendientes);
+
 // Asignar eventos
 document.addEventListener('DOMContentLoaded', () => {
+  cargarTabla().then(sincronizarPendientes);
   document.getElementById('btn-comenzar')?.addEventListener('click', empezarDiagnostico);
   document.getElementById('btn-si')?.addEventListener('click', () => responder(true));
   document.getElementById('btn-no')?.addEventListener('click', () => responder(false));
@@ -0,0 +1,243 @@
+"""
+Diagnóstico por lotes de archivos de encuestas (sin pasar por la API)
+
+Lee un archivo CSV (una columna por hecho, valores 1/0, si/no, true/false)
+o NDJSON (un objeto por línea, con los hechos directamente o bajo la clave
+"hechos"), reparte bloques de líneas entre un pool de procesos que ejecutan
+el motor de inferencia y guarda los resultados con una escritura por bloque
+(una transacción en SQLite) en el motor de almacenamiento configurado.
+
+El archivo se lee de a bloques y nunca hay más de 2 bloques por proceso en
+vuelo, así que la memoria no crece con el tamaño del archivo. Cada proceso
+recibe la base de reglas una sola vez al iniciar y solo devuelve, por
+encuesta, el JSON de los hechos y el índice de la regla aplicada.
+
+Uso:
+
+    python lote.py encuestas.csv
+    python lote.py encuestas.ndjson --procesos 8 --bloque 20000 --inquilino norte
+    python lote.py encuestas.csv --almacen log
+
+Las celdas CSV no pueden contener saltos de línea (el archivo se divide por
+líneas).
+"""
+
+import argparse
+import csv
+import json
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+import database
+from almacenamiento import MOTORES, Almacen, crear_almacen
+from base_reglas import HECHOS_VALIDOS, BaseReglas
+from inquilinos import CacheBasesInquilinos
+from reglas import motor_inferencia
+from registros import Regla
+from serializacion import dumps
+
+FORMATOS = ("csv", "ndjson")
+VERDADEROS = frozenset({"1", "true", "t", "si", "sí", "s", "yes", "y", "x"})
+
+# Encuestas con las mismas respuestas se evalúan una sola vez por proceso;
+# la memoria de cada proceso queda acotada vaciando la caché al llenarse
+MAX_CACHE_RESPUESTAS = 65536
+
+# Estado de cada proceso del pool (se fija en _inicializar)
+_reglas: List[Regla] = []
+_indices: Dict[int, int] = {}
+_cache: Dict[tuple, Tuple[str, int]] = {}
+
+
+def _inicializar(reglas: List[Regla]) -> None:
+    global _reglas, _indices
+    _reglas = reglas
+    _indices = {id(regla): posicion for posicion, regla in enumerate(reglas)}
+
+
+def _evaluar(clave: tuple, hechos: Dict[str, Any]) -> Tuple[str, int]:
+    """JSON de los hechos e índice de la regla aplicada (-1 si ninguna)"""
+    resultado = _cache.get(clave)
+    if resultado is None:
+        regla = motor_inferencia(hechos, _reglas)
+        resultado = (dumps(hechos).decode("utf-8"), -1 if regla is None else _indices[id(regla)])
+        if len(_cache) >= MAX_CACHE_RESPUESTAS:
+            _cache.clear()
+        _cache[clave] = resultado
+    return resultado
+
+
+def _a_bool(valor: Any) -> bool:
+    if isinstance(valor, str):
+        return valor.strip().lower() in VERDADEROS
+    return bool(valor)
+
+
+def procesar_bloque(formato: str, columnas: Optional[Sequence[str]],
+                    lineas: List[str]) -> Tuple[List[Tuple[str, int]], int]:
+    """
+    Ejecuta el motor sobre un bloque de líneas (corre en los procesos del pool)
+
+    Args:
+        formato: "csv" o "ndjson"
+        columnas: Encabezado del CSV (None para NDJSON); las columnas que no son
+                  hechos (id, fecha...) se ignoran
+        lineas: Líneas del archivo
+
+    Returns:
+        Pares (hechos en JSON, índice de regla o -1) y cantidad de líneas inválidas
+    """
+    resultados = []
+    invalidas = 0
+    if formato == "csv":
+        hechos_csv = [(posicion, columna) for posicion, columna in enumerate(columnas) if columna in HECHOS_VALIDOS]
+        for fila in csv.reader(lineas):
+            if not fila:
+                continue
+            if len(fila) != len(columnas):
+                invalidas += 1
+                continue
+            valores = tuple(_a_bool(fila[posicion]) for posicion, _ in hechos_csv)
+            resultados.append(_evaluar(valores, {columna: valor for (_, columna), valor in zip(hechos_csv, valores)}))
+    else:
+        for linea in lineas:
+            if not linea.strip():
+                continue
+            try:
+                hechos = json.loads(linea)
+            except ValueError:
+                invalidas += 1
+                continue
+            if isinstance(hechos, dict) and isinstance(hechos.get("hechos"), dict):
+                hechos = hechos["hechos"]
+            if not isinstance(hechos, dict):
+                invalidas += 1
+                continue
+            # Igual que en CSV, las claves que no son hechos (id, fecha...) no se guardan
+            hechos = {hecho: _a_bool(valor) for hecho, valor in hechos.items() if hecho in HECHOS_VALIDOS}
+            resultados.append(_evaluar(tuple(hechos.items()), hechos))
+    return resultados, invalidas
+
+
+def leer_bloques(archivo, tamano: int) -> Iterator[List[str]]:
+    """Bloques de `tamano` líneas"""
+    bloque = []
+    for linea in archivo:
+        bloque.append(linea)
+        if len(bloque) >= tamano:
+            yield bloque
+            bloque = []
+    if bloque:
+        yield bloque
+
+
+def detectar_formato(ruta: str) -> str:
+    return "csv" if ruta.lower().endswith(".csv") else "ndjson"
+
+
+def procesar_archivo(ruta: str, formato: Optional[str] = None, procesos: Optional[int] = None,
+                     bloque: int = 20000, inquilino: str = '', base: Optional[BaseReglas] = None,
+                     mostrar_progreso: bool = True, almacen: Optional[Almacen] = None) -> Dict[str, Any]:
+    """
+    Diagnostica todas las encuestas del archivo y las guarda en la base de datos
+
+    Args:
+        ruta: Archivo CSV o NDJSON
+        formato: "csv" o "ndjson" (por defecto según la extensión)
+        procesos: Procesos del pool (por defecto uno por núcleo)
+        bloque: Líneas por bloque (y por transacción)
+        inquilino: Inquilino cuyas reglas se usan y al que pertenecen los diagnósticos
+        base: Base de reglas a usar (por defecto la del inquilino)
+        mostrar_progreso: Escribir el avance en stderr
+        almacen: Dónde guardar los diagnósticos (por defecto el motor de ALMACEN)
+
+    Returns:
+        Totales: encuestas, inválidas, segundos, encuestas por segundo, versión y conteo por regla
+    """
+    formato = formato or detectar_formato(ruta)
+    if formato not in FORMATOS:
+        raise ValueError(f"Formato desconocido: {formato}")
+    base = base or CacheBasesInquilinos().base_para(inquilino)
+    almacen = almacen or crear_almacen()
+    reglas = base.reglas
+    procesos = procesos or os.cpu_count() or 1
+
+    totales = {"encuestas": 0, "invalidas": 0}
+    por_regla = [0] * (len(reglas) + 1)
+    inicio = time.perf_counter()
+    ultimo_aviso = inicio
+
+    def guardar(resultados: List[Tuple[str, int]], invalidas: int) -> None:
+        almacen.guardar_lote(
+            ((hechos_json, reglas[indice] if indice >= 0 else None) for hechos_json, indice in resultados),
+            base.version, inquilino
+        )
+        for _, indice in resultados:
+            por_regla[indice] += 1
+        totales["encuestas"] += len(resultados)
+        totales["invalidas"] += invalidas
+
+    with open(ruta, encoding="utf-8", newline="") as archivo:
+        columnas = None
+        if formato == "csv":
+            columnas = [columna.strip() for columna in next(csv.reader([archivo.readline()]), [])]
+        with ProcessPoolExecutor(procesos, initializer=_inicializar, initargs=(reglas,)) as pool:
+            pendientes = deque()
+            for lineas in leer_bloques(archivo, bloque):
+                pendientes.append(pool.submit(procesar_bloque, formato, columnas, lineas))
+                # Ventana acotada: se lee el siguiente bloque solo cuando hay lugar
+                while len(pendientes) >= 2 * procesos:
+                    guardar(*pendientes.popleft().result())
+                ahora = time.perf_counter()
+                if mostrar_progreso and ahora - ultimo_aviso >= 1.0:
+                    ultimo_aviso = ahora
+                    print(f"  {totales['encuestas']:>12,} encuestas  "
+                          f"{totales['encuestas'] / (ahora - inicio):>10,.0f}/s", file=sys.stderr)
+            while pendientes:
+                guardar(*pendientes.popleft().result())
+
+    segundos = time.perf_counter() - inicio
+    return {
+        "encuestas": totales["encuestas"],
+        "invalidas": totales["invalidas"],
+        "segundos": round(segundos, 3),
+        "por_segundo": round(totales["encuestas"] / segundos) if segundos else 0,
+        "version_reglas": base.version,
+        # La última posición cuenta las encuestas sin regla aplicable (índice -1)
+        "por_regla": {
+            (reglas[indice]["id"] if indice < len(reglas) else None): cantidad
+            for indice, cantidad in enumerate(por_regla)
+            if cantidad
+        },
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Diagnóstico por lotes de archivos de encuestas")
+    parser.add_argument("ruta", help="Archivo .csv o .ndjson")
+    parser.add_argument("--formato", choices=FORMATOS, help="Por defecto según la extensión")
+    parser.add_argument("--procesos", type=int, help="Procesos del pool (por defecto uno por núcleo)")
+    parser.add_argument("--bloque", type=int, default=20000, help="Encuestas por bloque y por transacción")
+    parser.add_argument("--inquilino", default="", help="Usar las reglas y los datos de este inquilino")
+    parser.add_argument("--db", help="Base de datos SQLite (por defecto la de la API)")
+    parser.add_argument("--almacen", choices=MOTORES, help="Motor de almacenamiento (por defecto ALMACEN o sqlite)")
+    parser.add_argument("--ruta-log", help="Archivo del motor log (por defecto ALMACEN_RUTA)")
+    args = parser.parse_args()
+
+    if args.db:
+        database.DATABASE_NAME = args.db
+    database.init_database()
+    almacen = crear_almacen(args.almacen, args.ruta_log)
+    try:
+        resumen = procesar_archivo(args.ruta, args.formato, args.procesos, args.bloque, args.inquilino,
+                                   almacen=almacen)
+    finally:
+        almacen.cerrar()
+    print(f"{resumen['encuestas']:,} encuestas en {resumen['segundos']:.1f} s "
+          f"({resumen['por_segundo']:,}/s), {resumen['invalidas']} líneas inválidas")
+    for regla_id, cantidad in sorted(resumen["por_regla"].items(), key=lambda par: -par[1]):
+        print(f"  {regla_id or 'sin diagnóstico':<16}{cantidad:>12,}")
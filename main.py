@@ -1,16 +1,72 @@
-from fastapi import FastAPI, Request, Query
+from fastapi import FastAPI, Request, Query, Header, Depends, HTTPException, WebSocket, WebSocketDisconnect
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import Response
-from reglas import motor_inferencia, motor_inferencia_multiple, HECHOS_OBSERVABLES
-from modelos import HechosRequest, DiagnosticoResponse, DiagnosticoMultipleRequest, DiagnosticoMultipleResponse
-from database import guardar_diagnostico, obtener_historial, obtener_diagnostico_por_id, obtener_estadisticas
+from fastapi.responses import Response, StreamingResponse, JSONResponse
+from fastapi.encoders import jsonable_encoder
+from fastapi.exceptions import RequestValidationError
+from starlette.concurrency import run_in_threadpool
+from reglas import HECHOS_OBSERVABLES
+from certeza import UMBRAL_MYCIN
+from sensibilidad import DemasiadosHechos
+from base_reglas import BaseReglas, base_vigente, recargar, VigilanteArchivo
+from inquilinos import CacheBasesInquilinos, InquilinoDesconocido, InquilinoEnRuta
+from admision import ControlAdmision, MiddlewareAdmision
+from trazas import EscritorTrazas, MiddlewareTrazas, inicio_validacion, registrar_tramo, tramo
+from modelos import (
+    HechosRequest, DiagnosticoResponse, DiagnosticoMultipleRequest, DiagnosticoMultipleResponse,
+    HechosParcialesRequest, DiagnosticoParcialResponse,
+    HechosCertezaRequest, LoteCertezaRequest, DiagnosticoCertezaResponse, LoteCertezaResponse,
+    LoteTelemetriaRequest, TelemetriaResponse, SensibilidadRequest, SensibilidadResponse,
+    SincronizacionRequest, SincronizacionResponse,
+)
+from database import registrar_observador, obtener_cambios_estado, cache_diagnosticos, ClaveIdempotenciaUsada
+from almacenamiento import crear_almacen
+from retencion import FORMATO_FECHA, normalizar_fecha, tarea_configurada
+import respaldo
+from idempotencia import CacheIdempotencia
+from eventos import Difusor
+from telemetria import ProcesadorTelemetria
+from estaticos import Activo, construir_activos, CACHE_INMUTABLE
+from serializacion import respuesta_negociada, dumps
+from registros import Regla
 from pdf_generator import generar_pdf_diagnostico, generar_pdf_historial
-from typing import Optional
-from datetime import datetime
+from sincronizacion import MAX_SINCRONIZACION, sincronizar
+from exportacion import MAX_EXPORTACION, RegistroExportaciones, cerrar_pool, diagnosticos_a_exportar, generar_zip
+from typing import Optional, Dict, Any, List, Tuple
+from datetime import datetime, timedelta, timezone
+from contextlib import asynccontextmanager
+import json
+import math
+
+@asynccontextmanager
+async def ciclo_de_vida(app: FastAPI):
+    # Recargar las reglas cuando cambie el archivo externo
+    vigilante = VigilanteArchivo()
+    vigilante.iniciar()
+    # Archivar los diagnósticos antiguos si RETENCION_DIAS está configurado
+    retencion = tarea_configurada()
+    if retencion is not None:
+        retencion.iniciar()
+    # Respaldos en caliente cada RESPALDO_INTERVALO segundos (si está configurado)
+    respaldos.iniciar()
+    yield
+    respaldos.detener()
+    vigilante.detener()
+    if retencion is not None:
+        retencion.detener()
+    # Al apagar, escribir las lecturas de telemetría pendientes
+    telemetria.vaciar()
+    escritor_trazas.cerrar()
+    almacen.cerrar()
+    cerrar_pool()
+
+app = FastAPI(title="Sistema Experto Ambiental", lifespan=ciclo_de_vida)
 
-app = FastAPI(title="Sistema Experto Ambiental")
+# Límites de concurrencia y tasa por clase de endpoint (PDF, lotes, inferencia).
+# Queda dentro de CORS para que los rechazos también lleven sus encabezados.
+control_admision = ControlAdmision()
+app.add_middleware(MiddlewareAdmision, control=control_admision)
 
 # Configurar CORS
 app.add_middleware(
@@ -21,75 +77,390 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Trazas por etapa (muestreo con TRAZAS_MUESTREO o traceparent); dentro de
+# InquilinoEnRuta para ver la ruta ya resuelta
+escritor_trazas = EscritorTrazas()
+app.add_middleware(MiddlewareTrazas, escritor=escritor_trazas)
+
+# El inquilino también se puede indicar con el prefijo /inquilinos/<inquilino>/
+app.add_middleware(InquilinoEnRuta)
+
+@app.exception_handler(RequestValidationError)
+async def error_de_validacion(request: Request, exc: RequestValidationError):
+    """
+    Como el de FastAPI, pero un NaN o infinito recibido (por ejemplo, una
+    lectura de telemetría) vuelve como texto: JSON no los admite y la
+    respuesta 422 terminaría en un error 500
+    """
+    finito = {float: lambda valor: valor if math.isfinite(valor) else str(valor)}
+    return JSONResponse(status_code=422, content={"detail": jsonable_encoder(exc.errors(), custom_encoder=finito)})
+
 # Servir archivos estáticos y plantillas
 templates = Jinja2Templates(directory="interfaz/templates")
 app.mount("/static", StaticFiles(directory="interfaz/static"), name="static")
 
+# Activos minificados, con huella y precomprimidos, construidos al iniciar
+ACTIVOS = construir_activos("interfaz/static")
+ACTIVOS_POR_NOMBRE = {activo.nombre: activo for activo in ACTIVOS.values()}
+PAGINA_PRINCIPAL = Activo(
+    "index.html",
+    templates.get_template("index.html").render(
+        activos={original: f"/activos/{activo.nombre}" for original, activo in ACTIVOS.items()}
+    ).encode("utf-8"),
+    "text/html; charset=utf-8",
+)
+
+def responder_activo(request: Request, activo: Activo, cache_control: str) -> Response:
+    """Sirve un activo en memoria con la mejor compresión aceptada y el ETag de esa codificación"""
+    cuerpo, codificacion = activo.cuerpo_para(request.headers.get("accept-encoding"))
+    etag = activo.etag(codificacion)
+    headers = {"ETag": etag, "Cache-Control": cache_control, "Vary": "Accept-Encoding"}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    
+    if codificacion:
+        headers["Content-Encoding"] = codificacion
+    return Response(content=cuerpo, media_type=activo.media_type, headers=headers)
+
+# Respuestas recientes por Idempotency-Key (los reintentos no vuelven a insertar)
+cache_idempotencia = CacheIdempotencia(max_entradas=10000, ttl_segundos=600)
+
+# Motor de almacenamiento de diagnósticos (ALMACEN: sqlite, memoria o log)
+almacen = crear_almacen()
+
+# Respaldos en caliente de la base de datos (POST /respaldos o RESPALDO_INTERVALO)
+respaldos = respaldo.tarea_configurada()
+
+# Avance de las exportaciones masivas de PDF (/exportaciones/{id})
+exportaciones = RegistroExportaciones()
+
+# Difusión de diagnósticos guardados hacia /eventos
+difusor = Difusor(capacidad_cola=100, tamano_historial=1000)
+registrar_observador(difusor.publicar)
+
+# Bases de reglas compiladas por inquilino (LRU acotada)
+bases_inquilinos = CacheBasesInquilinos()
+
+INQUILINO = Header(None, alias="X-Inquilino", description="Inquilino (municipio); sin él se usa la base global")
+
+def rango_fechas(
+    desde: Optional[str] = Query(None, description="Desde esta fecha (inclusive), YYYY-MM-DD[ HH:MM:SS]"),
+    hasta: Optional[str] = Query(None, description="Hasta esta fecha (exclusive)"),
+) -> Tuple[Optional[str], Optional[str]]:
+    """Rango de fechas normalizado al formato guardado, o 422 si no es una fecha"""
+    try:
+        return (normalizar_fecha(desde) if desde else None, normalizar_fecha(hasta) if hasta else None)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=f"Fecha inválida: {e}")
+
+def base_del_inquilino(inquilino: Optional[str]) -> BaseReglas:
+    """Base de reglas del inquilino, o 404 si no tiene reglas propias"""
+    try:
+        return bases_inquilinos.base_para(inquilino)
+    except InquilinoDesconocido:
+        raise HTTPException(status_code=404, detail=f"Inquilino desconocido: {inquilino}")
+
+async def base_del_inquilino_async(inquilino: Optional[str]) -> BaseReglas:
+    """
+    Igual que base_del_inquilino para endpoints async: si la base no está
+    compilada se compila en el pool de hilos, sin frenar el bucle de eventos
+    """
+    base = bases_inquilinos.cargada(inquilino)
+    if base is None:
+        base = await run_in_threadpool(base_del_inquilino, inquilino)
+    return base
+
+# Ventanas deslizantes de telemetría; las lecturas se escriben por bloques
+telemetria = ProcesadorTelemetria()
+
 @app.get("/")
 async def pagina_principal(request: Request):
-    return templates.TemplateResponse("index.html", {"request": request})
+    # El cliente revalida siempre, pero si no cambió recibe un 304 sin cuerpo
+    return responder_activo(request, PAGINA_PRINCIPAL, "no-cache")
+
+@app.get("/activos/{nombre}")
+async def obtener_activo(nombre: str, request: Request):
+    """
+    Sirve un archivo estático con huella (caché inmutable de un año)
+    """
+    activo = ACTIVOS_POR_NOMBRE.get(nombre)
+    if activo is None:
+        return Response(status_code=404)
+    return responder_activo(request, activo, CACHE_INMUTABLE)
 
 @app.get("/hechos")
 async def obtener_hechos():
     return list(HECHOS_OBSERVABLES)
 
-@app.post("/diagnosticar", response_model=DiagnosticoResponse)
-def diagnosticar(hechos_req: HechosRequest):
-    resultado = motor_inferencia(hechos_req.hechos)
+def diagnosticar_y_guardar(hechos: Dict[str, bool], clave_idempotencia: Optional[str] = None,
+                           base: Optional[BaseReglas] = None,
+                           inquilino: Optional[str] = None) -> Tuple[Optional[Regla], int]:
+    """
+    Ejecuta el motor de inferencia y guarda el diagnóstico (compartido por
+    /diagnosticar y la sesión WebSocket)
     
-    # Guardar diagnóstico en la base de datos
-    diagnostico_id = guardar_diagnostico(hechos_req.hechos, resultado)
+    Returns:
+        La regla aplicada (compartida, sin copiar) o None, y el ID del diagnóstico
+    """
+    base = base or base_vigente()
+    with tramo("motor_inferencia", reglas=len(base.reglas)):
+        resultado = base.diagnosticar(hechos)
     
-    # Agregar el ID del diagnóstico al resultado
-    response_data = {"diagnostico": resultado}
-    if resultado:
-        resultado["diagnostico_id"] = diagnostico_id
+    # Guardar diagnóstico en la base de datos, con la versión de las reglas usadas
+    with tramo("guardar_diagnostico"):
+        diagnostico_id = almacen.guardar(hechos, resultado, clave_idempotencia, base.version, inquilino or '')
+    return resultado, diagnostico_id
+
+def respuesta_diagnostico(resultado: Optional[Regla], diagnostico_id: int) -> Dict[str, Any]:
+    """
+    Respuesta de /diagnosticar como diccionario: solo se arma cuando no se
+    puede usar el JSON precalculado (MessagePack)
+    """
+    if resultado is None:
+        return {"diagnostico": {"diagnostico_id": diagnostico_id}}
+    return {"diagnostico": dict(resultado, diagnostico_id=diagnostico_id)}
+
+COMPACTO = Query(False, description="Devolver solo IDs de reglas (el texto se obtiene de /reglas)")
+
+@app.get("/reglas")
+async def obtener_catalogo_reglas(request: Request, inquilino: Optional[str] = INQUILINO):
+    """
+    Catálogo versionado de reglas (títulos, descripciones, acciones...).
+    Las respuestas en modo compacto solo traen regla_id y la versión del catálogo.
+    """
+    serializado = (await base_del_inquilino_async(inquilino)).serializado
+    etag = f'"{serializado.version}"'
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    return respuesta_negociada(request, serializado.datos, serializado.json, headers=headers)
+
+@app.get("/reglas/tabla")
+async def obtener_tabla_reglas(request: Request, inquilino: Optional[str] = INQUILINO):
+    """
+    Base de reglas compilada para diagnosticar en el navegador sin conexión:
+    regla ganadora de cada combinación de hechos, preguntas y textos de las reglas
+    """
+    base = await base_del_inquilino_async(inquilino)
+    try:
+        # La primera vez se arma la tabla (2^F entradas): fuera del bucle de eventos
+        cliente = base.cliente if base.tablas_armadas else await run_in_threadpool(lambda: base.cliente)
+    except DemasiadosHechos as e:
+        return JSONResponse(status_code=501, content={"error": str(e)})
+    headers = {"ETag": cliente.etag, "Cache-Control": "no-cache"}
+    if request.headers.get("if-none-match") == cliente.etag:
+        return Response(status_code=304, headers=headers)
+    return respuesta_negociada(request, cliente.datos, cliente.json, headers=headers)
+
+@app.post("/reglas/recargar")
+def recargar_reglas(inquilino: Optional[str] = INQUILINO):
+    """
+    Vuelve a leer el archivo de reglas (el global o el del inquilino), lo
+    valida, lo compila y lo publica. Las peticiones en curso terminan con la
+    versión anterior. Si el archivo no es válido se mantiene la base vigente
+    y se devuelve 422.
+    """
+    try:
+        if not inquilino:
+            return recargar()
+        anterior = base_del_inquilino(inquilino)
+        nueva = bases_inquilinos.recargar(inquilino)
+        return {"version": nueva.version, "anterior": anterior.version, "reglas": len(nueva.reglas),
+                "origen": nueva.origen}
+    except (ValueError, OSError) as e:
+        vigente = base_del_inquilino(inquilino).version
+        return JSONResponse(status_code=422, content={"error": str(e), "version": vigente})
+
+@app.get("/reglas/analisis")
+def analisis_reglas(inquilino: Optional[str] = INQUILINO):
+    """
+    Análisis estático de la base de reglas: reglas inalcanzables, reglas
+    sombreadas por otras de mayor prioridad, solapamientos y cobertura.
+    Se calcula una vez por base; si no entra en el máximo de nodos el
+    resultado es parcial (completo = false) en lugar de un error.
+    """
+    return base_del_inquilino(inquilino).analizar()
+
+@app.get("/respaldos")
+async def estado_respaldos():
+    """
+    Respaldo en curso (páginas copiadas), el último hecho y los disponibles
+    """
+    return respaldos.estado()
+
+@app.post("/respaldos", status_code=202)
+async def lanzar_respaldo():
+    """
+    Empieza un respaldo en caliente de la base de datos en segundo plano.
+    Responde 409 si ya hay uno en curso.
+    """
+    if not respaldos.lanzar():
+        return JSONResponse(status_code=409, content={"error": "Ya hay un respaldo en curso",
+                                                      **respaldos.estado()})
+    return respaldos.estado()
+
+@app.get("/reglas/inquilinos")
+async def estado_inquilinos():
+    """
+    Ocupación y aciertos de la caché de bases de reglas por inquilino
+    """
+    return bases_inquilinos.estadisticas()
+
+@app.get("/diagnosticos/cache")
+async def estado_cache_diagnosticos():
+    """
+    Ocupación (entradas y bytes estimados), aciertos y fallos de la caché de diagnósticos
+    """
+    return cache_diagnosticos().estadisticas()
+
+@app.get("/admision")
+async def estado_admision():
+    """
+    Límites, peticiones en curso y rechazos (429/503) por clase de endpoint
+    """
+    return control_admision.estadisticas()
+
+def respuesta_guardada(clave: str, inquilino: str = '') -> Optional[Dict[str, Any]]:
+    """
+    Busca un diagnóstico ya hecho con la misma Idempotency-Key: primero en
+    memoria y, si no está, por el índice único de la BD
+    
+    Returns:
+        {"hechos": ..., "resultado": ..., "diagnostico_id": ...} o None si la clave es nueva
+    """
+    previa = cache_idempotencia.obtener((inquilino, clave))
+    if previa is None:
+        registro = almacen.buscar_por_clave(clave, inquilino)
+        if registro is None:
+            return None
+        resultado = None
+        if registro["regla_id"]:
+            resultado = Regla(
+                id=registro["regla_id"],
+                titulo=registro["titulo"],
+                categoria=registro["categoria"],
+                riesgo=registro["riesgo"],
+                descripcion=registro["descripcion"],
+                justificacion=registro["justificacion"],
+                acciones=registro["acciones"],
+            )
+        previa = {"hechos": registro["hechos"], "resultado": resultado, "diagnostico_id": registro["id"]}
+        cache_idempotencia.guardar((inquilino, clave), previa)
+    return previa
+
+@app.post("/diagnosticar", response_model=DiagnosticoResponse)
+def diagnosticar(
+    hechos_req: HechosRequest,
+    request: Request,
+    compacto: bool = COMPACTO,
+    idempotency_key: Optional[str] = Header(None, max_length=200),
+    inquilino: Optional[str] = INQUILINO,
+    validacion: Optional[int] = Depends(inicio_validacion)
+):
+    registrar_tramo("validacion", validacion)
+    headers = {}
+    base = base_del_inquilino(inquilino)
+    inquilino = inquilino or ''
+    with tramo("idempotencia"):
+        previa = respuesta_guardada(idempotency_key, inquilino) if idempotency_key else None
+    if previa is not None:
+        if previa["hechos"] != hechos_req.hechos:
+            return JSONResponse(status_code=409, content={"error": "La Idempotency-Key ya se usó con otros hechos"})
+        resultado, diagnostico_id = previa["resultado"], previa["diagnostico_id"]
+        headers["Idempotent-Replayed"] = "true"
     else:
-        response_data["diagnostico"] = {"diagnostico_id": diagnostico_id}
+        try:
+            resultado, diagnostico_id = diagnosticar_y_guardar(hechos_req.hechos, idempotency_key, base, inquilino)
+        except ClaveIdempotenciaUsada:
+            # Otra petición con la misma clave se guardó entre la búsqueda y el INSERT
+            return JSONResponse(status_code=409, content={"error": "La Idempotency-Key ya se usó con otros hechos"})
+        if idempotency_key:
+            cache_idempotencia.guardar((inquilino, idempotency_key), {
+                "hechos": hechos_req.hechos, "resultado": resultado, "diagnostico_id": diagnostico_id
+            })
     
-    return response_data
+    with tramo("serializacion", compacto=compacto):
+        if compacto:
+            return respuesta_negociada(request, {
+                "diagnostico": {"regla_id": None if resultado is None else resultado["id"],
+                                "diagnostico_id": diagnostico_id},
+                "version_catalogo": base.version,
+                "hechos": hechos_req.hechos,
+            }, headers=headers)
+        # Sin regla aplicable el diagnóstico solo contiene diagnostico_id
+        return respuesta_negociada(request, lambda: respuesta_diagnostico(resultado, diagnostico_id),
+                                   base.serializado.json_diagnostico(resultado, diagnostico_id),
+                                   headers=headers)
 
 @app.get("/historial")
 async def obtener_historial_diagnosticos(
+    request: Request,
     limite: int = Query(50, ge=1, le=100, description="Número de diagnósticos a obtener"),
-    offset: int = Query(0, ge=0, description="Número de diagnósticos a saltar")
+    offset: int = Query(0, ge=0, description="Número de diagnósticos a saltar"),
+    compacto: bool = COMPACTO,
+    inquilino: Optional[str] = INQUILINO,
+    rango: Tuple[Optional[str], Optional[str]] = Depends(rango_fechas)
 ):
     """
-    Obtiene el historial de diagnósticos realizados
+    Obtiene el historial de diagnósticos realizados (opcionalmente entre dos fechas)
     """
-    historial = obtener_historial(limite=limite, offset=offset)
-    return {"historial": historial, "total": len(historial)}
+    base = await base_del_inquilino_async(inquilino)
+    historial = almacen.historial(limite, offset, inquilino or '', *rango)
+    if compacto:
+        return respuesta_negociada(request, {
+            "historial": [
+                {"id": d["id"], "fecha": d["fecha"], "regla_id": d["regla_id"], "hechos": d["hechos"]}
+                for d in historial
+            ],
+            "total": len(historial),
+            "version_catalogo": base.version,
+        })
+    return respuesta_negociada(request, {"historial": historial, "total": len(historial)})
 
 @app.get("/diagnostico/{diagnostico_id}")
-async def obtener_diagnostico(diagnostico_id: int):
+async def obtener_diagnostico(diagnostico_id: int, inquilino: Optional[str] = INQUILINO):
     """
     Obtiene un diagnóstico específico por su ID
     """
-    diagnostico = obtener_diagnostico_por_id(diagnostico_id)
+    await base_del_inquilino_async(inquilino)
+    diagnostico = almacen.obtener(diagnostico_id, inquilino or '')
     if diagnostico:
         return diagnostico
     return {"error": "Diagnóstico no encontrado"}
 
 @app.get("/estadisticas")
-async def obtener_estadisticas_diagnosticos():
+async def obtener_estadisticas_diagnosticos(inquilino: Optional[str] = INQUILINO,
+                                            rango: Tuple[Optional[str], Optional[str]] = Depends(rango_fechas)):
     """
-    Obtiene estadísticas generales de los diagnósticos
+    Obtiene estadísticas generales de los diagnósticos (opcionalmente entre dos fechas)
     """
-    stats = obtener_estadisticas()
+    await base_del_inquilino_async(inquilino)
+    stats = almacen.estadisticas(inquilino or '', *rango)
     return stats
 
+@app.get("/analitica/coocurrencia")
+async def analitica_coocurrencia(inquilino: Optional[str] = INQUILINO):
+    """
+    Qué hechos aparecen juntos y con qué reglas: conteos, probabilidades
+    condicionales y lift (de matrices que se actualizan al guardar, no del historial)
+    """
+    await base_del_inquilino_async(inquilino)
+    return almacen.coocurrencias(inquilino or '')
+
 @app.get("/descargar-pdf/{diagnostico_id}")
-async def descargar_pdf_diagnostico(diagnostico_id: int):
+def descargar_pdf_diagnostico(diagnostico_id: int, inquilino: Optional[str] = INQUILINO):
     """
     Genera y descarga un PDF con el diagnóstico específico
+    (función síncrona: el PDF se genera en el pool de hilos, sin bloquear el bucle de eventos)
     """
-    diagnostico = obtener_diagnostico_por_id(diagnostico_id)
+    base_del_inquilino(inquilino)
+    diagnostico = almacen.obtener(diagnostico_id, inquilino or '')
     
     if not diagnostico:
         return {"error": "Diagnóstico no encontrado"}
     
-    # Extraer hechos del diagnóstico
-    hechos = diagnostico.pop('hechos', {})
+    # Hechos del diagnóstico
+    hechos = diagnostico['hechos']
     
     # Generar PDF
     pdf_bytes = generar_pdf_diagnostico(diagnostico, hechos)
@@ -107,13 +478,17 @@ async def descargar_pdf_diagnostico(diagnostico_id: int):
     )
 
 @app.get("/descargar-historial-pdf")
-async def descargar_historial_pdf(
-    limite: int = Query(50, ge=1, le=100, description="Número de diagnósticos a incluir")
+def descargar_historial_pdf(
+    limite: int = Query(50, ge=1, le=100, description="Número de diagnósticos a incluir"),
+    inquilino: Optional[str] = INQUILINO,
+    rango: Tuple[Optional[str], Optional[str]] = Depends(rango_fechas)
 ):
     """
     Genera y descarga un PDF con el historial de diagnósticos
+    (función síncrona: el PDF se genera en el pool de hilos, sin bloquear el bucle de eventos)
     """
-    historial = obtener_historial(limite=limite, offset=0)
+    base_del_inquilino(inquilino)
+    historial = almacen.historial(limite, 0, inquilino or '', *rango)
     
     if not historial:
         return {"error": "No hay diagnósticos en el historial"}
@@ -133,18 +508,336 @@ async def descargar_historial_pdf(
         }
     )
 
+@app.get("/exportar-pdf")
+def exportar_pdf(
+    ids: Optional[List[int]] = Query(None, description="IDs puntuales (?ids=1&ids=2); sin ids, el rango de fechas"),
+    inquilino: Optional[str] = INQUILINO,
+    rango: Tuple[Optional[str], Optional[str]] = Depends(rango_fechas)
+):
+    """
+    Descarga un ZIP con el PDF de cada diagnóstico pedido (por IDs o por
+    rango de fechas). Los PDF se generan en un pool de procesos y el ZIP se
+    envía mientras se generan; el avance se consulta en /exportaciones/{id}
+    con el id del encabezado X-Exportacion-Id.
+    """
+    base_del_inquilino(inquilino)
+    inquilino = inquilino or ''
+    desde, hasta = rango
+    if ids is not None:
+        total = len(ids)
+    else:
+        # Hasta queda fijo (incluye el segundo actual): los diagnósticos nuevos no corren las páginas
+        hasta = hasta or (datetime.now(timezone.utc) + timedelta(seconds=1)).strftime(FORMATO_FECHA)
+        total = almacen.estadisticas(inquilino, desde, hasta)["total"]
+    
+    if not total:
+        return {"error": "No hay diagnósticos para exportar"}
+    if total > MAX_EXPORTACION:
+        return JSONResponse(status_code=422, content={
+            "error": f"La exportación tiene {total} diagnósticos; el máximo es {MAX_EXPORTACION}"})
+    
+    progreso = exportaciones.nueva(total)
+    diagnosticos = diagnosticos_a_exportar(almacen, inquilino, ids, desde, hasta, progreso)
+    fecha = datetime.now().strftime("%Y%m%d_%H%M%S")
+    return StreamingResponse(
+        generar_zip(diagnosticos, progreso),
+        media_type="application/zip",
+        headers={
+            "Content-Disposition": f"attachment; filename=diagnosticos_{fecha}.zip",
+            "X-Exportacion-Id": progreso.id,
+        }
+    )
+
+@app.get("/exportaciones/{exportacion_id}")
+async def estado_exportacion(exportacion_id: str):
+    """
+    Avance de una exportación masiva: PDF generados sobre el total, bytes enviados y estado
+    """
+    progreso = exportaciones.obtener(exportacion_id)
+    if progreso is None:
+        raise HTTPException(status_code=404, detail="Exportación desconocida")
+    return progreso.a_dict()
+
 @app.post("/diagnosticar-multiple", response_model=DiagnosticoMultipleResponse)
-def diagnosticar_multiple(hechos_req: DiagnosticoMultipleRequest):
+def diagnosticar_multiple(hechos_req: DiagnosticoMultipleRequest, request: Request, compacto: bool = COMPACTO,
+                          inquilino: Optional[str] = INQUILINO):
     """
     Realiza un diagnóstico devolviendo TODAS las reglas que se cumplen,
     ordenadas por nivel de riesgo (ALTO > MEDIO > BAJO)
     """
-    resultados = motor_inferencia_multiple(hechos_req.hechos)
+    base = base_del_inquilino(inquilino)
+    resultados = base.diagnosticar_multiple(hechos_req.hechos)
     
     # No guardamos en BD porque puede ser exploratorio
     # El usuario puede hacer diagnóstico normal si quiere guardar
     
-    return {
-        "diagnosticos": resultados,
-        "total": len(resultados)
-    }
\ No newline at end of file
+    if compacto:
+        return respuesta_negociada(request, {
+            "regla_ids": [r["id"] for r in resultados],
+            "total": len(resultados),
+            "version_catalogo": base.version,
+            "hechos": hechos_req.hechos,
+        })
+    
+    return respuesta_negociada(
+        request,
+        {"diagnosticos": resultados, "total": len(resultados)},
+        base.serializado.json_diagnosticos(resultados)
+    )
+
+@app.post("/diagnosticar-parcial", response_model=DiagnosticoParcialResponse)
+def diagnosticar_parcial(hechos_req: HechosParcialesRequest, inquilino: Optional[str] = INQUILINO):
+    """
+    Evalúa un conjunto incompleto de hechos (verdadero / falso / desconocido).
+    Pensado para consultas mientras se completa el cuestionario o para
+    lecturas de sensores con huecos. No se guarda en la BD.
+    """
+    return base_del_inquilino(inquilino).diagnosticar_parcial(hechos_req.hechos)
+
+
+UMBRAL = Query(UMBRAL_MYCIN, ge=0.0, lt=1.0,
+               description="La premisa debe superar este valor (exclusivo) para disparar una regla")
+
+@app.post("/diagnosticar-certeza", response_model=DiagnosticoCertezaResponse)
+def diagnosticar_certeza(hechos_req: HechosCertezaRequest, umbral: float = UMBRAL,
+                         inquilino: Optional[str] = INQUILINO):
+    """
+    Diagnóstico con factores de certeza: cada hecho es una confianza entre 0 y 1.
+    Devuelve las reglas disparadas ordenadas por certeza. No se guarda en la BD.
+    Un hecho que no es de la base da 422.
+    """
+    try:
+        resultados = base_del_inquilino(inquilino).certeza.diagnosticar_lote([hechos_req.hechos], umbral)[0]
+    except ValueError as e:
+        return JSONResponse(status_code=422, content={"error": str(e)})
+    return {"diagnosticos": resultados, "total": len(resultados)}
+
+@app.post("/diagnosticar-certeza-lote", response_model=LoteCertezaResponse)
+def diagnosticar_certeza_lote(lote_req: LoteCertezaRequest, umbral: float = UMBRAL,
+                              inquilino: Optional[str] = INQUILINO):
+    """
+    Igual que /diagnosticar-certeza para un lote de observaciones, puntuadas
+    todas juntas en una sola operación de matrices
+    """
+    try:
+        resultados = base_del_inquilino(inquilino).certeza.diagnosticar_lote(lote_req.lote, umbral)
+    except ValueError as e:
+        return JSONResponse(status_code=422, content={"error": str(e)})
+    return {"resultados": [{"diagnosticos": r, "total": len(r)} for r in resultados]}
+
+@app.post("/diagnosticos/sincronizar", response_model=SincronizacionResponse)
+def sincronizar_diagnosticos(sincronizacion_req: SincronizacionRequest, inquilino: Optional[str] = INQUILINO):
+    """
+    Guarda de una vez los diagnósticos hechos en el navegador sin conexión.
+    Cada uno trae su clave de idempotencia: reenviar el lote no duplica nada.
+    El servidor los vuelve a diagnosticar con la base vigente.
+    """
+    pendientes = [pendiente.model_dump() for pendiente in sincronizacion_req.diagnosticos]
+    if len(pendientes) > MAX_SINCRONIZACION:
+        return JSONResponse(status_code=422, content={
+            "error": f"Se pueden sincronizar hasta {MAX_SINCRONIZACION} diagnósticos por lote"})
+    base = base_del_inquilino(inquilino)
+    try:
+        tabla = base.sensibilidad
+    except DemasiadosHechos as e:
+        return JSONResponse(status_code=501, content={"error": str(e)})
+    resultados = sincronizar(almacen, tabla, base.version, pendientes, inquilino or '') if pendientes else []
+    return {"version": base.version, "resultados": resultados}
+
+@app.post("/sensibilidad", response_model=SensibilidadResponse)
+def analizar_sensibilidad(sensibilidad_req: SensibilidadRequest,
+                          pares: bool = Query(False, description="Incluir los cambios de dos hechos a la vez"),
+                          filtro: str = Query("todos", pattern="^(todos|cambios|mejoras)$",
+                                              description="todos, solo los que cambian el diagnóstico o solo los que bajan el riesgo"),
+                          inquilino: Optional[str] = INQUILINO):
+    """
+    ¿Qué pasaría si...? Para cada sitio (`hechos` o un `lote`), el diagnóstico
+    después de invertir cada hecho observable (y cada par con pares=true),
+    resuelto sobre la tabla de decisión precalculada de la base. No se guarda en la BD.
+    """
+    observaciones = list(sensibilidad_req.lote or [])
+    if sensibilidad_req.hechos is not None:
+        observaciones.insert(0, sensibilidad_req.hechos)
+    if not observaciones:
+        return JSONResponse(status_code=422, content={"error": "Indicar 'hechos' o 'lote'"})
+    try:
+        tabla = base_del_inquilino(inquilino).sensibilidad
+    except DemasiadosHechos as e:
+        return JSONResponse(status_code=501, content={"error": str(e)})
+    return {"resultados": tabla.analizar(observaciones, pares, filtro)}
+
+@app.websocket("/ws/diagnostico")
+async def sesion_diagnostico(websocket: WebSocket):
+    """
+    Sesión interactiva de diagnóstico: una conexión por cuestionario.
+    
+    Mensajes del cliente:
+        {"tipo": "respuesta", "hecho": "<id>", "valor": true | false | null}
+        {"tipo": "finalizar"}   -> diagnóstico final guardado en la BD
+        {"tipo": "multiple"}    -> todas las reglas que se cumplen
+        {"tipo": "reiniciar"}   -> descarta las respuestas de la sesión
+    
+    Mensajes del servidor:
+        {"tipo": "preguntas", "preguntas": [...]}     al conectar
+        {"tipo": "parcial", ...}                      tras cada respuesta
+        {"tipo": "diagnostico", "diagnostico": {...}}
+        {"tipo": "multiple", "diagnosticos": [...], "total": n}
+        {"tipo": "error", "detalle": "..."}
+    """
+    await websocket.accept()
+    inquilino = websocket.headers.get("x-inquilino") or ''
+
+    async def base_sesion() -> BaseReglas:
+        # La LRU puede haber descartado la base: se vuelve a compilar en el pool de hilos
+        base = bases_inquilinos.cargada(inquilino)
+        return base if base is not None else await run_in_threadpool(bases_inquilinos.base_para, inquilino)
+
+    try:
+        await base_sesion()
+    except InquilinoDesconocido:
+        await websocket.send_json({"tipo": "error", "detalle": f"Inquilino desconocido: {inquilino}"})
+        await websocket.close()
+        return
+    ids_validos = {hecho["id"] for hecho in HECHOS_OBSERVABLES}
+    hechos: Dict[str, Optional[bool]] = {}
+    
+    await websocket.send_json({"tipo": "preguntas", "preguntas": list(HECHOS_OBSERVABLES)})
+    
+    try:
+        while True:
+            try:
+                mensaje = await websocket.receive_json()
+            except ValueError:
+                await websocket.send_json({"tipo": "error", "detalle": "Mensaje JSON inválido"})
+                continue
+            
+            tipo = mensaje.get("tipo") if isinstance(mensaje, dict) else None
+            
+            if tipo == "respuesta":
+                hecho, valor = mensaje.get("hecho"), mensaje.get("valor")
+                # 1/0 no son respuestas: `1 in (True, False)` sería verdadero
+                if hecho not in ids_validos or not (isinstance(valor, bool) or valor is None):
+                    await websocket.send_json({"tipo": "error", "detalle": "Respuesta inválida"})
+                    continue
+                hechos[hecho] = valor
+                parcial = (await base_sesion()).diagnosticar_parcial(hechos)
+                await websocket.send_text(dumps({"tipo": "parcial", **parcial}).decode())
+            
+            elif tipo == "finalizar":
+                # Igual que /diagnosticar: los hechos sin responder cuentan como falsos
+                completos = {k: bool(v) for k, v in hechos.items()}
+                base = await base_sesion()
+                resultado, diagnostico_id = await run_in_threadpool(
+                    diagnosticar_y_guardar, completos, None, base, inquilino
+                )
+                # Mismo JSON precalculado que /diagnosticar, con el tipo al principio
+                cuerpo = base.serializado.json_diagnostico(resultado, diagnostico_id)
+                await websocket.send_text('{"tipo":"diagnostico",' + cuerpo[1:].decode())
+            
+            elif tipo == "multiple":
+                completos = {k: bool(v) for k, v in hechos.items()}
+                resultados = (await base_sesion()).diagnosticar_multiple(completos)
+                await websocket.send_text(dumps({
+                    "tipo": "multiple", "diagnosticos": resultados, "total": len(resultados)
+                }).decode())
+            
+            elif tipo == "reiniciar":
+                hechos = {}
+                parcial = (await base_sesion()).diagnosticar_parcial(hechos)
+                await websocket.send_text(dumps({"tipo": "parcial", **parcial}).decode())
+            
+            else:
+                await websocket.send_json({"tipo": "error", "detalle": f"Tipo de mensaje desconocido: {tipo}"})
+    except WebSocketDisconnect:
+        pass
+
+
+@app.get("/eventos")
+async def eventos_diagnosticos(
+    request: Request,
+    riesgo: Optional[List[str]] = Query(None, description="Filtrar por nivel de riesgo (ALTO, MEDIO, BAJO)"),
+    categoria: Optional[List[str]] = Query(None, description="Filtrar por categoría"),
+    last_event_id: Optional[str] = Header(None),
+    inquilino: Optional[str] = INQUILINO
+):
+    """
+    Flujo Server-Sent Events con cada diagnóstico nuevo que se guarda.
+    Con el encabezado Last-Event-ID se reanuda desde el último evento recibido.
+    """
+    await base_del_inquilino_async(inquilino)
+    ultimo_id = int(last_event_id) if last_event_id and last_event_id.isdigit() else None
+    suscripcion = difusor.suscribir(
+        riesgos=[r.upper() for r in riesgo] if riesgo else None,
+        categorias=categoria,
+        ultimo_id=ultimo_id,
+        inquilino=inquilino or '',
+    )
+    
+    async def flujo():
+        try:
+            yield "retry: 3000\n\n"
+            while not await request.is_disconnected():
+                pendientes = await suscripcion.esperar(timeout=15)
+                
+                perdidos = suscripcion.tomar_descartados()
+                if perdidos:
+                    yield f"event: desfase\ndata: {json.dumps({'descartados': perdidos})}\n\n"
+                
+                if not pendientes:
+                    # Comentario para mantener viva la conexión
+                    yield ": ping\n\n"
+                    continue
+                
+                for evento_id, datos in pendientes:
+                    yield f"id: {evento_id}\nevent: diagnostico\ndata: {json.dumps(datos, ensure_ascii=False)}\n\n"
+        finally:
+            difusor.cancelar(suscripcion)
+    
+    return StreamingResponse(
+        flujo(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.get("/eventos/estado")
+async def estado_eventos():
+    """
+    Contadores del flujo de eventos (suscriptores, publicados, descartados)
+    """
+    return difusor.estadisticas()
+
+@app.post("/telemetria", response_model=TelemetriaResponse)
+def ingerir_telemetria(lote_req: LoteTelemetriaRequest):
+    """
+    Ingesta de lecturas numéricas en formato columnar (una serie por estación
+    y variable). Deriva los hechos con ventanas deslizantes, ejecuta el motor
+    y devuelve solo las estaciones cuyo estado cambió.
+    """
+    try:
+        return telemetria.ingerir([serie.model_dump() for serie in lote_req.series])
+    except ValueError as e:
+        return JSONResponse(status_code=422, content={"error": str(e)})
+
+@app.get("/telemetria/umbrales")
+async def umbrales_telemetria():
+    """
+    Umbrales y ventanas usados para derivar hechos de la telemetría
+    """
+    return {"umbrales": telemetria.umbrales}
+
+@app.get("/telemetria/{estacion}")
+async def estado_estacion(estacion: str):
+    """
+    Estado actual de una estación: hechos derivados, regla y agregaciones de cada ventana
+    """
+    estado = telemetria.estado(estacion)
+    if estado is None:
+        return JSONResponse(status_code=404, content={"error": "Estación sin lecturas"})
+    return estado
+
+@app.get("/telemetria/{estacion}/cambios")
+async def cambios_estacion(estacion: str, limite: int = Query(50, ge=1, le=1000)):
+    """
+    Historial de cambios de estado de una estación
+    """
+    return {"estacion": estacion, "cambios": obtener_cambios_estado(estacion, limite)}
@@ -1,5 +1,6 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from typing import Optional, Dict, Any, List
+from typing_extensions import Annotated
 
 class HechosRequest(BaseModel):
     hechos: Dict[str, bool]
@@ -12,4 +13,66 @@ class DiagnosticoMultipleRequest(BaseModel):
 
 class DiagnosticoMultipleResponse(BaseModel):
     diagnosticos: List[Dict[str, Any]]
-    total: int
\ No newline at end of file
+    total: int
+
+class HechosParcialesRequest(BaseModel):
+    hechos: Dict[str, Optional[bool]]
+
+class DiagnosticoParcialResponse(BaseModel):
+    diagnostico: Optional[Dict[str, Any]] = None
+    decidido: bool
+    disparadas: List[str]
+    descartadas: List[str]
+    posibles: List[str]
+    sin_evaluar: List[str]
+
+
+Confianza = Annotated[float, Field(ge=0.0, le=1.0)]
+
+class HechosCertezaRequest(BaseModel):
+    hechos: Dict[str, Confianza]
+
+class LoteCertezaRequest(BaseModel):
+    lote: List[Dict[str, Confianza]]
+
+class DiagnosticoCertezaResponse(BaseModel):
+    diagnosticos: List[Dict[str, Any]]
+    total: int
+
+class LoteCertezaResponse(BaseModel):
+    resultados: List[DiagnosticoCertezaResponse]
+
+class DiagnosticoPendiente(BaseModel):
+    clave: str = Field(min_length=1, max_length=200)
+    hechos: Dict[str, bool]
+    regla_id: Optional[str] = None
+
+class SincronizacionRequest(BaseModel):
+    diagnosticos: List[DiagnosticoPendiente]
+
+class SincronizacionResponse(BaseModel):
+    version: str
+    resultados: List[Dict[str, Any]]
+
+class SensibilidadRequest(BaseModel):
+    hechos: Optional[Dict[str, bool]] = None
+    lote: Optional[List[Dict[str, bool]]] = None
+
+class SensibilidadResponse(BaseModel):
+    resultados: List[Dict[str, Any]]
+
+# Una lectura NaN o infinita dejaría la suma de la ventana (y su media) en NaN para siempre
+Lectura = Annotated[float, Field(allow_inf_nan=False)]
+
+class SerieTelemetria(BaseModel):
+    estacion: str
+    variable: str
+    tiempos: List[Lectura]
+    valores: List[Lectura]
+
+class LoteTelemetriaRequest(BaseModel):
+    series: List[SerieTelemetria]
+
+class TelemetriaResponse(BaseModel):
+    lecturas: int
+    cambios: List[Dict[str, Any]]
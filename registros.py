@@ -0,0 +1,141 @@
+"""
+Registros inmutables para reglas y diagnósticos
+
+Reemplazan a los diccionarios que se copiaban en cada petición: una regla
+se compila una sola vez a un objeto Regla y el motor devuelve ese mismo
+objeto, compartido, en cada coincidencia. Los registros usan __slots__
+(sin __dict__ por instancia) y se comportan como un Mapping de solo
+lectura, así que el código que hace registro["titulo"] o registro.get(...)
+sigue funcionando. Se convierten a diccionario únicamente al serializar.
+
+Como los comparten todas las peticiones (y la caché de diagnósticos), las
+listas y diccionarios de un registro se congelan al crearlo: siguen
+siendo iguales a una lista o un diccionario y se serializan igual, pero
+modificarlos es un error en lugar de un cambio que verían todos.
+"""
+
+from collections.abc import Mapping
+from typing import Any, Dict, Iterable, Iterator, List, Tuple
+
+# Valor de un campo opcional que no se indicó (no aparece como clave)
+_AUSENTE = object()
+
+
+def _reconstruir(clase, valores: Dict[str, Any]) -> "Registro":
+    return clase(**valores)
+
+
+def _inmutable(self, *args, **kwargs):
+    raise TypeError(f"{type(self).__name__} es inmutable")
+
+
+class ListaCongelada(list):
+    """Lista de solo lectura (por ejemplo, las acciones de una regla)"""
+
+    __slots__ = ()
+    __setitem__ = __delitem__ = __iadd__ = __imul__ = _inmutable
+    append = extend = insert = pop = remove = clear = sort = reverse = _inmutable
+
+    def __reduce__(self):
+        return ListaCongelada, (list(self),)
+
+
+class DiccionarioCongelado(dict):
+    """Diccionario de solo lectura (por ejemplo, los hechos de un diagnóstico)"""
+
+    __slots__ = ()
+    __setitem__ = __delitem__ = __ior__ = _inmutable
+    update = pop = popitem = clear = setdefault = _inmutable
+
+    def __reduce__(self):
+        return DiccionarioCongelado, (dict(self),)
+
+
+def _congelar(valor: Any) -> Any:
+    """Copia de solo lectura de las listas y diccionarios de un registro"""
+    if isinstance(valor, list) and not isinstance(valor, ListaCongelada):
+        return ListaCongelada(valor)
+    if isinstance(valor, dict) and not isinstance(valor, DiccionarioCongelado):
+        return DiccionarioCongelado(valor)
+    return valor
+
+
+class Registro(Mapping):
+    """
+    Base de los registros: CAMPOS son las claves visibles como Mapping y
+    OCULTOS los atributos que no forman parte de los datos (por ejemplo la
+    condición de una regla)
+    """
+
+    __slots__ = ()
+    CAMPOS: Tuple[str, ...] = ()
+    OCULTOS: Tuple[str, ...] = ()
+
+    def __init__(self, **valores: Any):
+        for campo in self.CAMPOS + self.OCULTOS:
+            object.__setattr__(self, campo, _congelar(valores.pop(campo, _AUSENTE)))
+        if valores:
+            raise TypeError(f"{type(self).__name__}: campos desconocidos {sorted(valores)}")
+
+    def __setattr__(self, nombre: str, valor: Any) -> None:
+        raise AttributeError(f"{type(self).__name__} es inmutable")
+
+    def __delattr__(self, nombre: str) -> None:
+        raise AttributeError(f"{type(self).__name__} es inmutable")
+
+    def __getitem__(self, clave: str) -> Any:
+        if clave in self.CAMPOS:
+            valor = getattr(self, clave)
+            if valor is not _AUSENTE:
+                return valor
+        raise KeyError(clave)
+
+    def __iter__(self) -> Iterator[str]:
+        return (campo for campo in self.CAMPOS if getattr(self, campo) is not _AUSENTE)
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self)
+
+    def __reduce__(self):
+        # Necesario para pickle (p. ej. multiprocessing): __setattr__ está bloqueado
+        valores = {campo: getattr(self, campo) for campo in self.CAMPOS + self.OCULTOS}
+        return _reconstruir, (type(self), {k: v for k, v in valores.items() if v is not _AUSENTE})
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}({dict(self)!r})"
+
+
+class Regla(Registro):
+    """Regla compilada: datos de la regla más su condición (que no es una clave)"""
+
+    CAMPOS = ("id", "titulo", "categoria", "riesgo", "descripcion", "justificacion", "acciones", "certeza")
+    OCULTOS = ("condicion",)
+    __slots__ = CAMPOS + OCULTOS
+
+    @classmethod
+    def desde_dict(cls, regla: Mapping) -> "Regla":
+        """Crea la regla a partir del formato de REGLAS_AMBIENTALES (ignora claves desconocidas)"""
+        return cls(**{campo: regla[campo] for campo in cls.CAMPOS + cls.OCULTOS if campo in regla})
+
+
+class Diagnostico(Registro):
+    """Diagnóstico guardado en la base de datos"""
+
+    CAMPOS = ("id", "fecha", "hechos", "regla_id", "titulo", "categoria", "riesgo", "descripcion",
+              "justificacion", "acciones", "version_reglas")
+    __slots__ = CAMPOS
+
+
+def compilar_reglas(reglas: Iterable[Mapping]) -> List[Regla]:
+    """Convierte reglas en formato diccionario a registros Regla (las que ya lo son se reutilizan)"""
+    return [regla if isinstance(regla, Regla) else Regla.desde_dict(regla) for regla in reglas]
+
+
+def a_json(objeto: Any) -> Any:
+    """
+    Función `default` para los serializadores JSON / MessagePack: convierte
+    los registros en diccionarios
+    """
+    if isinstance(objeto, Registro):
+        return dict(objeto)
+    raise TypeError(f"No se puede serializar {type(objeto).__name__}")
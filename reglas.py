@@ -1,4 +1,6 @@
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, List, Sequence
+from condiciones import Hecho
+from registros import Regla, compilar_reglas
 
 HECHOS_OBSERVABLES = [
     {"id": "olor_fuerte", "pregunta": "¿Detecta olor fuerte o desagradable en el área?"},
@@ -14,7 +16,7 @@ REGLAS_AMBIENTALES = [
     {
         "id": "R-AMB-01",
         "titulo": "Contaminación Crítica del Agua",
-        "condicion": lambda h: h.get("agua_turbia") and h.get("olor_fuerte") and h.get("humedad_excesiva"),
+        "condicion": Hecho("agua_turbia") & Hecho("olor_fuerte") & Hecho("humedad_excesiva"),
         "riesgo": "ALTO",
         "categoria": "Contaminación del Agua",
         "descripcion": "Indicadores de contaminación severa del agua que requiere atención inmediata.",
@@ -30,7 +32,7 @@ REGLAS_AMBIENTALES = [
     {
         "id": "R-AMB-02",
         "titulo": "Zona de Acumulación de Residuos Peligrosos",
-        "condicion": lambda h: h.get("residuos_acumulados") and h.get("olor_fuerte") and h.get("vegetacion_deteriorada"),
+        "condicion": Hecho("residuos_acumulados") & Hecho("olor_fuerte") & Hecho("vegetacion_deteriorada"),
         "riesgo": "ALTO",
         "categoria": "Gestión de Residuos",
         "descripcion": "Acumulación de residuos que está afectando el ecosistema local.",
@@ -46,7 +48,7 @@ REGLAS_AMBIENTALES = [
     {
         "id": "R-AMB-03",
         "titulo": "Contaminación Atmosférica Significativa",
-        "condicion": lambda h: h.get("aire_contaminado") and h.get("ruido_elevado"),
+        "condicion": Hecho("aire_contaminado") & Hecho("ruido_elevado"),
         "riesgo": "ALTO",
         "categoria": "Contaminación Atmosférica",
         "descripcion": "Niveles elevados de contaminación del aire combinados con contaminación acústica.",
@@ -62,7 +64,7 @@ REGLAS_AMBIENTALES = [
     {
         "id": "R-AMB-04",
         "titulo": "Deterioro Moderado del Ecosistema",
-        "condicion": lambda h: h.get("vegetacion_deteriorada") and (h.get("humedad_excesiva") or h.get("residuos_acumulados")),
+        "condicion": Hecho("vegetacion_deteriorada") & (Hecho("humedad_excesiva") | Hecho("residuos_acumulados")),
         "riesgo": "MEDIO",
         "categoria": "Ecosistema",
         "descripcion": "El ecosistema muestra signos de deterioro que requieren intervención preventiva.",
@@ -78,7 +80,7 @@ REGLAS_AMBIENTALES = [
     {
         "id": "R-AMB-05",
         "titulo": "Contaminación Acústica",
-        "condicion": lambda h: h.get("ruido_elevado") and not h.get("aire_contaminado"),
+        "condicion": Hecho("ruido_elevado") & ~Hecho("aire_contaminado"),
         "riesgo": "MEDIO",
         "categoria": "Contaminación Acústica",
         "descripcion": "Niveles de ruido que pueden afectar la calidad de vida.",
@@ -94,7 +96,7 @@ REGLAS_AMBIENTALES = [
     {
         "id": "R-AMB-06",
         "titulo": "Gestión de Residuos Mejorable",
-        "condicion": lambda h: h.get("residuos_acumulados") and not h.get("olor_fuerte"),
+        "condicion": Hecho("residuos_acumulados") & ~Hecho("olor_fuerte"),
         "riesgo": "MEDIO",
         "categoria": "Gestión de Residuos",
         "descripcion": "Acumulación de residuos que requiere mejora en la gestión.",
@@ -110,7 +112,7 @@ REGLAS_AMBIENTALES = [
     {
         "id": "R-AMB-07",
         "titulo": "Problema de Drenaje",
-        "condicion": lambda h: h.get("humedad_excesiva") and not h.get("agua_turbia") and not h.get("olor_fuerte"),
+        "condicion": Hecho("humedad_excesiva") & ~Hecho("agua_turbia") & ~Hecho("olor_fuerte"),
         "riesgo": "BAJO",
         "categoria": "Infraestructura",
         "descripcion": "Problemas de drenaje que pueden derivar en situaciones más graves.",
@@ -126,7 +128,7 @@ REGLAS_AMBIENTALES = [
     {
         "id": "R-AMB-08",
         "titulo": "Deterioro Ambiental con Afectación de Vegetación",
-        "condicion": lambda h: h.get("vegetacion_deteriorada") and h.get("olor_fuerte") and not h.get("residuos_acumulados"),
+        "condicion": Hecho("vegetacion_deteriorada") & Hecho("olor_fuerte") & ~Hecho("residuos_acumulados"),
         "riesgo": "MEDIO",
         "categoria": "Contaminación Ambiental",
         "descripcion": "Deterioro de la vegetación asociado a contaminación ambiental sin evidencia de residuos sólidos.",
@@ -143,7 +145,7 @@ REGLAS_AMBIENTALES = [
     {
         "id": "R-AMB-09",
         "titulo": "Zona con Condiciones Aceptables",
-        "condicion": lambda h: not h.get("olor_fuerte") and not h.get("residuos_acumulados") and not h.get("aire_contaminado") and not h.get("agua_turbia"),
+        "condicion": ~Hecho("olor_fuerte") & ~Hecho("residuos_acumulados") & ~Hecho("aire_contaminado") & ~Hecho("agua_turbia"),
         "riesgo": "BAJO",
         "categoria": "Monitoreo Preventivo",
         "descripcion": "La zona presenta condiciones ambientales aceptables.",
@@ -158,48 +160,114 @@ REGLAS_AMBIENTALES = [
     }
 ]
 
-def motor_inferencia(hechos: Dict[str, bool]) -> Optional[Dict[str, Any]]:
+# Reglas compiladas una sola vez; el motor devuelve estos mismos objetos
+REGLAS_COMPILADAS = compilar_reglas(REGLAS_AMBIENTALES)
+
+ORDEN_RIESGO = {'ALTO': 0, 'MEDIO': 1, 'BAJO': 2}
+
+def motor_inferencia(hechos: Dict[str, bool], reglas: Optional[Sequence[Regla]] = None) -> Optional[Regla]:
     """
     Motor de inferencia que evalúa todas las reglas y devuelve la de mayor prioridad
     
     Args:
         hechos: Diccionario con los hechos observados
+        reglas: Reglas compiladas a usar (por defecto REGLAS_COMPILADAS)
     
     Returns:
-        Regla con mayor prioridad que se cumple, o None si ninguna se cumple
+        Regla con mayor prioridad que se cumple (compartida, de solo lectura),
+        o None si ninguna se cumple
     """
-    for regla in REGLAS_AMBIENTALES:
+    for regla in REGLAS_COMPILADAS if reglas is None else reglas:
         try:
-            if regla["condicion"](hechos):
-                # Eliminar función lambda antes de devolver
-                return {k: v for k, v in regla.items() if k != "condicion"}
+            if regla.condicion(hechos):
+                return regla
         except Exception as e:
             print(f"Error evaluando regla {regla['id']}: {e}")
     return None
 
-def motor_inferencia_multiple(hechos: Dict[str, bool]) -> list:
+def motor_inferencia_multiple(hechos: Dict[str, bool], reglas: Optional[Sequence[Regla]] = None) -> List[Regla]:
     """
     Motor de inferencia que devuelve TODAS las reglas que se cumplen, ordenadas por prioridad
     
     Args:
         hechos: Diccionario con los hechos observados
+        reglas: Reglas compiladas a usar (por defecto REGLAS_COMPILADAS)
     
     Returns:
         Lista de reglas que se cumplen, ordenadas por nivel de riesgo (ALTO > MEDIO > BAJO)
     """
     reglas_cumplidas = []
     
-    for regla in REGLAS_AMBIENTALES:
+    for regla in REGLAS_COMPILADAS if reglas is None else reglas:
         try:
-            if regla["condicion"](hechos):
-                # Eliminar función lambda antes de agregar
-                regla_limpia = {k: v for k, v in regla.items() if k != "condicion"}
-                reglas_cumplidas.append(regla_limpia)
+            if regla.condicion(hechos):
+                reglas_cumplidas.append(regla)
         except Exception as e:
             print(f"Error evaluando regla {regla['id']}: {e}")
     
     # Ordenar por prioridad de riesgo
-    orden_riesgo = {'ALTO': 0, 'MEDIO': 1, 'BAJO': 2}
-    reglas_cumplidas.sort(key=lambda r: orden_riesgo.get(r.get('riesgo', 'BAJO'), 3))
+    reglas_cumplidas.sort(key=lambda r: ORDEN_RIESGO.get(r.get('riesgo', 'BAJO'), 3))
+    
+    return reglas_cumplidas
+
+def motor_inferencia_parcial(hechos: Dict[str, Optional[bool]], terminacion_temprana: bool = True,
+                             reglas: Optional[Sequence[Regla]] = None) -> Dict[str, Any]:
+    """
+    Motor de inferencia con lógica de tres valores (verdadero / falso / desconocido)
+    
+    Un hecho con valor None o ausente se considera desconocido. Las reglas se
+    evalúan en orden de prioridad y, con terminación temprana, la evaluación se
+    detiene en la primera regla que se cumple con certeza: ninguna regla posterior
+    puede ganarle.
+    
+    Args:
+        hechos: Diccionario con los hechos observados (True, False o None)
+        terminacion_temprana: Si es False se evalúan todas las reglas
+        reglas: Reglas compiladas a usar (por defecto REGLAS_COMPILADAS)
     
-    return reglas_cumplidas
\ No newline at end of file
+    Returns:
+        Diccionario con:
+            - diagnostico: regla de mayor prioridad si ya está decidida, o None
+            - decidido: True si ningún hecho desconocido puede cambiar el diagnóstico
+            - disparadas: IDs de reglas que se cumplen con certeza
+            - descartadas: IDs de reglas que no pueden cumplirse
+            - posibles: IDs de reglas que dependen de hechos desconocidos
+            - sin_evaluar: IDs omitidos por la terminación temprana
+    """
+    disparadas, descartadas, posibles = [], [], []
+    ganadora = None
+    # La regla ganadora queda decidida si todas las anteriores están descartadas
+    previas_descartadas = True
+    if reglas is None:
+        reglas = REGLAS_COMPILADAS
+    
+    for indice, regla in enumerate(reglas):
+        try:
+            valor = regla.condicion.evaluar_parcial(hechos)
+        except Exception as e:
+            print(f"Error evaluando regla {regla['id']}: {e}")
+            continue
+        
+        if valor is True:
+            disparadas.append(regla["id"])
+            if ganadora is None and previas_descartadas:
+                ganadora = regla
+            if terminacion_temprana:
+                sin_evaluar = [r["id"] for r in reglas[indice + 1:]]
+                break
+        elif valor is False:
+            descartadas.append(regla["id"])
+        else:
+            posibles.append(regla["id"])
+            previas_descartadas = False
+    else:
+        sin_evaluar = []
+    
+    return {
+        "diagnostico": ganadora,
+        "decidido": ganadora is not None or not posibles,
+        "disparadas": disparadas,
+        "descartadas": descartadas,
+        "posibles": posibles,
+        "sin_evaluar": sin_evaluar,
+    }
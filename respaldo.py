@@ -0,0 +1,398 @@
+"""
+Respaldos en caliente de la base de datos
+
+Copiar el archivo .db con el servicio andando puede dar una copia rota (a
+mitad de una transacción). Este módulo usa la API de respaldo en línea de
+SQLite: la copia avanza de a PAGINAS_POR_PASO páginas, con una pausa entre
+pasos, así nunca retiene el disco ni el GIL mucho tiempo seguido.
+
+Para que la copia sea de un único instante sin frenar a los escritores, la
+base trabaja en modo WAL y el respaldo mantiene abierta una transacción de
+lectura durante toda la copia: ve siempre la misma versión de las páginas
+mientras /diagnosticar sigue escribiendo en el WAL (sin esa transacción,
+cada escritura de otra conexión reiniciaría la copia desde el principio).
+
+Cada respaldo se escribe primero como .parcial, se verifica (integrity_check)
+y recién entonces toma su nombre definitivo junto a un manifiesto .json con
+la fecha, el sha256, las páginas y las filas por tabla. Se conservan los
+últimos RESPALDOS_CONSERVAR.
+
+El archivo frío (ver retencion.py) no se incluye: sus segmentos no cambian
+una vez escritos y se copian como archivos comunes.
+
+Uso:
+
+    python respaldo.py crear
+    python respaldo.py listar
+    python respaldo.py verificar respaldos/diagnosticos-20260601T030000000000Z.db
+    python respaldo.py restaurar respaldos/diagnosticos-20260601T030000000000Z.db
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+
+import database
+
+RESPALDOS_DIR = os.environ.get("RESPALDOS_DIR", "respaldos")
+RESPALDOS_CONSERVAR = int(os.environ.get("RESPALDOS_CONSERVAR", "7"))
+# 256 páginas de 4 KB: alrededor de 1 MB por paso
+PAGINAS_POR_PASO = 256
+PAUSA_ENTRE_PASOS = 0.005
+
+PREFIJO = "diagnosticos-"
+# Segundos sin cambios tras los que un .parcial se considera de una copia cortada
+PARCIAL_ABANDONADO = 3600
+
+
+class RespaldoInvalido(Exception):
+    """El respaldo no pasa la verificación (archivo dañado o manifiesto distinto)"""
+
+
+def _sha256(ruta: str) -> str:
+    digest = hashlib.sha256()
+    with open(ruta, 'rb') as archivo:
+        for bloque in iter(lambda: archivo.read(1 << 20), b''):
+            digest.update(bloque)
+    return digest.hexdigest()
+
+
+def _filas_por_tabla(conn: sqlite3.Connection) -> Dict[str, int]:
+    tablas = [fila[0] for fila in conn.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%' ORDER BY name")]
+    return {tabla: conn.execute(f'SELECT COUNT(*) FROM "{tabla}"').fetchone()[0] for tabla in tablas}
+
+
+def _manifiesto(ruta: str) -> str:
+    return os.path.splitext(ruta)[0] + ".json"
+
+
+class Progreso:
+    """Estado del respaldo en curso, para consultarlo desde otro hilo"""
+
+    def __init__(self):
+        self.inicio = time.time()
+        self.paginas_copiadas = 0
+        self.paginas_totales = 0
+        self.pasos = 0
+
+    def a_dict(self) -> Dict[str, Any]:
+        return {
+            "paginas_copiadas": self.paginas_copiadas,
+            "paginas_totales": self.paginas_totales,
+            "pasos": self.pasos,
+            "segundos": round(time.time() - self.inicio, 3),
+        }
+
+
+def crear_respaldo(directorio: Optional[str] = None, paginas: int = PAGINAS_POR_PASO,
+                   pausa: float = PAUSA_ENTRE_PASOS, conservar: Optional[int] = None,
+                   progreso: Optional[Progreso] = None) -> Dict[str, Any]:
+    """
+    Copia la base de datos actual a un respaldo nuevo sin detener el servicio
+
+    Args:
+        directorio: Directorio de respaldos (por defecto RESPALDOS_DIR)
+        paginas: Páginas copiadas por paso
+        pausa: Segundos de espera entre pasos (deja correr a las peticiones)
+        conservar: Respaldos a conservar; los más viejos se borran (por defecto RESPALDOS_CONSERVAR)
+        progreso: Objeto que se actualiza en cada paso
+
+    Returns:
+        El manifiesto del respaldo nuevo
+
+    Raises:
+        RespaldoInvalido: Si la copia no pasa integrity_check
+    """
+    directorio = directorio or RESPALDOS_DIR
+    conservar = RESPALDOS_CONSERVAR if conservar is None else conservar
+    progreso = progreso or Progreso()
+    os.makedirs(directorio, exist_ok=True)
+    ahora = datetime.now(timezone.utc)
+    ruta = os.path.join(directorio, f"{PREFIJO}{ahora.strftime('%Y%m%dT%H%M%S%fZ')}.db")
+    parcial = ruta + ".parcial"
+
+    def avanzar(estado, restantes, totales):
+        progreso.paginas_totales = totales
+        progreso.paginas_copiadas = totales - restantes
+        progreso.pasos += 1
+        if restantes and pausa:
+            time.sleep(pausa)
+
+    origen = sqlite3.connect(database.DATABASE_NAME)
+    destino = sqlite3.connect(parcial)
+    try:
+        # Sin WAL la transacción de lectura bloquearía a los escritores
+        origen.execute('PRAGMA journal_mode=WAL')
+        # Instantánea fija: la transacción de lectura dura toda la copia
+        origen.execute('BEGIN')
+        ultimo_id = origen.execute('SELECT COALESCE(MAX(id), 0) FROM diagnosticos').fetchone()[0]
+        origen.backup(destino, pages=paginas, progress=avanzar)
+        origen.execute('COMMIT')
+        # El respaldo queda como un único archivo, sin -wal
+        destino.execute('PRAGMA journal_mode=DELETE')
+        integridad = destino.execute('PRAGMA integrity_check').fetchone()[0]
+        filas = _filas_por_tabla(destino)
+    finally:
+        destino.close()
+        origen.close()
+
+    if integridad != "ok":
+        os.remove(parcial)
+        raise RespaldoInvalido(f"La copia no pasó integrity_check: {integridad}")
+    manifiesto = {
+        "archivo": os.path.basename(ruta),
+        "fecha": ahora.strftime('%Y-%m-%d %H:%M:%S'),
+        "origen": database.DATABASE_NAME,
+        "bytes": os.path.getsize(parcial),
+        "paginas": progreso.paginas_totales,
+        "pasos": progreso.pasos,
+        "segundos": round(time.time() - progreso.inicio, 3),
+        "ultimo_diagnostico": ultimo_id,
+        "filas": filas,
+        "sha256": _sha256(parcial),
+    }
+    with open(_manifiesto(ruta), 'w', encoding='utf-8') as archivo:
+        json.dump(manifiesto, archivo, ensure_ascii=False, indent=2)
+    os.replace(parcial, ruta)
+    podar(directorio, conservar)
+    return manifiesto
+
+
+def listar(directorio: Optional[str] = None) -> List[Dict[str, Any]]:
+    """
+    Manifiestos de los respaldos completos, del más reciente al más antiguo
+
+    Args:
+        directorio: Directorio de respaldos (por defecto RESPALDOS_DIR)
+
+    Returns:
+        Lista de manifiestos
+    """
+    directorio = directorio or RESPALDOS_DIR
+    if not os.path.isdir(directorio):
+        return []
+    manifiestos = []
+    for nombre in sorted(os.listdir(directorio), reverse=True):
+        if nombre.startswith(PREFIJO) and nombre.endswith(".db"):
+            try:
+                with open(_manifiesto(os.path.join(directorio, nombre)), encoding='utf-8') as archivo:
+                    manifiestos.append(json.load(archivo))
+            except (OSError, ValueError):
+                continue
+    return manifiestos
+
+
+def podar(directorio: Optional[str] = None, conservar: int = RESPALDOS_CONSERVAR) -> List[str]:
+    """
+    Borra los respaldos más viejos y los .parcial que quedaron de copias cortadas
+
+    Args:
+        directorio: Directorio de respaldos (por defecto RESPALDOS_DIR)
+        conservar: Cantidad de respaldos a mantener
+
+    Returns:
+        Nombres de los archivos borrados
+    """
+    directorio = directorio or RESPALDOS_DIR
+    borrados = []
+    nombres = sorted(os.listdir(directorio), reverse=True) if os.path.isdir(directorio) else []
+    respaldos = [nombre for nombre in nombres if nombre.startswith(PREFIJO) and nombre.endswith(".db")]
+    for nombre in respaldos[conservar:]:
+        ruta = os.path.join(directorio, nombre)
+        os.remove(ruta)
+        if os.path.exists(_manifiesto(ruta)):
+            os.remove(_manifiesto(ruta))
+        borrados.append(nombre)
+    # Un .parcial reciente puede ser de otra copia en curso
+    for nombre in nombres:
+        ruta = os.path.join(directorio, nombre)
+        if nombre.endswith(".parcial") and time.time() - os.path.getmtime(ruta) > PARCIAL_ABANDONADO:
+            os.remove(ruta)
+            borrados.append(nombre)
+    return borrados
+
+
+def verificar(ruta: str) -> Dict[str, Any]:
+    """
+    Comprueba un respaldo: sha256 del manifiesto, integrity_check y filas por tabla
+
+    Args:
+        ruta: Archivo .db del respaldo
+
+    Returns:
+        El manifiesto del respaldo
+
+    Raises:
+        RespaldoInvalido: Si falta el manifiesto o algo no coincide
+    """
+    try:
+        with open(_manifiesto(ruta), encoding='utf-8') as archivo:
+            manifiesto = json.load(archivo)
+    except (OSError, ValueError) as e:
+        raise RespaldoInvalido(f"Manifiesto ilegible para {ruta}: {e}")
+    if _sha256(ruta) != manifiesto["sha256"]:
+        raise RespaldoInvalido(f"{ruta}: el sha256 no coincide con el manifiesto")
+    # Solo lectura: verificar no debe modificar el respaldo
+    conn = sqlite3.connect(f"file:{os.path.abspath(ruta)}?mode=ro", uri=True)
+    try:
+        integridad = conn.execute('PRAGMA integrity_check').fetchone()[0]
+        filas = _filas_por_tabla(conn)
+    finally:
+        conn.close()
+    if integridad != "ok":
+        raise RespaldoInvalido(f"{ruta}: integrity_check devolvió {integridad}")
+    if filas != manifiesto["filas"]:
+        raise RespaldoInvalido(f"{ruta}: las filas por tabla no coinciden con el manifiesto")
+    return manifiesto
+
+
+def restaurar(ruta: str, destino: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Reemplaza el contenido de la base de datos por el de un respaldo verificado
+
+    La copia se hace con la misma API de respaldo, en una sola transacción
+    sobre el destino: las demás conexiones ven la base anterior o la
+    restaurada, nunca una mezcla. Después se le da una generación nueva, así
+    los procesos que la usan (la API, aunque se restaure desde otro proceso)
+    vacían su caché de diagnósticos: este enseguida y los demás dentro de
+    CACHE_GENERACION_SEGUNDOS.
+
+    Args:
+        ruta: Archivo .db del respaldo
+        destino: Base de datos a reemplazar (por defecto la de la API)
+
+    Returns:
+        El manifiesto del respaldo restaurado
+
+    Raises:
+        RespaldoInvalido: Si el respaldo no pasa la verificación
+    """
+    manifiesto = verificar(ruta)
+    destino = destino or database.DATABASE_NAME
+    origen = sqlite3.connect(f"file:{os.path.abspath(ruta)}?mode=ro", uri=True)
+    conn = sqlite3.connect(destino)
+    try:
+        origen.backup(conn)
+        conn.execute('PRAGMA journal_mode=WAL')
+        # Los diagnósticos posteriores al respaldo ya no existen y sus IDs se reutilizarán
+        database.nueva_generacion(conn)
+        conn.commit()
+    finally:
+        conn.close()
+        origen.close()
+    # Otros procesos lo notan en la próxima revisión de la generación; este, ya
+    database.revisar_generacion(destino)
+    return manifiesto
+
+
+class TareaRespaldo:
+    """Hilo de respaldos: periódicos (RESPALDO_INTERVALO segundos) o a pedido"""
+
+    def __init__(self, intervalo: Optional[float] = None, directorio: Optional[str] = None):
+        self.intervalo = intervalo
+        self.directorio = directorio
+        self.progreso: Optional[Progreso] = None
+        self.ultimo: Optional[Dict[str, Any]] = None
+        self.error: Optional[str] = None
+        self._cerrojo = threading.Lock()
+        self._detener = threading.Event()
+        self._hilo: Optional[threading.Thread] = None
+
+    def respaldar(self) -> Optional[Dict[str, Any]]:
+        """Hace un respaldo en el hilo actual; None si ya hay uno en curso"""
+        if not self._cerrojo.acquire(blocking=False):
+            return None
+        try:
+            self.progreso = Progreso()
+            self.ultimo = crear_respaldo(self.directorio, progreso=self.progreso)
+            self.error = None
+            return self.ultimo
+        except Exception as e:
+            self.error = str(e)
+            print(f"Error en el respaldo: {e}")
+            return None
+        finally:
+            self.progreso = None
+            self._cerrojo.release()
+
+    def en_curso(self) -> bool:
+        return self._cerrojo.locked()
+
+    def lanzar(self) -> bool:
+        """Empieza un respaldo en otro hilo; False si ya hay uno en curso"""
+        if self.en_curso():
+            return False
+        threading.Thread(target=self.respaldar, name="respaldo", daemon=True).start()
+        return True
+
+    def estado(self) -> Dict[str, Any]:
+        progreso = self.progreso
+        return {
+            "en_curso": progreso.a_dict() if progreso is not None else None,
+            "ultimo": self.ultimo,
+            "error": self.error,
+            "respaldos": listar(self.directorio),
+        }
+
+    def _ciclo(self) -> None:
+        while not self._detener.wait(self.intervalo):
+            self.respaldar()
+
+    def iniciar(self) -> None:
+        if self.intervalo:
+            self._hilo = threading.Thread(target=self._ciclo, name="respaldos", daemon=True)
+            self._hilo.start()
+
+    def detener(self) -> None:
+        self._detener.set()
+        if self._hilo is not None:
+            self._hilo.join()
+
+
+def tarea_configurada() -> TareaRespaldo:
+    """Tarea según RESPALDO_INTERVALO (sin esa variable solo hay respaldos a pedido)"""
+    intervalo = os.environ.get("RESPALDO_INTERVALO")
+    return TareaRespaldo(float(intervalo) if intervalo else None)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Respaldos en caliente de la base de datos")
+    parser.add_argument("--db", help="Base de datos (por defecto la de la API)")
+    parser.add_argument("--dir", help="Directorio de respaldos (por defecto RESPALDOS_DIR)")
+    sub = parser.add_subparsers(dest="comando", required=True)
+    cre = sub.add_parser("crear", help="Hace un respaldo sin detener el servicio")
+    cre.add_argument("--paginas", type=int, default=PAGINAS_POR_PASO, help="Páginas por paso")
+    cre.add_argument("--pausa", type=float, default=PAUSA_ENTRE_PASOS, help="Segundos entre pasos")
+    sub.add_parser("listar", help="Respaldos completos")
+    ver = sub.add_parser("verificar", help="Comprueba un respaldo")
+    ver.add_argument("ruta")
+    res = sub.add_parser("restaurar", help="Reemplaza la base por un respaldo")
+    res.add_argument("ruta")
+    args = parser.parse_args()
+
+    if args.db:
+        database.DATABASE_NAME = args.db
+    try:
+        if args.comando == "crear":
+            manifiesto = crear_respaldo(args.dir, paginas=args.paginas, pausa=args.pausa)
+            print(f"{manifiesto['archivo']}  {manifiesto['bytes'] / 1024:,.0f} KB  "
+                  f"{manifiesto['pasos']} pasos en {manifiesto['segundos']} s")
+        elif args.comando == "listar":
+            for manifiesto in listar(args.dir):
+                print(f"{manifiesto['archivo']}  {manifiesto['fecha']}  {manifiesto['bytes'] / 1024:>9,.0f} KB  "
+                      f"hasta el diagnóstico {manifiesto['ultimo_diagnostico']}")
+        elif args.comando == "verificar":
+            manifiesto = verificar(args.ruta)
+            print(f"{manifiesto['archivo']}: correcto")
+        else:
+            manifiesto = restaurar(args.ruta)
+            print(f"{database.DATABASE_NAME} restaurada desde {manifiesto['archivo']} ({manifiesto['fecha']})")
+    except RespaldoInvalido as e:
+        raise SystemExit(str(e))
@@ -0,0 +1,495 @@
+"""
+Retención: archivo frío columnar de los diagnósticos antiguos
+
+La tabla diagnosticos solo crece. La tarea de retención mueve las filas más
+viejas que RETENCION_DIAS a segmentos comprimidos en disco y las borra de
+la tabla, que queda chica. obtener_historial, obtener_estadisticas y
+obtener_diagnostico_por_id (y con ellos los PDF) consultan la tabla y el
+archivo juntos.
+
+Cada segmento guarda hasta FILAS_POR_SEGMENTO filas por columnas: id y
+fecha (segundos UTC) como int64 y los textos codificados con diccionario
+(lista de valores distintos + un código int32 por fila), cada columna
+comprimida con zlib por separado. Así una consulta solo descomprime las
+columnas que necesita. El índice (indice.json) tiene por segmento el rango
+de IDs y de fechas y, por inquilino, el total, los conteos por riesgo y
+categoría y su propio rango de fechas. Con eso las estadísticas de un
+segmento entero, o las páginas del historial que caen en otro segmento,
+se resuelven sin abrirlo. Los segmentos fuera del rango de fechas pedido
+también se saltan.
+
+Las claves de idempotencia no se archivan: solo sirven para reintentos
+recientes.
+
+Uso:
+
+    python retencion.py archivar --dias 90
+    python retencion.py estado
+"""
+
+import argparse
+import json
+import os
+import struct
+import threading
+import zlib
+from collections import Counter, OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+import database
+from registros import Diagnostico
+
+FILAS_POR_SEGMENTO = 100_000
+MAGIA = b"DIAGSEG1"
+INDICE = "indice.json"
+# Columnas decodificadas que se mantienen en memoria entre consultas
+MAX_COLUMNAS_EN_CACHE = 64
+
+FORMATO_FECHA = '%Y-%m-%d %H:%M:%S'
+COLUMNAS_TEXTO = ("inquilino", "hechos_json", "regla_id", "titulo", "categoria", "riesgo", "descripcion",
+                  "justificacion", "acciones_json", "version_reglas")
+
+
+def normalizar_fecha(fecha: str) -> str:
+    """Fecha ISO (con o sin hora) al formato de la columna fecha"""
+    return datetime.fromisoformat(fecha).strftime(FORMATO_FECHA)
+
+
+def _segundos(fecha: str) -> int:
+    return int(datetime.strptime(fecha, FORMATO_FECHA).replace(tzinfo=timezone.utc).timestamp())
+
+
+def _fecha(segundos: int) -> str:
+    return datetime.fromtimestamp(segundos, timezone.utc).strftime(FORMATO_FECHA)
+
+
+def _en_rango(fecha_min: str, fecha_max: str, desde: Optional[str], hasta: Optional[str]) -> Tuple[bool, bool]:
+    """(se toca el rango, está entero dentro del rango); desde inclusivo, hasta exclusivo"""
+    toca = (desde is None or fecha_max >= desde) and (hasta is None or fecha_min < hasta)
+    dentro = (desde is None or fecha_min >= desde) and (hasta is None or fecha_max < hasta)
+    return toca, dentro
+
+
+class ArchivoFrio:
+    """
+    Segmentos de un directorio y su índice. El índice se vuelve a leer si
+    otro proceso (la tarea de retención) lo reemplazó.
+    """
+
+    def __init__(self, directorio: str):
+        self.directorio = directorio
+        self.segmentos: List[Dict[str, Any]] = []
+        self._firma = None
+        self._columnas: "OrderedDict[Tuple[str, str], Any]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _ruta(self, nombre: str) -> str:
+        return os.path.join(self.directorio, nombre)
+
+    def actualizar(self) -> List[Dict[str, Any]]:
+        """Segmentos vigentes (lee el índice solo si cambió)"""
+        try:
+            estado = os.stat(self._ruta(INDICE))
+            firma = (estado.st_mtime_ns, estado.st_size)
+        except OSError:
+            firma = None
+        if firma != self._firma:
+            with self._lock:
+                if firma is None:
+                    self.segmentos = []
+                else:
+                    with open(self._ruta(INDICE), encoding="utf-8") as f:
+                        self.segmentos = json.load(f)
+                self._firma = firma
+        return self.segmentos
+
+    # --- escritura ---
+
+    def escribir_segmento(self, filas: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """
+        Escribe un segmento con filas de la tabla (ordenadas por id) y lo agrega al índice
+
+        Returns:
+            Entrada del índice del segmento
+        """
+        os.makedirs(self.directorio, exist_ok=True)
+        segmentos = list(self.actualizar())
+        numero = max((s["numero"] for s in segmentos), default=0) + 1
+        nombre = f"seg-{numero:06d}.col"
+
+        bloques, cabecera = [], {}
+        posicion = 0
+
+        def agregar_bloque(datos: bytes) -> List[int]:
+            nonlocal posicion
+            comprimido = zlib.compress(datos, 6)
+            bloques.append(comprimido)
+            posicion += len(comprimido)
+            return [posicion - len(comprimido), len(comprimido)]
+
+        ids = np.array([fila["id"] for fila in filas], dtype=np.int64)
+        segundos = np.array([_segundos(fila["fecha"]) for fila in filas], dtype=np.int64)
+        cabecera["id"] = {"tipo": "i8", "datos": agregar_bloque(ids.tobytes())}
+        cabecera["fecha"] = {"tipo": "i8", "datos": agregar_bloque(segundos.tobytes())}
+        for columna in COLUMNAS_TEXTO:
+            codigos_de: Dict[Any, int] = {}
+            codigos = np.fromiter((codigos_de.setdefault(fila[columna], len(codigos_de)) for fila in filas),
+                                  dtype=np.int32, count=len(filas))
+            cabecera[columna] = {
+                "tipo": "dic",
+                "valores": agregar_bloque(json.dumps(list(codigos_de), ensure_ascii=False).encode("utf-8")),
+                "datos": agregar_bloque(codigos.tobytes()),
+            }
+
+        encabezado = json.dumps({"filas": len(filas), "columnas": cabecera}).encode("utf-8")
+        temporal = self._ruta(nombre + ".tmp")
+        with open(temporal, "wb") as f:
+            f.write(MAGIA + struct.pack("<I", len(encabezado)) + encabezado)
+            f.writelines(bloques)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporal, self._ruta(nombre))
+
+        inquilinos: Dict[str, Dict[str, Any]] = {}
+        for fila in filas:
+            resumen = inquilinos.setdefault(fila["inquilino"], {
+                "total": 0, "por_riesgo": Counter(), "por_categoria": Counter(),
+                "fecha_min": fila["fecha"], "fecha_max": fila["fecha"],
+            })
+            resumen["total"] += 1
+            resumen["por_riesgo"][fila["riesgo"]] += 1
+            resumen["por_categoria"][fila["categoria"]] += 1
+            resumen["fecha_min"] = min(resumen["fecha_min"], fila["fecha"])
+            resumen["fecha_max"] = max(resumen["fecha_max"], fila["fecha"])
+        entrada = {
+            "numero": numero,
+            "archivo": nombre,
+            "filas": len(filas),
+            "bytes": os.path.getsize(self._ruta(nombre)),
+            "id_min": int(ids.min()),
+            "id_max": int(ids.max()),
+            "fecha_min": min(fila["fecha"] for fila in filas),
+            "fecha_max": max(fila["fecha"] for fila in filas),
+            # Las claves None (riesgo/categoría vacíos) se guardan como "null" en JSON
+            "inquilinos": {inquilino: dict(r, por_riesgo=dict(r["por_riesgo"]), por_categoria=dict(r["por_categoria"]))
+                           for inquilino, r in inquilinos.items()},
+        }
+        segmentos.append(entrada)
+        temporal = self._ruta(INDICE + ".tmp")
+        with open(temporal, "w", encoding="utf-8") as f:
+            json.dump(segmentos, f, ensure_ascii=False)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporal, self._ruta(INDICE))
+        self.actualizar()
+        return entrada
+
+    # --- lectura ---
+
+    def _columna(self, segmento: Dict[str, Any], nombre: str):
+        """Columna decodificada: ndarray (i8) o (valores, códigos) (dic)"""
+        clave = (segmento["archivo"], nombre)
+        with self._lock:
+            if clave in self._columnas:
+                self._columnas.move_to_end(clave)
+                return self._columnas[clave]
+        with open(self._ruta(segmento["archivo"]), "rb") as f:
+            if f.read(len(MAGIA)) != MAGIA:
+                raise ValueError(f"{segmento['archivo']} no es un segmento de diagnósticos")
+            largo, = struct.unpack("<I", f.read(4))
+            cabecera = json.loads(f.read(largo))
+            base = len(MAGIA) + 4 + largo
+            columna = cabecera["columnas"][nombre]
+
+            def leer(bloque: List[int]) -> bytes:
+                f.seek(base + bloque[0])
+                return zlib.decompress(f.read(bloque[1]))
+
+            if columna["tipo"] == "i8":
+                valor = np.frombuffer(leer(columna["datos"]), dtype=np.int64)
+            else:
+                valor = (json.loads(leer(columna["valores"])), np.frombuffer(leer(columna["datos"]), dtype=np.int32))
+        with self._lock:
+            self._columnas[clave] = valor
+            while len(self._columnas) > MAX_COLUMNAS_EN_CACHE:
+                self._columnas.popitem(last=False)
+        return valor
+
+    def _mascara(self, segmento: Dict[str, Any], inquilino: str, desde: Optional[str],
+                 hasta: Optional[str], dentro: bool) -> np.ndarray:
+        """Filas del segmento que son del inquilino y caen en el rango"""
+        valores, codigos = self._columna(segmento, "inquilino")
+        if inquilino not in valores:
+            return np.zeros(len(codigos), dtype=bool)
+        mascara = codigos == valores.index(inquilino)
+        if not dentro:
+            segundos = self._columna(segmento, "fecha")
+            if desde is not None:
+                mascara &= segundos >= _segundos(desde)
+            if hasta is not None:
+                mascara &= segundos < _segundos(hasta)
+        return mascara
+
+    def _candidatos(self, inquilino: str, desde: Optional[str], hasta: Optional[str]):
+        """Segmentos con filas del inquilino en el rango (en cualquier orden: sus rangos pueden solaparse)"""
+        for segmento in self.actualizar():
+            resumen = segmento["inquilinos"].get(inquilino)
+            if resumen is None:
+                continue
+            toca, dentro = _en_rango(resumen["fecha_min"], resumen["fecha_max"], desde, hasta)
+            if toca:
+                yield segmento, resumen, dentro
+
+    def _grupos(self, inquilino: str, desde: Optional[str], hasta: Optional[str]):
+        """
+        Candidatos agrupados del más nuevo al más viejo: dentro de un grupo los
+        rangos de fechas del inquilino se solapan (la fecha se toma antes del
+        INSERT, así que IDs y fechas no van en el mismo orden y un archivado
+        posterior puede caer entre segmentos anteriores); entre grupos, no
+        """
+        candidatos = sorted(self._candidatos(inquilino, desde, hasta), key=lambda c: c[1]["fecha_max"], reverse=True)
+        grupo: List[Tuple[Dict[str, Any], Dict[str, Any], bool]] = []
+        fecha_min = None
+        for candidato in candidatos:
+            if grupo and candidato[1]["fecha_max"] < fecha_min:
+                yield grupo
+                grupo = []
+            fecha_min = candidato[1]["fecha_min"] if not grupo else min(fecha_min, candidato[1]["fecha_min"])
+            grupo.append(candidato)
+        if grupo:
+            yield grupo
+
+    def _diagnostico(self, segmento: Dict[str, Any], fila: int) -> Diagnostico:
+        texto = {}
+        for columna in COLUMNAS_TEXTO[1:]:
+            valores, codigos = self._columna(segmento, columna)
+            texto[columna] = valores[codigos[fila]]
+        return Diagnostico(
+            id=int(self._columna(segmento, "id")[fila]),
+            fecha=_fecha(int(self._columna(segmento, "fecha")[fila])),
+            hechos=json.loads(texto["hechos_json"]),
+            regla_id=texto["regla_id"],
+            titulo=texto["titulo"],
+            categoria=texto["categoria"],
+            riesgo=texto["riesgo"],
+            descripcion=texto["descripcion"],
+            justificacion=texto["justificacion"],
+            acciones=json.loads(texto["acciones_json"]) if texto["acciones_json"] else [],
+            version_reglas=texto["version_reglas"],
+        )
+
+    def contar(self, inquilino: str = '', desde: Optional[str] = None, hasta: Optional[str] = None) -> int:
+        total = 0
+        for segmento, resumen, dentro in self._candidatos(inquilino, desde, hasta):
+            total += resumen["total"] if dentro else int(self._mascara(segmento, inquilino, desde, hasta, dentro).sum())
+        return total
+
+    def historial(self, limite: int, offset: int = 0, inquilino: str = '', desde: Optional[str] = None,
+                  hasta: Optional[str] = None, antes: Optional[Tuple[str, int]] = None) -> List[Diagnostico]:
+        """Diagnósticos archivados del más reciente al más antiguo (antes como en obtener_historial)"""
+        resultado: List[Diagnostico] = []
+        if antes is not None:
+            # Los segmentos que empiezan después del segundo de `antes` ni se abren
+            fecha_antes, id_antes = _segundos(antes[0]), antes[1]
+            tope = _fecha(fecha_antes + 1)
+            hasta = tope if hasta is None else min(hasta, tope)
+        for grupo in self._grupos(inquilino, desde, hasta):
+            if len(resultado) >= limite:
+                break
+            # Un grupo entero dentro del rango y antes del desplazamiento se salta sin abrirlo
+            if antes is None and all(dentro for _, _, dentro in grupo):
+                total = sum(resumen["total"] for _, resumen, _ in grupo)
+                if offset >= total:
+                    offset -= total
+                    continue
+            # Las filas de todo el grupo, por fecha y id descendentes como en la tabla
+            segmentos, filas, fechas, ids = [], [], [], []
+            for numero, (segmento, _, dentro) in enumerate(grupo):
+                elegidas = np.flatnonzero(self._mascara(segmento, inquilino, desde, hasta, dentro))
+                if antes is not None:
+                    fechas_fila = self._columna(segmento, "fecha")[elegidas]
+                    ids_fila = self._columna(segmento, "id")[elegidas]
+                    elegidas = elegidas[(fechas_fila < fecha_antes) | ((fechas_fila == fecha_antes) & (ids_fila < id_antes))]
+                segmentos.append(np.full(len(elegidas), numero))
+                filas.append(elegidas)
+                fechas.append(self._columna(segmento, "fecha")[elegidas])
+                ids.append(self._columna(segmento, "id")[elegidas])
+            orden = np.lexsort((np.concatenate(ids), np.concatenate(fechas)))[::-1]
+            if offset >= len(orden):
+                offset -= len(orden)
+                continue
+            segmentos, filas = np.concatenate(segmentos), np.concatenate(filas)
+            for posicion in orden[offset:offset + limite - len(resultado)].tolist():
+                resultado.append(self._diagnostico(grupo[segmentos[posicion]][0], int(filas[posicion])))
+            offset = 0
+        return resultado
+
+    def estadisticas(self, inquilino: str = '', desde: Optional[str] = None,
+                     hasta: Optional[str] = None) -> Tuple[int, Counter, Counter]:
+        """Total y conteos completos por riesgo y por categoría de lo archivado"""
+        total, por_riesgo, por_categoria = 0, Counter(), Counter()
+        for segmento, resumen, dentro in self._candidatos(inquilino, desde, hasta):
+            if dentro:
+                total += resumen["total"]
+                por_riesgo.update(resumen["por_riesgo"])
+                por_categoria.update(resumen["por_categoria"])
+                continue
+            mascara = self._mascara(segmento, inquilino, desde, hasta, dentro)
+            total += int(mascara.sum())
+            for columna, conteo in (("riesgo", por_riesgo), ("categoria", por_categoria)):
+                valores, codigos = self._columna(segmento, columna)
+                for codigo, cantidad in enumerate(np.bincount(codigos[mascara], minlength=len(valores)).tolist()):
+                    if cantidad:
+                        conteo[valores[codigo]] += cantidad
+        # En el índice JSON las claves None quedaron como "null"
+        for conteo in (por_riesgo, por_categoria):
+            if "null" in conteo:
+                conteo[None] += conteo.pop("null")
+        return total, por_riesgo, por_categoria
+
+    def agrupar(self, columnas: Tuple[str, ...]) -> Counter:
+        """Filas archivadas por combinación de valores de columnas de texto (sin decodificar filas)"""
+        conteos: Counter = Counter()
+        for segmento in self.actualizar():
+            decodificadas = [self._columna(segmento, columna) for columna in columnas]
+            codigos = np.stack([codigos for _, codigos in decodificadas], axis=1)
+            combinaciones, veces = np.unique(codigos, axis=0, return_counts=True)
+            for combinacion, cantidad in zip(combinaciones.tolist(), veces.tolist()):
+                conteos[tuple(valores[codigo] for (valores, _), codigo in zip(decodificadas, combinacion))] += cantidad
+        return conteos
+
+    def obtener(self, diagnostico_id: int, inquilino: str = '') -> Optional[Diagnostico]:
+        for segmento in self.actualizar():
+            if segmento["id_min"] <= diagnostico_id <= segmento["id_max"] and inquilino in segmento["inquilinos"]:
+                ids = self._columna(segmento, "id")
+                fila = int(np.searchsorted(ids, diagnostico_id))
+                if fila < len(ids) and ids[fila] == diagnostico_id:
+                    valores, codigos = self._columna(segmento, "inquilino")
+                    if valores[codigos[fila]] == inquilino:
+                        return self._diagnostico(segmento, fila)
+                # Los rangos de IDs pueden solaparse: puede estar en otro segmento
+        return None
+
+
+def archivar(dias: float, ahora: Optional[datetime] = None, filas_por_segmento: int = FILAS_POR_SEGMENTO,
+             compactar: bool = False) -> Dict[str, Any]:
+    """
+    Mueve los diagnósticos más viejos que `dias` al archivo frío
+
+    Cada segmento se escribe (y entra al índice) antes de borrar sus filas
+    de la tabla; si el proceso se corta en el medio, la próxima ejecución
+    borra las filas que ya estaban archivadas.
+
+    Args:
+        dias: Antigüedad mínima de las filas a archivar
+        ahora: Fecha de referencia (por defecto la actual, UTC)
+        filas_por_segmento: Filas por segmento (y por transacción de borrado)
+        compactar: Ejecutar VACUUM al final para devolver el espacio al disco
+
+    Returns:
+        Filas archivadas, segmentos nuevos y fecha de corte
+    """
+    ahora = ahora or datetime.now(timezone.utc)
+    corte = (ahora - timedelta(days=dias)).strftime(FORMATO_FECHA)
+    archivo = database.archivo_frio()
+    _reconciliar(archivo)
+
+    archivadas, segmentos = 0, 0
+    while True:
+        with database.get_db_connection() as conn:
+            filas = [dict(fila) for fila in conn.execute(f'''
+                SELECT {database.COLUMNAS_DIAGNOSTICO}, inquilino
+                FROM diagnosticos
+                WHERE fecha < ?
+                ORDER BY id
+                LIMIT ?
+            ''', (corte, filas_por_segmento))]
+        if not filas:
+            break
+        entrada = archivo.escribir_segmento(filas)
+        # Las filas elegidas son las de menor id con fecha < corte: se borran por rango
+        with database.get_db_connection() as conn:
+            conn.execute('DELETE FROM diagnosticos WHERE id <= ? AND fecha < ?', (entrada["id_max"], corte))
+        archivadas += len(filas)
+        segmentos += 1
+        if len(filas) < filas_por_segmento:
+            break
+
+    if compactar:
+        conn = database.sqlite3.connect(database.DATABASE_NAME)
+        conn.execute('VACUUM')
+        conn.close()
+    return {"archivadas": archivadas, "segmentos": segmentos, "corte": corte}
+
+
+def _reconciliar(archivo: ArchivoFrio) -> None:
+    """Borra de la tabla las filas del último segmento que hayan quedado (corte entre escribir y borrar)"""
+    segmentos = archivo.actualizar()
+    if not segmentos:
+        return
+    ultimo = max(segmentos, key=lambda s: s["numero"])
+    # Las filas sin archivar de ese rango de IDs tienen fecha posterior al corte
+    with database.get_db_connection() as conn:
+        conn.execute('DELETE FROM diagnosticos WHERE id BETWEEN ? AND ? AND fecha <= ?',
+                     (ultimo["id_min"], ultimo["id_max"], ultimo["fecha_max"]))
+
+
+class TareaRetencion:
+    """Hilo que archiva periódicamente (RETENCION_DIAS, cada RETENCION_INTERVALO segundos)"""
+
+    def __init__(self, dias: float, intervalo: float = 3600.0):
+        self.dias = dias
+        self.intervalo = intervalo
+        self._detener = threading.Event()
+        self._hilo: Optional[threading.Thread] = None
+
+    def _ciclo(self) -> None:
+        while not self._detener.wait(self.intervalo):
+            try:
+                archivar(self.dias)
+            except Exception as e:
+                print(f"Error en la tarea de retención: {e}")
+
+    def iniciar(self) -> None:
+        self._hilo = threading.Thread(target=self._ciclo, name="retencion", daemon=True)
+        self._hilo.start()
+
+    def detener(self) -> None:
+        self._detener.set()
+        if self._hilo is not None:
+            self._hilo.join()
+
+
+def tarea_configurada() -> Optional[TareaRetencion]:
+    """Tarea según RETENCION_DIAS (sin esa variable no se archiva automáticamente)"""
+    dias = os.environ.get("RETENCION_DIAS")
+    if not dias:
+        return None
+    return TareaRetencion(float(dias), float(os.environ.get("RETENCION_INTERVALO", "3600")))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Retención de diagnósticos en el archivo frío")
+    parser.add_argument("--db", help="Base de datos (por defecto la de la API)")
+    sub = parser.add_subparsers(dest="comando", required=True)
+    arc = sub.add_parser("archivar", help="Mueve los diagnósticos antiguos al archivo")
+    arc.add_argument("--dias", type=float, default=float(os.environ.get("RETENCION_DIAS", "90")))
+    arc.add_argument("--filas-por-segmento", type=int, default=FILAS_POR_SEGMENTO)
+    arc.add_argument("--compactar", action="store_true", help="VACUUM al terminar")
+    sub.add_parser("estado", help="Segmentos del archivo")
+    args = parser.parse_args()
+
+    if args.db:
+        database.DATABASE_NAME = args.db
+    if args.comando == "archivar":
+        resumen = archivar(args.dias, filas_por_segmento=args.filas_por_segmento, compactar=args.compactar)
+        print(f"{resumen['archivadas']:,} diagnósticos anteriores a {resumen['corte']} "
+              f"archivados en {resumen['segmentos']} segmentos")
+    else:
+        archivo = database.archivo_frio()
+        for segmento in archivo.actualizar():
+            print(f"{segmento['archivo']}  {segmento['filas']:>9,} filas  {segmento['bytes'] / 1024:>9,.0f} KB  "
+                  f"{segmento['fecha_min']} .. {segmento['fecha_max']}  ids {segmento['id_min']}-{segmento['id_max']}")
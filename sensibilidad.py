@@ -0,0 +1,115 @@
+"""
+Análisis de sensibilidad ("¿qué pasaría si...?") del diagnóstico
+
+Para cada sitio se calcula el diagnóstico que resultaría de invertir cada
+hecho observable, y opcionalmente cada par de hechos, para saber qué
+observación habría que corregir para bajar el nivel de riesgo.
+
+Con F hechos observables hay 2^F combinaciones posibles, así que cada base
+de reglas precalcula una tabla de decisión con la regla ganadora de cada
+combinación (un entero por combinación, sacado del diagrama de decisión de
+la base). Un lote de sitios se convierte en un vector de máscaras de bits y
+todos los cambios se resuelven con un XOR y una indexación de numpy, sin
+llamar al motor por cada sitio y cada cambio.
+
+La tabla crece al doble con cada hecho: solo se arma con hasta
+MAX_HECHOS_TABLA hechos y la primera vez que se pide (ver
+BaseReglas.sensibilidad). Se llena recorriendo el diagrama de decisión con
+todas las máscaras a la vez, un paso por nivel.
+"""
+
+from itertools import combinations
+from typing import Any, Dict, List, Sequence
+
+import numpy as np
+
+from bdd import ReglasCompiladas
+from reglas import ORDEN_RIESGO
+
+# Con más hechos que esto la tabla (2^F enteros) ocuparía demasiado
+MAX_HECHOS_TABLA = 20
+
+FILTROS = ("todos", "cambios", "mejoras")
+
+
+class DemasiadosHechos(ValueError):
+    """La base tiene más hechos observables de los que entran en la tabla de decisión"""
+
+
+class TablaDecision:
+    """Regla ganadora de cada combinación de hechos observables"""
+
+    def __init__(self, compiladas: ReglasCompiladas, hechos: Sequence[str]):
+        self.hechos = list(hechos)
+        if len(self.hechos) > MAX_HECHOS_TABLA:
+            raise DemasiadosHechos(f"Demasiados hechos para la tabla de decisión "
+                                   f"({len(self.hechos)}, máximo {MAX_HECHOS_TABLA})")
+        reglas = self.reglas = compiladas.reglas
+        n = len(self.hechos)
+
+        self.ganadora = compiladas.indices(self.hechos, np.arange(1 << n, dtype=np.int64)).astype(np.int32)
+
+        # Nivel de riesgo por regla (0 = ALTO); la última posición es "sin diagnóstico"
+        # y se indexa con -1, que es lo que devuelve la tabla cuando no hay regla
+        self._nivel = np.array([ORDEN_RIESGO.get(regla["riesgo"], 3) for regla in reglas] + [len(ORDEN_RIESGO)])
+        self._resumen = [{"regla_id": regla["id"], "riesgo": regla["riesgo"]} for regla in reglas] + [None]
+
+        bits = [1 << bit for bit in range(n)]
+        self._simples = [[self.hechos[bit]] for bit in range(n)]
+        self._pares = [[self.hechos[a], self.hechos[b]] for a, b in combinations(range(n), 2)]
+        self._desplazamientos_simples = np.array(bits, dtype=np.int64)
+        self._desplazamientos_pares = np.array([bits[a] | bits[b] for a, b in combinations(range(n), 2)],
+                                               dtype=np.int64)
+
+    def mascaras(self, observaciones: Sequence[Dict[str, bool]]) -> np.ndarray:
+        """Máscara de bits de cada observación (los hechos que no son observables se ignoran)"""
+        mascaras = np.zeros(len(observaciones), dtype=np.int64)
+        for bit, hecho in enumerate(self.hechos):
+            mascaras |= np.fromiter((bool(o.get(hecho)) for o in observaciones), dtype=bool,
+                                    count=len(observaciones)).astype(np.int64) << bit
+        return mascaras
+
+    def analizar(self, observaciones: Sequence[Dict[str, bool]], pares: bool = False,
+                 filtro: str = "todos") -> List[Dict[str, Any]]:
+        """
+        Diagnóstico actual y después de cada cambio, para un lote de sitios
+
+        Args:
+            observaciones: Hechos observados de cada sitio
+            pares: Incluir también los cambios de dos hechos a la vez
+            filtro: "todos" los cambios, solo los que "cambian" el diagnóstico
+                    o solo las "mejoras" (los que bajan el nivel de riesgo)
+
+        Returns:
+            Por sitio: diagnostico (regla_id y riesgo, o None) y la lista de
+            cambios con los hechos invertidos, el diagnóstico resultante y
+            baja_riesgo
+        """
+        if filtro not in FILTROS:
+            raise ValueError(f"Filtro desconocido: {filtro}")
+        mascaras = self.mascaras(observaciones)
+        etiquetas = self._simples + (self._pares if pares else [])
+        desplazamientos = self._desplazamientos_simples
+        if pares:
+            desplazamientos = np.concatenate((desplazamientos, self._desplazamientos_pares))
+
+        actual = self.ganadora[mascaras]
+        # (sitios, cambios): regla ganadora después de invertir cada hecho o par
+        cambiada = self.ganadora[mascaras[:, None] ^ desplazamientos[None, :]]
+        baja = self._nivel[cambiada] > self._nivel[actual][:, None]
+        if filtro == "mejoras":
+            mostrar = baja
+        elif filtro == "cambios":
+            mostrar = cambiada != actual[:, None]
+        else:
+            mostrar = np.ones_like(baja)
+
+        resumen = self._resumen
+        resultados = [{"diagnostico": resumen[regla], "cambios": []} for regla in actual.tolist()]
+        sitios, indices = np.nonzero(mostrar)
+        for sitio, k, regla, menor in zip(sitios.tolist(), indices.tolist(),
+                                          cambiada[sitios, indices].tolist(), baja[sitios, indices].tolist()):
+            resultados[sitio]["cambios"].append(
+                {"invertir": etiquetas[k], "diagnostico": resumen[regla], "baja_riesgo": menor}
+            )
+        return resultados
@@ -0,0 +1,153 @@
+"""
+Serialización rápida de las respuestas de la API
+
+Las respuestas de diagnóstico se arman concatenando el JSON ya serializado
+de cada regla (calculado una sola vez), en lugar de dejar que FastAPI
+revalide el response_model y vuelva a codificar los textos de las reglas en
+cada petición. Si el cliente envía `Accept: application/msgpack` y el
+paquete `msgpack` está instalado, se responde en MessagePack.
+
+orjson y msgpack son opcionales: sin ellos se usa el módulo json estándar.
+"""
+
+import base64
+import hashlib
+import json
+from typing import Any, Dict, Iterable, List, Optional, Sequence
+
+from fastapi import Request
+from fastapi.responses import Response
+
+from registros import Regla, a_json, compilar_reglas
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+TIPO_JSON = "application/json"
+TIPOS_MSGPACK = ("application/msgpack", "application/x-msgpack")
+
+
+def dumps(datos: Any) -> bytes:
+    """Serializa a JSON compacto en UTF-8"""
+    if orjson is not None:
+        return orjson.dumps(datos, default=a_json)
+    return json.dumps(datos, ensure_ascii=False, separators=(",", ":"), default=a_json).encode("utf-8")
+
+
+class CatalogoSerializado:
+    """
+    JSON de cada regla (sin la condición) y del catálogo, calculado una vez
+    por base de reglas. La versión es una huella del contenido completo,
+    condiciones incluidas, así que cambia con cualquier edición de las reglas.
+    """
+
+    __slots__ = ("version", "datos", "json", "_fragmentos")
+
+    def __init__(self, reglas: Iterable[Dict[str, Any]]):
+        """
+        Args:
+            reglas: Reglas con el mismo formato que REGLAS_AMBIENTALES
+        """
+        reglas = compilar_reglas(reglas)
+        limpias = {regla["id"]: dict(regla) for regla in reglas}
+        self._fragmentos: Dict[str, bytes] = {regla_id: dumps(regla) for regla_id, regla in limpias.items()}
+
+        cuerpo = b"{" + b",".join(dumps(regla_id) + b":" + fragmento
+                                  for regla_id, fragmento in self._fragmentos.items()) + b"}"
+        condiciones = dumps([regla.condicion.a_dict() for regla in reglas])
+        self.version = hashlib.sha256(cuerpo + condiciones).hexdigest()[:12]
+        self.datos = {"version": self.version, "reglas": limpias}
+        self.json = b'{"version":"' + self.version.encode() + b'","reglas":' + cuerpo + b"}"
+
+    def _fragmento(self, regla: Dict[str, Any]) -> bytes:
+        """JSON precalculado de una regla devuelta por el motor de inferencia"""
+        # Atributo directo en los registros: evita el acceso genérico de Mapping
+        fragmento = self._fragmentos.get(regla.id if isinstance(regla, Regla) else regla.get("id"))
+        if fragmento is None:
+            return dumps(regla)
+        return fragmento
+
+    def json_diagnostico(self, resultado: Optional[Dict[str, Any]], diagnostico_id: int) -> bytes:
+        """
+        JSON de la respuesta de /diagnosticar: {"diagnostico": {...regla, "diagnostico_id": N}}
+        """
+        if resultado is None:
+            return b'{"diagnostico":{"diagnostico_id":' + str(diagnostico_id).encode() + b'}}'
+        # Se reemplaza la llave de cierre de la regla por el ID del diagnóstico
+        return (b'{"diagnostico":' + self._fragmento(resultado)[:-1]
+                + b',"diagnostico_id":' + str(diagnostico_id).encode() + b'}}')
+
+    def json_diagnosticos(self, resultados: List[Dict[str, Any]]) -> bytes:
+        """
+        JSON de la respuesta de /diagnosticar-multiple: {"diagnosticos": [...], "total": N}
+        """
+        return (b'{"diagnosticos":[' + b",".join(self._fragmento(r) for r in resultados)
+                + b'],"total":' + str(len(resultados)).encode() + b'}')
+
+
+class TablaCliente:
+    """Tabla de decisión, preguntas y textos de una base de reglas, en el JSON que descarga el navegador"""
+
+    __slots__ = ("etag", "datos", "json")
+
+    def __init__(self, tabla: "TablaDecision", catalogo: CatalogoSerializado, preguntas: Sequence[Dict[str, str]]):
+        """
+        Args:
+            tabla: Tabla de decisión de la base
+            catalogo: Catálogo serializado de la misma base (versión y textos)
+            preguntas: Hechos observables con su pregunta (deben incluir los de la tabla)
+        """
+        por_id = {hecho["id"]: hecho for hecho in preguntas}
+        tipo = "<u1" if len(tabla.reglas) < 255 else "<u2"
+        # -1 (sin regla) pasa a 0 y la regla k a k + 1
+        codigos = (tabla.ganadora + 1).astype(tipo)
+        self.datos = {
+            "version": catalogo.version,
+            "hechos": [dict(por_id[hecho]) for hecho in tabla.hechos],
+            "reglas": [regla["id"] for regla in tabla.reglas],
+            "bytes_por_entrada": codigos.itemsize,
+            "tabla": base64.b64encode(codigos.tobytes()).decode("ascii"),
+            "textos": catalogo.datos["reglas"],
+        }
+        self.json = dumps(self.datos)
+        self.etag = '"' + hashlib.sha256(self.json).hexdigest()[:16] + '"'
+
+
+def acepta_msgpack(request: Request) -> bool:
+    """Indica si el cliente pidió MessagePack y se puede generar"""
+    if msgpack is None:
+        return False
+    accept = request.headers.get("accept", "")
+    return any(tipo in accept for tipo in TIPOS_MSGPACK)
+
+
+def respuesta_negociada(request: Request, datos: Any, cuerpo_json: Optional[bytes] = None,
+                        headers: Optional[Dict[str, str]] = None) -> Response:
+    """
+    Devuelve los datos en MessagePack o JSON según el encabezado Accept
+
+    Args:
+        request: Petición entrante
+        datos: Datos a serializar, o función que los arma (solo se llama si hacen falta)
+        cuerpo_json: JSON ya armado (se usa en lugar de serializar `datos`)
+        headers: Encabezados adicionales
+
+    Returns:
+        Respuesta sin pasar por la validación del response_model
+    """
+    headers = {"Vary": "Accept", **(headers or {})}
+    if acepta_msgpack(request):
+        if callable(datos):
+            datos = datos()
+        return Response(content=msgpack.packb(datos, use_bin_type=True, default=a_json),
+                        media_type=TIPOS_MSGPACK[0], headers=headers)
+    if cuerpo_json is None:
+        cuerpo_json = dumps(datos() if callable(datos) else datos)
+    return Response(content=cuerpo_json, media_type=TIPO_JSON, headers=headers)
@@ -0,0 +1,75 @@
+"""
+Diagnóstico sin conexión en el navegador y sincronización por lotes
+
+Las cuadrillas de campo pierden la conexión y cada diagnóstico del
+cuestionario necesitaba ir y volver a /diagnosticar. Con F hechos
+observables hay 2^F combinaciones y cada base de reglas ya precalcula la
+regla ganadora de cada una (TablaDecision, ver sensibilidad.py). Esa tabla
+se exporta en /reglas/tabla junto con las preguntas y el texto de las
+reglas (TablaCliente, en serializacion.py). El navegador la guarda y
+diagnostica con una indexación: arma la máscara de bits de las respuestas
+(bit i = hechos[i]) y lee la entrada.
+
+Formato de la tabla: bytes en base64, `bytes_por_entrada` (1 o 2) por
+combinación, little-endian; 0 = sin regla aplicable y k = reglas[k - 1].
+La respuesta lleva un ETag del contenido y el navegador la revalida con
+If-None-Match.
+
+Los diagnósticos hechos en el navegador quedan en una cola local y se
+envían a /diagnosticos/sincronizar cuando hay conexión. Cada uno lleva
+la clave de idempotencia que generó el navegador, así que reenviar un lote
+(por ejemplo, si se cortó la respuesta) no duplica nada. El servidor vuelve
+a diagnosticar todo el lote con su base vigente, en una sola operación sobre
+la misma tabla. Ese es el diagnóstico que se guarda. Si la tabla del
+navegador era vieja, la respuesta indica que el resultado difiere.
+"""
+
+import os
+from typing import Any, Dict, List, Optional, Sequence
+
+from almacenamiento import Almacen
+from registros import Regla
+from sensibilidad import TablaDecision
+
+# Diagnósticos por llamada a /diagnosticos/sincronizar
+MAX_SINCRONIZACION = int(os.environ.get("SINCRONIZACION_MAX", "1000"))
+
+
+def sincronizar(almacen: Almacen, tabla: TablaDecision, version: str, pendientes: Sequence[Dict[str, Any]],
+                inquilino: str = '') -> List[Dict[str, Any]]:
+    """
+    Diagnostica y guarda de una vez los diagnósticos hechos sin conexión
+
+    Args:
+        almacen: Dónde guardarlos
+        tabla: Tabla de decisión de la base vigente
+        version: Versión de esa base (se guarda con cada diagnóstico)
+        pendientes: Diccionarios con clave, hechos y regla_id (el que dio la tabla del navegador)
+        inquilino: Inquilino dueño de los diagnósticos
+
+    Returns:
+        Por diagnóstico, en el mismo orden: clave, diagnostico_id, regla_id
+        del servidor, coincide (si es el mismo del navegador) y estado:
+        "nuevo", "repetido" (la clave ya se había sincronizado) o "conflicto"
+        (la clave ya se usó con otros hechos; diagnostico_id es el de entonces)
+    """
+    ganadoras = tabla.ganadora[tabla.mascaras([p["hechos"] for p in pendientes])].tolist()
+    reglas: List[Optional[Regla]] = [None if indice < 0 else tabla.reglas[indice] for indice in ganadoras]
+    guardados = almacen.guardar_con_claves(
+        [(p["clave"], p["hechos"], regla) for p, regla in zip(pendientes, reglas)], version, inquilino
+    )
+    resultados = []
+    for pendiente, regla, (diagnostico_id, previos) in zip(pendientes, reglas, guardados):
+        if previos is None:
+            estado = "nuevo"
+        else:
+            estado = "repetido" if previos == pendiente["hechos"] else "conflicto"
+        regla_id = None if regla is None else regla["id"]
+        resultados.append({
+            "clave": pendiente["clave"],
+            "diagnostico_id": diagnostico_id,
+            "estado": estado,
+            "regla_id": regla_id,
+            "coincide": pendiente.get("regla_id") == regla_id,
+        })
+    return resultados
@@ -0,0 +1,261 @@
+"""
+Ingesta de telemetría de estaciones de monitoreo
+
+Las estaciones envían series numéricas (ruido en dB, turbidez en NTU,
+PM2.5, humedad...). Para cada estación y variable se mantiene una ventana
+deslizante en arreglos compactos (array('d')) con la media y el máximo
+actualizados de forma incremental. Tras cada lote se derivan los hechos
+observables según los umbrales configurados, se ejecuta el motor con
+lógica de tres valores (los hechos sin sensor quedan desconocidos) y solo
+se guardan los cambios de estado.
+
+Las lecturas crudas se acumulan en memoria y se escriben por bloques
+columnares (un BLOB de tiempos y otro de valores por estación y variable),
+en una sola transacción por vaciado.
+"""
+
+import json
+import math
+import os
+import threading
+import time
+from array import array
+from collections import deque
+from typing import Any, Dict, List, Optional, Tuple
+
+from database import guardar_bloques_lecturas, guardar_cambios_estado
+from base_reglas import base_vigente
+
+# Umbrales por defecto: el hecho se considera presente si la agregación de la
+# variable en la ventana supera el umbral. Se pueden reemplazar con un JSON
+# indicado en la variable de entorno TELEMETRIA_UMBRALES.
+UMBRALES_TELEMETRIA = [
+    {"variable": "ruido_db", "hecho": "ruido_elevado", "agregacion": "media", "ventana_min": 10, "umbral": 70.0},
+    {"variable": "turbidez_ntu", "hecho": "agua_turbia", "agregacion": "media", "ventana_min": 15, "umbral": 5.0},
+    {"variable": "pm25", "hecho": "aire_contaminado", "agregacion": "media", "ventana_min": 60, "umbral": 35.0},
+    {"variable": "humedad", "hecho": "humedad_excesiva", "agregacion": "media", "ventana_min": 30, "umbral": 85.0},
+]
+
+AGREGACIONES = ("media", "max")
+
+
+def cargar_umbrales() -> List[Dict[str, Any]]:
+    """Umbrales del archivo TELEMETRIA_UMBRALES, o los de por defecto"""
+    ruta = os.environ.get("TELEMETRIA_UMBRALES")
+    if not ruta:
+        return UMBRALES_TELEMETRIA
+    with open(ruta, encoding="utf-8") as f:
+        umbrales = json.load(f)
+    for umbral in umbrales:
+        if umbral.get("agregacion") not in AGREGACIONES:
+            raise ValueError(f"Agregación inválida en {ruta}: {umbral.get('agregacion')}")
+    return umbrales
+
+
+class SerieVentana:
+    """Lecturas de una variable dentro de una ventana de tiempo deslizante"""
+
+    __slots__ = ("duracion", "tiempos", "valores", "inicio", "suma", "_maximos")
+
+    def __init__(self, duracion_segundos: float):
+        self.duracion = duracion_segundos
+        self.tiempos = array("d")
+        self.valores = array("d")
+        self.inicio = 0
+        self.suma = 0.0
+        # Cola monótona decreciente de (tiempo, valor) para el máximo
+        self._maximos: deque = deque()
+
+    def agregar(self, t: float, valor: float) -> None:
+        self.tiempos.append(t)
+        self.valores.append(valor)
+        self.suma += valor
+        while self._maximos and self._maximos[-1][1] <= valor:
+            self._maximos.pop()
+        self._maximos.append((t, valor))
+        self._recortar(t - self.duracion)
+
+    def _recortar(self, limite: float) -> None:
+        tiempos, valores = self.tiempos, self.valores
+        while self.inicio < len(tiempos) and tiempos[self.inicio] < limite:
+            self.suma -= valores[self.inicio]
+            self.inicio += 1
+        while self._maximos and self._maximos[0][0] < limite:
+            self._maximos.popleft()
+        # Compactar cuando la parte vencida ocupa más de la mitad
+        if self.inicio > 1024 and self.inicio * 2 > len(tiempos):
+            del tiempos[:self.inicio]
+            del valores[:self.inicio]
+            self.inicio = 0
+
+    @property
+    def cantidad(self) -> int:
+        return len(self.tiempos) - self.inicio
+
+    def media(self) -> Optional[float]:
+        return self.suma / self.cantidad if self.cantidad else None
+
+    def maximo(self) -> Optional[float]:
+        return self._maximos[0][1] if self._maximos else None
+
+
+class ProcesadorTelemetria:
+    """Ventanas por estación, derivación de hechos y escritura por lotes"""
+
+    def __init__(self, umbrales: Optional[List[Dict[str, Any]]] = None,
+                 max_pendientes: int = 5000, max_segundos: float = 5.0):
+        self.umbrales = umbrales if umbrales is not None else cargar_umbrales()
+        self.max_pendientes = max_pendientes
+        self.max_segundos = max_segundos
+        # Duración de ventana por variable (la mayor si hay varios umbrales)
+        self._ventanas: Dict[str, float] = {}
+        for umbral in self.umbrales:
+            segundos = umbral["ventana_min"] * 60.0
+            self._ventanas[umbral["variable"]] = max(segundos, self._ventanas.get(umbral["variable"], 0.0))
+        self._series: Dict[Tuple[str, str], SerieVentana] = {}
+        self._estados: Dict[str, Dict[str, Any]] = {}
+        self._pendientes: Dict[Tuple[str, str], Tuple[array, array]] = {}
+        self._n_pendientes = 0
+        self._ultimo_vaciado = time.monotonic()
+        self._lock = threading.Lock()
+        self.lecturas_totales = 0
+
+    def ingerir(self, series: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """
+        Procesa un lote de series columnares
+
+        El lote se valida completo antes de tocar las ventanas: si una serie
+        es inválida no se aplica ninguna.
+
+        Args:
+            series: Lista de {"estacion", "variable", "tiempos": [...], "valores": [...]}
+                    (tiempos en segundos Unix)
+
+        Returns:
+            Cantidad de lecturas procesadas y cambios de estado detectados
+
+        Raises:
+            ValueError: Si una serie tiene tiempos y valores de distinto largo, o
+                        lecturas anteriores a la última recibida de esa estación y variable
+        """
+        with self._lock:
+            ordenadas = self._validar(series)
+
+            estaciones = set()
+            n_lecturas = 0
+            for clave, tiempos, valores in ordenadas:
+                ventana = self._series.get(clave)
+                if ventana is None:
+                    ventana = self._series[clave] = SerieVentana(self._ventanas.get(clave[1], 0.0))
+                for t, valor in zip(tiempos, valores):
+                    ventana.agregar(t, valor)
+
+                pendiente = self._pendientes.setdefault(clave, (array("d"), array("d")))
+                pendiente[0].extend(tiempos)
+                pendiente[1].extend(valores)
+                n_lecturas += len(tiempos)
+                estaciones.add(clave[0])
+
+            self._n_pendientes += n_lecturas
+            self.lecturas_totales += n_lecturas
+            cambios = [c for c in (self._evaluar(e) for e in sorted(estaciones)) if c]
+            if cambios:
+                guardar_cambios_estado(cambios)
+            if (self._n_pendientes >= self.max_pendientes
+                    or time.monotonic() - self._ultimo_vaciado >= self.max_segundos):
+                self._vaciar()
+
+        return {"lecturas": n_lecturas, "cambios": cambios}
+
+    def _validar(self, series: List[Dict[str, Any]]) -> List[Tuple[Tuple[str, str], Any, Any]]:
+        """
+        Ordena cada serie por tiempo y comprueba que se pueda agregar a su
+        ventana: la cola de máximos y el recorte por tiempo suponen lecturas
+        en orden, así que no se aceptan lecturas anteriores a la última ya
+        recibida (en ventanas anteriores o antes en el mismo lote). Tampoco
+        tiempos o valores NaN o infinitos: dejarían la suma de la ventana en NaN
+        """
+        ultimos: Dict[Tuple[str, str], float] = {}
+        ordenadas = []
+        for serie in series:
+            clave = (serie["estacion"], serie["variable"])
+            tiempos, valores = serie["tiempos"], serie["valores"]
+            if len(tiempos) != len(valores):
+                raise ValueError(f"Serie {clave}: tiempos y valores tienen distinto largo")
+            if not tiempos:
+                continue
+            if not all(map(math.isfinite, tiempos)) or not all(map(math.isfinite, valores)):
+                raise ValueError(f"Serie {clave}: hay tiempos o valores NaN o infinitos")
+            if any(a > b for a, b in zip(tiempos, tiempos[1:])):
+                tiempos, valores = zip(*sorted(zip(tiempos, valores)))
+
+            ultimo = ultimos.get(clave)
+            if ultimo is None:
+                ventana = self._series.get(clave)
+                ultimo = ventana.tiempos[-1] if ventana is not None and ventana.tiempos else None
+            if ultimo is not None and tiempos[0] < ultimo:
+                raise ValueError(f"Serie {clave}: lecturas anteriores a la última recibida ({ultimo})")
+            ultimos[clave] = tiempos[-1]
+            ordenadas.append((clave, tiempos, valores))
+        return ordenadas
+
+    def hechos_derivados(self, estacion: str) -> Dict[str, Optional[bool]]:
+        """Hechos derivados de las ventanas actuales (solo los que tienen datos)"""
+        hechos: Dict[str, Optional[bool]] = {}
+        for umbral in self.umbrales:
+            ventana = self._series.get((estacion, umbral["variable"]))
+            if ventana is None or not ventana.cantidad:
+                continue
+            valor = ventana.media() if umbral["agregacion"] == "media" else ventana.maximo()
+            # Varias variables pueden indicar el mismo hecho: basta con una
+            hechos[umbral["hecho"]] = hechos.get(umbral["hecho"]) or valor > umbral["umbral"]
+        return hechos
+
+    def _evaluar(self, estacion: str) -> Optional[Dict[str, Any]]:
+        """Ejecuta el motor para la estación y devuelve el cambio de estado, si lo hay"""
+        hechos = self.hechos_derivados(estacion)
+        resultado = base_vigente().diagnosticar_parcial(hechos)
+        diagnostico = resultado["diagnostico"]
+        estado = {
+            "estacion": estacion,
+            "hechos": hechos,
+            "regla_id": diagnostico["id"] if diagnostico else None,
+            "riesgo": diagnostico["riesgo"] if diagnostico else None,
+            "decidido": resultado["decidido"],
+            "posibles": resultado["posibles"],
+        }
+        anterior = self._estados.get(estacion)
+        self._estados[estacion] = estado
+        if anterior and all(anterior[k] == estado[k] for k in ("hechos", "regla_id", "decidido")):
+            return None
+        return estado
+
+    def estado(self, estacion: str) -> Optional[Dict[str, Any]]:
+        """Último estado evaluado y agregaciones actuales de una estación"""
+        with self._lock:
+            estado = self._estados.get(estacion)
+            if estado is None:
+                return None
+            variables = {
+                variable: {"cantidad": ventana.cantidad, "media": ventana.media(), "max": ventana.maximo()}
+                for (nombre, variable), ventana in self._series.items() if nombre == estacion
+            }
+            return dict(estado, variables=variables)
+
+    def vaciar(self) -> int:
+        """Escribe en la BD las lecturas pendientes"""
+        with self._lock:
+            return self._vaciar()
+
+    def _vaciar(self) -> int:
+        bloques = [
+            (estacion, variable, tiempos[0], tiempos[-1], len(tiempos), tiempos.tobytes(), valores.tobytes())
+            for (estacion, variable), (tiempos, valores) in self._pendientes.items() if tiempos
+        ]
+        if bloques:
+            guardar_bloques_lecturas(bloques)
+        escritas = self._n_pendientes
+        self._pendientes.clear()
+        self._n_pendientes = 0
+        self._ultimo_vaciado = time.monotonic()
+        return escritas
@@ -0,0 +1,100 @@
+"""
+Tests del control de admisión
+
+Ejecutar con: pytest test_admision.py -v
+"""
+
+import pytest
+from fastapi.testclient import TestClient
+
+import database
+import main
+from admision import ClaseAdmision, ControlAdmision
+
+
+class Reloj:
+    """Reloj manual para las cubetas de fichas"""
+
+    def __init__(self):
+        self.ahora = 0.0
+
+    def __call__(self):
+        return self.ahora
+
+
+@pytest.fixture
+def cliente(tmp_path, monkeypatch):
+    """Cliente con base de datos temporal y límites estrictos para los PDF"""
+    monkeypatch.setattr(database, "DATABASE_NAME", str(tmp_path / "test.db"))
+    database.init_database()
+    monkeypatch.setitem(main.control_admision.clases, "pdf",
+                        ClaseAdmision("pdf", concurrencia=1, tasa=0.01, rafaga=2))
+    with TestClient(main.app) as c:
+        yield c
+
+
+class TestClaseAdmision:
+    """Tests de los límites de una clase"""
+
+    def test_cubeta_de_fichas(self):
+        """Se admite una ráfaga y luego se recupera una ficha por cada 1/tasa segundos"""
+        reloj = Reloj()
+        clase = ClaseAdmision("lote", concurrencia=10, tasa=2.0, rafaga=3, reloj=reloj)
+        for _ in range(3):
+            assert clase.admitir("a") is None
+            clase.liberar()
+
+        assert clase.admitir("a") == (429, 1)
+        assert clase.admitir("b") is None
+        clase.liberar()
+        reloj.ahora = 0.5
+        assert clase.admitir("a") is None
+        assert clase.rechazadas_tasa == 1
+
+    def test_concurrencia(self):
+        """Con la clase llena se rechaza con 503 sin gastar fichas"""
+        clase = ClaseAdmision("pdf", concurrencia=2, tasa=1.0, rafaga=5)
+        assert clase.admitir("a") is None
+        assert clase.admitir("b") is None
+        assert clase.admitir("c") == (503, 1)
+
+        clase.liberar()
+        assert clase.admitir("c") is None
+        assert clase.estadisticas()["rechazadas_concurrencia"] == 1
+        assert clase.estadisticas()["max_en_curso"] == 2
+
+    def test_clasificacion(self):
+        """Cada ruta cae en su clase; /diagnosticar-certeza-lote no es inferencia"""
+        control = ControlAdmision()
+
+        assert control.clasificar("GET", "/descargar-pdf/7").nombre == "pdf"
+        assert control.clasificar("POST", "/diagnosticar-certeza-lote").nombre == "lote"
+        assert control.clasificar("POST", "/diagnosticar").nombre == "inferencia"
+        assert control.clasificar("GET", "/telemetria/est-1") is None
+        assert control.clasificar("GET", "/historial") is None
+
+
+class TestApiAdmision:
+    """Tests del middleware sobre la API"""
+
+    def test_pdf_limitado_sin_afectar_diagnosticos(self, cliente):
+        """Al agotar las fichas de PDF se responde 429 y /diagnosticar sigue atendiendo"""
+        diagnostico_id = cliente.post("/diagnosticar", json={"hechos": {"ruido_elevado": True}}).json()[
+            "diagnostico"]["diagnostico_id"]
+        codigos = [cliente.get(f"/descargar-pdf/{diagnostico_id}").status_code for _ in range(3)]
+        rechazo = cliente.get(f"/descargar-pdf/{diagnostico_id}")
+
+        assert codigos == [200, 200, 429]
+        assert int(rechazo.headers["retry-after"]) >= 1
+        assert "error" in rechazo.json()
+        assert cliente.post("/diagnosticar", json={"hechos": {}}).status_code == 200
+        assert cliente.get("/admision").json()["pdf"]["rechazadas_tasa"] == 2
+
+    def test_clientes_separados(self, cliente):
+        """La cubeta es por cliente: otro inquilino tiene sus propias fichas"""
+        for _ in range(3):
+            cliente.get("/descargar-historial-pdf")
+        res = cliente.get("/descargar-historial-pdf", headers={"X-Inquilino": "otro"})
+
+        # El inquilino no existe (404), pero pasó la admisión
+        assert res.status_code == 404
@@ -0,0 +1,243 @@
+"""
+Tests de conformidad de los motores de almacenamiento (sqlite, memoria, log)
+
+Los mismos tests corren contra cada motor.
+
+Ejecutar con: pytest test_almacenamiento.py -v
+"""
+
+import threading
+
+import pytest
+from fastapi.testclient import TestClient
+
+import database
+import main
+from almacenamiento import AlmacenLog, AlmacenMemoria, AlmacenSQLite, MOTORES, crear_almacen
+from reglas import REGLAS_COMPILADAS, motor_inferencia
+from serializacion import dumps
+
+
+HECHOS_AGUA = {"agua_turbia": True, "olor_fuerte": True, "humedad_excesiva": True}
+HECHOS_RUIDO = {"ruido_elevado": True}
+
+
+@pytest.fixture(params=MOTORES)
+def almacen(request, monkeypatch, tmp_path):
+    """Cada motor, vacío y sin observadores"""
+    monkeypatch.setattr(database, "_observadores_guardado", [])
+    if request.param == "sqlite":
+        monkeypatch.setattr(database, "DATABASE_NAME", str(tmp_path / "conformidad.db"))
+        database.init_database()
+    almacen = crear_almacen(request.param, str(tmp_path / "conformidad.log"))
+    yield almacen
+    almacen.cerrar()
+
+
+def guardar(almacen, hechos, **kwargs):
+    """Diagnostica y guarda; devuelve el ID"""
+    return almacen.guardar(hechos, motor_inferencia(hechos), **kwargs)
+
+
+class TestConformidad:
+    """Comportamiento común a todos los motores"""
+
+    def test_guardar_y_obtener(self, almacen):
+        """El diagnóstico guardado se lee con los mismos datos"""
+        diagnostico_id = guardar(almacen, HECHOS_AGUA, version_reglas="v1")
+        regla = motor_inferencia(HECHOS_AGUA)
+
+        leido = almacen.obtener(diagnostico_id)
+        assert leido["id"] == diagnostico_id
+        assert leido["hechos"] == HECHOS_AGUA
+        assert leido["regla_id"] == regla["id"]
+        assert leido["acciones"] == list(regla["acciones"])
+        assert leido["version_reglas"] == "v1"
+        assert almacen.obtener(diagnostico_id + 1000) is None
+
+    def test_sin_diagnostico(self, almacen):
+        """Sin regla aplicable se guardan los valores de SIN_DIAGNOSTICO"""
+        leido = almacen.obtener(almacen.guardar({}, None))
+
+        assert leido["regla_id"] is None
+        assert leido["riesgo"] == "BAJO"
+
+    def test_inquilinos_separados(self, almacen):
+        """Un inquilino no ve los diagnósticos de otro"""
+        diagnostico_id = guardar(almacen, HECHOS_AGUA, inquilino="norte")
+
+        assert almacen.obtener(diagnostico_id) is None
+        assert almacen.obtener(diagnostico_id, "norte") is not None
+        assert almacen.historial() == []
+        assert almacen.estadisticas("norte")["total"] == 1
+
+    def test_clave_idempotencia(self, almacen):
+        """La misma clave devuelve el mismo ID sin guardar otra fila"""
+        primero = guardar(almacen, HECHOS_AGUA, clave_idempotencia="k1")
+        segundo = guardar(almacen, HECHOS_AGUA, clave_idempotencia="k1")
+
+        assert primero == segundo
+        assert almacen.estadisticas()["total"] == 1
+        assert almacen.buscar_por_clave("k1")["id"] == primero
+        assert almacen.buscar_por_clave("k1", "norte") is None
+
+    def test_clave_con_otros_hechos(self, almacen):
+        """La misma clave con otros hechos no guarda y devuelve el diagnóstico previo"""
+        primero = guardar(almacen, HECHOS_AGUA, clave_idempotencia="k1")
+
+        with pytest.raises(database.ClaveIdempotenciaUsada) as error:
+            guardar(almacen, HECHOS_RUIDO, clave_idempotencia="k1")
+
+        assert error.value.existente["id"] == primero
+        assert error.value.existente["hechos"] == HECHOS_AGUA
+        assert almacen.estadisticas()["total"] == 1
+
+    def test_historial_paginado(self, almacen):
+        """Del más reciente al más antiguo, con límite y desplazamiento"""
+        ids = [guardar(almacen, HECHOS_AGUA if i % 2 else HECHOS_RUIDO) for i in range(7)]
+
+        assert [d["id"] for d in almacen.historial(limite=3)] == ids[::-1][:3]
+        assert [d["id"] for d in almacen.historial(limite=3, offset=5)] == ids[::-1][5:]
+        assert almacen.historial(limite=3, offset=10) == []
+
+    def test_historial_despues_de_la_ultima_fila(self, almacen):
+        """Paginar con antes = (fecha, id) de la última fila da lo mismo que con offset"""
+        ids = [guardar(almacen, HECHOS_AGUA if i % 2 else HECHOS_RUIDO) for i in range(7)]
+
+        paginas, antes = [], None
+        while True:
+            pagina = almacen.historial(limite=3, antes=antes)
+            paginas += [d["id"] for d in pagina]
+            if len(pagina) < 3:
+                break
+            antes = (pagina[-1]["fecha"], pagina[-1]["id"])
+        assert paginas == ids[::-1]
+
+    def test_rango_de_fechas(self, almacen):
+        """desde es inclusivo y hasta exclusivo"""
+        guardar(almacen, HECHOS_AGUA)
+        guardar(almacen, HECHOS_RUIDO)
+        fecha = almacen.historial(limite=1)[0]["fecha"]
+
+        assert len(almacen.historial(desde=fecha)) == 2
+        assert almacen.historial(hasta=fecha) == []
+        assert almacen.estadisticas(desde="2000-01-01 00:00:00", hasta="2999-01-01 00:00:00")["total"] == 2
+        assert almacen.estadisticas(desde="2999-01-01 00:00:00")["total"] == 0
+
+    def test_lote_y_estadisticas(self, almacen):
+        """guardar_lote guarda todo y las estadísticas lo cuentan"""
+        pares = [(dumps(h).decode(), motor_inferencia(h)) for h in [HECHOS_AGUA] * 3 + [HECHOS_RUIDO] * 2 + [{}]]
+
+        assert almacen.guardar_lote(pares, "v2") == 6
+        estadisticas = almacen.estadisticas()
+        riesgo_agua = motor_inferencia(HECHOS_AGUA)["riesgo"]
+        assert estadisticas["total"] == 6
+        assert sum(estadisticas["por_riesgo"].values()) == 6
+        assert estadisticas["por_riesgo"][riesgo_agua] >= 3
+        assert estadisticas["por_categoria"][motor_inferencia(HECHOS_AGUA)["categoria"]] == 3
+        assert almacen.historial(limite=1)[0]["hechos"] == {}
+
+    def test_observadores(self, almacen):
+        """guardar avisa a los observadores; guardar_lote no"""
+        avisos = []
+        database.registrar_observador(avisos.append)
+
+        diagnostico_id = guardar(almacen, HECHOS_AGUA)
+        almacen.guardar_lote([(dumps(HECHOS_RUIDO).decode(), None)])
+
+        assert [aviso["id"] for aviso in avisos] == [diagnostico_id]
+
+
+class TestAlmacenLog:
+    """Recuperación del motor log"""
+
+    def test_reabrir_recupera_indices(self, tmp_path):
+        """Al reabrir el archivo se recuperan diagnósticos, claves y conteos"""
+        ruta = str(tmp_path / "diag.log")
+        almacen = AlmacenLog(ruta)
+        diagnostico_id = guardar(almacen, HECHOS_AGUA, clave_idempotencia="k", inquilino="norte")
+        almacen.guardar_lote([(dumps(HECHOS_RUIDO).decode(), REGLAS_COMPILADAS[0])] * 4)
+        almacen.cerrar()
+
+        almacen = AlmacenLog(ruta)
+        assert almacen.buscar_por_clave("k", "norte")["id"] == diagnostico_id
+        assert almacen.estadisticas()["total"] == 4
+        assert guardar(almacen, HECHOS_RUIDO) == 6
+        almacen.cerrar()
+
+    def test_descarta_cola_incompleta(self, tmp_path):
+        """Una escritura cortada al final se descarta al abrir"""
+        ruta = tmp_path / "diag.log"
+        almacen = AlmacenLog(str(ruta))
+        guardar(almacen, HECHOS_AGUA)
+        guardar(almacen, HECHOS_RUIDO)
+        almacen.cerrar()
+        ruta.write_bytes(ruta.read_bytes()[:-5])
+
+        almacen = AlmacenLog(str(ruta))
+        assert [d["hechos"] for d in almacen.historial()] == [HECHOS_AGUA]
+        assert guardar(almacen, HECHOS_RUIDO) == 2
+        almacen.cerrar()
+
+    def test_sincronizar_clave_ya_guardada(self, tmp_path):
+        """Un lote que repite una clave conocida no se traba al leer sus hechos del archivo"""
+        almacen = AlmacenLog(str(tmp_path / "diag.log"))
+        diagnostico_id = guardar(almacen, HECHOS_AGUA, clave_idempotencia="K1")
+
+        resultados = []
+        hilo = threading.Thread(target=lambda: resultados.extend(almacen.guardar_con_claves([
+            ("K1", HECHOS_AGUA, motor_inferencia(HECHOS_AGUA)),
+            ("K2", HECHOS_RUIDO, motor_inferencia(HECHOS_RUIDO)),
+            ("K1", HECHOS_AGUA, motor_inferencia(HECHOS_AGUA)),
+        ])), daemon=True)
+        hilo.start()
+        hilo.join(5)
+
+        assert not hilo.is_alive()
+        assert resultados == [(diagnostico_id, HECHOS_AGUA), (2, None), (diagnostico_id, HECHOS_AGUA)]
+        almacen.cerrar()
+
+    def test_columnas_de_regla_por_escritura(self, tmp_path):
+        """Otra regla (aunque Python reutilice el objeto o su dirección) se guarda con sus propios textos"""
+        almacen = AlmacenLog(str(tmp_path / "diag.log"))
+        regla = {"id": "A", "titulo": "A Viejo", "riesgo": "BAJO", "categoria": "X", "acciones": []}
+        almacen.guardar(HECHOS_AGUA, regla)
+        regla.update(id="B", titulo="B Nuevo")
+        almacen.guardar_lote([(dumps(HECHOS_RUIDO).decode(), regla)] * 2)
+
+        assert [(d["regla_id"], d["titulo"]) for d in almacen.historial()] == [
+            ("B", "B Nuevo"), ("B", "B Nuevo"), ("A", "A Viejo")]
+        almacen.cerrar()
+
+    def test_un_solo_escritor(self, tmp_path):
+        """Un segundo proceso (o almacén) no puede abrir el mismo log"""
+        almacen = AlmacenLog(str(tmp_path / "diag.log"))
+        with pytest.raises(RuntimeError):
+            AlmacenLog(str(tmp_path / "diag.log"))
+        almacen.cerrar()
+
+
+class TestConfiguracion:
+    """Elección del motor"""
+
+    def test_motor_por_entorno(self, monkeypatch):
+        """ALMACEN elige el motor; sqlite es el de por defecto"""
+        monkeypatch.delenv("ALMACEN", raising=False)
+        assert isinstance(crear_almacen(), AlmacenSQLite)
+        monkeypatch.setenv("ALMACEN", "memoria")
+        assert isinstance(crear_almacen(), AlmacenMemoria)
+        with pytest.raises(ValueError):
+            crear_almacen("otro")
+
+    def test_api_con_motor_en_memoria(self, monkeypatch, tmp_path):
+        """La API usa el motor configurado para guardar y consultar"""
+        monkeypatch.setattr(database, "DATABASE_NAME", str(tmp_path / "api.db"))
+        database.init_database()
+        monkeypatch.setattr(main, "almacen", AlmacenMemoria())
+        cliente = TestClient(main.app)
+
+        diagnostico_id = cliente.post("/diagnosticar", json={"hechos": HECHOS_AGUA}).json()["diagnostico"]["diagnostico_id"]
+
+        assert cliente.get(f"/diagnostico/{diagnostico_id}").json()["hechos"] == HECHOS_AGUA
+        assert cliente.get("/estadisticas").json()["total"] == 1
+        assert database.obtener_estadisticas()["total"] == 0
@@ -0,0 +1,267 @@
+"""
+Tests de la API del Sistema Experto Ambiental
+
+Ejecutar con: pytest test_api.py -v
+"""
+
+import pytest
+from fastapi.testclient import TestClient
+
+import database
+import main
+from estaticos import Activo
+from reglas import motor_inferencia_multiple
+
+
+HECHOS_AGUA = {
+    "olor_fuerte": True,
+    "vegetacion_deteriorada": False,
+    "residuos_acumulados": False,
+    "humedad_excesiva": True,
+    "ruido_elevado": False,
+    "aire_contaminado": False,
+    "agua_turbia": True
+}
+
+
+@pytest.fixture
+def cliente(tmp_path, monkeypatch):
+    """Cliente de pruebas con una base de datos temporal"""
+    monkeypatch.setattr(database, "DATABASE_NAME", str(tmp_path / "test.db"))
+    database.init_database()
+    with TestClient(main.app) as c:
+        yield c
+
+
+class TestSesionWebSocket:
+    """Tests de la sesión interactiva por WebSocket"""
+
+    def test_sesion_envia_preguntas_al_conectar(self, cliente):
+        """Al conectar, el servidor debe enviar las preguntas del cuestionario"""
+        with cliente.websocket_connect("/ws/diagnostico") as ws:
+            mensaje = ws.receive_json()
+
+        assert mensaje["tipo"] == "preguntas"
+        assert len(mensaje["preguntas"]) == 7
+
+    def test_sesion_completa_guarda_diagnostico(self, cliente):
+        """Las respuestas parciales deben producir el mismo diagnóstico que /diagnosticar"""
+        with cliente.websocket_connect("/ws/diagnostico") as ws:
+            ws.receive_json()
+            for hecho, valor in HECHOS_AGUA.items():
+                ws.send_json({"tipo": "respuesta", "hecho": hecho, "valor": valor})
+                parcial = ws.receive_json()
+                assert parcial["tipo"] == "parcial"
+            assert parcial["decidido"] is True
+
+            ws.send_json({"tipo": "finalizar"})
+            final = ws.receive_json()
+
+        assert final["tipo"] == "diagnostico"
+        assert final["diagnostico"]["id"] == "R-AMB-01"
+        guardado = database.obtener_diagnostico_por_id(final["diagnostico"]["diagnostico_id"])
+        assert guardado["regla_id"] == "R-AMB-01"
+
+    def test_sesion_rechaza_hecho_desconocido(self, cliente):
+        """Un hecho que no existe debe devolver un mensaje de error"""
+        with cliente.websocket_connect("/ws/diagnostico") as ws:
+            ws.receive_json()
+            ws.send_json({"tipo": "respuesta", "hecho": "no_existe", "valor": True})
+            mensaje = ws.receive_json()
+
+        assert mensaje["tipo"] == "error"
+
+    def test_sesion_rechaza_valores_que_no_son_booleanos(self, cliente):
+        """1, 0, 1.0 o "si" no son respuestas válidas; true, false y null sí"""
+        with cliente.websocket_connect("/ws/diagnostico") as ws:
+            ws.receive_json()
+            rechazados = []
+            for valor in (1, 0, 1.0, 0.0, "si"):
+                ws.send_json({"tipo": "respuesta", "hecho": "ruido_elevado", "valor": valor})
+                rechazados.append(ws.receive_json()["tipo"])
+            ws.send_json({"tipo": "respuesta", "hecho": "ruido_elevado", "valor": None})
+            aceptado = ws.receive_json()["tipo"]
+
+        assert rechazados == ["error"] * 5
+        assert aceptado == "parcial"
+
+    def test_rest_sigue_funcionando(self, cliente):
+        """El endpoint REST debe seguir disponible"""
+        res = cliente.post("/diagnosticar", json={"hechos": HECHOS_AGUA})
+
+        assert res.status_code == 200
+        assert res.json()["diagnostico"]["id"] == "R-AMB-01"
+
+
+class TestActivosEstaticos:
+    """Tests de la página principal y los activos con huella"""
+
+    def test_pagina_principal_con_etag(self, cliente):
+        """La segunda visita con If-None-Match debe recibir 304 sin cuerpo"""
+        primera = cliente.get("/")
+        segunda = cliente.get("/", headers={"If-None-Match": primera.headers["etag"]})
+
+        assert primera.status_code == 200
+        assert "/activos/script." in primera.text
+        assert segunda.status_code == 304
+        assert segunda.content == b""
+
+    def test_activo_con_huella_inmutable_y_comprimido(self, cliente):
+        """Los activos referenciados por la página se sirven comprimidos y con caché larga"""
+        url = f"/activos/{main.ACTIVOS['style.css'].nombre}"
+        res = cliente.get(url, headers={"Accept-Encoding": "gzip"})
+
+        assert res.status_code == 200
+        assert "immutable" in res.headers["cache-control"]
+        assert res.headers["content-encoding"] == "gzip"
+        assert "/*" not in res.text
+
+    def test_etag_por_codificacion(self, cliente):
+        """Cada codificación tiene su ETag: el de gzip no revalida la versión sin comprimir"""
+        url = f"/activos/{main.ACTIVOS['style.css'].nombre}"
+        comprimido = cliente.get(url, headers={"Accept-Encoding": "gzip"})
+        plano = cliente.get(url, headers={"Accept-Encoding": "identity", "If-None-Match": comprimido.headers["etag"]})
+        revalidado = cliente.get(url, headers={"Accept-Encoding": "gzip", "If-None-Match": comprimido.headers["etag"]})
+
+        assert comprimido.headers["etag"].endswith('-gzip"')
+        assert plano.status_code == 200
+        assert "content-encoding" not in plano.headers
+        assert plano.headers["etag"] != comprimido.headers["etag"]
+        assert revalidado.status_code == 304
+        assert "Accept-Encoding" in revalidado.headers["vary"]
+
+    @pytest.mark.parametrize("accept_encoding, esperada", [
+        ("gzip", "gzip"),
+        ("gzip;q=0", None),
+        ("gzip; q=0.0", None),
+        ("gzip ; q=0.000 , identity", None),
+        ("gzip;q=abc", None),
+        ("br;q=0.5, gzip;q=0.8", "gzip"),
+        ("gzip, br", "br"),
+        ("*", "br"),
+        ("*;q=0.1, br;q=0", "gzip"),
+        ("", None),
+    ])
+    def test_valores_q_de_accept_encoding(self, accept_encoding, esperada):
+        """Se elige la codificación con mayor q; q=0 (en cualquier forma) la excluye"""
+        activo = Activo("a.css", b"body{}" * 100, "text/css")
+        activo.brotli = b"br"
+
+        assert activo.cuerpo_para(accept_encoding)[1] == esperada
+
+    def test_activo_inexistente(self, cliente):
+        """Un nombre sin huella conocida debe devolver 404"""
+        assert cliente.get("/activos/script.js").status_code == 404
+
+
+class TestSerializacion:
+    """Tests de la serialización rápida y la negociación de contenido"""
+
+    def test_json_precalculado_equivale_al_original(self, cliente):
+        """El JSON armado con fragmentos debe decodificar igual que el resultado del motor"""
+        res = cliente.post("/diagnosticar-multiple", json={"hechos": HECHOS_AGUA})
+        esperado = motor_inferencia_multiple(HECHOS_AGUA)
+
+        assert res.headers["content-type"].startswith("application/json")
+        assert res.json() == {"diagnosticos": esperado, "total": len(esperado)}
+
+    def test_diagnostico_sin_regla(self, cliente):
+        """Sin regla aplicable la respuesta solo contiene el ID guardado"""
+        hechos = {"olor_fuerte": True, "aire_contaminado": True}
+        res = cliente.post("/diagnosticar", json={"hechos": hechos})
+
+        assert list(res.json()["diagnostico"]) == ["diagnostico_id"]
+
+    def test_msgpack_por_accept(self, cliente):
+        """Con Accept: application/msgpack la respuesta debe venir en MessagePack"""
+        msgpack = pytest.importorskip("msgpack")
+        res = cliente.post("/diagnosticar", json={"hechos": HECHOS_AGUA},
+                           headers={"Accept": "application/msgpack"})
+
+        assert res.headers["content-type"] == "application/msgpack"
+        assert msgpack.unpackb(res.content)["diagnostico"]["id"] == "R-AMB-01"
+
+
+class TestCatalogoReglas:
+    """Tests del catálogo de reglas y el modo compacto"""
+
+    def test_catalogo_versionado_con_etag(self, cliente):
+        """El catálogo debe revalidarse con su versión como ETag"""
+        res = cliente.get("/reglas")
+        catalogo = res.json()
+        revalidado = cliente.get("/reglas", headers={"If-None-Match": res.headers["etag"]})
+
+        assert res.headers["etag"] == f'"{catalogo["version"]}"'
+        assert "R-AMB-01" in catalogo["reglas"]
+        assert "condicion" not in catalogo["reglas"]["R-AMB-01"]
+        assert revalidado.status_code == 304
+
+    def test_diagnostico_compacto(self, cliente):
+        """En modo compacto solo se devuelven IDs, la versión y los hechos"""
+        version = cliente.get("/reglas").json()["version"]
+        res = cliente.post("/diagnosticar?compacto=true", json={"hechos": HECHOS_AGUA}).json()
+
+        assert res["diagnostico"]["regla_id"] == "R-AMB-01"
+        assert "acciones" not in res["diagnostico"]
+        assert res["version_catalogo"] == version
+        assert res["hechos"] == HECHOS_AGUA
+
+    def test_historial_compacto(self, cliente):
+        """El historial compacto no debe repetir el texto de las reglas"""
+        cliente.post("/diagnosticar", json={"hechos": HECHOS_AGUA})
+        fila = cliente.get("/historial?compacto=true").json()["historial"][0]
+
+        assert set(fila) == {"id", "fecha", "regla_id", "hechos"}
+        assert fila["regla_id"] == "R-AMB-01"
+
+
+class TestIdempotencia:
+    """Tests de los reintentos con Idempotency-Key"""
+
+    def test_reintento_devuelve_el_mismo_diagnostico(self, cliente):
+        """Un reintento no debe insertar otra fila"""
+        headers = {"Idempotency-Key": "clave-1"}
+        primera = cliente.post("/diagnosticar", json={"hechos": HECHOS_AGUA}, headers=headers)
+        segunda = cliente.post("/diagnosticar", json={"hechos": HECHOS_AGUA}, headers=headers)
+
+        assert segunda.json() == primera.json()
+        assert segunda.headers["idempotent-replayed"] == "true"
+        assert database.obtener_estadisticas()["total"] == 1
+
+    def test_reintento_tras_vencer_la_cache(self, cliente, monkeypatch):
+        """Sin la caché en memoria la clave se resuelve por el índice de la BD"""
+        headers = {"Idempotency-Key": "clave-2"}
+        primera = cliente.post("/diagnosticar", json={"hechos": HECHOS_AGUA}, headers=headers).json()
+        monkeypatch.setattr(main, "cache_idempotencia", main.CacheIdempotencia())
+        segunda = cliente.post("/diagnosticar", json={"hechos": HECHOS_AGUA}, headers=headers).json()
+
+        assert segunda == primera
+        assert database.obtener_estadisticas()["total"] == 1
+
+    def test_misma_clave_con_otros_hechos(self, cliente):
+        """Reutilizar una clave con otro cuerpo debe dar 409"""
+        headers = {"Idempotency-Key": "clave-3"}
+        cliente.post("/diagnosticar", json={"hechos": HECHOS_AGUA}, headers=headers)
+        res = cliente.post("/diagnosticar", json={"hechos": {"ruido_elevado": True}}, headers=headers)
+
+        assert res.status_code == 409
+
+    def test_indice_unico_evita_duplicados(self, cliente):
+        """Dos inserciones con la misma clave deben devolver el mismo ID"""
+        primero = database.guardar_diagnostico(HECHOS_AGUA, None, "clave-4")
+        segundo = database.guardar_diagnostico(HECHOS_AGUA, None, "clave-4")
+
+        assert primero == segundo
+        assert database.obtener_estadisticas()["total"] == 1
+
+    def test_carrera_con_otros_hechos(self, cliente, monkeypatch):
+        """Si la otra petición gana la carrera con otros hechos, también da 409"""
+        headers = {"Idempotency-Key": "clave-5"}
+        cliente.post("/diagnosticar", json={"hechos": HECHOS_AGUA}, headers=headers)
+        # Como si la búsqueda se hubiera hecho antes de que la otra guardara
+        monkeypatch.setattr(main, "respuesta_guardada", lambda clave, inquilino='': None)
+
+        res = cliente.post("/diagnosticar", json={"hechos": {"ruido_elevado": True}}, headers=headers)
+
+        assert res.status_code == 409
+        assert database.obtener_estadisticas()["total"] == 1
@@ -0,0 +1,140 @@
+"""
+Tests de la base de reglas recargable
+
+Ejecutar con: pytest test_base_reglas.py -v
+"""
+
+import json
+import os
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+
+import base_reglas
+import database
+import main
+from base_reglas import BaseReglas, VigilanteArchivo, base_vigente, exportar, leer_archivo, recargar
+from condiciones import O, Y, Hecho, No, desde_dict
+from reglas import REGLAS_AMBIENTALES
+
+
+HECHOS_RUIDO = {"ruido_elevado": True}
+
+
+@pytest.fixture
+def archivo_reglas(tmp_path, monkeypatch):
+    """Archivo de reglas temporal; la base vigente se restaura al terminar"""
+    ruta = str(tmp_path / "reglas.json")
+    exportar(REGLAS_AMBIENTALES, ruta)
+    monkeypatch.setattr(base_reglas, "ARCHIVO_REGLAS", ruta)
+    monkeypatch.setattr(base_reglas, "_vigente", base_reglas._vigente)
+    monkeypatch.setattr(database, "DATABASE_NAME", str(tmp_path / "test.db"))
+    database.init_database()
+    return ruta
+
+
+def editar(ruta, funcion):
+    """Aplica una modificación a las reglas del archivo"""
+    with open(ruta, encoding="utf-8") as f:
+        reglas = json.load(f)
+    funcion(reglas)
+    with open(ruta, "w", encoding="utf-8") as f:
+        json.dump(reglas, f, ensure_ascii=False)
+    # Asegurar una firma distinta aunque el reloj del sistema de archivos sea grueso
+    os.utime(ruta, ns=(0, os.stat(ruta).st_mtime_ns + 10 ** 9))
+
+
+def ruido_primero(reglas):
+    """Pone primero una regla que solo requiere ruido elevado"""
+    reglas.insert(0, dict(reglas[0], id="R-NUEVA", condicion="ruido_elevado"))
+
+
+class TestArchivoReglas:
+    """Tests del formato de archivo y la validación"""
+
+    def test_exportar_y_leer_conserva_la_version(self, archivo_reglas):
+        """Las reglas exportadas deben compilar a la misma versión que las de reglas.py"""
+        assert BaseReglas(leer_archivo(archivo_reglas)).version == BaseReglas(REGLAS_AMBIENTALES).version
+
+    def test_condicion_invalida(self):
+        """Un operador desconocido debe rechazarse"""
+        with pytest.raises(ValueError):
+            desde_dict({"xor": ["olor_fuerte", "agua_turbia"]})
+
+    def test_hecho_desconocido_no_reemplaza_la_base(self, archivo_reglas):
+        """Si la validación falla, la base vigente no cambia"""
+        version = base_vigente().version
+        editar(archivo_reglas, lambda reglas: reglas[0].update(condicion="hecho_inventado"))
+
+        with pytest.raises(ValueError, match="hecho_inventado"):
+            recargar()
+        assert base_vigente().version == version
+
+
+    def test_condicion_que_explota_en_forma_normal(self, archivo_reglas):
+        """Un Y de muchos O se rechaza al validar, sin expandirlo"""
+        version = base_vigente().version
+        explosiva = {"y": [{"o": ["agua_turbia", "olor_fuerte"]}] * 60}
+        editar(archivo_reglas, lambda reglas: reglas[0].update(condicion=explosiva))
+
+        inicio = time.perf_counter()
+        with pytest.raises(ValueError, match="forma normal disyuntiva"):
+            recargar()
+        assert time.perf_counter() - inicio < 1
+        assert base_vigente().version == version
+
+    def test_contar_terminos(self):
+        """La cuenta sin expandir coincide con la expansión cuando no hay repetidos"""
+        a, b, c, d = (Hecho(nombre) for nombre in "abcd")
+        condicion = (a | b) & ~(c & d) & (a | ~(b | c))
+
+        assert condicion.terminos_fnd() == 2 * 2 * 2 == len(condicion._fnd(False))
+        negada = No(Y(O(a, b), O(c, d)))
+        assert negada.terminos_fnd() == len(negada._fnd(False)) == 2
+
+
+class TestRecarga:
+    """Tests del reemplazo atómico de la base"""
+
+    def test_peticion_en_curso_usa_la_version_anterior(self, archivo_reglas):
+        """Una base tomada antes de la recarga sigue diagnosticando con sus reglas"""
+        anterior = base_vigente()
+        editar(archivo_reglas, ruido_primero)
+        resultado = recargar()
+
+        assert resultado["anterior"] == anterior.version
+        assert anterior.diagnosticar(HECHOS_RUIDO)["id"] != "R-NUEVA"
+        assert base_vigente().diagnosticar(HECHOS_RUIDO)["id"] == "R-NUEVA"
+
+    def test_endpoint_y_version_guardada(self, archivo_reglas):
+        """El diagnóstico guardado registra la versión de reglas con que se hizo"""
+        editar(archivo_reglas, ruido_primero)
+        with TestClient(main.app) as cliente:
+            version = cliente.post("/reglas/recargar").json()["version"]
+            res = cliente.post("/diagnosticar", json={"hechos": HECHOS_RUIDO}).json()
+            catalogo = cliente.get("/reglas").json()
+
+        guardado = database.obtener_diagnostico_por_id(res["diagnostico"]["diagnostico_id"])
+        assert res["diagnostico"]["id"] == "R-NUEVA"
+        assert guardado["version_reglas"] == version
+        assert catalogo["version"] == version
+
+    def test_endpoint_con_archivo_invalido(self, archivo_reglas):
+        """Un archivo roto devuelve 422 y la versión que sigue vigente"""
+        with open(archivo_reglas, "w", encoding="utf-8") as f:
+            f.write("[{")
+        with TestClient(main.app) as cliente:
+            res = cliente.post("/reglas/recargar")
+
+        assert res.status_code == 422
+        assert res.json()["version"] == base_vigente().version
+
+    def test_vigilante_detecta_cambios(self, archivo_reglas):
+        """El vigilante recarga solo cuando cambia el archivo"""
+        vigilante = VigilanteArchivo(archivo_reglas)
+        assert vigilante.revisar() is None
+
+        editar(archivo_reglas, ruido_primero)
+        assert vigilante.revisar()["reglas"] == len(REGLAS_AMBIENTALES) + 1
+        assert vigilante.revisar() is None
@@ -0,0 +1,194 @@
+"""
+Tests del compilador de reglas a diagramas de decisión y del análisis estático
+
+Ejecutar con: pytest test_bdd.py -v
+"""
+
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from itertools import product
+
+import pytest
+from fastapi.testclient import TestClient
+
+import base_reglas
+import database
+import main
+from base_reglas import BaseReglas
+from bdd import DiagramaDecision, ReglasCompiladas
+from condiciones import Hecho, No, O, Y
+from reglas import REGLAS_AMBIENTALES, REGLAS_COMPILADAS, motor_inferencia
+from registros import compilar_reglas
+
+
+def regla(id_regla, condicion):
+    """Regla mínima válida con la condición dada"""
+    return {
+        "id": id_regla, "titulo": id_regla, "categoria": "Prueba", "riesgo": "BAJO",
+        "descripcion": "d", "justificacion": "j", "acciones": [], "condicion": condicion,
+    }
+
+
+class TestDiagramaDecision:
+    """Tests de los BDD de condiciones"""
+
+    def test_nodos_compartidos(self):
+        """Condiciones equivalentes escritas distinto dan el mismo nodo"""
+        d = DiagramaDecision(["a", "b", "c"])
+        uno = d.desde_expresion(Y(Hecho("a"), O(Hecho("b"), Hecho("c"))))
+        otro = d.desde_expresion(O(Y(Hecho("c"), Hecho("a")), Y(Hecho("a"), Hecho("b"))))
+
+        assert uno == otro
+        assert d.desde_expresion(Y(Hecho("a"), No(Hecho("a")))) == d.CERO
+        assert d.desde_expresion(O(Hecho("b"), No(Hecho("b")))) == d.UNO
+
+    def test_contar_y_ejemplo(self):
+        """Cuenta las combinaciones sobre todos los hechos y da una que cumple"""
+        d = DiagramaDecision(["a", "b", "c"])
+        nodo = d.desde_expresion(Y(Hecho("a"), No(Hecho("c"))))
+
+        assert d.contar(nodo) == 2
+        ejemplo = d.ejemplo(nodo)
+        assert ejemplo == {"a": True, "c": False}
+        assert d.evaluar(nodo, ejemplo) is True
+        assert d.ejemplo(d.CERO) is None
+
+
+class TestReglasCompiladas:
+    """El diagrama de la base da el mismo resultado que el motor lineal"""
+
+    def test_equivalente_en_todas_las_combinaciones(self):
+        """Las 2^7 combinaciones de hechos eligen la misma regla"""
+        compiladas = ReglasCompiladas(REGLAS_COMPILADAS)
+        hechos = compiladas.diagrama.hechos
+        for valores in product([False, True], repeat=len(hechos)):
+            observados = dict(zip(hechos, valores))
+            assert compiladas.diagnosticar(observados) is motor_inferencia(observados)
+
+    def test_camino_acotado_por_hechos(self):
+        """Evaluar recorre como mucho un nodo por hecho"""
+        analisis = ReglasCompiladas(REGLAS_COMPILADAS).analizar()
+
+        assert analisis["diagrama_base"] is True
+        assert analisis["profundidad"] <= analisis["hechos"]
+
+    def test_base_incluida_sin_problemas(self):
+        """Las reglas incluidas no tienen reglas inalcanzables ni sombreadas"""
+        analisis = BaseReglas(REGLAS_AMBIENTALES).analizar()
+
+        assert analisis["inalcanzables"] == []
+        assert analisis["sombreadas"] == []
+        assert all(0 < alcance <= 1 for alcance in analisis["alcance"].values())
+
+
+class TestAnalisis:
+    """Tests del análisis estático"""
+
+    def test_detecta_inalcanzable_sombreada_y_solapada(self):
+        """Cada tipo de problema se informa con la regla que lo causa"""
+        reglas = compilar_reglas([
+            regla("A", Y(Hecho("olor_fuerte"), Hecho("agua_turbia"))),
+            regla("B", Hecho("ruido_elevado")),
+            regla("IMPOSIBLE", Y(Hecho("olor_fuerte"), No(Hecho("olor_fuerte")))),
+            regla("TAPADA", Y(Hecho("olor_fuerte"), Hecho("agua_turbia"), Hecho("ruido_elevado"))),
+            regla("PARCIAL", Hecho("olor_fuerte")),
+        ])
+        analisis = ReglasCompiladas(reglas).analizar()
+
+        assert analisis["inalcanzables"] == [{"id": "IMPOSIBLE"}]
+        assert analisis["sombreadas"] == [{"id": "TAPADA", "por": ["A", "B"]}]
+        assert analisis["alcance"]["PARCIAL"] == pytest.approx(0.25)
+        solapa = {(par["id"], par["con"]): par for par in analisis["solapamientos"]}
+        assert solapa[("PARCIAL", "A")]["fraccion"] == pytest.approx(0.5)
+        assert solapa[("PARCIAL", "A")]["ejemplo"] == {"olor_fuerte": True, "agua_turbia": True}
+        assert ("B", "A") in solapa
+
+    def test_cientos_de_hechos(self):
+        """200 reglas sobre 300 hechos se analizan rápido y diagnostican igual"""
+        aleatorio = random.Random(7)
+        hechos = [f"h{i:03d}" for i in range(300)]
+
+        def condicion():
+            literales = [Hecho(h) if aleatorio.random() < 0.7 else No(Hecho(h))
+                         for h in aleatorio.sample(hechos, aleatorio.randint(2, 4))]
+            return Y(*literales) if aleatorio.random() < 0.8 else O(*literales)
+
+        reglas = compilar_reglas([regla(f"R{i}", condicion()) for i in range(200)])
+        inicio = time.perf_counter()
+        compiladas = ReglasCompiladas(reglas)
+        analisis = compiladas.analizar()
+
+        assert time.perf_counter() - inicio < 20
+        assert analisis["hechos"] > 200
+        assert analisis["inalcanzables"] == []
+        for _ in range(500):
+            observados = {h: aleatorio.random() < 0.3 for h in hechos}
+            assert compiladas.diagnosticar(observados) is motor_inferencia(observados, reglas)
+
+    def test_reglas_en_forma_normal_disyuntiva(self):
+        """Con reglas O de dos Y la unión explota: el análisis se corta y es parcial"""
+        aleatorio = random.Random(11)
+        hechos = [f"h{i:03d}" for i in range(300)]
+
+        def termino():
+            return Y(*[Hecho(h) if aleatorio.random() < 0.5 else No(Hecho(h)) for h in aleatorio.sample(hechos, 4)])
+
+        reglas = compilar_reglas([regla(f"R{i}", O(termino(), termino())) for i in range(200)])
+        inicio = time.perf_counter()
+        compiladas = ReglasCompiladas(reglas, max_nodos_analisis=50_000)
+        analisis = compiladas.analizar()
+
+        assert time.perf_counter() - inicio < 20
+        assert analisis["completo"] is False
+        assert 0 < analisis["reglas_analizadas"] < 200
+        assert analisis["cobertura"] is None
+        assert len(analisis["alcance"]) == analisis["reglas_analizadas"]
+        assert len(analisis["solapamientos"]) == 200 * 199 // 2
+        # Los diagramas del análisis se descartan: el de la base solo tiene las condiciones
+        assert len(compiladas.diagrama) < 10_000
+        for par in analisis["solapamientos"][:500]:
+            ejemplo = par["ejemplo"]
+            assert reglas[int(par["id"][1:])].condicion.evaluar(ejemplo)
+            assert reglas[int(par["con"][1:])].condicion.evaluar(ejemplo)
+
+    def test_se_analiza_una_vez(self):
+        """Pedidos concurrentes comparten un único análisis"""
+        compiladas = ReglasCompiladas(REGLAS_COMPILADAS)
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            resultados = list(pool.map(lambda _: compiladas.analizar(), range(16)))
+
+        assert all(resultado is resultados[0] for resultado in resultados)
+        assert resultados[0]["completo"] is True
+
+
+class TestEndpointAnalisis:
+    """Tests de GET /reglas/analisis"""
+
+    def test_analisis_de_la_base_vigente(self, monkeypatch, tmp_path):
+        """Devuelve el análisis con la versión de la base"""
+        monkeypatch.setattr(database, "DATABASE_NAME", str(tmp_path / "bdd.db"))
+        database.init_database()
+        cliente = TestClient(main.app)
+
+        res = cliente.get("/reglas/analisis")
+
+        assert res.status_code == 200
+        datos = res.json()
+        assert datos["reglas"] == len(REGLAS_AMBIENTALES)
+        assert datos["sombreadas"] == []
+        assert datos["version"] == cliente.get("/reglas").json()["version"]
+
+    def test_analisis_parcial_no_es_un_error(self, monkeypatch, tmp_path):
+        """Una base que no entra en el máximo de nodos responde 200 con completo = false"""
+        monkeypatch.setattr(database, "DATABASE_NAME", str(tmp_path / "bdd.db"))
+        database.init_database()
+        monkeypatch.setattr(base_reglas, "_vigente", BaseReglas(REGLAS_AMBIENTALES))
+        main.base_vigente().diagrama.max_nodos_analisis = 3
+        cliente = TestClient(main.app)
+
+        res = cliente.get("/reglas/analisis")
+
+        assert res.status_code == 200
+        assert res.json()["completo"] is False
+        assert res.json()["cobertura"] is None
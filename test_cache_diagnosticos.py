@@ -0,0 +1,152 @@
+"""
+Tests de la caché LRU de diagnósticos
+
+Ejecutar con: pytest test_cache_diagnosticos.py -v
+"""
+
+import pytest
+from fastapi.testclient import TestClient
+
+import database
+import main
+from cache_diagnosticos import CacheDiagnosticos, tamano_estimado
+from reglas import motor_inferencia
+
+
+HECHOS_AGUA = {"agua_turbia": True, "olor_fuerte": True, "humedad_excesiva": True}
+HECHOS_RUIDO = {"ruido_elevado": True}
+
+
+@pytest.fixture(autouse=True)
+def base_temporal(monkeypatch, tmp_path):
+    """Base de datos temporal (con su propia caché)"""
+    monkeypatch.setattr(database, "DATABASE_NAME", str(tmp_path / "cache.db"))
+    database.init_database()
+
+
+def sin_sqlite(monkeypatch):
+    """Hace fallar cualquier acceso a la base de datos, también la revisión de la generación"""
+    def conexion_prohibida(*args):
+        raise AssertionError("No debería consultarse SQLite")
+    monkeypatch.setattr(database, "get_db_connection", conexion_prohibida)
+    monkeypatch.setattr(database, "GENERACION_INTERVALO", 3600.0)
+    for vigilante in database._vigilantes_generacion.values():
+        monkeypatch.setattr(vigilante, "_conn", type("ConexionProhibida", (), {"execute": conexion_prohibida})())
+
+
+def un_diagnostico():
+    """Diagnóstico guardado y leído de la base, para usar como valor"""
+    return database.obtener_diagnostico_por_id(database.guardar_diagnostico(HECHOS_AGUA, motor_inferencia(HECHOS_AGUA)))
+
+
+class TestCacheDiagnosticos:
+    """Tests de la caché en sí"""
+
+    def test_descarta_el_menos_usado(self):
+        """Al pasarse de max_entradas sale el usado hace más tiempo"""
+        valor = un_diagnostico()
+        cache = CacheDiagnosticos(max_entradas=2)
+        cache.guardar(1, valor)
+        cache.guardar(2, valor)
+        cache.obtener(1)
+        cache.guardar(3, valor)
+
+        assert cache.obtener(2) is None
+        assert cache.obtener(1) is valor
+        assert cache.obtener(3) is valor
+        assert cache.estadisticas()["descartados"] == 1
+
+    def test_limite_de_memoria(self):
+        """Los bytes estimados nunca superan max_bytes"""
+        valor = un_diagnostico()
+        tamano = tamano_estimado(valor)
+        cache = CacheDiagnosticos(max_entradas=100, max_bytes=tamano * 3)
+        for clave in range(10):
+            cache.guardar(clave, valor)
+
+        assert len(cache) == 3
+        assert cache.bytes == tamano * 3
+        cache.guardar(0, valor)
+        assert cache.bytes == tamano * 3
+
+        chica = CacheDiagnosticos(max_bytes=tamano - 1)
+        chica.guardar(1, valor)
+        assert len(chica) == 0
+
+    def test_metricas(self):
+        """Cuenta aciertos y fallos"""
+        valor = un_diagnostico()
+        cache = CacheDiagnosticos()
+        cache.obtener(1)
+        cache.guardar(1, valor)
+        cache.obtener(1)
+        cache.obtener(1)
+
+        estadisticas = cache.estadisticas()
+        assert (estadisticas["aciertos"], estadisticas["fallos"]) == (2, 1)
+        assert estadisticas["tasa_aciertos"] == pytest.approx(2 / 3, abs=1e-4)
+
+    def test_generacion(self):
+        """Otra generación vacía la caché y lo leído con la anterior no se guarda"""
+        valor = un_diagnostico()
+        cache = CacheDiagnosticos()
+        cache.validar("a")
+        cache.guardar(1, valor, "a")
+        cache.guardar(2, valor)
+
+        cache.validar("b")
+        cache.guardar(3, valor, "a")
+
+        assert len(cache) == 0
+        assert cache.bytes == 0
+        cache.guardar(3, valor, "b")
+        assert cache.obtener(3) is valor
+
+
+class TestLecturaATraves:
+    """Tests de la caché en database.py"""
+
+    def test_guardar_llena_la_cache(self, monkeypatch):
+        """Lo recién guardado se lee sin consultar SQLite y con los mismos datos"""
+        diagnostico_id = database.guardar_diagnostico(HECHOS_AGUA, motor_inferencia(HECHOS_AGUA),
+                                                      version_reglas="v1", inquilino="norte")
+        desde_cache = database.obtener_diagnostico_por_id(diagnostico_id, "norte")
+        database.cache_diagnosticos().vaciar()
+        desde_tabla = database.obtener_diagnostico_por_id(diagnostico_id, "norte")
+
+        assert dict(desde_cache) == dict(desde_tabla)
+        sin_sqlite(monkeypatch)
+        assert database.obtener_diagnostico_por_id(diagnostico_id, "norte") is desde_tabla
+
+    def test_fallo_llena_la_cache(self, monkeypatch):
+        """Un diagnóstico guardado por lote se cachea en la primera lectura"""
+        database.guardar_diagnosticos_lote([('{"ruido_elevado": true}', motor_inferencia(HECHOS_RUIDO))])
+        primero = database.obtener_diagnostico_por_id(1)
+        sin_sqlite(monkeypatch)
+
+        assert database.obtener_diagnostico_por_id(1) is primero
+        assert database.cache_diagnosticos().estadisticas()["aciertos"] == 1
+
+    def test_separa_inquilinos(self):
+        """La caché no entrega un diagnóstico a otro inquilino"""
+        diagnostico_id = database.guardar_diagnostico(HECHOS_AGUA, None, inquilino="norte")
+
+        assert database.obtener_diagnostico_por_id(diagnostico_id) is None
+        assert database.obtener_diagnostico_por_id(diagnostico_id, "sur") is None
+        assert database.obtener_diagnostico_por_id(diagnostico_id, "norte") is not None
+
+
+class TestEndpoints:
+    """Tests de la caché vista desde la API"""
+
+    def test_detalle_y_pdf_repetidos(self, monkeypatch):
+        """El detalle y el PDF de un diagnóstico recién creado salen de la caché"""
+        cliente = TestClient(main.app)
+        diagnostico_id = cliente.post("/diagnosticar", json={"hechos": HECHOS_AGUA}).json()["diagnostico"]["diagnostico_id"]
+        sin_sqlite(monkeypatch)
+
+        assert cliente.get(f"/diagnostico/{diagnostico_id}").json()["hechos"] == HECHOS_AGUA
+        assert cliente.get(f"/descargar-pdf/{diagnostico_id}").status_code == 200
+        estadisticas = cliente.get("/diagnosticos/cache").json()
+        assert estadisticas["aciertos"] == 2
+        assert estadisticas["entradas"] == 1
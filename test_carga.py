@@ -0,0 +1,98 @@
+"""
+Tests del generador de carga
+
+Ejecutar con: pytest test_carga.py -v
+"""
+
+import asyncio
+
+import pytest
+
+import database
+import main
+from carga import app_en_proceso, armar_informe, generar_carga, leer_mezcla, Medicion
+
+
+def correr(mezcla, tasa=40.0, duracion=0.5, **kwargs):
+    """Genera carga contra la app en proceso y devuelve el informe"""
+    async def principal():
+        with app_en_proceso() as cliente:
+            async with cliente:
+                return await generar_carga(cliente, mezcla, tasa, duracion, semilla=7, **kwargs)
+    return asyncio.run(principal())
+
+
+class TestMezcla:
+    """Tests de leer_mezcla"""
+
+    def test_pesos(self):
+        """Lee los pesos; sin peso vale 1"""
+        assert leer_mezcla("cuestionario=3, historial") == {"cuestionario": 3.0, "historial": 1.0}
+
+    @pytest.mark.parametrize("texto", ["otro=1", "historial=-1", "historial=0"])
+    def test_invalida(self, texto):
+        """Flujos desconocidos, pesos negativos o todos en cero"""
+        with pytest.raises(ValueError):
+            leer_mezcla(texto)
+
+
+class TestGenerarCarga:
+    """Tests de generar_carga contra la app en proceso"""
+
+    def test_recorridos_del_navegador(self):
+        """El cuestionario pasa por los endpoints de script.js y no hay errores"""
+        informe = correr({"cuestionario": 1})
+
+        endpoints = informe["endpoints"]
+        flujos = informe["flujos"]["cuestionario"]
+        assert flujos > 5
+        assert informe["tasa_error"] == 0
+        for etiqueta in ("GET /reglas/tabla", "POST /diagnosticos/sincronizar"):
+            assert endpoints[etiqueta]["peticiones"] == flujos
+        # La tabla se descarga una vez y después se revalida con If-None-Match
+        assert endpoints["GET /reglas/tabla"]["codigos"].get("304", 0) >= flujos - 2
+        assert set(endpoints) <= {"GET /reglas/tabla", "POST /diagnosticos/sincronizar",
+                                  "POST /diagnosticar-multiple", "GET /descargar-pdf/{id}"}
+        datos = endpoints["POST /diagnosticos/sincronizar"]
+        assert datos["p50_ms"] <= datos["p90_ms"] <= datos["p99_ms"] <= datos["max_ms"]
+
+    def test_solo_historial(self):
+        """Con la mezcla se eligen los flujos"""
+        informe = correr({"historial": 1, "cuestionario": 0})
+
+        assert set(informe["flujos"]) == {"historial"}
+        assert {"GET /historial", "GET /estadisticas"} <= set(informe["endpoints"])
+        assert "POST /diagnosticos/sincronizar" not in informe["endpoints"]
+
+    def test_descarta_por_encima_del_maximo(self):
+        """Con max_en_curso alcanzado los flujos nuevos se descartan, no se encolan"""
+        informe = correr({"cuestionario": 1}, tasa=400.0, duracion=0.2, max_en_curso=1)
+
+        assert informe["descartados"] > 0
+
+    def test_restaura_base_y_admision(self):
+        """Al terminar vuelven la base de datos y los límites de admisión"""
+        base = database.DATABASE_NAME
+        clases = dict(main.control_admision.clases)
+        correr({"historial": 1}, duracion=0.1)
+
+        assert database.DATABASE_NAME == base
+        assert main.control_admision.clases == clases
+
+
+class TestInforme:
+    """Tests de armar_informe"""
+
+    def test_errores_y_percentiles(self):
+        """Las respuestas con error cuentan en la tasa de error del endpoint"""
+        medicion = Medicion()
+        medicion.latencias = [i / 1000 for i in range(1, 101)]
+        medicion.codigos.update({"200": 98, "503": 2})
+        medicion.errores = 2
+
+        informe = armar_informe({"GET /x": medicion}, {"historial": 100}, 0, 10.0)
+
+        datos = informe["endpoints"]["GET /x"]
+        assert datos["por_segundo"] == 10.0
+        assert datos["tasa_error"] == 0.02
+        assert (datos["p50_ms"], datos["p99_ms"], datos["max_ms"]) == (51.0, 100.0, 100.0)
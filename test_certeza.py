@@ -0,0 +1,100 @@
+"""
+Tests del motor de inferencia con factores de certeza
+
+Ejecutar con: pytest test_certeza.py -v
+"""
+
+import itertools
+
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+from reglas import motor_inferencia_multiple, HECHOS_OBSERVABLES
+from certeza import motor_inferencia_certeza, motor_certeza
+
+IDS_HECHOS = [hecho["id"] for hecho in HECHOS_OBSERVABLES]
+
+
+class TestMotorCerteza:
+    """Tests del motor con confianzas entre 0 y 1"""
+
+    def test_confianzas_extremas_equivalen_al_motor_booleano(self):
+        """Con confianzas 0/1 deben dispararse las mismas reglas que en motor_inferencia_multiple"""
+        for valores in itertools.product([False, True], repeat=len(IDS_HECHOS)):
+            hechos = dict(zip(IDS_HECHOS, valores))
+            confianzas = {h: float(v) for h, v in hechos.items()}
+
+            esperadas = {r["id"] for r in motor_inferencia_multiple(hechos)}
+            obtenidas = {r["id"] for r in motor_inferencia_certeza(confianzas)}
+
+            assert obtenidas == esperadas, hechos
+
+    def test_combinacion_minimo_maximo(self):
+        """Y toma el mínimo y O el máximo de las certezas"""
+        confianzas = {"vegetacion_deteriorada": 0.9, "humedad_excesiva": 0.6, "residuos_acumulados": 0.3}
+        resultado = {r["id"]: r["certeza"] for r in motor_inferencia_certeza(confianzas)}
+
+        # R-AMB-04: vegetacion & (humedad | residuos) = min(0.9, max(0.6, 0.3))
+        assert resultado["R-AMB-04"] == pytest.approx(0.6)
+
+    def test_negacion_es_complemento(self):
+        """NO de un hecho con confianza c vale 1 - c"""
+        confianzas = {"ruido_elevado": 0.8, "aire_contaminado": 0.3}
+        resultado = {r["id"]: r["certeza"] for r in motor_inferencia_certeza(confianzas)}
+
+        # R-AMB-05: ruido & ~aire = min(0.8, 0.7); R-AMB-03: ruido & aire = 0.3
+        assert resultado["R-AMB-05"] == pytest.approx(0.7)
+        assert resultado["R-AMB-03"] == pytest.approx(0.3)
+
+    def test_umbral_descarta_reglas_debiles(self):
+        """Las premisas por debajo del umbral no disparan la regla"""
+        confianzas = {"ruido_elevado": 0.8, "aire_contaminado": 0.3}
+        ids = [r["id"] for r in motor_inferencia_certeza(confianzas, umbral=0.5)]
+
+        assert "R-AMB-03" not in ids
+        assert "R-AMB-05" in ids
+
+    def test_resultados_ordenados_por_certeza(self):
+        """Las reglas deben devolverse de mayor a menor certeza"""
+        confianzas = {h: 0.5 + 0.05 * i for i, h in enumerate(IDS_HECHOS)}
+        certezas = [r["certeza"] for r in motor_inferencia_certeza(confianzas)]
+
+        assert certezas == sorted(certezas, reverse=True)
+
+    def test_lote_igual_a_observaciones_individuales(self):
+        """Puntuar en lote debe dar lo mismo que una observación a la vez"""
+        lote = [{h: (i * 7 + j * 3) % 10 / 10 for j, h in enumerate(IDS_HECHOS)} for i in range(25)]
+
+        assert motor_certeza.diagnosticar_lote(lote) == [motor_inferencia_certeza(o) for o in lote]
+
+    def test_umbral_exclusivo(self):
+        """Una premisa igual al umbral no dispara la regla"""
+        confianzas = {"ruido_elevado": 0.8, "aire_contaminado": 0.3}
+
+        assert "R-AMB-03" not in [r["id"] for r in motor_inferencia_certeza(confianzas, umbral=0.3)]
+
+    def test_hecho_desconocido(self):
+        """Un hecho que no es de la base es un error, no una confianza ignorada"""
+        with pytest.raises(ValueError, match="olor_fuertee"):
+            motor_certeza.diagnosticar_lote([{"olor_fuerte": 0.5}, {"olor_fuertee": 0.5}])
+
+
+class TestEndpointsCerteza:
+    """Tests de /diagnosticar-certeza y /diagnosticar-certeza-lote"""
+
+    def test_hecho_desconocido_da_422(self):
+        """Igual que un tipo inválido: 422 en lugar de ignorar el hecho"""
+        cliente = TestClient(main.app)
+
+        assert cliente.post("/diagnosticar-certeza", json={"hechos": {"olor_fuertee": 0.9}}).status_code == 422
+        lote = {"lote": [{"olor_fuerte": 0.9}, {"olor_fuertee": 0.9}]}
+        assert cliente.post("/diagnosticar-certeza-lote", json=lote).status_code == 422
+
+    def test_umbral_uno_da_422(self):
+        """Con umbral exclusivo, 1.0 no podría disparar ninguna regla"""
+        cliente = TestClient(main.app)
+        hechos = {"hechos": {"ruido_elevado": 1.0}}
+
+        assert cliente.post("/diagnosticar-certeza?umbral=1.0", json=hechos).status_code == 422
+        assert cliente.post("/diagnosticar-certeza?umbral=0.99", json=hechos).json()["total"] > 0
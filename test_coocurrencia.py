@@ -0,0 +1,158 @@
+"""
+Tests de las matrices de coocurrencia de hechos
+
+Ejecutar con: pytest test_coocurrencia.py -v
+"""
+
+import pytest
+from fastapi.testclient import TestClient
+
+import database
+import main
+import retencion
+from almacenamiento import AlmacenLog, AlmacenMemoria, AlmacenSQLite
+from coocurrencia import MatrizCoocurrencia
+from reglas import motor_inferencia
+from serializacion import dumps
+
+
+HECHOS_AGUA = {"agua_turbia": True, "olor_fuerte": True, "humedad_excesiva": True}
+HECHOS_RUIDO = {"ruido_elevado": True, "agua_turbia": False}
+
+
+@pytest.fixture(autouse=True)
+def base_temporal(monkeypatch, tmp_path):
+    """Base de datos temporal"""
+    monkeypatch.setattr(database, "DATABASE_NAME", str(tmp_path / "coocurrencia.db"))
+    monkeypatch.setattr(main, "almacen", AlmacenSQLite())
+    database.init_database()
+
+
+def par(analisis, a, b):
+    return next(p for p in analisis["pares"] if {p["a"], p["b"]} == {a, b})
+
+
+class TestMatrizCoocurrencia:
+    """Tests de MatrizCoocurrencia"""
+
+    def test_conteos_probabilidades_y_lift(self):
+        """Solo cuentan los hechos presentes; el lift compara con la independencia"""
+        matriz = MatrizCoocurrencia()
+        matriz.sumar(HECHOS_AGUA, "R-AMB-01", 3)
+        matriz.sumar({"agua_turbia": True}, None)
+
+        analisis = matriz.analizar()
+
+        assert analisis["total"] == 4
+        assert analisis["hechos"]["agua_turbia"] == {"conteo": 4, "proporcion": 1.0}
+        assert analisis["hechos"]["ruido_elevado"]["conteo"] == 0
+        juntos = par(analisis, "agua_turbia", "olor_fuerte")
+        assert juntos["juntos"] == 3
+        assert (juntos["p_b_dado_a"], juntos["p_a_dado_b"], juntos["lift"]) in \
+            [(0.75, 1.0, 1.0), (1.0, 0.75, 1.0)]
+        assert par(analisis, "agua_turbia", "ruido_elevado")["lift"] is None
+        regla = analisis["reglas"]["R-AMB-01"]
+        assert regla["total"] == 3
+        assert regla["hechos"]["olor_fuerte"]["p_regla_dado_hecho"] == 1.0
+        assert regla["hechos"]["agua_turbia"]["p_regla_dado_hecho"] == 0.75
+        assert analisis["reglas"]["sin_regla"]["hechos"]["agua_turbia"]["conteo"] == 1
+
+    def test_fila_y_hechos_nuevos(self):
+        """Se guarda como BLOB y se relee aunque la lista de hechos cambie"""
+        matriz = MatrizCoocurrencia(["a", "b"])
+        matriz.sumar({"a": True, "b": True}, "R1", 2)
+        matriz.sumar({"b": True}, None)
+
+        releida = MatrizCoocurrencia.desde_fila(matriz.a_fila(), hechos=["c", "b", "a"])
+
+        assert releida.total == 3
+        assert releida.reglas == ["R1", None]
+        assert releida.pares.tolist() == [[0, 0, 0], [0, 3, 2], [0, 2, 2]]
+        assert releida.por_regla.tolist() == [[0, 0], [2, 1], [2, 0]]
+        assert releida.conteo_reglas.tolist() == [2, 1]
+
+
+class TestPersistencia:
+    """Tests de las matrices guardadas en SQLite"""
+
+    def test_guardar_y_lote_actualizan(self):
+        """Cada guardado suma en la matriz de su inquilino"""
+        database.guardar_diagnostico(HECHOS_AGUA, motor_inferencia(HECHOS_AGUA))
+        database.guardar_diagnosticos_lote([(dumps(HECHOS_AGUA).decode(), motor_inferencia(HECHOS_AGUA))] * 4 +
+                                           [(dumps(HECHOS_RUIDO).decode(), motor_inferencia(HECHOS_RUIDO))] * 2)
+        database.guardar_diagnostico(HECHOS_RUIDO, motor_inferencia(HECHOS_RUIDO), inquilino="norte")
+
+        analisis = database.obtener_coocurrencias()
+
+        assert analisis["total"] == 7
+        assert par(analisis, "agua_turbia", "olor_fuerte")["juntos"] == 5
+        assert analisis["hechos"]["ruido_elevado"]["conteo"] == 2
+        regla = motor_inferencia(HECHOS_AGUA)["id"]
+        assert analisis["reglas"][regla]["total"] == 5
+        assert database.obtener_coocurrencias("norte")["total"] == 1
+        assert database.obtener_coocurrencias("sur")["total"] == 0
+
+    def test_insert_fallido_no_cuenta(self):
+        """Si el INSERT se deshace, la matriz también"""
+        database.guardar_diagnostico(HECHOS_AGUA, motor_inferencia(HECHOS_AGUA), clave_idempotencia="k")
+        database.guardar_diagnostico(HECHOS_AGUA, motor_inferencia(HECHOS_AGUA), clave_idempotencia="k")
+
+        assert database.obtener_coocurrencias()["total"] == 1
+
+    def test_reconstruir_incluye_archivo(self):
+        """Reconstruir da lo mismo que lo acumulado, aunque parte esté en el archivo frío"""
+        database.guardar_diagnosticos_lote([(dumps(HECHOS_AGUA).decode(), motor_inferencia(HECHOS_AGUA))] * 3)
+        database.guardar_diagnostico({}, None, inquilino="norte")
+        with database.get_db_connection() as conn:
+            conn.execute("UPDATE diagnosticos SET fecha = '2020-01-01 00:00:00' WHERE id <= 2")
+        retencion.archivar(30)
+        database.guardar_diagnostico(HECHOS_RUIDO, motor_inferencia(HECHOS_RUIDO))
+        acumulado = {inquilino: database.obtener_coocurrencias(inquilino) for inquilino in ("", "norte")}
+
+        assert database.reconstruir_coocurrencias() == {"": 4, "norte": 1}
+
+        assert {inquilino: database.obtener_coocurrencias(inquilino) for inquilino in ("", "norte")} == acumulado
+
+    def test_base_anterior_se_calcula_al_iniciar(self):
+        """Una base sin la tabla la crea y la llena con los diagnósticos existentes"""
+        database.guardar_diagnosticos_lote([(dumps(HECHOS_AGUA).decode(), motor_inferencia(HECHOS_AGUA))] * 2)
+        with database.get_db_connection() as conn:
+            conn.execute("DROP TABLE coocurrencias")
+
+        database.init_database()
+
+        assert database.obtener_coocurrencias()["total"] == 2
+
+
+class TestOtrosMotores:
+    """Los motores memoria y log mantienen las mismas matrices"""
+
+    def test_memoria_y_log(self, tmp_path):
+        """Mismo análisis que SQLite; el log lo rearma al reabrir"""
+        lote = [(dumps(HECHOS_AGUA).decode(), motor_inferencia(HECHOS_AGUA))] * 3
+        ruta = str(tmp_path / "diagnosticos.log")
+        almacenes = [AlmacenSQLite(), AlmacenMemoria(), AlmacenLog(ruta)]
+        for almacen in almacenes:
+            almacen.guardar_lote(lote)
+            almacen.guardar(HECHOS_RUIDO, motor_inferencia(HECHOS_RUIDO))
+        almacenes[2].cerrar()
+        reabierto = AlmacenLog(ruta)
+
+        esperado = almacenes[0].coocurrencias()
+        assert almacenes[1].coocurrencias() == esperado
+        assert reabierto.coocurrencias() == esperado
+        reabierto.cerrar()
+
+
+class TestEndpoint:
+    """Tests de /analitica/coocurrencia"""
+
+    def test_diagnosticar_actualiza(self):
+        """Un diagnóstico de la API aparece enseguida en la analítica"""
+        cliente = TestClient(main.app)
+        cliente.post("/diagnosticar", json={"hechos": HECHOS_AGUA})
+
+        analisis = cliente.get("/analitica/coocurrencia").json()
+
+        assert analisis["total"] == 1
+        assert par(analisis, "olor_fuerte", "humedad_excesiva")["juntos"] == 1
@@ -0,0 +1,80 @@
+"""
+Tests del difusor de eventos de diagnósticos
+
+Ejecutar con: pytest test_eventos.py -v
+"""
+
+import asyncio
+
+from eventos import Difusor
+
+
+def evento(riesgo, categoria="Ecosistema"):
+    return {"riesgo": riesgo, "categoria": categoria}
+
+
+class TestDifusor:
+    """Tests del difusor en proceso"""
+
+    def test_filtra_por_riesgo_y_categoria(self):
+        """Solo deben llegar los eventos que pasan los filtros"""
+        async def escenario():
+            difusor = Difusor()
+            suscripcion = difusor.suscribir(riesgos=["ALTO"], categorias=["Ecosistema"])
+            difusor.publicar(evento("MEDIO"))
+            difusor.publicar(evento("ALTO", "Gestión de Residuos"))
+            difusor.publicar(evento("ALTO"))
+            return await suscripcion.esperar(timeout=1)
+
+        recibidos = asyncio.run(escenario())
+
+        assert [datos for _, datos in recibidos] == [evento("ALTO")]
+
+    def test_cliente_lento_pierde_los_mas_antiguos(self):
+        """La cola acotada descarta los eventos viejos y los contabiliza"""
+        async def escenario():
+            difusor = Difusor(capacidad_cola=3)
+            suscripcion = difusor.suscribir()
+            for _ in range(5):
+                difusor.publicar(evento("ALTO"))
+            recibidos = await suscripcion.esperar(timeout=1)
+            return difusor, suscripcion, recibidos
+
+        difusor, suscripcion, recibidos = asyncio.run(escenario())
+
+        assert [evento_id for evento_id, _ in recibidos] == [3, 4, 5]
+        assert suscripcion.tomar_descartados() == 2
+        assert suscripcion.tomar_descartados() == 0
+        assert difusor.estadisticas()["descartados"] == 2
+
+    def test_reanuda_desde_last_event_id(self):
+        """Al reanudar deben reenviarse los eventos posteriores al último recibido"""
+        async def escenario():
+            difusor = Difusor()
+            for riesgo in ("ALTO", "BAJO", "ALTO"):
+                difusor.publicar(evento(riesgo))
+            suscripcion = difusor.suscribir(riesgos=["ALTO"], ultimo_id=1)
+            return await suscripcion.esperar(timeout=1)
+
+        recibidos = asyncio.run(escenario())
+
+        assert [evento_id for evento_id, _ in recibidos] == [3]
+
+    def test_reanudar_fuera_del_historial_informa_perdidos(self):
+        """Si el historial ya no contiene el evento se informa el desfase"""
+        async def escenario():
+            difusor = Difusor(tamano_historial=2)
+            for _ in range(5):
+                difusor.publicar(evento("ALTO"))
+            return difusor.suscribir(ultimo_id=1)
+
+        suscripcion = asyncio.run(escenario())
+
+        assert suscripcion.tomar_descartados() == 2
+
+    def test_publicar_sin_suscriptores_no_bloquea(self):
+        """Publicar sin suscriptores solo actualiza el historial"""
+        difusor = Difusor()
+
+        assert difusor.publicar(evento("ALTO")) == 1
+        assert difusor.estadisticas()["suscriptores"] == 0
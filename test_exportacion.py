@@ -0,0 +1,172 @@
+"""
+Tests de la exportación masiva de PDF en ZIP
+
+Ejecutar con: pytest test_exportacion.py -v
+"""
+
+import csv
+import io
+import zipfile
+
+import pytest
+from fastapi.testclient import TestClient
+
+import database
+import exportacion
+import main
+from admision import ClaseAdmision
+from almacenamiento import AlmacenSQLite
+from reglas import motor_inferencia
+from serializacion import dumps
+
+
+HECHOS_AGUA = {"agua_turbia": True, "olor_fuerte": True, "humedad_excesiva": True}
+HECHOS_RUIDO = {"ruido_elevado": True}
+
+
+@pytest.fixture(autouse=True)
+def base_temporal(monkeypatch, tmp_path):
+    """Base de datos temporal, sin límites de admisión para los PDF"""
+    monkeypatch.setattr(database, "DATABASE_NAME", str(tmp_path / "exportacion.db"))
+    monkeypatch.setattr(main, "almacen", AlmacenSQLite())
+    monkeypatch.setitem(main.control_admision.clases, "pdf", ClaseAdmision("pdf", 100, 1000.0, 1000))
+    database.init_database()
+
+
+def cargar(hechos, cantidad, inquilino='', fecha=None):
+    """Guarda `cantidad` diagnósticos (opcionalmente con una fecha fija)"""
+    database.guardar_diagnosticos_lote([(dumps(hechos).decode(), motor_inferencia(hechos))] * cantidad,
+                                       "v1", inquilino)
+    if fecha is not None:
+        with database.get_db_connection() as conn:
+            conn.execute('UPDATE diagnosticos SET fecha = ? WHERE id > (SELECT MAX(id) FROM diagnosticos) - ?',
+                         (fecha, cantidad))
+
+
+def abrir_zip(contenido):
+    """Nombres de los PDF y filas de indice.csv de un ZIP"""
+    archivo = zipfile.ZipFile(io.BytesIO(contenido))
+    nombres = [nombre for nombre in archivo.namelist() if nombre.endswith(".pdf")]
+    for nombre in nombres:
+        assert archivo.read(nombre).startswith(b"%PDF")
+    indice = list(csv.DictReader(io.StringIO(archivo.read("indice.csv").decode())))
+    return nombres, indice
+
+
+class TestExportarPDF:
+    """Tests de /exportar-pdf y /exportaciones/{id}"""
+
+    def test_rango_completo_y_progreso(self):
+        """Sin filtros exporta todo, del más reciente al más antiguo, y el avance queda terminado"""
+        cargar(HECHOS_AGUA, 5)
+        cargar(HECHOS_RUIDO, 4)
+        cliente = TestClient(main.app)
+
+        respuesta = cliente.get("/exportar-pdf")
+
+        assert respuesta.headers["content-type"] == "application/zip"
+        nombres, indice = abrir_zip(respuesta.content)
+        assert nombres == [f"diagnostico_{i}.pdf" for i in range(9, 0, -1)]
+        assert [fila["archivo"] for fila in indice] == nombres
+        assert indice[0]["riesgo"] == motor_inferencia(HECHOS_RUIDO)["riesgo"]
+        progreso = cliente.get(f"/exportaciones/{respuesta.headers['x-exportacion-id']}").json()
+        assert progreso["estado"] == "terminada"
+        assert progreso["generados"] == progreso["total"] == 9
+        assert progreso["bytes"] == len(respuesta.content)
+
+    def test_por_ids_e_inquilino(self):
+        """Con ids respeta el orden pedido y cuenta los que no existen (o son de otro inquilino)"""
+        cargar(HECHOS_AGUA, 3)
+        cargar(HECHOS_RUIDO, 2, inquilino="norte")
+        cliente = TestClient(main.app)
+
+        respuesta = cliente.get("/exportar-pdf?ids=3&ids=1&ids=4&ids=99")
+
+        assert abrir_zip(respuesta.content)[0] == ["diagnostico_3.pdf", "diagnostico_1.pdf"]
+        progreso = cliente.get(f"/exportaciones/{respuesta.headers['x-exportacion-id']}").json()
+        assert progreso["faltantes"] == 2
+        norte = exportacion.diagnosticos_a_exportar(AlmacenSQLite(), "norte", [4, 1])
+        assert [d["id"] for d in norte] == [4]
+
+    def test_rango_de_fechas(self):
+        """desde/hasta eligen el período"""
+        cargar(HECHOS_AGUA, 3, fecha="2026-01-10 10:00:00")
+        cargar(HECHOS_RUIDO, 2, fecha="2026-02-10 10:00:00")
+        cliente = TestClient(main.app)
+
+        respuesta = cliente.get("/exportar-pdf?desde=2026-02-01&hasta=2026-03-01")
+
+        assert abrir_zip(respuesta.content)[0] == ["diagnostico_5.pdf", "diagnostico_4.pdf"]
+        assert zipfile.ZipFile(io.BytesIO(respuesta.content)).getinfo("diagnostico_4.pdf").date_time == \
+            (2026, 2, 10, 10, 0, 0)
+
+    def test_borrados_durante_la_exportacion(self, monkeypatch):
+        """Lo que se borra a mitad de la exportación no corre las páginas; lo que falta se cuenta"""
+        cargar(HECHOS_AGUA, 5)
+        monkeypatch.setattr(exportacion, "PAGINA", 2)
+        progreso = exportacion.ProgresoExportacion(5)
+        diagnosticos = exportacion.diagnosticos_a_exportar(AlmacenSQLite(), progreso=progreso)
+
+        exportados = [next(diagnosticos)["id"], next(diagnosticos)["id"]]
+        with database.get_db_connection() as conn:
+            conn.execute('DELETE FROM diagnosticos WHERE id IN (5, 4, 1)')
+        exportados += [d["id"] for d in diagnosticos]
+
+        assert exportados == [5, 4, 3, 2]
+        assert progreso.faltantes == 1
+
+    def test_vacia_y_demasiado_grande(self, monkeypatch):
+        """Sin diagnósticos devuelve un error; por encima del máximo, 422"""
+        cliente = TestClient(main.app)
+        assert "error" in cliente.get("/exportar-pdf").json()
+
+        cargar(HECHOS_AGUA, 3)
+        monkeypatch.setattr(main, "MAX_EXPORTACION", 2)
+        assert cliente.get("/exportar-pdf").status_code == 422
+        assert cliente.get("/exportaciones/desconocida").status_code == 404
+
+
+class TestGenerarZip:
+    """Tests de generar_zip"""
+
+    def test_pool_de_procesos(self):
+        """Con procesos el ZIP tiene los mismos PDF y en el mismo orden"""
+        cargar(HECHOS_AGUA, 10)
+        almacen = AlmacenSQLite()
+
+        en_serie = b"".join(exportacion.generar_zip(exportacion.diagnosticos_a_exportar(almacen),
+                                                    exportacion.ProgresoExportacion(10), procesos=1))
+        try:
+            en_paralelo = b"".join(exportacion.generar_zip(exportacion.diagnosticos_a_exportar(almacen),
+                                                           exportacion.ProgresoExportacion(10), procesos=2))
+        finally:
+            exportacion.cerrar_pool()
+
+        assert abrir_zip(en_paralelo)[0] == abrir_zip(en_serie)[0]
+
+    def test_sin_forkserver(self, monkeypatch):
+        """Donde no hay forkserver (Windows) el pool usa spawn y genera lo mismo"""
+        cargar(HECHOS_RUIDO, 3)
+        monkeypatch.setattr(exportacion.multiprocessing, "get_all_start_methods", lambda: ["spawn"])
+        try:
+            pool = exportacion.pool_pdf(2)
+            contenido = b"".join(exportacion.generar_zip(exportacion.diagnosticos_a_exportar(AlmacenSQLite()),
+                                                         exportacion.ProgresoExportacion(3), procesos=2))
+        finally:
+            exportacion.cerrar_pool()
+
+        assert pool._mp_context.get_start_method() == "spawn"
+        assert len(abrir_zip(contenido)[0]) == 3
+
+    def test_envia_mientras_genera(self, monkeypatch):
+        """Cada PDF sale apenas está listo y cortar la descarga deja la exportación cancelada"""
+        cargar(HECHOS_AGUA, 3)
+        monkeypatch.setattr(exportacion, "PAGINA", 1)
+        progreso = exportacion.ProgresoExportacion(3)
+        partes = exportacion.generar_zip(exportacion.diagnosticos_a_exportar(AlmacenSQLite()), progreso, procesos=1)
+
+        primera = next(partes)
+        assert progreso.generados == 1
+        assert b"diagnostico_3.pdf" in primera
+        partes.close()
+        assert progreso.estado == "cancelada"
@@ -0,0 +1,143 @@
+"""
+Tests de las bases de reglas por inquilino
+
+Ejecutar con: pytest test_inquilinos.py -v
+"""
+
+import asyncio
+
+import pytest
+from fastapi.testclient import TestClient
+
+import database
+import main
+from base_reglas import exportar
+from condiciones import Hecho
+from inquilinos import CacheBasesInquilinos, InquilinoDesconocido
+from reglas import REGLAS_AMBIENTALES
+
+
+HECHOS_RUIDO = {"ruido_elevado": True}
+
+
+@pytest.fixture
+def directorio(tmp_path):
+    """Directorio con tres inquilinos; "norte" diagnostica ruido con una regla propia"""
+    regla_ruido = dict(REGLAS_AMBIENTALES[0], id="R-NORTE-01", condicion=Hecho("ruido_elevado"))
+    exportar([regla_ruido] + REGLAS_AMBIENTALES, str(tmp_path / "norte.json"))
+    exportar(REGLAS_AMBIENTALES, str(tmp_path / "sur.json"))
+    exportar(REGLAS_AMBIENTALES, str(tmp_path / "este.json"))
+    return str(tmp_path)
+
+
+@pytest.fixture
+def cliente(directorio, tmp_path, monkeypatch):
+    """Cliente con una base de datos temporal y la caché de inquilinos del directorio"""
+    monkeypatch.setattr(database, "DATABASE_NAME", str(tmp_path / "test.db"))
+    database.init_database()
+    monkeypatch.setattr(main, "bases_inquilinos", CacheBasesInquilinos(directorio, max_cargados=2))
+    with TestClient(main.app) as c:
+        yield c
+
+
+class TestCacheBasesInquilinos:
+    """Tests de la caché LRU de bases compiladas"""
+
+    def test_memoria_acotada(self, directorio):
+        """No se guardan más bases que max_cargados; se descarta la menos usada"""
+        cache = CacheBasesInquilinos(directorio, max_cargados=2)
+        norte = cache.base_para("norte")
+        cache.base_para("sur")
+        cache.base_para("norte")
+        cache.base_para("este")
+
+        assert cache.estadisticas()["cargados"] == 2
+        assert cache.base_para("norte") is norte
+        assert cache.estadisticas()["aciertos"] == 2
+
+    def test_sin_inquilino_usa_la_base_global(self, directorio):
+        """Sin inquilino se usa la base global, sin ocupar la caché"""
+        cache = CacheBasesInquilinos(directorio)
+
+        assert cache.base_para(None).diagnosticar(HECHOS_RUIDO)["id"] != "R-NORTE-01"
+        assert cache.estadisticas()["cargados"] == 0
+
+    @pytest.mark.parametrize("nombre", ["oeste", "../norte", "Norte"])
+    def test_inquilino_desconocido(self, directorio, nombre):
+        """Nombres sin archivo o con caracteres no permitidos se rechazan"""
+        with pytest.raises(InquilinoDesconocido):
+            CacheBasesInquilinos(directorio).base_para(nombre)
+
+
+class TestApiInquilinos:
+    """Tests de la selección de inquilino y la partición de los datos"""
+
+    def test_encabezado_y_ruta_eligen_la_misma_base(self, cliente):
+        """X-Inquilino y /inquilinos/<inquilino>/ deben usar las reglas del inquilino"""
+        por_encabezado = cliente.post("/diagnosticar", json={"hechos": HECHOS_RUIDO},
+                                      headers={"X-Inquilino": "norte"}).json()
+        por_ruta = cliente.post("/inquilinos/norte/diagnosticar", json={"hechos": HECHOS_RUIDO}).json()
+        global_ = cliente.post("/diagnosticar", json={"hechos": HECHOS_RUIDO}).json()
+
+        assert por_encabezado["diagnostico"]["id"] == "R-NORTE-01"
+        assert por_ruta["diagnostico"]["id"] == "R-NORTE-01"
+        assert global_["diagnostico"]["id"] != "R-NORTE-01"
+
+    def test_inquilino_desconocido_da_404(self, cliente):
+        """Un inquilino sin reglas propias no puede diagnosticar"""
+        res = cliente.post("/inquilinos/oeste/diagnosticar", json={"hechos": HECHOS_RUIDO})
+
+        assert res.status_code == 404
+
+    def test_historial_y_estadisticas_por_inquilino(self, cliente):
+        """Cada inquilino solo ve sus propios diagnósticos"""
+        res = cliente.post("/inquilinos/norte/diagnosticar", json={"hechos": HECHOS_RUIDO}).json()
+        diagnostico_id = res["diagnostico"]["diagnostico_id"]
+
+        assert cliente.get("/inquilinos/norte/estadisticas").json()["total"] == 1
+        assert cliente.get("/estadisticas").json()["total"] == 0
+        assert cliente.get("/inquilinos/sur/historial").json()["total"] == 0
+        assert cliente.get(f"/inquilinos/norte/diagnostico/{diagnostico_id}").json()["id"] == diagnostico_id
+        assert "error" in cliente.get(f"/diagnostico/{diagnostico_id}").json()
+
+    def test_claves_de_idempotencia_separadas(self, cliente):
+        """La misma Idempotency-Key en dos inquilinos crea dos diagnósticos"""
+        headers = {"Idempotency-Key": "clave-compartida"}
+        norte = cliente.post("/inquilinos/norte/diagnosticar", json={"hechos": HECHOS_RUIDO}, headers=headers)
+        sur = cliente.post("/inquilinos/sur/diagnosticar", json={"hechos": HECHOS_RUIDO}, headers=headers)
+
+        assert "idempotent-replayed" not in sur.headers
+        assert norte.json()["diagnostico"]["diagnostico_id"] != sur.json()["diagnostico"]["diagnostico_id"]
+
+    def test_historial_usa_indice_por_inquilino(self, cliente):
+        """La consulta del historial debe resolverse con el índice (inquilino, fecha)"""
+        with database.get_db_connection() as conn:
+            plan = " ".join(fila["detail"] for fila in conn.execute(
+                "EXPLAIN QUERY PLAN SELECT id FROM diagnosticos WHERE inquilino = ? ORDER BY fecha DESC LIMIT 50",
+                ("norte",)
+            ))
+
+        assert "idx_diagnosticos_inquilino_fecha" in plan
+
+    def test_compilar_no_bloquea_el_bucle(self, cliente, monkeypatch):
+        """Los endpoints async compilan una base nueva en el pool de hilos"""
+        hilos = []
+        compilar = main.bases_inquilinos._compilar
+
+        def compilar_y_anotar(inquilino):
+            try:
+                asyncio.get_running_loop()
+                hilos.append("bucle")
+            except RuntimeError:
+                hilos.append("pool")
+            return compilar(inquilino)
+
+        monkeypatch.setattr(main.bases_inquilinos, "_compilar", compilar_y_anotar)
+        rutas = ["/reglas", "/reglas/tabla", "/historial", "/estadisticas", "/analitica/coocurrencia"]
+        for inquilino, ruta in zip(["norte", "sur", "este", "norte", "sur"], rutas):
+            assert cliente.get(ruta, headers={"X-Inquilino": inquilino}).status_code == 200
+        with cliente.websocket_connect("/ws/diagnostico", headers={"X-Inquilino": "este"}) as ws:
+            assert ws.receive_json()["tipo"] == "preguntas"
+        assert cliente.get("/reglas", headers={"X-Inquilino": "oeste"}).status_code == 404
+
+        assert hilos and set(hilos) == {"pool"}
@@ -0,0 +1,105 @@
+"""
+Tests del diagnóstico por lotes
+
+Ejecutar con: pytest test_lote.py -v
+"""
+
+import json
+
+import pytest
+
+import database
+from base_reglas import exportar
+from inquilinos import CacheBasesInquilinos
+from lote import procesar_archivo
+from reglas import REGLAS_AMBIENTALES, motor_inferencia
+
+
+ENCUESTAS = [
+    {"ruido_elevado": True},
+    {"agua_turbia": True, "olor_fuerte": True, "humedad_excesiva": True},
+    {},
+    {"residuos_acumulados": True, "olor_fuerte": True},
+    {"ruido_elevado": True},
+]
+
+
+@pytest.fixture(autouse=True)
+def base_temporal(tmp_path, monkeypatch):
+    """Base de datos temporal para cada test"""
+    monkeypatch.setattr(database, "DATABASE_NAME", str(tmp_path / "test.db"))
+    database.init_database()
+
+
+def guardados():
+    """Hechos, regla e inquilino de los diagnósticos guardados, en orden"""
+    with database.get_db_connection() as conn:
+        return [(json.loads(fila["hechos_json"]), fila["regla_id"], fila["inquilino"])
+                for fila in conn.execute("SELECT hechos_json, regla_id, inquilino FROM diagnosticos ORDER BY id")]
+
+
+def esperado(hechos):
+    """ID de la regla que devuelve el motor para los hechos"""
+    regla = motor_inferencia(hechos)
+    return regla["id"] if regla else None
+
+
+class TestLote:
+    """Tests de procesar_archivo con varios procesos y bloques chicos"""
+
+    def test_ndjson(self, tmp_path):
+        """Cada encuesta se guarda en orden con la regla que da el motor; las líneas rotas se cuentan"""
+        ruta = tmp_path / "encuestas.ndjson"
+        lineas = [json.dumps({"id": i, "hechos": h}) for i, h in enumerate(ENCUESTAS)]
+        ruta.write_text("\n".join(lineas[:2] + ["{roto", "[1, 2]"] + lineas[2:]) + "\n", encoding="utf-8")
+
+        resumen = procesar_archivo(str(ruta), procesos=2, bloque=2, mostrar_progreso=False)
+
+        assert resumen["encuestas"] == len(ENCUESTAS)
+        assert resumen["invalidas"] == 2
+        assert [(h, r) for h, r, _ in guardados()] == [(h, esperado(h)) for h in ENCUESTAS]
+        assert resumen["por_regla"][esperado(ENCUESTAS[0])] == 2
+
+    def test_csv_ignora_columnas_que_no_son_hechos(self, tmp_path):
+        """Las columnas id/fecha no se guardan como hechos; si/no y 1/0 se interpretan"""
+        ruta = tmp_path / "encuestas.csv"
+        ruta.write_text(
+            "id,ruido_elevado,agua_turbia,olor_fuerte,fecha\n"
+            "1,si,no,0,2026-01-01\n"
+            "2,0,1,1,2026-01-02\n"
+            "3,1,1\n",
+            encoding="utf-8",
+        )
+
+        resumen = procesar_archivo(str(ruta), procesos=2, bloque=1, mostrar_progreso=False)
+        filas = guardados()
+
+        assert resumen["encuestas"] == 2
+        assert resumen["invalidas"] == 1
+        assert filas[0][0] == {"ruido_elevado": True, "agua_turbia": False, "olor_fuerte": False}
+        assert [r for _, r, _ in filas] == [esperado(h) for h, _, _ in filas]
+
+    def test_ndjson_ignora_claves_que_no_son_hechos(self, tmp_path):
+        """Las claves sueltas que no son hechos no se guardan ni cambian el diagnóstico"""
+        ruta = tmp_path / "encuestas.ndjson"
+        ruta.write_text(
+            json.dumps(dict(ENCUESTAS[1], id=7, fecha="2026-01-01", inventado=True)) + "\n"
+            + json.dumps({"id": 8, "hechos": dict(ENCUESTAS[0], inventado=1)}) + "\n",
+            encoding="utf-8",
+        )
+
+        resumen = procesar_archivo(str(ruta), procesos=1, bloque=1, mostrar_progreso=False)
+
+        assert resumen["encuestas"] == 2
+        assert [(h, r) for h, r, _ in guardados()] == [(h, esperado(h)) for h in ENCUESTAS[1::-1]]
+
+    def test_inquilino(self, tmp_path):
+        """Los diagnósticos quedan a nombre del inquilino indicado"""
+        exportar(REGLAS_AMBIENTALES, str(tmp_path / "norte.json"))
+        ruta = tmp_path / "encuestas.ndjson"
+        ruta.write_text(json.dumps(ENCUESTAS[0]) + "\n", encoding="utf-8")
+
+        base = CacheBasesInquilinos(str(tmp_path)).base_para("norte")
+        procesar_archivo(str(ruta), procesos=1, inquilino="norte", base=base, mostrar_progreso=False)
+
+        assert guardados()[0][2] == "norte"
@@ -6,7 +6,7 @@ O con: python -m pytest test_motor_inferencia.py -v
 """
 
 import pytest
-from reglas import motor_inferencia, motor_inferencia_multiple, REGLAS_AMBIENTALES, HECHOS_OBSERVABLES
+from reglas import motor_inferencia, motor_inferencia_multiple, motor_inferencia_parcial, REGLAS_AMBIENTALES, HECHOS_OBSERVABLES
 
 
 class TestMotorInferencia:
@@ -279,6 +279,73 @@ class TestMotorInferenciaMultiple:
             assert 'justificacion' in regla
 
 
+class TestMotorInferenciaParcial:
+    """Tests para el motor de inferencia con hechos desconocidos"""
+    
+    def test_sin_hechos_nada_decidido(self):
+        """Sin hechos conocidos ninguna regla está decidida"""
+        resultado = motor_inferencia_parcial({})
+        
+        assert resultado['decidido'] is False
+        assert resultado['diagnostico'] is None
+        assert resultado['disparadas'] == []
+        assert len(resultado['posibles']) == len(REGLAS_AMBIENTALES)
+    
+    def test_decide_con_hechos_incompletos(self):
+        """Debe decidir contaminación del agua aunque falten hechos irrelevantes"""
+        hechos = {"agua_turbia": True, "olor_fuerte": True, "humedad_excesiva": True}
+        resultado = motor_inferencia_parcial(hechos)
+        
+        assert resultado['decidido'] is True
+        assert resultado['diagnostico']['id'] == 'R-AMB-01'
+        assert 'condicion' not in resultado['diagnostico']
+        # Terminación temprana: las reglas posteriores no se evalúan
+        assert len(resultado['sin_evaluar']) == len(REGLAS_AMBIENTALES) - 1
+    
+    def test_desconocido_distinto_de_falso(self):
+        """Un hecho desconocido no debe tratarse como falso"""
+        hechos = {
+            "olor_fuerte": False,
+            "vegetacion_deteriorada": False,
+            "residuos_acumulados": False,
+            "humedad_excesiva": False,
+            "aire_contaminado": False,
+            "agua_turbia": False,
+            "ruido_elevado": None
+        }
+        resultado = motor_inferencia_parcial(hechos)
+        
+        # Con ruido=False ganaría R-AMB-09, pero ruido=True activa R-AMB-05 antes
+        assert resultado['decidido'] is False
+        assert 'R-AMB-05' in resultado['posibles']
+        assert 'R-AMB-09' in resultado['disparadas']
+    
+    def test_coincide_con_motor_completo(self):
+        """Con todos los hechos conocidos debe coincidir con motor_inferencia"""
+        hechos = {
+            "olor_fuerte": False,
+            "vegetacion_deteriorada": True,
+            "residuos_acumulados": True,
+            "humedad_excesiva": False,
+            "ruido_elevado": True,
+            "aire_contaminado": False,
+            "agua_turbia": False
+        }
+        resultado = motor_inferencia_parcial(hechos)
+        
+        assert resultado['decidido'] is True
+        assert resultado['posibles'] == []
+        assert resultado['diagnostico'] == motor_inferencia(hechos)
+    
+    def test_sin_terminacion_temprana_evalua_todas(self):
+        """Sin terminación temprana deben clasificarse todas las reglas"""
+        resultado = motor_inferencia_parcial({"ruido_elevado": True}, terminacion_temprana=False)
+        clasificadas = resultado['disparadas'] + resultado['descartadas'] + resultado['posibles']
+        
+        assert resultado['sin_evaluar'] == []
+        assert sorted(clasificadas) == sorted(r['id'] for r in REGLAS_AMBIENTALES)
+
+
 class TestBaseConocimiento:
     """Tests para la base de conocimiento"""
     
@@ -0,0 +1,96 @@
+"""
+Tests de los registros inmutables de reglas y diagnósticos
+
+Ejecutar con: pytest test_registros.py -v
+"""
+
+import pickle
+
+import pytest
+
+from registros import Diagnostico, Regla, compilar_reglas
+from reglas import REGLAS_AMBIENTALES, REGLAS_COMPILADAS, motor_inferencia, motor_inferencia_multiple
+from serializacion import dumps
+
+
+HECHOS_RUIDO = {"ruido_elevado": True}
+
+
+class TestRegla:
+    """Tests del registro Regla"""
+
+    def test_es_un_mapping_sin_la_condicion(self):
+        """La regla compilada tiene las claves de la original salvo la condición"""
+        original = REGLAS_AMBIENTALES[0]
+        regla = REGLAS_COMPILADAS[0]
+
+        assert dict(regla) == {k: v for k, v in original.items() if k != "condicion"}
+        assert "condicion" not in regla
+        assert regla.condicion is original["condicion"]
+
+    def test_inmutable(self):
+        """No se pueden cambiar ni agregar atributos"""
+        regla = REGLAS_COMPILADAS[0]
+        with pytest.raises(AttributeError):
+            regla.titulo = "otro"
+        with pytest.raises(AttributeError):
+            regla.diagnostico_id = 1
+        with pytest.raises(TypeError):
+            regla["titulo"] = "otro"
+
+    def test_listas_y_diccionarios_congelados(self):
+        """Las acciones y los hechos compartidos no se pueden modificar"""
+        original = {"agua_turbia": True}
+        diagnostico = Diagnostico(id=1, hechos=original, acciones=["Reportar"])
+        original["olor_fuerte"] = True
+
+        assert diagnostico["hechos"] == {"agua_turbia": True}
+        assert diagnostico["acciones"] == ["Reportar"]
+        with pytest.raises(TypeError):
+            diagnostico["hechos"]["olor_fuerte"] = True
+        with pytest.raises(TypeError):
+            diagnostico["hechos"].update(olor_fuerte=True)
+        with pytest.raises(TypeError):
+            REGLAS_COMPILADAS[0]["acciones"].append("otra")
+        assert dumps(diagnostico) == dumps({"id": 1, "hechos": {"agua_turbia": True}, "acciones": ["Reportar"]})
+
+    def test_campo_desconocido(self):
+        """Crear un registro con campos que no existen es un error"""
+        with pytest.raises(TypeError):
+            Diagnostico(id=1, inventado=True)
+
+    def test_pickle(self):
+        """Los registros deben poder enviarse a otros procesos"""
+        regla = pickle.loads(pickle.dumps(REGLAS_COMPILADAS[0]))
+
+        assert regla == REGLAS_COMPILADAS[0]
+        assert regla.condicion.a_dict() == REGLAS_COMPILADAS[0].condicion.a_dict()
+
+    def test_compilar_reutiliza_registros(self):
+        """Compilar reglas ya compiladas no crea copias"""
+        assert all(a is b for a, b in zip(compilar_reglas(REGLAS_COMPILADAS), REGLAS_COMPILADAS))
+
+
+class TestMotorCompartido:
+    """El motor devuelve las reglas compiladas por referencia"""
+
+    def test_misma_instancia_en_cada_coincidencia(self):
+        """Dos diagnósticos iguales devuelven el mismo objeto, sin copias"""
+        primera = motor_inferencia(HECHOS_RUIDO)
+        segunda = motor_inferencia(HECHOS_RUIDO)
+
+        assert primera is segunda
+        assert isinstance(primera, Regla)
+        assert any(r is primera for r in REGLAS_COMPILADAS)
+
+    def test_multiple_comparte_las_reglas(self):
+        """Las reglas del diagnóstico múltiple también son las compiladas"""
+        todos = {hecho: True for regla in REGLAS_COMPILADAS for hecho in regla.condicion.hechos()}
+
+        assert all(any(r is c for c in REGLAS_COMPILADAS) for r in motor_inferencia_multiple(todos))
+
+    def test_serializa_como_diccionario(self):
+        """Los registros se convierten a JSON solo en el borde"""
+        regla = motor_inferencia(HECHOS_RUIDO)
+
+        assert dumps([regla]) == dumps([dict(regla)])
@@ -0,0 +1,190 @@
+"""
+Tests de los respaldos en caliente
+
+Ejecutar con: pytest test_respaldo.py -v
+"""
+
+import os
+import sqlite3
+import subprocess
+import sys
+import threading
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+
+import database
+import main
+import respaldo
+from reglas import motor_inferencia
+from serializacion import dumps
+
+
+HECHOS_AGUA = {"agua_turbia": True, "olor_fuerte": True, "humedad_excesiva": True}
+HECHOS_RUIDO = {"ruido_elevado": True}
+
+
+@pytest.fixture(autouse=True)
+def base_temporal(monkeypatch, tmp_path):
+    """Base de datos temporal"""
+    monkeypatch.setattr(database, "DATABASE_NAME", str(tmp_path / "respaldo.db"))
+    database.init_database()
+
+
+@pytest.fixture
+def directorio(tmp_path):
+    """Directorio de respaldos temporal"""
+    return str(tmp_path / "respaldos")
+
+
+def cargar(cantidad):
+    """Guarda `cantidad` diagnósticos en una transacción"""
+    database.guardar_diagnosticos_lote([(dumps(HECHOS_AGUA).decode(), motor_inferencia(HECHOS_AGUA))] * cantidad)
+
+
+def contar(ruta):
+    """Filas de la tabla diagnosticos en una base"""
+    conn = sqlite3.connect(ruta)
+    try:
+        return conn.execute('SELECT COUNT(*) FROM diagnosticos').fetchone()[0]
+    finally:
+        conn.close()
+
+
+class TestCrearYVerificar:
+    """Tests de crear_respaldo y verificar"""
+
+    def test_respaldo_completo(self, directorio):
+        """El respaldo tiene las mismas filas y pasa la verificación"""
+        cargar(300)
+
+        manifiesto = respaldo.crear_respaldo(directorio, paginas=4, pausa=0)
+
+        ruta = f"{directorio}/{manifiesto['archivo']}"
+        assert manifiesto["filas"]["diagnosticos"] == 300
+        assert manifiesto["ultimo_diagnostico"] == 300
+        assert manifiesto["pasos"] > 1
+        assert contar(ruta) == 300
+        assert respaldo.verificar(ruta)["sha256"] == manifiesto["sha256"]
+        assert respaldo.listar(directorio) == [manifiesto]
+
+    def test_instantanea_con_escrituras_concurrentes(self, directorio):
+        """Lo que se escribe durante la copia no entra al respaldo ni la reinicia"""
+        cargar(2000)
+        progreso = respaldo.Progreso()
+        escritas, errores = [], []
+
+        def escribir():
+            while progreso.pasos == 0:
+                time.sleep(0.001)
+            try:
+                for _ in range(20):
+                    cargar(10)
+                    escritas.append(progreso.paginas_copiadas)
+            except Exception as e:
+                errores.append(e)
+
+        hilo = threading.Thread(target=escribir)
+        hilo.start()
+        manifiesto = respaldo.crear_respaldo(directorio, paginas=2, pausa=0.002, progreso=progreso)
+        hilo.join()
+
+        assert errores == []
+        # Hubo escrituras mientras la copia avanzaba y la copia no se reinició
+        assert any(copiadas < manifiesto["paginas"] for copiadas in escritas)
+        assert manifiesto["pasos"] <= manifiesto["paginas"] // 2 + 1
+        assert manifiesto["filas"]["diagnosticos"] == manifiesto["ultimo_diagnostico"] == 2000
+        assert contar(database.DATABASE_NAME) == 2200
+
+    def test_verificar_detecta_danos(self, directorio):
+        """Un byte cambiado hace fallar la verificación"""
+        cargar(50)
+        manifiesto = respaldo.crear_respaldo(directorio, pausa=0)
+        ruta = f"{directorio}/{manifiesto['archivo']}"
+        with open(ruta, 'r+b') as archivo:
+            archivo.seek(-100, 2)
+            byte = archivo.read(1)
+            archivo.seek(-100, 2)
+            archivo.write(bytes([byte[0] ^ 0xFF]))
+
+        with pytest.raises(respaldo.RespaldoInvalido):
+            respaldo.verificar(ruta)
+
+    def test_conserva_los_ultimos(self, directorio):
+        """Solo quedan los `conservar` respaldos más recientes"""
+        cargar(1)
+        nombres = [respaldo.crear_respaldo(directorio, pausa=0, conservar=2)["archivo"] for _ in range(4)]
+
+        assert [m["archivo"] for m in respaldo.listar(directorio)] == nombres[:1:-1]
+
+
+class TestRestaurar:
+    """Tests de restaurar"""
+
+    def test_vuelve_al_instante_del_respaldo(self, directorio):
+        """Las filas escritas después del respaldo desaparecen al restaurar"""
+        cargar(40)
+        manifiesto = respaldo.crear_respaldo(directorio, pausa=0)
+        cargar(25)
+
+        respaldo.restaurar(f"{directorio}/{manifiesto['archivo']}")
+
+        assert contar(database.DATABASE_NAME) == 40
+        assert database.obtener_estadisticas()["total"] == 40
+        cargar(1)
+        assert contar(database.DATABASE_NAME) == 41
+
+
+    def test_restaurar_desde_otro_proceso(self, directorio, monkeypatch):
+        """Pasado el intervalo la caché de la API no sirve diagnósticos deshechos ni IDs reutilizados"""
+        monkeypatch.setattr(database, "GENERACION_INTERVALO", 0.0)
+        cargar(3)
+        manifiesto = respaldo.crear_respaldo(directorio, pausa=0)
+        posterior = database.guardar_diagnostico(HECHOS_RUIDO, motor_inferencia(HECHOS_RUIDO))
+        assert database.obtener_diagnostico_por_id(posterior)["hechos"] == HECHOS_RUIDO
+
+        subprocess.run([sys.executable, "respaldo.py", "--db", database.DATABASE_NAME, "restaurar",
+                        f"{directorio}/{manifiesto['archivo']}"],
+                       cwd=os.path.dirname(os.path.abspath(respaldo.__file__)), check=True, capture_output=True)
+
+        assert database.obtener_diagnostico_por_id(posterior) is None
+        cargar(1)
+        assert database.obtener_diagnostico_por_id(posterior)["hechos"] == HECHOS_AGUA
+
+    def test_lote_descarta_ids_reutilizados(self, directorio, monkeypatch):
+        """Restaurar en el mismo proceso vacía la caché ya; un lote que reutiliza IDs aún cacheados los descarta"""
+        monkeypatch.setattr(database, "GENERACION_INTERVALO", 3600.0)
+        cargar(3)
+        manifiesto = respaldo.crear_respaldo(directorio, pausa=0)
+        posterior = database.guardar_diagnostico(HECHOS_RUIDO, motor_inferencia(HECHOS_RUIDO))
+        viejo = database.obtener_diagnostico_por_id(posterior)
+        respaldo.restaurar(f"{directorio}/{manifiesto['archivo']}")
+        assert database.obtener_diagnostico_por_id(posterior) is None
+
+        # Una entrada vieja que quedó en la caché (por ejemplo, leída durante la restauración)
+        database.cache_diagnosticos().guardar(("", posterior), viejo)
+        database.guardar_diagnosticos_con_claves([("k", HECHOS_AGUA, motor_inferencia(HECHOS_AGUA))])
+
+        assert database.obtener_diagnostico_por_id(posterior)["hechos"] == HECHOS_AGUA
+
+
+class TestEndpoints:
+    """Tests de /respaldos"""
+
+    def test_lanzar_y_consultar(self, monkeypatch, directorio):
+        """POST /respaldos lo hace en segundo plano y GET /respaldos lo lista"""
+        cargar(10)
+        monkeypatch.setattr(main, "respaldos", respaldo.TareaRespaldo(directorio=directorio))
+        cliente = TestClient(main.app)
+
+        assert cliente.post("/respaldos").status_code == 202
+        for _ in range(200):
+            estado = cliente.get("/respaldos").json()
+            if estado["en_curso"] is None and estado["ultimo"] is not None:
+                break
+            time.sleep(0.01)
+
+        assert estado["error"] is None
+        assert [m["archivo"] for m in estado["respaldos"]] == [estado["ultimo"]["archivo"]]
+        assert estado["ultimo"]["filas"]["diagnosticos"] == 10
@@ -0,0 +1,200 @@
+"""
+Tests de la retención y del archivo frío columnar
+
+Ejecutar con: pytest test_retencion.py -v
+"""
+
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from fastapi.testclient import TestClient
+
+import database
+import main
+import retencion
+from reglas import motor_inferencia
+from serializacion import dumps
+
+
+AHORA = datetime(2026, 6, 1, tzinfo=timezone.utc)
+HECHOS_AGUA = {"agua_turbia": True, "olor_fuerte": True, "humedad_excesiva": True}
+HECHOS_RUIDO = {"ruido_elevado": True}
+
+
+@pytest.fixture(autouse=True)
+def base_temporal(monkeypatch, tmp_path):
+    """Base de datos y archivo frío temporales"""
+    monkeypatch.setattr(database, "DATABASE_NAME", str(tmp_path / "retencion.db"))
+    monkeypatch.setattr(database, "ARCHIVO_DIR", None)
+    monkeypatch.setattr(database, "_archivos_frios", {})
+    database.init_database()
+
+
+def cargar(dias_atras, hechos, cantidad=1, inquilino='', diagnosticar=True):
+    """Guarda diagnósticos con fecha `dias_atras` días antes de AHORA; devuelve sus IDs"""
+    resultado = motor_inferencia(hechos) if diagnosticar else None
+    database.guardar_diagnosticos_lote([(dumps(hechos).decode(), resultado)] * cantidad, "v1", inquilino)
+    fecha = (AHORA - timedelta(days=dias_atras)).strftime(retencion.FORMATO_FECHA)
+    with database.get_db_connection() as conn:
+        ids = [fila[0] for fila in conn.execute(
+            'SELECT id FROM diagnosticos ORDER BY id DESC LIMIT ?', (cantidad,))]
+        conn.executemany('UPDATE diagnosticos SET fecha = ? WHERE id = ?', [(fecha, i) for i in ids])
+    return sorted(ids)
+
+
+def filas_en_tabla():
+    """Filas de la tabla caliente"""
+    with database.get_db_connection() as conn:
+        return conn.execute('SELECT COUNT(*) FROM diagnosticos').fetchone()[0]
+
+
+class TestArchivar:
+    """Tests de la tarea de retención"""
+
+    def test_mueve_filas_antiguas(self):
+        """Las filas más viejas que el corte pasan a segmentos y salen de la tabla"""
+        viejas = cargar(100, HECHOS_AGUA, 25)
+        cargar(5, HECHOS_RUIDO, 3)
+        estadisticas = database.obtener_estadisticas()
+
+        resumen = retencion.archivar(30, ahora=AHORA, filas_por_segmento=10)
+
+        assert resumen["archivadas"] == 25
+        assert resumen["segmentos"] == 3
+        assert filas_en_tabla() == 3
+        assert database.obtener_estadisticas() == estadisticas
+        archivado = database.obtener_diagnostico_por_id(viejas[7])
+        assert archivado["hechos"] == HECHOS_AGUA
+        assert archivado["regla_id"] == motor_inferencia(HECHOS_AGUA)["id"]
+        assert archivado["acciones"] == list(motor_inferencia(HECHOS_AGUA)["acciones"])
+        assert archivado["version_reglas"] == "v1"
+
+    def test_historial_continua_en_el_archivo(self):
+        """Las páginas del historial cruzan de la tabla al archivo sin saltos"""
+        ids = cargar(200, HECHOS_AGUA, 12) + cargar(100, HECHOS_RUIDO, 12) + cargar(1, HECHOS_AGUA, 6)
+        esperado = [d["id"] for d in database.obtener_historial(limite=100)]
+        retencion.archivar(30, ahora=AHORA, filas_por_segmento=5)
+
+        paginas = []
+        for offset in range(0, 30, 4):
+            paginas += [d["id"] for d in database.obtener_historial(limite=4, offset=offset)]
+        assert paginas == esperado == sorted(ids, reverse=True)
+
+    def test_segmentos_solapados(self):
+        """Un ID que cae en el rango de dos segmentos se encuentra y el historial sigue ordenado"""
+        viejo = cargar(200, HECHOS_AGUA)
+        intermedio = cargar(50, HECHOS_RUIDO)
+        viejos = cargar(190, HECHOS_AGUA) + cargar(180, HECHOS_RUIDO, 2)
+        esperado = [d["id"] for d in database.obtener_historial(limite=100)]
+        retencion.archivar(100, ahora=AHORA)
+        retencion.archivar(30, ahora=AHORA)
+
+        segmentos = database.archivo_frio().actualizar()
+        assert [(s["id_min"], s["id_max"]) for s in segmentos] == [(viejo[0], viejos[-1]), (intermedio[0],) * 2]
+        assert database.obtener_diagnostico_por_id(intermedio[0])["hechos"] == HECHOS_RUIDO
+        paginas = []
+        for offset in range(0, 5, 2):
+            paginas += [d["id"] for d in database.obtener_historial(limite=2, offset=offset)]
+        assert paginas == esperado
+        assert filas_en_tabla() == 0
+
+    def test_historial_despues_de_la_ultima_fila(self):
+        """Las páginas con antes = (fecha, id) cruzan de la tabla a segmentos solapados sin saltos"""
+        cargar(200, HECHOS_AGUA)
+        cargar(50, HECHOS_RUIDO, 3)
+        cargar(190, HECHOS_AGUA, 3)
+        cargar(2, HECHOS_RUIDO, 2)
+        esperado = [d["id"] for d in database.obtener_historial(limite=100)]
+        retencion.archivar(100, ahora=AHORA, filas_por_segmento=2)
+        retencion.archivar(30, ahora=AHORA, filas_por_segmento=2)
+
+        paginas, antes = [], None
+        while True:
+            pagina = database.obtener_historial(limite=2, antes=antes)
+            paginas += [d["id"] for d in pagina]
+            if len(pagina) < 2:
+                break
+            antes = (pagina[-1]["fecha"], pagina[-1]["id"])
+        assert paginas == esperado
+        assert filas_en_tabla() == 2
+
+    def test_inquilinos_y_rango_de_fechas(self):
+        """Filtros por inquilino y por fecha sobre tabla y archivo"""
+        cargar(200, HECHOS_AGUA, 4, inquilino="norte")
+        cargar(100, HECHOS_RUIDO, 3)
+        cargar(150, HECHOS_AGUA, 2)
+        cargar(2, HECHOS_RUIDO, 1)
+        retencion.archivar(30, ahora=AHORA, filas_por_segmento=4)
+
+        desde = (AHORA - timedelta(days=120)).strftime(retencion.FORMATO_FECHA)
+        assert database.obtener_estadisticas("norte")["total"] == 4
+        assert database.obtener_estadisticas(desde=desde)["total"] == 4
+        assert len(database.obtener_historial(desde=desde)) == 4
+        assert database.obtener_historial(limite=10, inquilino="otro") == []
+        ruido = motor_inferencia(HECHOS_RUIDO)["riesgo"]
+        assert database.obtener_estadisticas(desde=desde)["por_riesgo"] == {ruido: 4}
+
+    def test_segmentos_fuera_de_rango_no_se_abren(self):
+        """Un rango de fechas que no toca un segmento no lo descomprime"""
+        cargar(200, HECHOS_AGUA, 5)
+        cargar(100, HECHOS_RUIDO, 5)
+        retencion.archivar(30, ahora=AHORA, filas_por_segmento=5)
+        archivo = database.archivo_frio()
+        archivo._columnas.clear()
+
+        desde = (AHORA - timedelta(days=120)).strftime(retencion.FORMATO_FECHA)
+        assert database.obtener_estadisticas(desde=desde)["total"] == 5
+        assert len(database.obtener_historial(desde=desde)) == 5
+        abiertos = {nombre for nombre, _ in archivo._columnas}
+        assert abiertos == {"seg-000002.col"}
+
+    def test_reconciliar_tras_corte(self):
+        """Si el proceso se cortó después de escribir un segmento, sus filas se borran al volver"""
+        cargar(100, HECHOS_AGUA, 4)
+        with database.get_db_connection() as conn:
+            filas = [dict(fila) for fila in conn.execute(
+                f'SELECT {database.COLUMNAS_DIAGNOSTICO}, inquilino FROM diagnosticos ORDER BY id')]
+        database.archivo_frio().escribir_segmento(filas)
+        assert filas_en_tabla() == 4
+
+        resumen = retencion.archivar(30, ahora=AHORA)
+
+        assert resumen["archivadas"] == 0
+        assert filas_en_tabla() == 0
+        assert database.obtener_estadisticas()["total"] == 4
+
+    def test_sin_archivo(self):
+        """Sin segmentos las consultas no cambian"""
+        cargar(1, HECHOS_AGUA, 2)
+
+        assert retencion.archivar(30, ahora=AHORA)["archivadas"] == 0
+        assert database.obtener_estadisticas()["total"] == 2
+        assert database.archivo_frio().segmentos == []
+
+
+class TestEndpointsConRango:
+    """Tests de desde/hasta en la API"""
+
+    def test_historial_y_estadisticas(self):
+        """Los endpoints filtran por fecha y validan el formato"""
+        cargar(100, HECHOS_AGUA, 2)
+        cargar(1, HECHOS_RUIDO, 3)
+        retencion.archivar(30, ahora=AHORA)
+        cliente = TestClient(main.app)
+        desde = (AHORA - timedelta(days=150)).date().isoformat()
+        hasta = (AHORA - timedelta(days=50)).date().isoformat()
+
+        historial = cliente.get(f"/historial?desde={desde}&hasta={hasta}").json()
+        assert historial["total"] == 2
+        assert cliente.get(f"/estadisticas?desde={desde}").json()["total"] == 5
+        assert cliente.get("/estadisticas?desde=ayer").status_code == 422
+
+    def test_regla_archivada_sin_diagnostico(self):
+        """Las filas sin regla aplicable se archivan y se leen igual"""
+        ids = cargar(100, {}, 1, diagnosticar=False)
+        retencion.archivar(30, ahora=AHORA)
+
+        archivado = database.obtener_diagnostico_por_id(ids[0])
+        assert archivado["regla_id"] is None
+        assert archivado["titulo"] == database.SIN_DIAGNOSTICO["titulo"]
+        assert database.obtener_estadisticas()["por_riesgo"] == {"BAJO": 1}
@@ -0,0 +1,134 @@
+"""
+Tests del análisis de sensibilidad (/sensibilidad)
+
+Ejecutar con: pytest test_sensibilidad.py -v
+"""
+
+import random
+
+import pytest
+from fastapi.testclient import TestClient
+
+import base_reglas
+import database
+import main
+import sensibilidad
+from base_reglas import BaseReglas
+from bdd import ReglasCompiladas
+from reglas import REGLAS_AMBIENTALES, motor_inferencia
+from registros import compilar_reglas
+from sensibilidad import DemasiadosHechos, TablaDecision
+
+
+@pytest.fixture
+def tabla():
+    """Tabla de decisión de las reglas incluidas"""
+    return BaseReglas(REGLAS_AMBIENTALES).sensibilidad
+
+
+@pytest.fixture
+def cliente(monkeypatch, tmp_path):
+    """Cliente de la API con una base de datos temporal"""
+    monkeypatch.setattr(database, "DATABASE_NAME", str(tmp_path / "sensibilidad.db"))
+    database.init_database()
+    return TestClient(main.app)
+
+
+def invertir(hechos, nombres):
+    """Copia de los hechos con los indicados invertidos"""
+    cambiados = dict(hechos)
+    for nombre in nombres:
+        cambiados[nombre] = not cambiados.get(nombre, False)
+    return cambiados
+
+
+class TestTablaDecision:
+    """Tests de la tabla precalculada"""
+
+    def test_tabla_igual_al_motor(self, tabla):
+        """Cada combinación de la tabla tiene la regla que elige el motor"""
+        for mascara, indice in enumerate(tabla.ganadora.tolist()):
+            hechos = {hecho: bool(mascara >> bit & 1) for bit, hecho in enumerate(tabla.hechos)}
+            regla = motor_inferencia(hechos)
+            assert (regla["id"] if regla is not None else None) == \
+                   (tabla.reglas[indice]["id"] if indice >= 0 else None)
+
+    def test_tabla_sin_diagrama_de_la_base(self, tabla):
+        """Sin el diagrama de la base completa la tabla sale de las condiciones y es la misma"""
+        compiladas = ReglasCompiladas(compilar_reglas(REGLAS_AMBIENTALES), max_nodos_base=1)
+        assert compiladas.raiz is None
+
+        assert TablaDecision(compiladas, tabla.hechos).ganadora.tolist() == tabla.ganadora.tolist()
+
+    def test_cambios_simples_y_pares(self, tabla):
+        """Cada cambio da el diagnóstico de los hechos con esos hechos invertidos"""
+        aleatorio = random.Random(3)
+        lote = [{hecho: aleatorio.random() < 0.4 for hecho in tabla.hechos} for _ in range(50)]
+        resultados = tabla.analizar(lote, pares=True)
+
+        n = len(tabla.hechos)
+        for hechos, resultado in zip(lote, resultados):
+            assert len(resultado["cambios"]) == n + n * (n - 1) // 2
+            for cambio in resultado["cambios"]:
+                regla = motor_inferencia(invertir(hechos, cambio["invertir"]))
+                esperado = None if regla is None else {"regla_id": regla["id"], "riesgo": regla["riesgo"]}
+                assert cambio["diagnostico"] == esperado
+
+    def test_solo_mejoras(self, tabla):
+        """Con filtro=mejoras solo quedan los cambios que bajan el riesgo"""
+        resultado = tabla.analizar([{"ruido_elevado": True}], filtro="mejoras")[0]
+
+        assert resultado["diagnostico"]["riesgo"] == "MEDIO"
+        assert resultado["cambios"] == [{
+            "invertir": ["ruido_elevado"],
+            "diagnostico": {"regla_id": "R-AMB-09", "riesgo": "BAJO"},
+            "baja_riesgo": True,
+        }]
+
+    def test_hechos_desconocidos_se_ignoran(self, tabla):
+        """Los hechos que no son observables no cambian la máscara"""
+        assert tabla.mascaras([{"inventado": True}]).tolist() == [0]
+
+
+class TestEndpointSensibilidad:
+    """Tests de POST /sensibilidad"""
+
+    def test_un_sitio(self, cliente):
+        """Con 'hechos' se analiza un solo sitio"""
+        res = cliente.post("/sensibilidad", json={"hechos": {"ruido_elevado": True}})
+
+        assert res.status_code == 200
+        resultados = res.json()["resultados"]
+        assert len(resultados) == 1
+        assert len(resultados[0]["cambios"]) == 7
+
+    def test_lote_con_pares_y_filtro(self, cliente):
+        """Un lote con pares y filtro=cambios devuelve un resultado por sitio"""
+        lote = [{"ruido_elevado": True}, {"agua_turbia": True, "olor_fuerte": True}, {}]
+        res = cliente.post("/sensibilidad?pares=true&filtro=cambios", json={"lote": lote})
+
+        resultados = res.json()["resultados"]
+        assert len(resultados) == 3
+        for resultado in resultados:
+            assert all(c["diagnostico"] != resultado["diagnostico"] for c in resultado["cambios"])
+        assert any(len(c["invertir"]) == 2 for c in resultados[1]["cambios"])
+
+    def test_sin_hechos(self, cliente):
+        """Sin hechos ni lote se responde 422"""
+        assert cliente.post("/sensibilidad", json={}).status_code == 422
+        assert cliente.post("/sensibilidad?filtro=otro", json={"hechos": {}}).status_code == 422
+
+    def test_demasiados_hechos(self, cliente, monkeypatch):
+        """Con más hechos que MAX_HECHOS_TABLA la base se compila igual y la tabla responde 501"""
+        monkeypatch.setattr(sensibilidad, "MAX_HECHOS_TABLA", 3)
+        base = BaseReglas(REGLAS_AMBIENTALES)
+        monkeypatch.setattr(base_reglas, "_vigente", base)
+
+        assert not base.tablas_armadas
+        with pytest.raises(DemasiadosHechos):
+            base.sensibilidad
+        assert base.diagnosticar({"ruido_elevado": True})["id"] == motor_inferencia({"ruido_elevado": True})["id"]
+        assert cliente.post("/sensibilidad", json={"hechos": {}}).status_code == 501
+        assert cliente.get("/reglas/tabla").status_code == 501
+        lote = {"diagnosticos": [{"clave": "a", "hechos": {}, "regla_id": None}]}
+        assert cliente.post("/diagnosticos/sincronizar", json=lote).status_code == 501
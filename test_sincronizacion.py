@@ -0,0 +1,143 @@
+"""
+Tests de la tabla de reglas para el navegador y de la sincronización por lotes
+
+Ejecutar con: pytest test_sincronizacion.py -v
+"""
+
+import base64
+from itertools import product
+
+import pytest
+from fastapi.testclient import TestClient
+
+import database
+import main
+from admision import ClaseAdmision
+from almacenamiento import AlmacenMemoria, AlmacenSQLite
+from reglas import motor_inferencia
+
+
+HECHOS_AGUA = {"agua_turbia": True, "olor_fuerte": True, "humedad_excesiva": True}
+HECHOS_RUIDO = {"ruido_elevado": True}
+
+
+@pytest.fixture(autouse=True)
+def base_temporal(monkeypatch, tmp_path):
+    """Base de datos temporal, sin límites de admisión para los lotes"""
+    monkeypatch.setattr(database, "DATABASE_NAME", str(tmp_path / "sincronizacion.db"))
+    monkeypatch.setattr(main, "almacen", AlmacenSQLite())
+    monkeypatch.setitem(main.control_admision.clases, "lote", ClaseAdmision("lote", 100, 1000.0, 1000))
+    database.init_database()
+
+
+def diagnosticar_con_tabla(datos, hechos):
+    """Lo mismo que diagnosticarLocal de script.js"""
+    codigos = base64.b64decode(datos["tabla"])
+    mascara = sum(1 << bit for bit, hecho in enumerate(datos["hechos"]) if hechos.get(hecho["id"]) is True)
+    ancho = datos["bytes_por_entrada"]
+    codigo = int.from_bytes(codigos[mascara * ancho:(mascara + 1) * ancho], "little")
+    return None if codigo == 0 else datos["reglas"][codigo - 1]
+
+
+def pendiente(clave, hechos, regla_id="calcular"):
+    if regla_id == "calcular":
+        regla = motor_inferencia(hechos)
+        regla_id = None if regla is None else regla["id"]
+    return {"clave": clave, "hechos": hechos, "regla_id": regla_id}
+
+
+class TestTablaReglas:
+    """Tests de /reglas/tabla"""
+
+    def test_mismo_diagnostico_que_el_motor(self):
+        """Para cada combinación de hechos la tabla da la regla del motor"""
+        datos = TestClient(main.app).get("/reglas/tabla").json()
+
+        ids = [hecho["id"] for hecho in datos["hechos"]]
+        assert all(hecho["pregunta"] for hecho in datos["hechos"])
+        for valores in product([False, True], repeat=len(ids)):
+            hechos = dict(zip(ids, valores))
+            regla = motor_inferencia(hechos)
+            assert diagnosticar_con_tabla(datos, hechos) == (None if regla is None else regla["id"])
+        assert set(datos["textos"]) == set(datos["reglas"])
+        assert datos["version"] == main.base_vigente().version
+
+    def test_etag(self):
+        """Con el ETag vigente responde 304 sin cuerpo"""
+        cliente = TestClient(main.app)
+        etag = cliente.get("/reglas/tabla").headers["etag"]
+
+        respuesta = cliente.get("/reglas/tabla", headers={"If-None-Match": etag})
+
+        assert respuesta.status_code == 304
+        assert respuesta.content == b""
+
+
+class TestSincronizar:
+    """Tests de /diagnosticos/sincronizar"""
+
+    def test_guarda_y_no_duplica(self):
+        """Reenviar el lote devuelve los mismos IDs sin guardar de nuevo"""
+        cliente = TestClient(main.app)
+        lote = {"diagnosticos": [pendiente("a", HECHOS_AGUA), pendiente("b", HECHOS_RUIDO)]}
+
+        primera = cliente.post("/diagnosticos/sincronizar", json=lote).json()["resultados"]
+        segunda = cliente.post("/diagnosticos/sincronizar", json=lote).json()["resultados"]
+
+        assert [r["estado"] for r in primera] == ["nuevo", "nuevo"]
+        assert [r["estado"] for r in segunda] == ["repetido", "repetido"]
+        assert [r["diagnostico_id"] for r in segunda] == [r["diagnostico_id"] for r in primera]
+        assert all(r["coincide"] for r in primera)
+        assert database.obtener_estadisticas()["total"] == 2
+        guardado = database.obtener_diagnostico_por_id(primera[0]["diagnostico_id"])
+        assert guardado["regla_id"] == motor_inferencia(HECHOS_AGUA)["id"]
+        assert guardado["version_reglas"] == main.base_vigente().version
+        assert database.obtener_coocurrencias()["total"] == 2
+
+    def test_conflicto_y_tabla_vieja(self):
+        """Una clave con otros hechos no se guarda; un regla_id distinto se marca"""
+        cliente = TestClient(main.app)
+        cliente.post("/diagnosticar", json={"hechos": HECHOS_AGUA}, headers={"Idempotency-Key": "k"})
+
+        resultados = cliente.post("/diagnosticos/sincronizar", json={"diagnosticos": [
+            pendiente("k", HECHOS_RUIDO),
+            pendiente("c", HECHOS_RUIDO, regla_id="R-VIEJA"),
+            pendiente("c", HECHOS_RUIDO, regla_id="R-VIEJA"),
+        ]}).json()["resultados"]
+
+        assert resultados[0]["estado"] == "conflicto"
+        assert resultados[1]["estado"] == "nuevo"
+        assert resultados[1]["coincide"] is False
+        assert resultados[1]["regla_id"] == motor_inferencia(HECHOS_RUIDO)["id"]
+        assert resultados[2]["estado"] == "repetido"
+        assert database.obtener_estadisticas()["total"] == 2
+
+    def test_limites(self, monkeypatch):
+        """Un lote vacío no guarda nada y uno demasiado grande da 422"""
+        cliente = TestClient(main.app)
+        assert cliente.post("/diagnosticos/sincronizar", json={"diagnosticos": []}).json()["resultados"] == []
+
+        monkeypatch.setattr(main, "MAX_SINCRONIZACION", 1)
+        lote = {"diagnosticos": [pendiente("a", HECHOS_AGUA), pendiente("b", HECHOS_RUIDO)]}
+        assert cliente.post("/diagnosticos/sincronizar", json=lote).status_code == 422
+        sin_clave = {"diagnosticos": [pendiente("", HECHOS_AGUA)]}
+        assert cliente.post("/diagnosticos/sincronizar", json=sin_clave).status_code == 422
+
+
+class TestGuardarConClaves:
+    """Tests de Almacen.guardar_con_claves en el motor en memoria"""
+
+    def test_memoria(self):
+        """Las claves se respetan como en SQLite, también las de guardar"""
+        almacen = AlmacenMemoria()
+        almacen.guardar(HECHOS_AGUA, motor_inferencia(HECHOS_AGUA), clave_idempotencia="k")
+
+        resultados = almacen.guardar_con_claves([
+            ("k", HECHOS_AGUA, motor_inferencia(HECHOS_AGUA)),
+            ("n", HECHOS_RUIDO, motor_inferencia(HECHOS_RUIDO)),
+            ("n", HECHOS_RUIDO, motor_inferencia(HECHOS_RUIDO)),
+        ])
+
+        assert resultados == [(1, HECHOS_AGUA), (2, None), (2, HECHOS_RUIDO)]
+        assert almacen.buscar_por_clave("n")["regla_id"] == motor_inferencia(HECHOS_RUIDO)["id"]
+        assert almacen.estadisticas()["total"] == 2
@@ -0,0 +1,172 @@
+"""
+Tests de la ingesta de telemetría
+
+Ejecutar con: pytest test_telemetria.py -v
+"""
+
+import json
+from array import array
+
+import pytest
+from fastapi.testclient import TestClient
+
+import database
+import main
+from telemetria import SerieVentana, ProcesadorTelemetria
+
+
+@pytest.fixture
+def bd_temporal(tmp_path, monkeypatch):
+    """Base de datos temporal para las escrituras de telemetría"""
+    monkeypatch.setattr(database, "DATABASE_NAME", str(tmp_path / "test.db"))
+    database.init_database()
+
+
+def serie(estacion, variable, valores, inicio=0.0, paso=1.0):
+    """Serie columnar con lecturas equiespaciadas"""
+    return {
+        "estacion": estacion,
+        "variable": variable,
+        "tiempos": [inicio + i * paso for i in range(len(valores))],
+        "valores": list(valores),
+    }
+
+
+class TestSerieVentana:
+    """Tests de la ventana deslizante"""
+
+    def test_media_y_maximo_solo_de_la_ventana(self):
+        """Las lecturas más viejas que la ventana no deben contar"""
+        ventana = SerieVentana(duracion_segundos=10)
+        for t, valor in enumerate([100, 1, 2, 3]):
+            ventana.agregar(t * 5.0, valor)
+
+        # t=0 quedó fuera (límite 15 - 10 = 5)
+        assert ventana.cantidad == 3
+        assert ventana.media() == 2
+        assert ventana.maximo() == 3
+
+    def test_compacta_los_arreglos(self):
+        """Los arreglos no deben crecer sin límite en una serie larga"""
+        ventana = SerieVentana(duracion_segundos=100)
+        for t in range(10000):
+            ventana.agregar(float(t), 1.0)
+
+        assert ventana.cantidad == 101
+        assert len(ventana.tiempos) < 3000
+
+
+class TestProcesadorTelemetria:
+    """Tests de la derivación de hechos y los cambios de estado"""
+
+    def test_deriva_hechos_y_ejecuta_el_motor(self, bd_temporal):
+        """Turbidez y humedad altas más olor desconocido no deciden R-AMB-01 todavía"""
+        procesador = ProcesadorTelemetria()
+        resultado = procesador.ingerir([
+            serie("E1", "turbidez_ntu", [8.0] * 10),
+            serie("E1", "humedad", [90.0] * 10),
+            serie("E1", "ruido_db", [40.0] * 10),
+        ])
+
+        cambio = resultado["cambios"][0]
+        assert cambio["hechos"] == {"agua_turbia": True, "humedad_excesiva": True, "ruido_elevado": False}
+        assert "R-AMB-01" in cambio["posibles"]
+
+    def test_solo_guarda_cambios_de_estado(self, bd_temporal):
+        """Lotes que no cambian los hechos derivados no generan filas nuevas"""
+        procesador = ProcesadorTelemetria()
+        primero = procesador.ingerir([serie("E1", "ruido_db", [80.0] * 5)])
+        repetido = procesador.ingerir([serie("E1", "ruido_db", [85.0] * 5, inicio=5)])
+        # Sale de la ventana de 10 minutos y baja el promedio
+        bajo = procesador.ingerir([serie("E1", "ruido_db", [30.0] * 5, inicio=1000)])
+
+        assert len(primero["cambios"]) == 1
+        assert repetido["cambios"] == []
+        assert bajo["cambios"][0]["hechos"] == {"ruido_elevado": False}
+        assert len(database.obtener_cambios_estado("E1")) == 2
+
+    def test_escribe_bloques_columnares(self, bd_temporal):
+        """Las lecturas pendientes se guardan como arreglos float64"""
+        procesador = ProcesadorTelemetria(max_pendientes=10 ** 6)
+        procesador.ingerir([serie("E1", "pm25", [10.0, 20.0, 30.0])])
+
+        assert procesador.vaciar() == 3
+        with database.get_db_connection() as conn:
+            fila = conn.execute("SELECT cantidad, valores FROM lecturas_bloques").fetchone()
+        assert fila["cantidad"] == 3
+        assert array("d", fila["valores"]).tolist() == [10.0, 20.0, 30.0]
+
+    def test_series_de_distinto_largo(self, bd_temporal):
+        """Tiempos y valores deben tener la misma cantidad de elementos"""
+        with pytest.raises(ValueError):
+            ProcesadorTelemetria().ingerir([
+                {"estacion": "E1", "variable": "pm25", "tiempos": [0.0, 1.0], "valores": [1.0]}
+            ])
+
+    def test_lote_invalido_no_aplica_nada(self, bd_temporal):
+        """Si una serie del lote es inválida, las anteriores tampoco se aplican"""
+        procesador = ProcesadorTelemetria(max_pendientes=10 ** 6)
+        with pytest.raises(ValueError):
+            procesador.ingerir([
+                serie("E1", "pm25", [50.0] * 3),
+                {"estacion": "E1", "variable": "ruido_db", "tiempos": [0.0, 1.0], "valores": [1.0]},
+            ])
+
+        assert procesador.estado("E1") is None
+        assert procesador.lecturas_totales == 0
+        assert procesador.vaciar() == 0
+
+    def test_valores_no_finitos(self, bd_temporal):
+        """Una lectura NaN o infinita se rechaza y la media sigue siendo un número"""
+        procesador = ProcesadorTelemetria(max_pendientes=10 ** 6)
+        procesador.ingerir([serie("E1", "pm25", [10.0, 20.0])])
+
+        for valor in (float("nan"), float("inf"), float("-inf")):
+            with pytest.raises(ValueError, match="NaN"):
+                procesador.ingerir([serie("E1", "pm25", [valor], inicio=5)])
+        assert procesador.estado("E1")["variables"]["pm25"]["media"] == 15.0
+
+    def test_lecturas_anteriores_a_la_ventana(self, bd_temporal):
+        """Un lote más viejo que la última lectura se rechaza sin romper la ventana"""
+        procesador = ProcesadorTelemetria(max_pendientes=10 ** 6)
+        procesador.ingerir([serie("E1", "pm25", [10.0, 20.0], inicio=100)])
+
+        with pytest.raises(ValueError, match="anteriores"):
+            procesador.ingerir([serie("E1", "pm25", [90.0], inicio=50)])
+        with pytest.raises(ValueError, match="anteriores"):
+            procesador.ingerir([serie("E1", "pm25", [1.0], inicio=200), serie("E1", "pm25", [90.0], inicio=150)])
+        procesador.ingerir([serie("E1", "pm25", [5.0], inicio=101)])
+
+        variables = procesador.estado("E1")["variables"]["pm25"]
+        assert (variables["cantidad"], variables["max"]) == (3, 20.0)
+        assert procesador.lecturas_totales == 3
+
+
+class TestApiTelemetria:
+    """Tests de los endpoints de telemetría"""
+
+    def test_ingesta_y_estado(self, bd_temporal, monkeypatch):
+        """El estado de la estación refleja las lecturas recibidas"""
+        monkeypatch.setattr(main, "telemetria", ProcesadorTelemetria())
+        with TestClient(main.app) as cliente:
+            res = cliente.post("/telemetria", json={"series": [serie("E7", "pm25", [50.0] * 4)]})
+            estado = cliente.get("/telemetria/E7").json()
+            desconocida = cliente.get("/telemetria/no-existe")
+
+        assert res.json()["lecturas"] == 4
+        assert estado["hechos"] == {"aire_contaminado": True}
+        assert estado["variables"]["pm25"]["media"] == 50.0
+        assert desconocida.status_code == 404
+
+    def test_rechaza_nan_e_infinito(self, bd_temporal, monkeypatch):
+        """/telemetria responde 422 a lecturas NaN o infinitas (JSON con NaN/Infinity)"""
+        monkeypatch.setattr(main, "telemetria", ProcesadorTelemetria())
+        with TestClient(main.app) as cliente:
+            for valor in ("NaN", "Infinity", "-Infinity"):
+                cuerpo = json.dumps({"series": [serie("E7", "pm25", [50.0])]}).replace("50.0", valor)
+                res = cliente.post("/telemetria", content=cuerpo, headers={"Content-Type": "application/json"})
+                assert res.status_code == 422
+            cuerpo = json.dumps({"series": [serie("E7", "pm25", [50.0])]}).replace("0.0", "NaN")
+            assert cliente.post("/telemetria", content=cuerpo,
+                                headers={"Content-Type": "application/json"}).status_code == 422
+            assert cliente.get("/telemetria/E7").status_code == 404
@@ -0,0 +1,98 @@
+"""
+Tests de las trazas por etapa
+
+Ejecutar con: pytest test_trazas.py -v
+"""
+
+import json
+import os
+
+import pytest
+from fastapi.testclient import TestClient
+
+import database
+import main
+from trazas import EscritorTrazas, Traza, Tramo, leer_trazas, resumir
+
+
+TRAZA_ENTRANTE = "0af7651916cd43dd8448eb211c80319c"
+TRACEPARENT = f"00-{TRAZA_ENTRANTE}-b7ad6b7169203331-01"
+
+
+@pytest.fixture
+def cliente(tmp_path, monkeypatch):
+    """Cliente con base de datos y archivo de trazas temporales"""
+    monkeypatch.setattr(database, "DATABASE_NAME", str(tmp_path / "test.db"))
+    database.init_database()
+    main.escritor_trazas.cerrar()
+    monkeypatch.setattr(main.escritor_trazas, "ruta", str(tmp_path / "trazas.ndjson"))
+    with TestClient(main.app) as c:
+        yield c
+    main.escritor_trazas.cerrar()
+
+
+def tramos_guardados(ruta):
+    """Tramos de cada traza guardada, por nombre"""
+    return [{t["name"]: t for t in tramos} for tramos in leer_trazas(ruta)]
+
+
+class TestMiddlewareTrazas:
+    """Tests de la traza de /diagnosticar"""
+
+    def test_etapas_de_diagnosticar(self, cliente):
+        """Con traceparent muestreado se guardan los tramos de cada etapa, hijos de la raíz"""
+        res = cliente.post("/diagnosticar", json={"hechos": {"ruido_elevado": True}},
+                           headers={"traceparent": TRACEPARENT})
+        trazas = tramos_guardados(main.escritor_trazas.ruta)
+
+        assert res.headers["x-trace-id"] == TRAZA_ENTRANTE
+        assert res.headers["traceparent"].endswith("-01")
+        assert len(trazas) == 1
+        tramos = trazas[0]
+        raiz = tramos["POST /diagnosticar"]
+        assert raiz["parentSpanId"] == "b7ad6b7169203331"
+        for etapa in ("lectura", "validacion", "idempotencia", "motor_inferencia", "guardar_diagnostico",
+                      "serializacion"):
+            assert tramos[etapa]["parentSpanId"] == raiz["spanId"]
+        for etapa in ("db.conectar", "db.insertar", "db.commit"):
+            assert tramos[etapa]["parentSpanId"] == tramos["guardar_diagnostico"]["spanId"]
+
+    def test_sin_muestreo_no_escribe(self, cliente):
+        """Sin traceparent (muestreo 0 por defecto) se propaga el ID pero no se guarda nada"""
+        res = cliente.get("/hechos")
+
+        assert len(res.headers["x-trace-id"]) == 32
+        assert res.headers["traceparent"].endswith("-00")
+        assert not os.path.exists(main.escritor_trazas.ruta)
+
+    def test_ruta_con_plantilla(self, cliente):
+        """La raíz se nombra con la plantilla de la ruta, no con el ID"""
+        cliente.get("/diagnostico/12345", headers={"traceparent": TRACEPARENT})
+
+        assert "GET /diagnostico/{diagnostico_id}" in tramos_guardados(main.escritor_trazas.ruta)[0]
+
+
+class TestArchivoTrazas:
+    """Tests de la rotación y el resumen"""
+
+    def test_rotacion_y_resumen(self, tmp_path):
+        """Al rotar se conservan las copias y el resumen las lee todas"""
+        ruta = str(tmp_path / "trazas.ndjson")
+        escritor = EscritorTrazas(ruta, max_bytes=2000, copias=3)
+        for i in range(20):
+            raiz = Tramo("POST /diagnosticar", None, 0, tipo=2)
+            raiz.fin = (i + 1) * 1_000_000
+            hijo = Tramo("motor_inferencia", raiz.id, 0)
+            hijo.fin = 500_000
+            traza = Traza(f"{i:032x}", True, raiz)
+            traza.tramos.append(hijo)
+            escritor.escribir(traza)
+        escritor.cerrar()
+
+        resumen = resumir(ruta, top=2)
+        assert (tmp_path / "trazas.ndjson.1").exists()
+        assert not (tmp_path / "trazas.ndjson.4").exists()
+        assert resumen["etapas"]["motor_inferencia"]["p50"] == 0.5
+        assert resumen["lentas"][0]["ms"] == 20.0
+        assert resumen["lentas"][0]["etapas"] == {"motor_inferencia": 0.5}
+        assert json.loads((tmp_path / "trazas.ndjson.1").read_text().splitlines()[0])["resourceSpans"]
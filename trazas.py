@@ -0,0 +1,347 @@
+"""
+Trazas de las peticiones con tramos por etapa
+
+Un middleware abre una traza por petición HTTP y los tramos (`tramo(...)`)
+marcan las etapas: validación, motor de inferencia, conexión/inserción/commit
+en SQLite, serialización... La traza actual viaja en una ContextVar, así
+que también llega a las funciones síncronas que FastAPI corre en el pool de
+hilos.
+
+Muestreo: se respeta la decisión del encabezado W3C `traceparent` si viene;
+si no, se muestrea una fracción TRAZAS_MUESTREO de las peticiones (0 por
+defecto, es decir desactivado). Toda respuesta lleva `traceparent` y
+`X-Trace-Id`, muestreada o no. Sin muestreo, tramo() no hace nada.
+
+Las trazas muestreadas se escriben en TRAZAS_ARCHIVO, una línea por traza en
+el formato JSON de OTLP (resourceSpans/scopeSpans/spans, el mismo del
+exportador a archivo de OpenTelemetry), rotando al superar TRAZAS_MAX_MB.
+
+Resumen de las trazas guardadas:
+
+    python trazas.py resumen trazas.ndjson --top 10
+"""
+
+import argparse
+import json
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Iterator, List, Optional
+
+ARCHIVO_TRAZAS = os.environ.get("TRAZAS_ARCHIVO", "trazas.ndjson")
+MUESTREO = float(os.environ.get("TRAZAS_MUESTREO", "0"))
+MAX_BYTES = int(float(os.environ.get("TRAZAS_MAX_MB", "20")) * 1024 * 1024)
+COPIAS = 5
+
+SERVICIO = "sistema-experto-ambiental"
+
+# SpanKind de OTLP
+TIPO_INTERNO = 1
+TIPO_SERVIDOR = 2
+
+
+def _id_hex(n_bytes: int) -> str:
+    return os.urandom(n_bytes).hex()
+
+
+class Tramo:
+    """Un tramo (span) de la traza"""
+
+    __slots__ = ("nombre", "id", "padre", "inicio", "fin", "atributos", "tipo", "error")
+
+    def __init__(self, nombre: str, padre: Optional[str], inicio: int, tipo: int = TIPO_INTERNO,
+                 atributos: Optional[Dict[str, Any]] = None):
+        self.nombre = nombre
+        self.id = _id_hex(8)
+        self.padre = padre
+        self.inicio = inicio
+        self.fin = inicio
+        self.tipo = tipo
+        self.atributos = atributos or {}
+        self.error: Optional[str] = None
+
+    def a_otlp(self, traza_id: str) -> Dict[str, Any]:
+        tramo = {
+            "traceId": traza_id,
+            "spanId": self.id,
+            "name": self.nombre,
+            "kind": self.tipo,
+            "startTimeUnixNano": str(self.inicio),
+            "endTimeUnixNano": str(self.fin),
+            "attributes": [{"key": clave, "value": _valor_otlp(valor)} for clave, valor in self.atributos.items()],
+            "status": {"code": 2, "message": self.error} if self.error else {"code": 0},
+        }
+        if self.padre:
+            tramo["parentSpanId"] = self.padre
+        return tramo
+
+
+def _valor_otlp(valor: Any) -> Dict[str, Any]:
+    if isinstance(valor, bool):
+        return {"boolValue": valor}
+    if isinstance(valor, int):
+        return {"intValue": str(valor)}
+    if isinstance(valor, float):
+        return {"doubleValue": valor}
+    return {"stringValue": str(valor)}
+
+
+class Traza:
+    """Tramos de una petición; el primero es la raíz"""
+
+    __slots__ = ("id", "muestreada", "tramos", "raiz")
+
+    def __init__(self, traza_id: str, muestreada: bool, raiz: Tramo):
+        self.id = traza_id
+        self.muestreada = muestreada
+        self.raiz = raiz
+        self.tramos: List[Tramo] = [raiz]
+
+    def a_otlp(self) -> Dict[str, Any]:
+        return {"resourceSpans": [{
+            "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": SERVICIO}}]},
+            "scopeSpans": [{
+                "scope": {"name": SERVICIO},
+                "spans": [tramo.a_otlp(self.id) for tramo in self.tramos],
+            }],
+        }]}
+
+
+_traza_actual: ContextVar[Optional[Traza]] = ContextVar("traza_actual", default=None)
+_tramo_actual: ContextVar[Optional[Tramo]] = ContextVar("tramo_actual", default=None)
+
+
+@contextmanager
+def tramo(nombre: str, **atributos: Any) -> Iterator[None]:
+    """Mide una etapa dentro de la traza actual (no hace nada si no se muestrea)"""
+    traza = _traza_actual.get()
+    if traza is None or not traza.muestreada:
+        yield
+        return
+    padre = _tramo_actual.get()
+    actual = Tramo(nombre, padre.id if padre else traza.raiz.id, time.time_ns(), atributos=atributos)
+    traza.tramos.append(actual)
+    token = _tramo_actual.set(actual)
+    try:
+        yield
+    except Exception as e:
+        actual.error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        actual.fin = time.time_ns()
+        _tramo_actual.reset(token)
+
+
+def registrar_tramo(nombre: str, inicio: Optional[int], **atributos: Any) -> None:
+    """
+    Registra un tramo que ya empezó (desde `inicio` hasta ahora); sirve para
+    etapas que ocurren antes de llegar al endpoint, como la validación
+    """
+    traza = _traza_actual.get()
+    if traza is None or not traza.muestreada or inicio is None:
+        return
+    actual = Tramo(nombre, traza.raiz.id, inicio, atributos=atributos)
+    actual.fin = time.time_ns()
+    traza.tramos.append(actual)
+
+
+async def inicio_validacion() -> Optional[int]:
+    """
+    Dependencia de FastAPI: se resuelve con el cuerpo ya leído y antes de
+    validarlo. Registra el tramo "lectura" (desde el inicio de la petición)
+    y devuelve el momento actual para que el endpoint registre "validacion"
+    (validación de parámetros y cuerpo, más el paso al pool de hilos).
+    """
+    traza = _traza_actual.get()
+    if traza is None or not traza.muestreada:
+        return None
+    registrar_tramo("lectura", traza.raiz.inicio)
+    return time.time_ns()
+
+
+class EscritorTrazas:
+    """Archivo NDJSON con rotación por tamaño (archivo.1 ... archivo.N)"""
+
+    def __init__(self, ruta: str = ARCHIVO_TRAZAS, max_bytes: int = MAX_BYTES, copias: int = COPIAS):
+        self.ruta = ruta
+        self.max_bytes = max_bytes
+        self.copias = copias
+        self._lock = threading.Lock()
+        self._archivo = None
+        self.escritas = 0
+
+    def escribir(self, traza: Traza) -> None:
+        linea = json.dumps(traza.a_otlp(), separators=(",", ":")) + "\n"
+        with self._lock:
+            if self._archivo is None:
+                self._archivo = open(self.ruta, "a", encoding="utf-8")
+            self._archivo.write(linea)
+            self._archivo.flush()
+            self.escritas += 1
+            if self._archivo.tell() >= self.max_bytes:
+                self._rotar()
+
+    def _rotar(self) -> None:
+        self._archivo.close()
+        self._archivo = None
+        for n in range(self.copias - 1, 0, -1):
+            if os.path.exists(f"{self.ruta}.{n}"):
+                os.replace(f"{self.ruta}.{n}", f"{self.ruta}.{n + 1}")
+        os.replace(self.ruta, f"{self.ruta}.1")
+
+    def cerrar(self) -> None:
+        with self._lock:
+            if self._archivo is not None:
+                self._archivo.close()
+                self._archivo = None
+
+
+def _leer_traceparent(valor: str):
+    """(traza_id, tramo_padre, muestreada) del encabezado W3C, o None si no es válido"""
+    partes = valor.strip().split("-")
+    if len(partes) != 4 or len(partes[1]) != 32 or len(partes[2]) != 16 or partes[1] == "0" * 32:
+        return None
+    try:
+        int(partes[1], 16), int(partes[2], 16)
+        banderas = int(partes[3], 16)
+    except ValueError:
+        return None
+    return partes[1], partes[2], bool(banderas & 1)
+
+
+class MiddlewareTrazas:
+    """Middleware ASGI: abre la traza, propaga los encabezados y la escribe al terminar"""
+
+    def __init__(self, app, escritor: Optional[EscritorTrazas] = None, muestreo: float = MUESTREO):
+        self.app = app
+        self.escritor = escritor or EscritorTrazas()
+        self.muestreo = muestreo
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        entrante = next((v for k, v in scope["headers"] if k == b"traceparent"), None)
+        padre = _leer_traceparent(entrante.decode("latin-1")) if entrante else None
+        if padre:
+            traza_id, tramo_padre, muestreada = padre
+        else:
+            traza_id, tramo_padre = _id_hex(16), None
+            muestreada = self.muestreo > 0 and random.random() < self.muestreo
+
+        raiz = Tramo(f"{scope['method']} {scope['path']}", tramo_padre, time.time_ns(), TIPO_SERVIDOR,
+                     {"http.method": scope["method"], "http.target": scope["path"]})
+        traza = Traza(traza_id, muestreada, raiz)
+        encabezados = [
+            (b"traceparent", f"00-{traza_id}-{raiz.id}-{'01' if muestreada else '00'}".encode()),
+            (b"x-trace-id", traza_id.encode()),
+        ]
+
+        async def enviar(mensaje):
+            if mensaje["type"] == "http.response.start":
+                raiz.atributos["http.status_code"] = mensaje["status"]
+                mensaje = dict(mensaje, headers=list(mensaje.get("headers", [])) + encabezados)
+            await send(mensaje)
+
+        token = _traza_actual.set(traza)
+        try:
+            await self.app(scope, receive, enviar)
+        except Exception as e:
+            raiz.error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            _traza_actual.reset(token)
+            raiz.fin = time.time_ns()
+            if muestreada:
+                ruta = scope.get("route")
+                if ruta is not None and getattr(ruta, "path", None):
+                    # Nombre por plantilla de ruta (/diagnostico/{diagnostico_id}), no por ID
+                    raiz.nombre = f"{scope['method']} {ruta.path}"
+                self.escritor.escribir(traza)
+
+
+def leer_trazas(ruta: str) -> Iterator[Dict[str, Any]]:
+    """Tramos OTLP de cada traza del archivo y sus copias rotadas (de la más vieja a la más nueva)"""
+    rutas = [f"{ruta}.{n}" for n in range(COPIAS, 0, -1)] + [ruta]
+    for actual in rutas:
+        if not os.path.exists(actual):
+            continue
+        with open(actual, encoding="utf-8") as f:
+            for linea in f:
+                if not linea.strip():
+                    continue
+                datos = json.loads(linea)
+                yield [tramo for recurso in datos["resourceSpans"]
+                       for alcance in recurso["scopeSpans"] for tramo in alcance["spans"]]
+
+
+def _duracion_ms(tramo: Dict[str, Any]) -> float:
+    return (int(tramo["endTimeUnixNano"]) - int(tramo["startTimeUnixNano"])) / 1e6
+
+
+def _percentil(valores: List[float], p: float) -> float:
+    valores = sorted(valores)
+    return valores[min(len(valores) - 1, int(len(valores) * p))]
+
+
+def resumir(ruta: str, top: int = 10) -> Dict[str, Any]:
+    """
+    Percentiles por etapa y trazas más lentas
+
+    Returns:
+        {"trazas": n, "etapas": {nombre: {cantidad, p50, p90, p99, max}},
+         "lentas": [{traza, nombre, ms, etapas: {nombre: ms}}]}
+    """
+    duraciones: Dict[str, List[float]] = {}
+    lentas = []
+    total = 0
+    for tramos in leer_trazas(ruta):
+        total += 1
+        raiz = next((t for t in tramos if t.get("kind") == TIPO_SERVIDOR), tramos[0])
+        etapas: Dict[str, float] = {}
+        for t in tramos:
+            ms = _duracion_ms(t)
+            duraciones.setdefault(t["name"], []).append(ms)
+            if t is not raiz:
+                etapas[t["name"]] = etapas.get(t["name"], 0.0) + ms
+        lentas.append({"traza": raiz["traceId"], "nombre": raiz["name"], "ms": _duracion_ms(raiz), "etapas": etapas})
+        # Conservar solo las más lentas
+        if len(lentas) > 4 * top:
+            lentas = sorted(lentas, key=lambda t: -t["ms"])[:top]
+    return {
+        "trazas": total,
+        "etapas": {
+            nombre: {
+                "cantidad": len(valores),
+                "p50": _percentil(valores, 0.5),
+                "p90": _percentil(valores, 0.9),
+                "p99": _percentil(valores, 0.99),
+                "max": max(valores),
+            }
+            for nombre, valores in sorted(duraciones.items())
+        },
+        "lentas": sorted(lentas, key=lambda t: -t["ms"])[:top],
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Herramientas de las trazas")
+    sub = parser.add_subparsers(dest="comando", required=True)
+    res = sub.add_parser("resumen", help="Percentiles por etapa y trazas más lentas")
+    res.add_argument("ruta", nargs="?", default=ARCHIVO_TRAZAS)
+    res.add_argument("--top", type=int, default=10, help="Cantidad de trazas lentas a mostrar")
+    args = parser.parse_args()
+
+    resumen = resumir(args.ruta, args.top)
+    print(f"{resumen['trazas']} trazas\n")
+    print(f"{'etapa':<36}{'n':>8}{'p50 ms':>10}{'p90 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    for nombre, e in resumen["etapas"].items():
+        print(f"{nombre:<36}{e['cantidad']:>8}{e['p50']:>10.2f}{e['p90']:>10.2f}{e['p99']:>10.2f}{e['max']:>10.2f}")
+    print("\nTrazas más lentas:")
+    for lenta in resumen["lentas"]:
+        etapas = ", ".join(f"{nombre} {ms:.2f}" for nombre, ms in sorted(lenta["etapas"].items(), key=lambda p: -p[1]))
+        print(f"  {lenta['traza']}  {lenta['nombre']:<28}{lenta['ms']:>9.2f} ms  [{etapas}]")